@@ -0,0 +1,129 @@
+import os
+import stat
+import sys
+import types
+
+import pytest
+
+from internal.adb import Adb, AdbShellSession
+
+# A stand-in for adb that runs the "device" shell commands on the local /bin/sh. With
+# FAKE_ADB_PTY set, the interactive shell runs on a PTY like devices without the shell v2
+# protocol (the commands are echoed back and lines end with \r\n).
+FAKE_ADB = '''#!{python}
+import os
+import pty
+import select
+import subprocess
+import sys
+args = sys.argv[1:]
+if len(args) >= 2 and args[0] == '-s':
+    args = args[2:]
+if args == ['devices']:
+    print('List of devices attached')
+    print('FAKE0001\\tdevice')
+elif args == ['shell']:
+    if os.environ.get('FAKE_ADB_PTY'):
+        master, slave = pty.openpty()
+        proc = subprocess.Popen(['/bin/sh'], stdin=slave, stdout=slave, stderr=slave, close_fds=True)
+        os.close(slave)
+        stdin = sys.stdin.fileno()
+        stdout = sys.stdout.fileno()
+        while proc.poll() is None:
+            readable, _, _ = select.select([stdin, master], [], [], 0.5)
+            try:
+                if stdin in readable:
+                    data = os.read(stdin, 4096)
+                    if not data:
+                        os.write(master, b'exit\\n')
+                        stdin = -1
+                    else:
+                        os.write(master, data)
+                if master in readable:
+                    os.write(stdout, os.read(master, 65536))
+            except OSError:
+                break
+    else:
+        os.execv('/bin/sh', ['sh'])
+elif args and args[0] == 'shell':
+    os.execv('/bin/sh', ['sh', '-c', ' '.join(args[1:])])
+'''
+
+
+@pytest.fixture
+def fake_adb(tmp_path):
+    path = str(tmp_path.joinpath('adb'))
+    with open(path, 'w') as f_out:
+        f_out.write(FAKE_ADB.format(python=sys.executable))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+def make_adb(fake_adb, session):
+    options = types.SimpleNamespace(device='FAKE0001', rndis=None, gnirehtet=False, noadbsession=not session)
+    adb = Adb(options, None)
+    adb.exe = fake_adb
+    if session:
+        adb.shell_session = AdbShellSession(adb.build_adb_command(['shell']))
+    return adb
+
+
+def stop_session(adb):
+    if adb.shell_session is not None:
+        adb.shell_session.stop()
+        adb.shell_session = None
+
+
+@pytest.fixture(params=['oneshot', 'session', 'pty'])
+def adb(request, fake_adb, monkeypatch):
+    if request.param == 'pty':
+        monkeypatch.setenv('FAKE_ADB_PTY', '1')
+    else:
+        monkeypatch.delenv('FAKE_ADB_PTY', raising=False)
+    adb = make_adb(fake_adb, request.param != 'oneshot')
+    yield adb
+    stop_session(adb)
+
+
+def test_shell_output(adb):
+    assert adb.shell(['echo', 'hello']) == 'hello\n'
+    assert adb.shell(['printf', 'no-newline']) == 'no-newline'
+    assert adb.shell(['true']) == ''
+    # Commands with several lines of output, one after another in the same session
+    for count in range(1, 4):
+        assert adb.shell(['seq', str(count)]) == ''.join('{0:d}\n'.format(i) for i in range(1, count + 1))
+
+
+def test_bytes_rx(adb):
+    with open('/proc/net/dev') as f_in:
+        expected = adb.parse_bytes_rx(f_in.read())
+    adb.last_bytes_rx = 0
+    # The counters only go up between the two reads
+    assert adb.get_bytes_rx() >= expected
+    size, delta = adb.get_video_activity()
+    assert size == 0
+    assert delta >= 0
+
+
+def test_session_recovers_after_timeout(fake_adb, monkeypatch):
+    monkeypatch.delenv('FAKE_ADB_PTY', raising=False)
+    adb = make_adb(fake_adb, True)
+    try:
+        out = adb.shell(['echo', 'partial;', 'sleep', '5'], timeout_sec=1)
+        assert out.startswith('partial')
+        assert adb.shell_session.proc is None
+        # The next command starts a new session
+        assert adb.shell(['echo', 'ok']) == 'ok\n'
+    finally:
+        stop_session(adb)
+
+
+def test_dead_session_falls_back(fake_adb, tmp_path, monkeypatch):
+    monkeypatch.delenv('FAKE_ADB_PTY', raising=False)
+    adb = make_adb(fake_adb, True)
+    # A session that exits immediately (i.e. the device went away) never frames the command
+    adb.shell_session = AdbShellSession(['/bin/sh', '-c', 'echo error: device offline'])
+    try:
+        assert adb.shell(['echo', 'fallback']) == 'fallback\n'
+    finally:
+        stop_session(adb)
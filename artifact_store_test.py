@@ -0,0 +1,102 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from internal import artifact_store
+from internal.artifact_store import ARTIFACTS, ArtifactStore
+from internal.replay import Replay, list_results, load_file
+from internal.support import trace_parser
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts', 'replay_corpus', 'REPLAY_1.1.0')
+
+
+def read_gzip(path):
+    with gzip.open(path, 'rt') as f_in:
+        return json.load(f_in)
+
+
+def test_publish_and_load(tmp_path):
+    store = ArtifactStore()
+    path = str(tmp_path.joinpath('1_metrics.json.gz'))
+    data = {'a': [1, 2, 3]}
+    store.publish(path, data)
+    # Changes after publishing don't make it into the file
+    data['b'] = True
+    assert store.load(path) is data
+    store.flush()
+    assert read_gzip(path) == {'a': [1, 2, 3]}
+    store.release(str(tmp_path))
+    assert store.load(path) == {'a': [1, 2, 3]}
+    assert store.exists(path)
+    store.discard(path)
+    assert not os.path.exists(path)
+    assert store.load(path) is None
+
+
+def test_disabled_writes_immediately(tmp_path):
+    store = ArtifactStore()
+    store.enabled = False
+    path = str(tmp_path.joinpath('1_metrics.json'))
+    store.publish(path, {'a': 1})
+    assert store.thread is None
+    with open(path, 'rt') as f_in:
+        assert json.load(f_in) == {'a': 1}
+    assert store.load(path) == {'a': 1}
+
+
+def replay_run(scratch, enabled, monkeypatch):
+    """Replay the corpus with the trace results published to the store (the way devtools does it)"""
+    monkeypatch.setattr(ARTIFACTS, 'enabled', enabled)
+    trace_init = trace_parser.Trace.__init__
+
+    def init(self):
+        trace_init(self)
+        self.artifacts = ARTIFACTS
+    monkeypatch.setattr(trace_parser.Trace, '__init__', init)
+    hits = []
+    load = ArtifactStore.load
+
+    def spy(self, path):
+        with self.lock:
+            hits.append((os.path.basename(path), path in self.artifacts))
+        return load(self, path)
+    monkeypatch.setattr(ArtifactStore, 'load', spy)
+    replay = Replay(CORPUS)
+    replay.manifest['har'] = True
+    result = replay.run(str(scratch), mode='compare')
+    ARTIFACTS.flush()
+    ARTIFACTS.release(replay.task['dir'])
+    monkeypatch.undo()
+    return replay, result, hits
+
+
+def test_results_match_without_the_store(tmp_path, monkeypatch):
+    """ProcessTest produces the same results with the in-memory store as with --noartifactstore"""
+    stored, stored_result, stored_hits = replay_run(tmp_path.joinpath('stored'), True, monkeypatch)
+    files, files_result, files_hits = replay_run(tmp_path.joinpath('files'), False, monkeypatch)
+    assert ARTIFACTS.enabled
+    for result in [stored_result, files_result]:
+        assert not result['errors']
+        assert not result['diffs']
+    # The post-processing really did get the trace results from memory in one case and not the other
+    assert ('1_interactive.json.gz', True) in stored_hits
+    assert ('1_long_tasks.json.gz', True) in stored_hits
+    assert not [name for name, in_memory in files_hits if in_memory]
+    names = list_results(stored.task['dir'])
+    assert names == list_results(files.task['dir'])
+    assert '1_har.json.gz' in names
+    for name in names:
+        assert load_file(os.path.join(stored.task['dir'], name)) == \
+            load_file(os.path.join(files.task['dir'], name)), name
+    assert not ARTIFACTS.artifacts
+
+
+@pytest.mark.parametrize('name', ['1_interactive.json.gz', '1_long_tasks.json.gz'])
+def test_store_written_for_upload(tmp_path, monkeypatch, name):
+    """The published results are still written out for the upload"""
+    replay, _, _ = replay_run(tmp_path, True, monkeypatch)
+    path = os.path.join(replay.task['dir'], name)
+    assert read_gzip(path) == read_gzip(os.path.join(CORPUS, 'expected', name))
+    assert artifact_store.read_file(path) == read_gzip(path)
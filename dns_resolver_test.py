@@ -0,0 +1,215 @@
+import gzip
+import json
+import socket
+import struct
+import threading
+
+import dns.flags
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rrset
+import pytest
+
+from internal.dns_resolver import StubResolver
+from internal.host_rules import HostRules
+
+
+class FakeUpstream(object):
+    """A local upstream DNS server with canned answers (UDP and TCP on the same port)"""
+    def __init__(self, records=None, truncate=None, drop=False):
+        self.records = records if records is not None else {}
+        self.truncate = truncate if truncate is not None else []
+        self.drop = drop
+        self.queries = []
+        self.lock = threading.Lock()
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(('127.0.0.1', 0))
+        self.port = self.udp.getsockname()[1]
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind(('127.0.0.1', self.port))
+        self.tcp.listen(4)
+        for target in [self.udp_thread, self.tcp_thread]:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def answer(self, data, transport):
+        query = dns.message.from_wire(data)
+        question = query.question[0]
+        host = question.name.to_text(omit_final_dot=True)
+        with self.lock:
+            self.queries.append((host, transport))
+        reply = dns.message.make_response(query)
+        if host in self.records:
+            address, ttl = self.records[host]
+            if address is None:
+                reply.set_rcode(dns.rcode.NXDOMAIN)
+            elif transport == 'udp' and host in self.truncate:
+                reply.flags |= dns.flags.TC
+            else:
+                reply.answer.append(dns.rrset.from_text(question.name, ttl, 'IN', 'A', address))
+        else:
+            reply.set_rcode(dns.rcode.REFUSED)
+        return reply.to_wire()
+
+    def udp_thread(self):
+        while True:
+            try:
+                data, addr = self.udp.recvfrom(65535)
+            except Exception:
+                break
+            response = self.answer(data, 'udp')
+            if not self.drop:
+                self.udp.sendto(response, addr)
+
+    def tcp_thread(self):
+        while True:
+            try:
+                conn, _ = self.tcp.accept()
+            except Exception:
+                break
+            length = struct.unpack('!H', StubResolver.receive_exact(conn, 2))[0]
+            response = self.answer(StubResolver.receive_exact(conn, length), 'tcp')
+            conn.sendall(struct.pack('!H', len(response)) + response)
+            conn.close()
+
+    def count(self, host):
+        with self.lock:
+            return len([query for query in self.queries if query[0] == host])
+
+    def close(self):
+        for sock in [self.udp, self.tcp]:
+            sock.close()
+
+
+RECORDS = {'www.example.com': ('192.0.2.10', 120),
+           'short.example.com': ('192.0.2.11', 0),
+           'big.example.com': ('192.0.2.12', 120),
+           'missing.example.com': (None, 0)}
+
+
+@pytest.fixture
+def upstream():
+    server = FakeUpstream(RECORDS, truncate=['big.example.com'])
+    yield server
+    server.close()
+
+
+def start_resolver(upstreams):
+    resolver = StubResolver()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    assert resolver.start(','.join(upstreams), '127.0.0.1', port, configure_system=False)
+    return resolver
+
+
+def query(resolver, host, rdtype='A', tcp=False):
+    request = dns.message.make_query(host, rdtype)
+    if tcp:
+        reply = dns.query.tcp(request, '127.0.0.1', timeout=10, port=resolver.port)
+    else:
+        reply = dns.query.udp(request, '127.0.0.1', timeout=10, port=resolver.port)
+    assert reply.id == request.id
+    return reply
+
+
+def addresses(reply):
+    return [item.address for rrset in reply.answer for item in rrset]
+
+
+def upstream_address(server):
+    return '127.0.0.1#{0:d}'.format(server.port)
+
+
+def test_forward_and_cache(upstream):
+    resolver = start_resolver([upstream_address(upstream)])
+    try:
+        resolver.set_rules(None)
+        assert addresses(query(resolver, 'www.example.com')) == ['192.0.2.10']
+        # Answered from the cache (with the id of the new query)
+        assert addresses(query(resolver, 'WWW.example.com.')) == ['192.0.2.10']
+        assert addresses(query(resolver, 'www.example.com', tcp=True)) == ['192.0.2.10']
+        assert upstream.count('www.example.com') == 1
+        # A zero TTL isn't cached
+        for _ in range(2):
+            assert addresses(query(resolver, 'short.example.com')) == ['192.0.2.11']
+        assert upstream.count('short.example.com') == 2
+        # NXDOMAIN is cached for the negative TTL
+        for _ in range(2):
+            assert query(resolver, 'missing.example.com').rcode() == dns.rcode.NXDOMAIN
+        assert upstream.count('missing.example.com') == 1
+        # Truncated responses are retried over TCP
+        assert addresses(query(resolver, 'big.example.com')) == ['192.0.2.12']
+        assert [transport for host, transport in upstream.queries if host == 'big.example.com'] == ['udp', 'tcp']
+        sources = [(item['host'], item['source']) for item in resolver.get_queries()]
+        assert sources[:3] == [('www.example.com', 'upstream'), ('www.example.com', 'cache'),
+                               ('www.example.com', 'cache')]
+        resolver.flush()
+        query(resolver, 'www.example.com')
+        assert upstream.count('www.example.com') == 2
+    finally:
+        resolver.stop()
+
+
+def test_rules_answered_locally(upstream, tmp_path):
+    resolver = start_resolver([upstream_address(upstream)])
+    try:
+        rules = HostRules.from_task({'dns_override': [['www.example.com', '203.0.113.5'],
+                                                      ['v6.example.com', '2001:db8::1']],
+                                     'block_domains': ['ads.example.net', '*.tracker.example.org']})
+        resolver.set_rules(rules)
+        assert addresses(query(resolver, 'www.example.com')) == ['203.0.113.5']
+        # Only the matching address family gets an answer
+        assert addresses(query(resolver, 'www.example.com', 'AAAA')) == []
+        assert addresses(query(resolver, 'v6.example.com', 'AAAA')) == ['2001:db8::1']
+        assert addresses(query(resolver, 'ads.example.net', tcp=True)) == ['0.0.0.0']
+        assert addresses(query(resolver, 'a.b.tracker.example.org')) == ['0.0.0.0']
+        assert upstream.queries == []
+        assert addresses(query(resolver, 'short.example.com')) == ['192.0.2.11']
+        assert [item['source'] for item in resolver.get_queries()] == \
+            ['override', 'override', 'override', 'blocked', 'blocked', 'upstream']
+        path = str(tmp_path.joinpath('dns.json.gz'))
+        resolver.save_queries(path)
+        with gzip.open(path, 'rt') as f_in:
+            saved = json.load(f_in)
+        assert [item['host'] for item in saved] == ['www.example.com', 'www.example.com', 'v6.example.com',
+                                                    'ads.example.net', 'a.b.tracker.example.org',
+                                                    'short.example.com']
+        # A new test starts with a clean query log and its own rules
+        resolver.set_rules(None)
+        assert resolver.get_queries() == []
+        assert addresses(query(resolver, 'www.example.com')) == ['192.0.2.10']
+    finally:
+        resolver.stop()
+
+
+def test_upstream_failover(upstream, monkeypatch):
+    from internal import dns_resolver
+    monkeypatch.setattr(dns_resolver, 'UPSTREAM_TIMEOUT', 0.5)
+    dead = FakeUpstream(drop=True)
+    resolver = start_resolver([upstream_address(dead), upstream_address(upstream)])
+    try:
+        assert addresses(query(resolver, 'www.example.com')) == ['192.0.2.10']
+        assert dead.count('www.example.com') == 1
+    finally:
+        resolver.stop()
+        dead.close()
+    dead = FakeUpstream(drop=True)
+    resolver = start_resolver([upstream_address(dead)])
+    try:
+        assert query(resolver, 'www.example.com').rcode() == dns.rcode.SERVFAIL
+        assert resolver.get_queries()[-1]['source'] == 'error'
+    finally:
+        resolver.stop()
+        dead.close()
+
+
+def test_upstreams_option():
+    resolver = StubResolver()
+    resolver.address = '127.0.0.1'
+    resolver.port = 5353
+    assert resolver.get_upstreams('8.8.8.8, 1.1.1.1#5300,127.0.0.1#5353') == [('8.8.8.8', 53), ('1.1.1.1', 5300)]
@@ -0,0 +1,256 @@
+import copy
+import gzip
+import random
+
+import pytest
+
+from internal.firefox import Firefox
+from internal.support import firefox_log_parser
+from internal.support.firefox_log_parser import FirefoxLogParser
+
+START_TIME = '2023-05-01 10:00:00.000000'
+
+
+def timestamp(offset):
+    """Log timestamp for the given number of microseconds after the start"""
+    seconds, usecs = divmod(offset, 1000000)
+    minutes, seconds = divmod(seconds, 60)
+    return '2023-05-01 10:{0:02d}:{1:02d}.{2:06d}'.format(minutes, seconds, usecs)
+
+
+def write_logs(path, process_count=6, request_count=40, seed=1, message_port=None):
+    """Per-process moz logs with requests, sockets, TLS, HTTP/2 streams and DNS lookups.
+    Transaction pointers are reused within and across processes and some lookups start in one
+    process log and complete in another. With a message_port every fifth request goes to the
+    agent's message server."""
+    rand = random.Random(seed)
+    files = ['moz.log'] + ['moz.log.child-{0:d}'.format(index) for index in range(1, process_count)]
+    for index, name in enumerate(files):
+        thread = 'Parent' if index == 0 else 'Child {0:d}'.format(index)
+        lines = []
+        now = rand.randint(1000, 5000)
+
+        def log(category, message, socket_thread=False):
+            lines.append('{0} UTC - [{1} {2:d}: {3}]: D/{4} {5}'.format(
+                timestamp(now), thread, 100 + index, 'Socket Thread' if socket_thread else 'Main Thread',
+                category, message))
+        for request in range(request_count):
+            now += rand.randint(100, 20000)
+            host = 'host{0:d}.example.com'.format(rand.randint(0, 12))
+            channel = 'c{0:d}a{1:d}'.format(index, request)
+            # A small pool of transaction pointers so they get reused
+            trans = 'f{0:x}'.format(rand.randint(0, 15))
+            conn = 'e{0:d}b{1:d}'.format(index, request)
+            sock = 'd{0:d}c{1:d}'.format(index, request)
+            stream = 'a{0:d}d{1:d}'.format(index, request)
+            url = 'https://{0}/path/{1:d}?q={2:d}'.format(host, request, rand.randint(0, 3))
+            if message_port is not None and request % 5 == 0:
+                url = 'http://127.0.0.1:{0:d}/config/{1:d}'.format(message_port, request)
+            if rand.random() < 0.3:
+                log('nsHostResolver', 'Calling getaddrinfo for host [{0}].'.format(host))
+            if rand.random() < 0.3:
+                now += rand.randint(10, 500)
+                log('nsHostResolver', 'lookup completed for host [{0}]: success.'.format(host))
+            log('nsHttp', 'HttpBaseChannel::Init [this={0}]'.format(channel))
+            log('nsHttp', 'uri={0}'.format(url))
+            log('nsHttp', 'nsHttpChannel::SetPriority {0} p={1:d}'.format(channel, rand.choice([-20, -10, 0, 10])))
+            if rand.random() < 0.5:
+                log('nsHttp', 'Creating nsHttpTransaction @{0}'.format(trans))
+            log('nsHttp', 'nsHttpChannel {0} created nsHttpTransaction {1}'.format(channel, trans))
+            log('nsHttp', 'nsHttpTransaction::Init [this={0} caps=21]'.format(trans))
+            log('nsHttp', 'http request [')
+            log('nsHttp', '  GET /path/{0:d} HTTP/1.1'.format(request))
+            log('nsHttp', '  Host: {0}'.format(host))
+            log('nsHttp', ']')
+            now += rand.randint(10, 500)
+            log('nsSocketTransport', 'nsSocketTransport::Init [this={0} host={1}:443 origin={1}:443 proxy=:0]'.format(
+                sock, host), True)
+            log('nsSocketTransport', 'nsSocketTransport::SendStatus [this={0} status=804b0007]'.format(sock), True)
+            now += rand.randint(1000, 30000)
+            log('nsSocketTransport', 'nsSocketTransport::OnSocketReady [this={0} outFlags=2]'.format(sock), True)
+            log('nsHttp', 'nsHttpConnection::Init this={0}'.format(conn), True)
+            log('nsHttp', 'nsHttpConnection::SetupSSL {0}'.format(conn), True)
+            now += rand.randint(1000, 30000)
+            log('nsHttp', 'nsHttpConnection::HandshakeDone [this={0}]'.format(conn), True)
+            log('nsHttp', 'nsHttpConnection::Activate [this={0} trans={1} caps=21]'.format(conn, trans), True)
+            log('nsHttp', 'nsHttpTransaction::OnTransportStatus {0} SENDING_TO 0'.format(trans), True)
+            log('nsHttp', 'Http2Stream::Http2Stream {0} trans={1} '.format(stream, trans), True)
+            log('nsHttp', 'Http2Session::RegisterStreamID session=9f stream={0} id=0x{1:x} '.format(
+                stream, request * 2 + 1), True)
+            log('nsHttp', 'Http2Stream {0} Generating 120 bytes of HEADERS for stream 0x{1:x} with priority '
+                'weight {2:d} dep 0x{3:x} '.format(stream, request * 2 + 1, rand.randint(1, 256), 0), True)
+            now += rand.randint(1000, 50000)
+            log('nsHttp', 'nsHttpTransaction::ProcessData [this={0} count=512]'.format(trans), True)
+            log('nsHttp', 'Have status line [this={0} status=200 version=20]'.format(trans), True)
+            log('nsHttp', 'nsHttpTransaction::ParseLine [HTTP/2 200 OK]', True)
+            log('nsHttp', 'nsHttpTransaction::ParseLine [content-type: text/html]', True)
+            for _ in range(rand.randint(1, 3)):
+                now += rand.randint(100, 5000)
+                log('nsHttp', 'nsHttpTransaction::HandleContent [this={0} count={1:d} read=0]'.format(
+                    trans, rand.randint(100, 10000)), True)
+        lines.append('malformed line')
+        text = '\n'.join(lines) + '\n'
+        if index == 2:
+            with gzip.open(str(path.joinpath(name + '.gz')), 'wt') as f_out:
+                f_out.write(text)
+        else:
+            path.joinpath(name).write_text(text)
+    return str(path.joinpath('moz.log'))
+
+
+def legacy_attach_dns(dns, requests):
+    """The DNS claims the way finish_processing made them before the hostname index"""
+    from urllib.parse import urlsplit
+    for domain in dns:
+        if 'claimed' not in dns[domain]:
+            for request in requests:
+                host = urlsplit(request['url']).hostname
+                if host == domain:
+                    dns[domain]['claimed'] = True
+                    if 'start' in dns[domain]:
+                        request['dns_start'] = dns[domain]['start']
+                    if 'end' in dns[domain]:
+                        request['dns_end'] = dns[domain]['end']
+                    break
+
+
+def test_parallel_matches_serial(tmp_path, monkeypatch):
+    log_file = write_logs(tmp_path)
+    serial = FirefoxLogParser().process_logs(log_file, START_TIME, 1)
+    merged = []
+    merge_tables = FirefoxLogParser.merge_tables
+
+    def spy(self, tables):
+        merged.append(tables)
+        return merge_tables(self, tables)
+    monkeypatch.setattr(FirefoxLogParser, 'merge_tables', spy)
+    parallel = FirefoxLogParser().process_logs(log_file, START_TIME, 4)
+    # The pool did the parsing (rather than falling back to the serial loop)
+    assert len(merged) == 6
+    assert len(serial) > 100
+    assert parallel == serial
+    assert [list(request.keys()) for request in parallel] == [list(request.keys()) for request in serial]
+    assert len([request for request in serial if 'dns_start' in request]) > 0
+    assert len([request for request in serial if '.' in request['id']]) > 0
+
+
+def test_worker_tables_match_serial(tmp_path):
+    """Each worker's partial tables merged in file order match parsing the files one after another"""
+    write_logs(tmp_path, seed=7)
+    serial = FirefoxLogParser()
+    serial.set_start_time(START_TIME)
+    parallel = FirefoxLogParser()
+    parallel.set_start_time(START_TIME)
+    for path in sorted(tmp_path.glob('moz.log*')):
+        serial.process_log_file(str(path))
+        parallel.merge_tables(firefox_log_parser.parse_log_file_tables((str(path), START_TIME)))
+    for key in firefox_log_parser.SOURCE_STATE_KEYS:
+        serial.http.pop(key, None)
+    assert parallel.dns == serial.dns
+    assert parallel.http == serial.http
+    assert list(parallel.http['requests'].keys()) == list(serial.http['requests'].keys())
+    assert parallel.finish_processing() == serial.finish_processing()
+
+
+@pytest.mark.parametrize('processes', [1, 4])
+def test_message_server_requests_filtered(tmp_path, processes):
+    """A worker's own message server port is filtered out, not the default one"""
+    message_server = 'http://127.0.0.1:8890/'
+    log_file = write_logs(tmp_path, message_port=8890)
+    requests = FirefoxLogParser().process_logs(log_file, START_TIME, processes)
+    assert len([request for request in requests if request['url'].startswith(message_server)]) > 0
+    parser = FirefoxLogParser(message_server)
+    requests = parser.process_logs(log_file, START_TIME, processes)
+    assert parser.message_server == message_server
+    assert len(requests) > 100
+    assert [request for request in requests if request['url'].startswith(message_server)] == []
+    # The live parsing keeps the port too
+    parser = FirefoxLogParser(message_server)
+    parser.start_live(START_TIME)
+    for path in sorted(tmp_path.glob('moz.log*')):
+        if not path.name.endswith('.gz'):
+            parser.process_log_data(str(path), path.read_bytes())
+    requests = parser.finish_live()
+    assert len(requests) > 100
+    assert [request for request in requests if request['url'].startswith(message_server)] == []
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_dns_index_matches_linear_scan(tmp_path, seed):
+    write_logs(tmp_path, seed=seed)
+    parser = FirefoxLogParser()
+    parser.set_start_time(START_TIME)
+    for path in sorted(tmp_path.glob('moz.log*')):
+        parser.process_log_file(str(path))
+    reference = copy.deepcopy(parser)
+    requests = parser.finish_processing()
+    # The reference does everything but the DNS claims, then claims them the old way
+    dns = reference.dns
+    reference.dns = {}
+    expected = reference.finish_processing()
+    legacy_attach_dns(dns, expected)
+    assert requests == expected
+    assert len([request for request in requests if 'dns_start' in request]) > 0
+
+
+def extension_requests(log_requests, rand):
+    """Extension (webRequest) events for most of the log requests plus some that aren't in the logs"""
+    requests = {}
+    for index, log_request in enumerate(log_requests):
+        if rand.random() < 0.8:
+            request_id = 'ext{0:d}'.format(index)
+            requests[request_id] = {'id': request_id, 'url': log_request['url'], 'from_net': True,
+                                    'start': log_request['start'] + 0.001, 'method': 'GET', 'status': 200,
+                                    'response_headers': [{'name': 'Content-Length', 'value': '123'}]}
+    for index in range(10):
+        request_id = 'extra{0:d}'.format(index)
+        requests[request_id] = {'id': request_id, 'url': 'https://extra.example.com/{0:d}'.format(index),
+                                'from_net': True, 'start': 0.5 + index}
+    return requests
+
+
+def legacy_merge_expected(firefox, request_timings):
+    """Request ID -> the log entry the old nested URL scan paired it with"""
+    claimed = set()
+    pairs = {}
+    for req_id in firefox.requests:
+        req = firefox.requests[req_id]
+        for index, log_request in enumerate(request_timings):
+            if index not in claimed and 'url' in log_request and 'start' in log_request and \
+                    req['url'] == log_request['url']:
+                claimed.add(index)
+                pairs[req['id']] = log_request
+                break
+    unclaimed = [log_request for index, log_request in enumerate(request_timings)
+                 if index not in claimed and 'url' in log_request and 'start' in log_request]
+    return pairs, unclaimed
+
+
+@pytest.mark.parametrize('seed', [1, 2])
+def test_merge_requests_matches_linear_scan(tmp_path, seed):
+    log_file = write_logs(tmp_path, seed=seed)
+    request_timings = FirefoxLogParser().process_logs(log_file, START_TIME, 1)
+    firefox = Firefox.__new__(Firefox)
+    firefox.job = {}
+    firefox.requests = extension_requests(request_timings, random.Random(seed))
+    pairs, unclaimed = legacy_merge_expected(firefox, request_timings)
+    # Repeated URLs pair up in order
+    urls = [request['url'] for request in request_timings]
+    assert len(urls) > len(set(urls))
+    requests = firefox.merge_requests(copy.deepcopy(request_timings))
+    assert len(requests) == len(firefox.requests) + len(unclaimed)
+    by_id = {}
+    for request in requests:
+        by_id.setdefault(request['id'], []).append(request)
+    for req_id in firefox.requests:
+        request = by_id[req_id][0]
+        if req_id in pairs:
+            log_request = pairs[req_id]
+            assert request['load_start'] == int(log_request['start'] * 1000)
+            assert request['bytesIn'] == log_request['bytes_in']
+            assert request['socket'] == log_request.get('connection', -1)
+        else:
+            assert request['load_start'] == int(round(firefox.requests[req_id]['start'] * 1000.0))
+    for log_request in unclaimed:
+        assert [request for request in by_id[log_request['id']]
+                if request['load_start'] == int(log_request['start'] * 1000)]
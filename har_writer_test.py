@@ -0,0 +1,89 @@
+import gzip
+import json as std_json
+import os
+
+import pytest
+
+from internal import har_writer
+from internal.har_writer import HarWriter
+from internal.replay import Replay
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts', 'replay_corpus', 'REPLAY_1.1.0')
+
+
+def load_har():
+    with gzip.open(os.path.join(CORPUS, 'expected', '1_har.json.gz'), 'rt') as f_in:
+        return std_json.load(f_in)
+
+
+def read_output(path):
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rt') as f_in:
+            return f_in.read()
+    with open(path, 'rt') as f_in:
+        return f_in.read()
+
+
+def stream_har(path, har, compressor):
+    """Write the HAR the same way generate_har does (header, pages, each entry, then lighthouse)"""
+    log = har['log']
+    with HarWriter(path, compressor) as writer:
+        writer.begin_object()
+        writer.begin_object('log')
+        for key in log:
+            if key in ['pages', 'entries']:
+                writer.begin_array(key)
+                writer.add_items(iter(log[key]))
+                writer.end_array()
+            else:
+                writer.add(log[key], key)
+        writer.end_object()
+        for key in har:
+            if key != 'log':
+                writer.add(har[key], key)
+        writer.end_object()
+    return writer.path
+
+
+@pytest.mark.parametrize('json_module', ['default', 'json'])
+@pytest.mark.parametrize('compressor', ['none', 'gzip'])
+def test_stream_matches_json_dump(tmp_path, monkeypatch, json_module, compressor):
+    if json_module == 'json':
+        monkeypatch.setattr(har_writer, 'json', std_json)
+    har = load_har()
+    har['_lighthouse'] = {'categories': {'performance': {'score': 0.91}}, 'text': u'café ☃ "quoted"'}
+    path = stream_har(str(tmp_path.joinpath('1_har.json')), har, compressor)
+    assert read_output(path) == har_writer.json.dumps(har)
+
+
+def test_empty_containers_match_json_dump(tmp_path):
+    har = {'log': {'version': '1.1', 'pages': [], 'entries': []}}
+    path = stream_har(str(tmp_path.joinpath('empty.json')), har, 'none')
+    assert read_output(path) == har_writer.json.dumps(har)
+
+
+@pytest.mark.parametrize('compressor', ['none', 'gzip', 'brotli'])
+def test_error_deletes_partial_file(tmp_path, compressor):
+    if compressor == 'brotli':
+        pytest.importorskip('brotli')
+    path = str(tmp_path.joinpath('1_har.json'))
+    with pytest.raises(ValueError):
+        with HarWriter(path, compressor) as writer:
+            writer.begin_object()
+            writer.begin_array('entries')
+            writer.add({'request': {}})
+            raise ValueError('entry failed')
+    assert writer.file is None
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_generate_har_matches_json_dump(tmp_path):
+    """The HAR from the post-processing is what json.dump writes for the same document"""
+    replay = Replay(CORPUS)
+    replay.manifest['har'] = True
+    result = replay.run(str(tmp_path))
+    assert not result['errors']
+    text = read_output(os.path.join(replay.task['dir'], '1_har.json.gz'))
+    har = har_writer.json.loads(text)
+    assert text == har_writer.json.dumps(har)
+    assert har == load_har()
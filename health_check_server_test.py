@@ -0,0 +1,70 @@
+import socket
+import time
+
+import requests
+
+from internal.base_browser import BaseBrowser
+from internal.health_check_server import HealthCheckServer
+from internal.metrics import JOBS, PROFILE_DURATION, RUN_DURATION
+
+PROXIES = {'http': None, 'https': None}
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def parse_samples(text):
+    """The sample lines of the exposition text as {name{labels}: value}"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            assert name not in samples, 'Duplicate sample ' + name
+            samples[name] = float(value)
+    return samples
+
+
+def test_metrics_scrape():
+    port = free_port()
+    server = HealthCheckServer(port)
+    server.start()
+    JOBS.inc()
+    RUN_DURATION.observe(3.0)
+    response = requests.get('http://127.0.0.1:{0:d}/metrics'.format(port), timeout=10, proxies=PROXIES)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    samples = parse_samples(response.text)
+    assert samples['wptagent_jobs_total'] >= 1
+    assert samples['wptagent_run_duration_seconds_bucket{le="5"}'] >= 1
+    assert samples['wptagent_run_duration_seconds_bucket{le="+Inf"}'] == samples['wptagent_run_duration_seconds_count']
+    assert 0 <= samples['wptagent_last_healthy_age_seconds'] < 60
+    assert response.text.count('# TYPE wptagent_last_healthy_age_seconds gauge') == 1
+    # The health check itself
+    response = requests.get('http://127.0.0.1:{0:d}/'.format(port), timeout=10, proxies=PROXIES)
+    assert response.status_code == 200
+    assert response.text == 'OK\n'
+    # Another server instance doesn't register the metrics again
+    HealthCheckServer(free_port())
+    response = requests.get('http://127.0.0.1:{0:d}/metrics'.format(port), timeout=10, proxies=PROXIES)
+    parse_samples(response.text)
+    assert response.text.count('# TYPE wptagent_last_healthy_age_seconds gauge') == 1
+
+
+def test_profile_events_timed_without_profile_data():
+    browser = BaseBrowser()
+    browser.task = {'run': 1}
+    browser.profile_start('metrics_test.event')
+    time.sleep(0.05)
+    browser.profile_end('metrics_test.event')
+    # Ending an event that was never started isn't recorded
+    browser.profile_end('metrics_test.missing')
+    series = PROFILE_DURATION.series[('metrics_test.event',)]
+    assert series['count'] == 1
+    assert series['sum'] >= 0.05
+    assert ('metrics_test.missing',) not in PROFILE_DURATION.series
+    assert 'profile_data' not in browser.task
@@ -0,0 +1,143 @@
+import os
+import re
+
+import pytest
+
+from internal.host_rules import HostRules, add_block_domains, get_static_block_domains
+from internal.webpagetest import WebPageTest
+
+JOBS = [
+    {},
+    {'blockDomains': 'ads.example.com tracker.example.net,cdn.example.org'},
+    {'blockDomains': ' bad"domain.com, ,*.wild.example.com under_score.example.com '},
+    {'script': 'navigate\thttps://www.example.com/'},
+    {'blockDomains': 'ads.example.com',
+     'script': 'blockDomains\tads.example.com www.example.com\n'
+               'setDns\twww.example.com\t203.0.113.5\n'
+               'setDns\tapi.example.com\tnot-an-ip\n'
+               'setDns\tWWW.Example.com\t203.0.113.6\n'
+               'blockDomainsExcept\tkeep.example.com other.example.com\n'
+               'blockDomains\t*.example.net,coinhive.com\n'
+               'navigate\thttps://www.example.com/'},
+]
+
+
+def legacy_task(job):
+    """The host rule lists as get_task/build_script built them before the rules table"""
+    task = {}
+    if 'blockDomains' in job:
+        if 'host_rules' not in task:
+            task['host_rules'] = []
+        if 'block_domains' not in task:
+            task['block_domains'] = []
+        if 'dns_override' not in task:
+            task['dns_override'] = []
+        domains = re.split('[, ]', job['blockDomains'])
+        for domain in domains:
+            domain = domain.strip()
+            if len(domain) and domain.find('"') == -1:
+                task['block_domains'].append(domain)
+                task['host_rules'].append('"MAP {0} 127.0.0.1"'.format(domain))
+                if re.match(r'^[a-zA-Z0-9\-\.]+$', domain):
+                    task['dns_override'].append([domain, "0.0.0.0"])
+    crypto_list = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'internal', 'support', 'adblock',
+                               'nocoin', 'hosts.txt')
+    if os.path.exists(crypto_list):
+        with open(crypto_list, 'rt') as f_in:
+            if 'dns_override' not in task:
+                task['dns_override'] = []
+            for line in f_in:
+                if line.startswith('0.0.0.0'):
+                    domain = line[8:].strip()
+                    task['dns_override'].append([domain, "0.0.0.0"])
+    for line in job.get('script', '').splitlines():
+        parts = line.split("\t", 2)
+        command = parts[0].lower().strip()
+        target = parts[1].strip() if len(parts) > 1 else None
+        value = parts[2].strip() if len(parts) > 2 else None
+        if command == 'blockdomains' and target is not None:
+            if 'block_domains' not in task:
+                task['block_domains'] = []
+            if 'host_rules' not in task:
+                task['host_rules'] = []
+            if 'dns_override' not in task:
+                task['dns_override'] = []
+            domains = re.split('[, ]', target)
+            for domain in domains:
+                domain = domain.strip()
+                if len(domain) and domain.find('"') == -1:
+                    task['block_domains'].append(domain)
+                    task['host_rules'].append('"MAP {0} 127.0.0.1"'.format(domain))
+                    if re.match(r'^[a-zA-Z0-9\-\.]+$', domain):
+                        task['dns_override'].append([domain, "127.0.0.1"])
+        elif command == 'blockdomainsexcept' and target is not None:
+            if 'block_domains_except' not in task:
+                task['block_domains_except'] = []
+            if 'host_rules' not in task:
+                task['host_rules'] = []
+            for domain in target.split():
+                domain = domain.strip()
+                if len(domain) and domain.find('"') == -1:
+                    task['block_domains_except'].append(domain)
+                    task['host_rules'].append('"MAP * 127.0.0.1, EXCLUDE {0}"'.format(domain))
+        elif command == 'setdns':
+            if target is not None and value is not None and len(target) and len(value):
+                if target.find('"') == -1 and value.find('"') == -1:
+                    if 'dns_override' not in task:
+                        task['dns_override'] = []
+                    if 'host_rules' not in task:
+                        task['host_rules'] = []
+                    task['host_rules'].append('"MAP {0} {1}"'.format(target, value))
+                    if re.match(r'^\d+\.\d+\.\d+\.\d+$', value) and re.match(r'^[a-zA-Z0-9\-\.]+$', target):
+                        task['dns_override'].append([target, value])
+    return task
+
+
+def build_task(job):
+    """The host rule lists from the current get_task/build_script code"""
+    job = dict(job)
+    task = {'block': []}
+    if 'blockDomains' in job:
+        add_block_domains(task, job['blockDomains'], "0.0.0.0")
+    static_block_domains = get_static_block_domains()
+    if static_block_domains:
+        if 'dns_override' not in task:
+            task['dns_override'] = []
+        task['dns_override'].extend([[domain, "0.0.0.0"] for domain in static_block_domains])
+    WebPageTest.__new__(WebPageTest).build_script(job, task)
+    task['host_rules_table'] = HostRules.from_task(task)
+    return task
+
+
+def linear_resolve(task, host):
+    """Resolve a host by scanning the lists (the first override wins, like the hosts file)"""
+    host = host.lower().rstrip('.')
+    for override_host, address in task.get('dns_override', []):
+        if override_host.lower() == host:
+            return address
+    for domain in task.get('block_domains', []):
+        domain = domain.lower()
+        if domain == host or (domain.startswith('*.') and host.endswith(domain[1:])):
+            return '0.0.0.0'
+    return None
+
+
+@pytest.mark.parametrize('job', JOBS)
+def test_lists_match_legacy(job):
+    task = build_task(job)
+    expected = legacy_task(job)
+    for key in ['host_rules', 'block_domains', 'block_domains_except', 'dns_override']:
+        assert task.get(key) == expected.get(key)
+
+
+@pytest.mark.parametrize('job', JOBS)
+def test_table_matches_lists(job):
+    task = build_task(job)
+    rules = task['host_rules_table']
+    hosts = set(['www.example.com', 'WWW.EXAMPLE.COM.', 'api.example.com', 'unknown.example.com',
+                 'a.b.wild.example.com', 'wild.example.com', 'x.example.net', 'example.net'])
+    for key in ['dns_override']:
+        hosts.update(host for host, _ in task.get(key, []))
+    hosts.update(domain.lstrip('*.') for domain in task.get('block_domains', []))
+    for host in sorted(hosts):
+        assert rules.resolve(host) == linear_resolve(task, host), host
@@ -10,8 +10,10 @@ import platform
 import re
 import subprocess
 import sys
+import threading
 from threading import Timer
 import time
+import uuid
 if (sys.version_info >= (3, 0)):
     from time import monotonic
 else:
@@ -19,6 +21,124 @@ else:
 
 # cSpell:ignore vpndialogs, sysctl, iptables, ifconfig, dstaddr, clientidbase, nsecs
 
+class AdbShellSession(object):
+    """Long-lived adb shell that runs commands one at a time over the same connection.
+    Each command is followed by an echo of a unique marker so the output can be framed
+    without spawning a new adb process (and watchdog thread) for every command."""
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.proc = None
+        self.reader = None
+        self.buffer = bytearray()
+        self.marker = None
+        self.lock = threading.Lock()
+        self.data_available = threading.Condition()
+        self.command_count = 0
+
+    def start(self):
+        """Start the adb shell process"""
+        try:
+            self.marker = 'WPT_DONE_' + uuid.uuid4().hex
+            self.buffer = bytearray()
+            self.proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, bufsize=0)
+            self.reader = threading.Thread(target=self.read_output, args=(self.proc,))
+            self.reader.daemon = True
+            self.reader.start()
+        except Exception:
+            logging.exception('Error starting adb shell session')
+            self.proc = None
+        return self.proc is not None
+
+    def stop(self):
+        """Close the shell session"""
+        proc = self.proc
+        self.proc = None
+        if proc is not None:
+            try:
+                proc.stdin.close()
+            except Exception:
+                pass
+            try:
+                proc.kill()
+                proc.wait()
+            except Exception:
+                pass
+        if self.reader is not None:
+            self.reader.join(5)
+            self.reader = None
+
+    def read_output(self, proc):
+        """Background thread that collects the shell output"""
+        try:
+            while True:
+                data = proc.stdout.read(65536)
+                if not data:
+                    break
+                with self.data_available:
+                    self.buffer.extend(data)
+                    self.data_available.notify_all()
+        except Exception:
+            pass
+        with self.data_available:
+            self.data_available.notify_all()
+
+    def run(self, command, timeout_sec=60):
+        """Run a command in the shell session and return the output.
+        Returns None if the session isn't available or the command never started. If
+        the command times out, the session is closed (so it can't de-sync later
+        commands) and the partial output is returned."""
+        output = None
+        with self.lock:
+            if self.proc is None or self.proc.poll() is not None:
+                self.stop()
+                if not self.start():
+                    return None
+            self.command_count += 1
+            # The markers are split with "" in the script so the command line echoed back
+            # by shells running on a PTY can't match them, and PTY line endings are \r\n.
+            start_marker = re.compile(r'{0}_START:{1:d}\r?\n'.format(
+                self.marker, self.command_count).encode('utf-8'))
+            end_marker = re.compile(r'\r?\n{0}:{1:d}\r?\n'.format(
+                self.marker, self.command_count).encode('utf-8'))
+            # Run each command in a sub-shell with no stdin so it can't consume the
+            # commands that follow, and inject a newline before the marker so output
+            # that doesn't end with one can still be framed.
+            script = 'echo {1}_START:""{2:d}; ( {0} ) </dev/null; echo; echo {1}:""{2:d}\n'.format(
+                command, self.marker, self.command_count)
+            try:
+                self.proc.stdin.write(script.encode('utf-8'))
+                self.proc.stdin.flush()
+            except Exception:
+                logging.debug('Error writing to the adb shell session')
+                self.stop()
+                return None
+            end_time = monotonic() + timeout_sec
+            complete = False
+            with self.data_available:
+                while True:
+                    start = start_marker.search(self.buffer)
+                    end = end_marker.search(self.buffer, start.end()) if start else None
+                    if end is not None:
+                        output = bytes(self.buffer[start.end():end.start()])
+                        del self.buffer[:end.end()]
+                        complete = True
+                        break
+                    remaining = end_time - monotonic()
+                    if remaining <= 0 or self.reader is None or not self.reader.is_alive():
+                        # Output from a command that never started isn't the command's
+                        if start is not None:
+                            output = bytes(self.buffer[start.end():])
+                        break
+                    self.data_available.wait(min(remaining, 1.0))
+            if not complete:
+                logging.debug('adb shell session command did not complete, closing the session')
+                self.stop()
+        if output is not None:
+            output = output.decode('utf-8', 'replace').replace('\r\n', '\n')
+        return output
+
+
 class Adb(object):
     """ADB command-line interface"""
     def __init__(self, options, cache_dir):
@@ -32,6 +152,7 @@ class Adb(object):
         self.kernel = None
         self.short_version = None
         self.last_bytes_rx = 0
+        self.shell_session = None
         self.initialized = False
         self.this_path = os.path.abspath(os.path.dirname(__file__))
         self.root_path = os.path.abspath(os.path.join(self.this_path, os.pardir))
@@ -102,6 +223,14 @@ class Adb(object):
 
     def shell(self, args, timeout_sec=60, silent=False):
         """Run an adb shell command"""
+        if self.shell_session is not None:
+            if not silent:
+                logging.debug('adb shell %s', ' '.join(args))
+            stdout = self.shell_session.run(' '.join(args), timeout_sec)
+            if stdout is not None:
+                if not silent and len(stdout):
+                    logging.debug(stdout[:100])
+                return stdout
         cmd = self.build_adb_command(['shell'])
         cmd.extend(args)
         return self.run(cmd, timeout_sec, silent)
@@ -130,6 +259,8 @@ class Adb(object):
         out = self.run(self.build_adb_command(['devices']))
         if out is not None:
             ret = True
+            if not self.options.noadbsession and self.shell_session is None:
+                self.shell_session = AdbShellSession(self.build_adb_command(['shell']))
             # Set the CPU affinity for adb which helps avoid hangs
             if platform.system() != "Darwin":
                 for proc in psutil.process_iter():
@@ -166,6 +297,9 @@ class Adb(object):
 
     def stop(self):
         """Shut down anything necessary"""
+        if self.shell_session is not None:
+            self.shell_session.stop()
+            self.shell_session = None
         if self.simplert is not None:
             self.shell(['am', 'force-stop', 'com.viper.simplert'])
             logging.debug('Stopping simple-rt bridge process')
@@ -771,8 +905,12 @@ class Adb(object):
 
     def get_bytes_rx(self):
         """Get the incremental bytes received across all non-loopback interfaces"""
-        bytes_rx = 0
         out = self.shell(['cat', '/proc/net/dev'], silent=True)
+        return self.parse_bytes_rx(out)
+
+    def parse_bytes_rx(self, out):
+        """Calculate the incremental bytes received from /proc/net/dev"""
+        bytes_rx = 0
         if out is not None:
             for line in out.splitlines():
                 match = re.search(r'^\s*(\w+):\s+(\d+)', line)
@@ -784,6 +922,21 @@ class Adb(object):
         self.last_bytes_rx = bytes_rx
         return delta
 
+    def get_video_activity(self):
+        """Get the current video file size and incremental bytes received in one round trip"""
+        out = self.shell(['ls', '-l', '/data/local/tmp/wpt_video.mp4', ';',
+                          'echo', 'WPT_NET_DEV', ';', 'cat', '/proc/net/dev'], silent=True)
+        size = 0
+        net_dev = None
+        if out is not None:
+            parts = out.split('WPT_NET_DEV\n', 1)
+            match = re.search(r'[^\d]+\s+(\d+) \d+', parts[0])
+            if match:
+                size = int(match.group(1))
+            if len(parts) > 1:
+                net_dev = parts[1]
+        return size, self.parse_bytes_rx(net_dev)
+
     def get_video_size(self):
         """Get the current size of the video file"""
         size = 0
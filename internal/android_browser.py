@@ -324,7 +324,7 @@ class AndroidBrowser(BaseBrowser):
                     path_base = os.path.join(task['dir'], task['prefix'])
                     slices_file = path_base + '_pcap_slices.json.gz'
                     pcap_parser = os.path.join(os.path.abspath(os.path.dirname(__file__)),
-                                               'support', "pcap-parser.py")
+                                               'support', "pcap_parser.py")
                     cmd = [sys.executable, pcap_parser, '--json', '-i', pcap_out, '-d', slices_file]
                     logging.debug(' '.join(cmd))
                     self.tcpdump_processing = subprocess.Popen(cmd, stdout=subprocess.PIPE,
@@ -0,0 +1,142 @@
+# Copyright 2021 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""In-memory store for the json results of a run. The browser code publishes the results
+as they are collected and the post-processing consumes them directly, the gzipped files
+for the upload are written in the background."""
+import gzip
+import logging
+import os
+import sys
+import threading
+if (sys.version_info >= (3, 0)):
+    GZIP_TEXT = 'wt'
+    GZIP_READ_TEXT = 'rt'
+else:
+    GZIP_TEXT = 'w'
+    GZIP_READ_TEXT = 'r'
+try:
+    import ujson as json
+except BaseException:
+    import json
+
+
+def write_file(path, text, level=7):
+    """Write the serialized json to the file (gzipped if it is a .gz file)"""
+    if path.lower().endswith('.gz'):
+        with gzip.open(path, GZIP_TEXT, level) as f_out:
+            f_out.write(text)
+    else:
+        with open(path, 'wt') as f_out:
+            f_out.write(text)
+
+
+def read_file(path):
+    """Load the json from the file (gzipped if it is a .gz file)"""
+    if path.lower().endswith('.gz'):
+        with gzip.open(path, GZIP_READ_TEXT) as f_in:
+            return json.load(f_in)
+    with open(path, 'rt') as f_in:
+        return json.load(f_in)
+
+
+class ArtifactStore(object):
+    """Results of the current run, keyed by the path of the file they are written to"""
+    def __init__(self):
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.artifacts = {}
+        # Serialized results waiting to be written (in order) and the one being written
+        self.pending = {}
+        self.order = []
+        self.writing = None
+        self.thread = None
+
+    def publish(self, path, data, level=7):
+        """Make the result available for processing and write it to the file in the background.
+        The json is serialized immediately so the data can be changed once it is published."""
+        text = json.dumps(data)
+        if not self.enabled:
+            write_file(path, text, level)
+            return
+        with self.condition:
+            self.artifacts[path] = data
+            if path not in self.pending:
+                self.order.append(path)
+            self.pending[path] = (text, level)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.writer)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify_all()
+
+    def load(self, path):
+        """The published result for the file, loaded from disk if it wasn't published.
+        Returns None if it isn't available."""
+        with self.lock:
+            if path in self.artifacts:
+                return self.artifacts[path]
+        self.wait(path)
+        if os.path.isfile(path):
+            return read_file(path)
+        return None
+
+    def exists(self, path):
+        """See if the result is available (published or on disk)"""
+        with self.lock:
+            if path in self.artifacts:
+                return True
+        return os.path.isfile(path)
+
+    def wait(self, path=None):
+        """Wait for the file (or all of the files if path is None) to be written"""
+        with self.condition:
+            while (path is None and (self.pending or self.writing is not None)) or \
+                    (path is not None and (path in self.pending or self.writing == path)):
+                self.condition.wait(1)
+
+    def flush(self):
+        """Wait for all of the pending files to be written (before they are uploaded)"""
+        self.wait()
+
+    def discard(self, path):
+        """Drop the result and delete the file"""
+        with self.condition:
+            self.artifacts.pop(path, None)
+            self.pending.pop(path, None)
+        self.wait(path)
+        try:
+            if os.path.isfile(path):
+                os.unlink(path)
+        except Exception:
+            pass
+
+    def release(self, directory):
+        """Drop the results of a run once it has been processed (the files are kept)"""
+        directory = os.path.join(directory, '')
+        with self.lock:
+            for path in list(self.artifacts):
+                if path.startswith(directory):
+                    del self.artifacts[path]
+
+    def writer(self):
+        """Background thread for writing the files"""
+        while True:
+            with self.condition:
+                while not self.order:
+                    self.condition.wait()
+                path = self.order.pop(0)
+                entry = self.pending.pop(path, None)
+                self.writing = path if entry is not None else None
+            if entry is not None:
+                try:
+                    write_file(path, entry[0], entry[1])
+                except Exception:
+                    logging.exception('Error writing %s', path)
+                with self.condition:
+                    self.writing = None
+                    self.condition.notify_all()
+
+
+ARTIFACTS = ArtifactStore()
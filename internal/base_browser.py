@@ -9,6 +9,8 @@ import os
 import platform
 import shlex
 from time import monotonic
+from . import metrics
+from .spans import SPANS
 
 class BaseBrowser(object):
     """Browser base"""
@@ -26,11 +28,15 @@ class BaseBrowser(object):
         return None
 
     def profile_start(self, event_name):
+        SPANS.start(event_name)
         if self.task is not None and 'profile_data' in self.task:
             with self.task['profile_data']['lock']:
                 self.task['profile_data'][event_name] = {'s': round(monotonic() - self.task['profile_data']['start'], 3)}
 
     def profile_end(self, event_name):
+        elapsed = SPANS.end(event_name)
+        if elapsed is not None:
+            metrics.PROFILE_DURATION.observe(elapsed, event_name)
         if self.task is not None and 'profile_data' in self.task:
             with self.task['profile_data']['lock']:
                 if event_name in self.task['profile_data']:
@@ -231,8 +231,7 @@ class BlackBoxAndroid(AndroidBrowser):
         bytes_rx = self.adb.get_bytes_rx()
         while not video_started and monotonic() < end_startup and not self.must_exit:
             time.sleep(5)
-            video_size = self.adb.get_video_size()
-            bytes_rx = self.adb.get_bytes_rx()
+            video_size, bytes_rx = self.adb.get_video_activity()
             delta = video_size - last_size
             logging.debug('Video Size: %d bytes (+ %d)', video_size, delta)
             last_size = video_size
@@ -242,8 +241,7 @@ class BlackBoxAndroid(AndroidBrowser):
         video_idle_count = 0
         while video_idle_count <= 3 and monotonic() < end_time and not self.must_exit:
             time.sleep(5)
-            video_size = self.adb.get_video_size()
-            bytes_rx = self.adb.get_bytes_rx()
+            video_size, bytes_rx = self.adb.get_video_activity()
             delta = video_size - last_size
             logging.debug('Video Size: %d bytes (+ %d) - %d bytes received',
                           video_size, delta, bytes_rx)
@@ -89,7 +89,7 @@ class ChromeDesktop(DesktopBrowser, DevtoolsBrowser):
         DesktopBrowser.__init__(self, path, options, job)
         use_devtools_video = True if self.job['capture_display'] is None else False
         DevtoolsBrowser.__init__(self, options, job, use_devtools_video=use_devtools_video)
-        self.start_page = 'http://127.0.0.1:8888/orange.html'
+        self.start_page = 'http://127.0.0.1:{0:d}/orange.html'.format(options.messageport)
         self.connected = False
         self.is_chrome = True
         self.netlog_fifo = None
@@ -331,6 +331,29 @@ class ChromeDesktop(DesktopBrowser, DevtoolsBrowser):
                 os.remove(netlog_file)
         self.remove_policy()
 
+    def get_profile_template_sources(self):
+        """The template is rebuilt when the preferences change"""
+        return [os.path.join(os.path.abspath(os.path.dirname(__file__)), 'support', 'chrome', 'prefs.json')]
+
+    def build_profile_template(self, profile_dir):
+        """Launch the browser headless against an empty profile to initialize it.
+        Returns True if the profile was initialized."""
+        from .profile_cache import warm_profile
+        self.setup_prefs(profile_dir)
+        args = [self.path] + CHROME_COMMAND_LINE_OPTIONS
+        args.extend(['--headless=new', '--disable-gpu', '--user-data-dir=' + profile_dir])
+        if self.options.dockerized:
+            args.append('--no-sandbox')
+        if platform.system() == "Linux":
+            args.append('--disable-setuid-sandbox')
+            args.append('--disable-dev-shm-usage')
+        args.append('about:blank')
+        expected = [os.path.join(profile_dir, 'Local State'),
+                    os.path.join(profile_dir, 'Default', 'Preferences')]
+        locks = [os.path.join(profile_dir, name) for name in ['SingletonLock', 'SingletonSocket',
+                                                             'SingletonCookie', 'lockfile']]
+        return warm_profile(args, expected, locks)
+
     def setup_prefs(self, profile_dir):
         """Install our base set of preferences"""
         src = os.path.join(os.path.abspath(os.path.dirname(__file__)),
@@ -412,8 +435,9 @@ class ChromeDesktop(DesktopBrowser, DevtoolsBrowser):
                 self.netlog = None
                 if requests is not None and len(requests):
                     netlog_requests = os.path.join(task['dir'], task['prefix']) + '_netlog_requests.json.gz'
+                    from .support.request_record import dump
                     with gzip.open(netlog_requests, 'wt', compresslevel=7, encoding='utf-8') as outfile:
-                        json.dump(requests, outfile)
+                        dump(requests, outfile)
         DevtoolsBrowser.on_stop_recording(self, task)
 
     def on_start_processing(self, task):
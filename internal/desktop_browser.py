@@ -30,6 +30,9 @@ except BaseException:
     import json
 from .base_browser import BaseBrowser
 
+# How long to wait for ffmpeg to finish writing the video before it is killed
+VIDEO_STOP_TIMEOUT = 60
+
 SET_ORANGE = "(function() {" \
              "var wptDiv = document.getElementById('wptorange');" \
              "if (!wptDiv) {" \
@@ -68,6 +71,9 @@ class DesktopBrowser(BaseBrowser):
         self.video_processing = None
         self.pcap_file = None
         self.pcap_thread = None
+        self.pcap_monitor_thread = None
+        self.pcap_monitor = None
+        self.pcap_result = None
         self.task = None
         self.cpu_start = None
         self.throttling_cpu = False
@@ -121,14 +127,20 @@ class DesktopBrowser(BaseBrowser):
             if 'profile' in task:
                 if not task['cached'] and os.path.isdir(task['profile']):
                     logging.debug("Clearing profile %s", task['profile'])
-                    shutil.rmtree(task['profile'])
+                    self.clear_profile(task)
                 if not os.path.isdir(task['profile']):
                     os.makedirs(task['profile'])
+                if not task['cached']:
+                    self.clone_profile_template(job, task)
         except Exception as err:
             logging.exception("Exception preparing Browser: %s", err.__str__())
-        # Modify the hosts file for non-Chrome browsers
+        # Modify the hosts file for non-Chrome browsers (or hand the rules to the DNS resolver)
+        from .dns_resolver import RESOLVER
         self.restore_hosts()
-        self.modify_hosts(task, task['dns_override'])
+        if RESOLVER.is_running():
+            self.set_resolver_rules(task)
+        else:
+            self.modify_hosts(task, task['dns_override'])
         self.profile_end('desktop.prepare')
 
     def modify_hosts(self, task, hosts):
@@ -159,6 +171,15 @@ class DesktopBrowser(BaseBrowser):
             except Exception as err:
                 logging.exception("Exception modifying hosts file: %s", err.__str__())
 
+    def set_resolver_rules(self, task):
+        """Apply the DNS overrides and blocked domains for the test with the local DNS resolver"""
+        from .dns_resolver import RESOLVER
+        from .host_rules import HostRules
+        rules = task['host_rules_table'] if 'host_rules_table' in task else HostRules.from_task(task)
+        for domain in self.block_domains:
+            rules.add_block(domain)
+        RESOLVER.set_rules(rules)
+
     def restore_hosts(self):
         """See if we have a backup hosts file to restore"""
         hosts_backup = os.path.join(os.path.abspath(os.path.dirname(__file__)), "hosts.backup")
@@ -305,10 +326,13 @@ class DesktopBrowser(BaseBrowser):
         if self.rosetta:
             command_line = 'arch -arm64 ' + command_line
         logging.debug(command_line)
+        from .process_tracker import TRACKER
         if platform.system() == 'Windows':
             self.proc = subprocess.Popen(command_line, shell=True)
         else:
             self.proc = subprocess.Popen(command_line, preexec_fn=os.setsid, shell=True)
+        if self.path is not None:
+            TRACKER.track(self.proc, os.path.basename(self.path))
 
     def close_browser(self, job, _task):
         """Terminate the browser but don't do all of the cleanup that stop does"""
@@ -341,6 +365,10 @@ class DesktopBrowser(BaseBrowser):
         logging.debug("Stopping browser")
         self.close_browser(job, task)
         self.restore_hosts()
+        from .dns_resolver import RESOLVER
+        if RESOLVER.is_running():
+            RESOLVER.save_queries(os.path.join(task['dir'], task['task_prefix']) + '_dns.json.gz')
+            RESOLVER.set_rules(None)
         # Clean up the downloads folder in case anything was downloaded
         if platform.system() == 'Linux':
             downloads = os.path.expanduser('~/Downloads')
@@ -386,9 +414,43 @@ class DesktopBrowser(BaseBrowser):
                     logging.debug("CPU Utilization: %0.1f%% (%d CPU's, %0.1f%% target)", pct, cpu_count, target_pct)
         logging.debug("Done waiting for Idle...")
 
+    def get_profile_template(self, job):
+        """The warmed profile template for this build of the browser (None if it doesn't use one)"""
+        sources = self.get_profile_template_sources()
+        if not sources:
+            return None
+        from .profile_cache import TEMPLATES
+        name = os.path.splitext(os.path.basename(self.path))[0]
+        return TEMPLATES.get_template(job['persistent_dir'], name, [self.path] + sources,
+                                      self.build_profile_template)
+
+    def get_profile_template_sources(self):
+        """The files the browser's profile template is built from (empty if it doesn't use one)"""
+        return []
+
+    def build_profile_template(self, profile_dir):
+        """Populate a new profile template, returning True if it was initialized"""
+        return False
+
+    def clone_profile_template(self, job, task):
+        """Populate a fresh profile from the browser's pre-built profile template"""
+        if self.options.noprofiletemplate:
+            return
+        try:
+            template = self.get_profile_template(job)
+            if template is not None:
+                from .profile_cache import clone_tree
+                start = monotonic()
+                clone_tree(template, task['profile'])
+                task['profile_template'] = template
+                logging.debug("Cloned profile template %s in %0.3f seconds", template, monotonic() - start)
+        except Exception:
+            logging.exception('Error cloning the profile template')
+
     def clear_profile(self, task):
-        """Delete the browser profile directory"""
-        if os.path.isdir(task['profile']):
+        """Delete the browser profile directory (in the background where possible)"""
+        from .profile_cache import REAPER
+        if os.path.isdir(task['profile']) and not REAPER.remove(task['profile']):
             end_time = monotonic() + 30
             while monotonic() < end_time and not self.must_exit:
                 try:
@@ -406,7 +468,7 @@ class DesktopBrowser(BaseBrowser):
 
     def prepare_script_for_record(self, script, mark_start = False):
         """Convert a script command into one that first removes the orange frame"""
-        mark = "fetch('http://127.0.0.1:8888/wpt-start-recording');" if mark_start else ''
+        mark = "fetch('http://127.0.0.1:{0:d}/wpt-start-recording');".format(self.options.messageport) if mark_start else ''
         return "(function() {" \
                "var wptDiv = document.getElementById('wptorange');" \
                "if(wptDiv) {wptDiv.parentNode.removeChild(wptDiv);}" \
@@ -450,6 +512,7 @@ class DesktopBrowser(BaseBrowser):
             # Spawn tcpdump
             if self.tcpdump_enabled:
                 self.profile_start('desktop.start_pcap')
+                from .process_tracker import TRACKER
                 self.pcap_file = os.path.join(task['dir'], task['prefix']) + '.cap'
                 interface = 'any' if self.job['interface'] is None else self.job['interface']
                 if self.options.tcpdump:
@@ -463,10 +526,12 @@ class DesktopBrowser(BaseBrowser):
                     logging.debug(' '.join(args))
                     self.tcpdump = subprocess.Popen(args,
                                                     creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+                    TRACKER.track(self.tcpdump, 'WinDump')
                 else:
                     args = ['sudo', 'tcpdump', '-p', '-i', interface, '-s', '0', '-w', self.pcap_file, 'tcp', 'or', 'udp']
                     logging.debug(' '.join(args))
                     self.tcpdump = subprocess.Popen(args)
+                    TRACKER.track(self.tcpdump, 'tcpdump')
                 # Wait for the capture file to start growing
                 end_time = monotonic() + 5
                 started = False
@@ -474,6 +539,16 @@ class DesktopBrowser(BaseBrowser):
                     if os.path.isfile(self.pcap_file):
                         started = True
                     time.sleep(0.1)
+                # Parse the capture as it is written so the results are ready when it stops
+                self.pcap_result = None
+                if self.options.livepcap:
+                    # Each capture gets its own monitor state so a monitor that had to be
+                    # abandoned can never hand its result to a later capture
+                    self.pcap_monitor = {'done': False, 'abandoned': False, 'result': None}
+                    self.pcap_monitor_thread = threading.Thread(target=self.monitor_pcap,
+                                                                args=(self.pcap_file, self.pcap_monitor))
+                    self.pcap_monitor_thread.daemon = True
+                    self.pcap_monitor_thread.start()
                 self.profile_end('desktop.start_pcap')
 
             # Start video capture
@@ -544,13 +619,16 @@ class DesktopBrowser(BaseBrowser):
                     args.insert(2, '10')
                 logging.debug(' '.join(args))
                 try:
+                    from .process_tracker import TRACKER
                     if platform.system() == 'Windows':
                         self.ffmpeg = subprocess.Popen(args,
                                                        creationflags=subprocess.CREATE_NEW_PROCESS_GROUP,
                                                        stdin=subprocess.PIPE)
+                        TRACKER.track(self.ffmpeg, 'ffmpeg.exe')
                     else:
                         self.ffmpeg = subprocess.Popen(args,
                                                        stdin=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+                        TRACKER.track(self.ffmpeg, 'ffmpeg')
                     # Wait up to 5 seconds for something to be captured
                     end_time = monotonic() + 5
                     started = False
@@ -670,14 +748,26 @@ class DesktopBrowser(BaseBrowser):
             else:
                 wait_for_all('tcpdump')
             self.tcpdump = None
+        if self.pcap_monitor_thread is not None:
+            self.pcap_monitor['done'] = True
+            self.pcap_monitor_thread.join(30)
+            if self.pcap_monitor_thread.is_alive():
+                logging.warning('Timed out waiting for the live pcap processing, using the stand-alone parser')
+                self.pcap_monitor['abandoned'] = True
+            else:
+                self.pcap_result = self.pcap_monitor['result']
+            self.pcap_monitor_thread = None
+            self.pcap_monitor = None
         if self.ffmpeg is not None:
             self.stop_ffmpeg = True
             try:
                 logging.debug('Waiting for video capture to finish')
                 if platform.system() == 'Windows':
-                    self.ffmpeg.communicate(input='q'.encode('utf-8'))
+                    self.ffmpeg.communicate(input='q'.encode('utf-8'), timeout=VIDEO_STOP_TIMEOUT)
                 else:
-                    self.ffmpeg.communicate(input='q')
+                    self.ffmpeg.communicate(input='q', timeout=VIDEO_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                logging.warning('Timed out waiting for video capture to finish')
             except Exception:
                 logging.exception('Error terminating ffmpeg')
             self.ffmpeg = None
@@ -685,7 +775,9 @@ class DesktopBrowser(BaseBrowser):
             from .os_util import kill_all
             kill_all('ffmpeg.exe', True)
         else:
-            subprocess.call(['killall', '-9', 'ffmpeg'])
+            # Only the capture this agent launched (other agent instances can be capturing)
+            from .process_tracker import TRACKER
+            TRACKER.kill('ffmpeg', True)
         if self.ffmpeg_output_thread is not None:
             try:
                 self.ffmpeg_output_thread.join(10)
@@ -741,20 +833,10 @@ class DesktopBrowser(BaseBrowser):
             self.video_processing = subprocess.Popen(args, close_fds=True)
         # Process the tcpdump (async)
         if self.pcap_file is not None:
-            logging.debug('Compressing pcap')
             if os.path.isfile(self.pcap_file):
-                pcap_out = self.pcap_file + '.gz'
-                with open(self.pcap_file, 'rb') as f_in:
-                    with gzip.open(pcap_out, 'wb', 7) as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                if os.path.isfile(pcap_out):
-                    self.pcap_thread = threading.Thread(target=self.process_pcap)
-                    self.pcap_thread.daemon = True
-                    self.pcap_thread.start()
-                    try:
-                        os.remove(self.pcap_file)
-                    except Exception:
-                        pass
+                self.pcap_thread = threading.Thread(target=self.process_pcap)
+                self.pcap_thread.daemon = True
+                self.pcap_thread.start()
 
     def wait_for_processing(self, task):
         """Wait for any background processing threads to finish"""
@@ -792,36 +874,101 @@ class DesktopBrowser(BaseBrowser):
             with gzip.open(path, GZIP_TEXT, 7) as outfile:
                 outfile.write(json_page_data)
 
+    def monitor_pcap(self, pcap_file, monitor):
+        """Incrementally parse the pcap while tcpdump is still writing it"""
+        from .support.pcap_parser import Pcap
+        pcap = Pcap()
+        f_in = None
+        try:
+            while f_in is None and not monitor['done'] and not monitor['abandoned'] and not self.must_exit:
+                if os.path.isfile(pcap_file):
+                    f_in = open(pcap_file, 'rb')
+                else:
+                    time.sleep(0.1)
+            while f_in is not None and not monitor['abandoned'] and not self.must_exit:
+                # Check for the end before reading so the final read picks up everything
+                done = monitor['done']
+                data = f_in.read(1024 * 1024)
+                if data:
+                    pcap.Feed(data)
+                elif done:
+                    if not monitor['abandoned']:
+                        monitor['result'] = pcap
+                    break
+                else:
+                    time.sleep(0.5)
+        except Exception:
+            logging.exception('Error monitoring tcpdump')
+        if f_in is not None:
+            f_in.close()
+
     def process_pcap(self):
-        """Process the pcap in a background thread"""
+        """Compress and process the pcap in a background thread"""
         if self.must_exit:
             return
+        self.profile_start('desktop.pcap_processing')
+        pcap_result = self.pcap_result
+        self.pcap_result = None
+        logging.debug('Compressing pcap')
         pcap_file = self.pcap_file + '.gz'
-        if os.path.isfile(pcap_file):
-            self.profile_start('desktop.pcap_processing')
-            path_base = os.path.join(self.task['dir'], self.task['prefix'])
-            slices_file = path_base + '_pcap_slices.json.gz'
-            pcap_parser = os.path.join(os.path.abspath(os.path.dirname(__file__)),
-                                       'support', "pcap-parser.py")
-            cmd = [sys.executable, pcap_parser, '--json', '-i', pcap_file, '-d', slices_file]
-            logging.debug(cmd)
+        try:
+            with open(self.pcap_file, 'rb') as f_in:
+                with gzip.open(pcap_file, 'wb', 7) as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+        except Exception:
+            logging.exception('Error compressing the pcap')
+            # Keep the uncompressed capture rather than a truncated one
+            try:
+                if os.path.isfile(pcap_file):
+                    os.remove(pcap_file)
+            except Exception:
+                pass
+            pcap_file = None
+        if pcap_file is not None and os.path.isfile(pcap_file):
+            try:
+                os.remove(self.pcap_file)
+            except Exception:
+                pass
             try:
-                if (sys.version_info >= (3, 0)):
-                    stdout = subprocess.check_output(cmd, encoding='UTF-8')
+                path_base = os.path.join(self.task['dir'], self.task['prefix'])
+                slices_file = path_base + '_pcap_slices.json.gz'
+                connections_file = path_base + '_pcap_connections.json.gz'
+                if pcap_result is not None:
+                    logging.debug('Using the pcap results collected during the test')
+                    pcap_result.SaveDetails(slices_file)
+                    pcap_result.SaveConnections(connections_file)
+                    result = pcap_result.bytes
                 else:
-                    stdout = subprocess.check_output(cmd)
-                if stdout is not None:
-                    result = json.loads(stdout)
-                    if result:
-                        if 'in' in result:
-                            self.task['page_data']['pcapBytesIn'] = result['in']
-                        if 'out' in result:
-                            self.task['page_data']['pcapBytesOut'] = result['out']
-                        if 'in_dup' in result:
-                            self.task['page_data']['pcapBytesInDup'] = result['in_dup']
+                    result = self.run_pcap_parser(pcap_file, slices_file, connections_file)
+                if result:
+                    if 'in' in result:
+                        self.task['page_data']['pcapBytesIn'] = result['in']
+                    if 'out' in result:
+                        self.task['page_data']['pcapBytesOut'] = result['out']
+                    if 'in_dup' in result:
+                        self.task['page_data']['pcapBytesInDup'] = result['in_dup']
             except Exception:
-                logging.exception('Error processing tcpdump')
-            self.profile_end('desktop.pcap_processing')
+                logging.exception('Error processing the pcap')
+        self.profile_end('desktop.pcap_processing')
+
+    def run_pcap_parser(self, pcap_file, slices_file, connections_file):
+        """Process the compressed pcap with the stand-alone parser"""
+        result = None
+        pcap_parser = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                                   'support', "pcap_parser.py")
+        cmd = [sys.executable, pcap_parser, '--json', '-i', pcap_file, '-d', slices_file,
+               '-c', connections_file]
+        logging.debug(cmd)
+        try:
+            if (sys.version_info >= (3, 0)):
+                stdout = subprocess.check_output(cmd, encoding='UTF-8')
+            else:
+                stdout = subprocess.check_output(cmd)
+            if stdout is not None:
+                result = json.loads(stdout)
+        except Exception:
+            logging.exception('Error processing tcpdump')
+        return result
 
     def get_net_bytes(self):
         """Get the bytes received, ignoring the loopback interface"""
@@ -33,6 +33,9 @@ try:
 except BaseException:
     import json
 from ws4py.client.threadedclient import WebSocketClient
+from . import metrics
+from .spans import SPANS
+from .support.request_record import to_json
 
 
 class DevTools(object):
@@ -391,8 +394,11 @@ class DevTools(object):
                 self.job['keep_netlog'] = True
             if 'timeline' in self.job and self.job['timeline']:
                 if self.is_webkit:
+                    from internal.artifact_store import ARTIFACTS
                     from internal.support.trace_parser import Trace
                     self.trace_parser = Trace()
+                    self.trace_parser.artifacts = ARTIFACTS
+                    self.trace_parser.message_server = 'http://127.0.0.1:{0:d}'.format(self.options.messageport)
                     self.trace_parser.cpu['main_thread'] = '0'
                     self.trace_parser.threads['0'] = {}
                 if "blink.console" not in trace_config["includedCategories"]:
@@ -557,9 +563,8 @@ class DevTools(object):
             self.dev_tools_file.close()
             self.dev_tools_file = None
         # Save the console logs
-        log_file = self.path_base + '_console_log.json.gz'
-        with gzip.open(log_file, GZIP_TEXT, 7) as f_out:
-            json.dump(self.console_log, f_out)
+        from internal.artifact_store import ARTIFACTS
+        ARTIFACTS.publish(self.path_base + '_console_log.json.gz', list(self.console_log))
         self.send_command('Inspector.disable', {})
         self.send_command('Page.disable', {})
         self.send_command('Debugger.disable', {})
@@ -1905,12 +1910,16 @@ class DevTools(object):
 
     def profile_start(self, event_name):
         event_name = 'dt.' + event_name
+        SPANS.start(event_name)
         if self.task is not None and 'profile_data' in self.task:
             with self.task['profile_data']['lock']:
                 self.task['profile_data'][event_name] = {'s': round(monotonic() - self.task['profile_data']['start'], 3)}
 
     def profile_end(self, event_name):
         event_name = 'dt.' + event_name
+        elapsed = SPANS.end(event_name)
+        if elapsed is not None:
+            metrics.PROFILE_DURATION.observe(elapsed, event_name)
         if self.task is not None and 'profile_data' in self.task:
             with self.task['profile_data']['lock']:
                 if event_name in self.task['profile_data']:
@@ -1930,7 +1939,7 @@ class DevTools(object):
                         self.netlog_urls[url] = []
                     if request_id not in self.netlog_urls[url]:
                         self.netlog_urls[url].append(request_id)
-            logging.debug("Netlog request %s created: %s", request_id, json.dumps(request_info))
+            logging.debug("Netlog request %s created: %s", request_id, json.dumps(to_json(request_info)))
         except Exception:
             logging.exception('Error handling on_netlog_request_created')
 
@@ -2129,8 +2138,11 @@ class DevToolsClient(WebSocketClient):
                                             GZIP_TEXT, compresslevel=7)
                 self.trace_file.write('{"traceEvents":[{}')
             if self.trace_parser is None:
+                from internal.artifact_store import ARTIFACTS
                 from internal.support.trace_parser import Trace
                 self.trace_parser = Trace()
+                self.trace_parser.artifacts = ARTIFACTS
+                self.trace_parser.message_server = 'http://127.0.0.1:{0:d}'.format(self.options.messageport)
             # write out the trace events one-per-line but pull out any
             # devtools screenshots as separate files.
             trace_events = msg['params']['value']
@@ -28,6 +28,8 @@ try:
     import ujson as json
 except BaseException:
     import json
+from . import metrics
+from .spans import SPANS
 from .optimization_checks import OptimizationChecks
 
 KeyModifiers = {
@@ -291,15 +293,20 @@ class DevtoolsBrowser(object):
                 if not recording and command['record']:
                     recording = True
                     self.on_start_recording(task)
+                if command['record']:
+                    self.profile_start('dtbrowser.navigate')
                 self.process_command(command)
                 if command['record']:
                     self.devtools.wait_for_page_load()
+                    self.profile_end('dtbrowser.navigate')
                     if not task['combine_steps'] or not len(task['script']):
                         self.on_stop_capture(task)
                         self.on_stop_recording(task)
                         recording = False
+                        self.profile_start('dtbrowser.processing')
                         self.on_start_processing(task)
                         self.wait_for_processing(task)
+                        self.profile_end('dtbrowser.processing')
                         self.process_devtools_requests(task)
                         self.step_complete(task) #pylint: disable=no-member
                         if task['log_data']:
@@ -392,6 +399,9 @@ class DevtoolsBrowser(object):
             optimization = path_base + '_optimization.json.gz'
             options['optimization'] = optimization if os.path.isfile(optimization) else None
             user_timing = path_base + '_user_timing.json.gz'
+            # The parser reads the user timing file so it needs to be written
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.wait(user_timing)
             options['user'] = user_timing if os.path.isfile(user_timing) else None
             coverage = path_base + '_coverage.json.gz'
             options['coverage'] = coverage if os.path.isfile(coverage) else None
@@ -406,6 +416,11 @@ class DevtoolsBrowser(object):
             if 'metadata' in self.job:
                 parser.metadata = self.job['metadata']
             parser.process()
+            # Keep the raw inputs for replaying the processing
+            if self.options.archiveruns and not options['noheaders']:
+                from .replay import archive_files
+                archive_files(self.options.archiveruns, task, [devtools_file, netlog, timeline_requests,
+                                                               optimization, coverage])
             # Cleanup intermediate files that are not needed
             if 'debug' not in self.job or not self.job['debug']:
                 if os.path.isfile(netlog):
@@ -633,14 +648,12 @@ class DevtoolsBrowser(object):
                         logging.exception('Error substituting request data with bodies into custom script')
                 script = 'var wptCustomMetric = function() {' + custom_script + '};try{wptCustomMetric();}catch(e){};'
                 custom_metrics[name] = self.devtools.execute_js(script)
-            path = os.path.join(task['dir'], task['prefix'] + '_metrics.json.gz')
-            with gzip.open(path, GZIP_TEXT, 7) as outfile:
-                outfile.write(json.dumps(custom_metrics))
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.publish(os.path.join(task['dir'], task['prefix'] + '_metrics.json.gz'), custom_metrics)
         user_timing = self.run_js_file('user_timing.js')
         if user_timing is not None:
-            path = os.path.join(task['dir'], task['prefix'] + '_timed_events.json.gz')
-            with gzip.open(path, GZIP_TEXT, 7) as outfile:
-                outfile.write(json.dumps(user_timing))
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.publish(os.path.join(task['dir'], task['prefix'] + '_timed_events.json.gz'), user_timing)
         page_data = self.run_js_file('page_data.js')
         self.document_domain = None
         if page_data is not None:
@@ -653,6 +666,7 @@ class DevtoolsBrowser(object):
         logging.debug("Processing script command:")
         logging.debug(command)
         if command['command'] == 'navigate':
+            metrics.observe_first_navigation(self.task)
             self.task['page_data']['URL'] = command['target']
             url = str(command['target']).replace('"', '\"')
             script = 'window.location="{0}";'.format(url)
@@ -1242,11 +1256,15 @@ class DevtoolsBrowser(object):
         return script
 
     def profile_start(self, event_name):
+        SPANS.start(event_name)
         if self.task is not None and 'profile_data' in self.task:
             with self.task['profile_data']['lock']:
                 self.task['profile_data'][event_name] = {'s': round(monotonic() - self.task['profile_data']['start'], 3)}
 
     def profile_end(self, event_name):
+        elapsed = SPANS.end(event_name)
+        if elapsed is not None:
+            metrics.PROFILE_DURATION.observe(elapsed, event_name)
         if self.task is not None and 'profile_data' in self.task:
             with self.task['profile_data']['lock']:
                 if event_name in self.task['profile_data']:
@@ -0,0 +1,351 @@
+# Copyright 2020 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Local stub DNS resolver that applies the test's DNS overrides and blocked domains
+and forwards everything else to the upstream DNS servers"""
+import gzip
+import logging
+import os
+import platform
+import socket
+import struct
+import subprocess
+import sys
+import threading
+if (sys.version_info >= (3, 0)):
+    from time import monotonic
+    GZIP_TEXT = 'wt'
+else:
+    from monotonic import monotonic
+    GZIP_TEXT = 'w'
+try:
+    import ujson as json
+except BaseException:
+    import json
+
+DNS_ADDRESS = '127.0.0.1'
+DNS_PORT = 53
+UPSTREAM_TIMEOUT = 2
+OVERRIDE_TTL = 60
+MAX_CACHE_TTL = 300
+NEGATIVE_CACHE_TTL = 30
+MAX_MESSAGE_SIZE = 65535
+
+
+class StubResolver(object):
+    """DNS server bound locally that answers from the rules of the current test"""
+    def __init__(self):
+        self.address = DNS_ADDRESS
+        self.port = DNS_PORT
+        self.upstreams = []
+        self.udp_socket = None
+        self.tcp_socket = None
+        self.must_exit = False
+        self.rules = None
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.queries = []
+        self.start_time = monotonic()
+        self.resolv_conf = '/etc/resolv.conf'
+        self.resolv_backup = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'resolv.conf.backup')
+
+    def is_running(self):
+        """See if the resolver is up and answering queries"""
+        return self.udp_socket is not None and not self.must_exit
+
+    def start(self, upstreams=None, address=DNS_ADDRESS, port=DNS_PORT, configure_system=True):
+        """Start the resolver and point the system resolver at it. Returns False if it couldn't be started."""
+        self.address = address
+        self.port = port
+        self.must_exit = False
+        if configure_system:
+            if platform.system() != 'Linux':
+                logging.warning("The DNS resolver is only supported on Linux")
+                return False
+            self.restore_system_resolver()
+        self.upstreams = self.get_upstreams(upstreams)
+        if not self.upstreams:
+            logging.error("No upstream DNS servers available for the DNS resolver")
+            return False
+        try:
+            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.bind((address, port))
+            self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.tcp_socket.bind((address, port))
+            self.tcp_socket.listen(16)
+        except Exception as err:
+            logging.error("Unable to bind the DNS resolver to %s:%d: %s", address, port, err)
+            self.close_sockets()
+            return False
+        for target in [self.udp_thread, self.tcp_thread]:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        logging.debug("DNS resolver listening on %s:%d, forwarding to %s", address, port,
+                      ','.join(['{0}#{1:d}'.format(server[0], server[1]) for server in self.upstreams]))
+        if configure_system:
+            self.point_system_resolver()
+        return True
+
+    def stop(self):
+        """Stop the resolver and restore the system resolver"""
+        if self.udp_socket is not None:
+            self.must_exit = True
+            self.close_sockets()
+            self.restore_system_resolver()
+
+    def close_sockets(self):
+        """Close the listening sockets"""
+        for sock in [self.udp_socket, self.tcp_socket]:
+            if sock is not None:
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+        self.udp_socket = None
+        self.tcp_socket = None
+
+    def get_upstreams(self, upstreams):
+        """The (address, port) of the DNS servers to forward to, from the option
+        (address[#port],...) or the system configuration"""
+        servers = []
+        if upstreams:
+            for server in upstreams.split(','):
+                parts = server.strip().split('#', 1)
+                if parts[0]:
+                    servers.append((parts[0], int(parts[1]) if len(parts) > 1 else DNS_PORT))
+        else:
+            try:
+                from dns import resolver
+                servers = [(server, DNS_PORT) for server in resolver.Resolver().nameservers]
+            except Exception:
+                logging.exception('Error reading the system DNS servers')
+        return [server for server in servers if server != (self.address, self.port)]
+
+    def point_system_resolver(self):
+        """Replace resolv.conf with one that points to the resolver (backed up for restoring)"""
+        resolv_tmp = self.resolv_backup + '.tmp'
+        try:
+            with open(resolv_tmp, 'wt') as f_out:
+                f_out.write("nameserver {0}\n".format(self.address))
+            subprocess.call(['sudo', 'cp', self.resolv_conf, self.resolv_backup])
+            subprocess.call(['sudo', 'cp', resolv_tmp, self.resolv_conf])
+            os.unlink(resolv_tmp)
+        except Exception:
+            logging.exception('Error configuring the system DNS resolver')
+
+    def restore_system_resolver(self):
+        """See if we have a backup resolv.conf to restore"""
+        if os.path.isfile(self.resolv_backup):
+            logging.debug('Restoring backup of resolv.conf')
+            subprocess.call(['sudo', 'cp', self.resolv_backup, self.resolv_conf])
+            subprocess.call(['sudo', 'rm', self.resolv_backup])
+
+    def set_rules(self, rules):
+        """Switch to the HostRules of a new test (None to forward everything)"""
+        with self.lock:
+            self.rules = rules
+            self.queries = []
+            self.start_time = monotonic()
+
+    def flush(self):
+        """Clear the DNS cache"""
+        with self.lock:
+            self.cache = {}
+
+    def get_queries(self):
+        """The queries handled since the rules were set"""
+        with self.lock:
+            return list(self.queries)
+
+    def save_queries(self, path):
+        """Write the queries handled for the test to a gzipped json file"""
+        queries = self.get_queries()
+        if queries:
+            try:
+                with gzip.open(path, GZIP_TEXT, 7) as f_out:
+                    json.dump(queries, f_out)
+            except Exception:
+                logging.exception('Error writing the DNS queries')
+
+    def record(self, start, host, rdtype, source):
+        """Record the timing of a single query"""
+        end = monotonic()
+        with self.lock:
+            self.queries.append({'host': host,
+                                 'type': rdtype,
+                                 'start': int(round((start - self.start_time) * 1000.0)),
+                                 'ms': round((end - start) * 1000.0, 3),
+                                 'source': source})
+
+    def udp_thread(self):
+        """Background thread for the UDP queries"""
+        sock = self.udp_socket
+        while not self.must_exit:
+            try:
+                data, addr = sock.recvfrom(MAX_MESSAGE_SIZE)
+            except Exception:
+                if not self.must_exit:
+                    logging.exception('Error receiving DNS query')
+                break
+            start = monotonic()
+            response = self.answer_locally(data, start)
+            if response is not None:
+                self.send_udp(sock, response, addr)
+            else:
+                # Upstream queries can take a while, don't hold up the other queries
+                thread = threading.Thread(target=self.forward_udp, args=(sock, data, addr, start))
+                thread.daemon = True
+                thread.start()
+
+    def send_udp(self, sock, response, addr):
+        """Send a response to a UDP query"""
+        try:
+            sock.sendto(response, addr)
+        except Exception:
+            logging.debug('Error sending DNS response to %s', addr)
+
+    def forward_udp(self, sock, data, addr, start):
+        """Forward a UDP query upstream and relay the response"""
+        response = self.forward(data, start)
+        if response is not None:
+            self.send_udp(sock, response, addr)
+
+    def tcp_thread(self):
+        """Background thread accepting the TCP connections"""
+        sock = self.tcp_socket
+        while not self.must_exit:
+            try:
+                conn, _ = sock.accept()
+            except Exception:
+                if not self.must_exit:
+                    logging.exception('Error accepting DNS connection')
+                break
+            thread = threading.Thread(target=self.tcp_connection, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def tcp_connection(self, conn):
+        """Answer the length-prefixed queries on a TCP connection"""
+        try:
+            conn.settimeout(10)
+            while not self.must_exit:
+                header = self.receive_exact(conn, 2)
+                if header is None:
+                    break
+                data = self.receive_exact(conn, struct.unpack('!H', header)[0])
+                if data is None:
+                    break
+                start = monotonic()
+                response = self.answer_locally(data, start)
+                if response is None:
+                    response = self.forward(data, start)
+                if response is not None:
+                    conn.sendall(struct.pack('!H', len(response)) + response)
+        except Exception:
+            pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def receive_exact(conn, size):
+        """Read exactly size bytes from the connection (None if it closed)"""
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def answer_locally(self, data, start):
+        """Answer the query from the test's rules or the cache. Returns None if the
+        query needs to go upstream."""
+        response = None
+        try:
+            import dns.message
+            import dns.rdatatype
+            import dns.rrset
+            query = dns.message.from_wire(data)
+            if not query.question:
+                return None
+            question = query.question[0]
+            host = question.name.to_text(omit_final_dot=True).lower()
+            rdtype = dns.rdatatype.to_text(question.rdtype)
+            rules = self.rules
+            address = rules.get_override(host) if rules is not None else None
+            source = 'override'
+            if address is None and rules is not None and rules.is_blocked(host):
+                address = '0.0.0.0'
+                source = 'blocked'
+            if address is not None:
+                # Only answer with the matching address family, an empty answer for the rest
+                reply = dns.message.make_response(query)
+                is_ipv6 = address.find(':') >= 0
+                if (rdtype == 'A' and not is_ipv6) or (rdtype == 'AAAA' and is_ipv6):
+                    reply.answer.append(dns.rrset.from_text(question.name, OVERRIDE_TTL, 'IN', rdtype, address))
+                response = reply.to_wire()
+                self.record(start, host, rdtype, source)
+            else:
+                key = (host, question.rdtype, question.rdclass)
+                with self.lock:
+                    cached = self.cache.get(key)
+                    if cached is not None and cached[0] < monotonic():
+                        del self.cache[key]
+                        cached = None
+                if cached is not None:
+                    # Re-use the cached response with the id of this query
+                    response = data[:2] + cached[1][2:]
+                    self.record(start, host, rdtype, 'cache')
+        except Exception:
+            logging.exception('Error processing DNS query')
+        return response
+
+    def forward(self, data, start):
+        """Send the query to the upstream servers (in order) and cache the response"""
+        import dns.flags
+        import dns.message
+        import dns.query
+        import dns.rcode
+        import dns.rdatatype
+        query = None
+        host = None
+        rdtype = None
+        try:
+            query = dns.message.from_wire(data)
+            question = query.question[0]
+            host = question.name.to_text(omit_final_dot=True).lower()
+            rdtype = dns.rdatatype.to_text(question.rdtype)
+        except Exception:
+            logging.exception('Error parsing DNS query')
+            return None
+        for upstream, port in self.upstreams:
+            try:
+                reply = dns.query.udp(query, upstream, timeout=UPSTREAM_TIMEOUT, port=port)
+                if reply.flags & dns.flags.TC:
+                    reply = dns.query.tcp(query, upstream, timeout=UPSTREAM_TIMEOUT, port=port)
+                response = reply.to_wire()
+                rcode = reply.rcode()
+                if rcode in [dns.rcode.NOERROR, dns.rcode.NXDOMAIN]:
+                    ttls = [rrset.ttl for rrset in reply.answer + reply.authority]
+                    ttl = min(min(ttls), MAX_CACHE_TTL) if ttls else NEGATIVE_CACHE_TTL
+                    if ttl > 0:
+                        with self.lock:
+                            self.cache[(host, question.rdtype, question.rdclass)] = (monotonic() + ttl, response)
+                self.record(start, host, rdtype, 'upstream')
+                return response
+            except Exception as err:
+                logging.debug('Error forwarding DNS query for %s to %s: %s', host, upstream, err)
+        self.record(start, host, rdtype, 'error')
+        try:
+            reply = dns.message.make_response(query)
+            reply.set_rcode(dns.rcode.SERVFAIL)
+            return reply.to_wire()
+        except Exception:
+            return None
+
+
+RESOLVER = StubResolver()
@@ -4,6 +4,7 @@
 # Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
 # found in the LICENSE.md file.
 """Support for Firefox"""
+from collections import deque
 from datetime import datetime, timedelta
 import glob
 import gzip
@@ -15,6 +16,7 @@ import re
 import shutil
 import subprocess
 import sys
+import threading
 import time
 if (sys.version_info >= (3, 0)):
     from time import monotonic
@@ -29,7 +31,9 @@ try:
     import ujson as json
 except BaseException:
     import json
+from . import metrics
 from .desktop_browser import DesktopBrowser
+from .support.request_record import Request, dump
 
 def _get_location_uri(accuracy, lat, lng) -> str:
     return f'data:application/json, {{ "status":"OK", "accuracy":{accuracy}, "location":{{ "lat":{lat}, "lng":{lng} }} }}'
@@ -60,6 +64,9 @@ class Firefox(DesktopBrowser):
         self.wait_interval = 5.0
         self.wait_for_script = None
         self.log_pos = {}
+        self.moz_log_monitor_thread = None
+        self.moz_log_monitor_done = False
+        self.moz_log_requests = None
         self.log_level = 5
         self.must_exit_now = False
         if 'browser_info' in job and 'log_level' in job['browser_info']:
@@ -71,7 +78,7 @@ class Firefox(DesktopBrowser):
         self.long_tasks = []
         self.last_activity = monotonic()
         self.script_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'js')
-        self.start_page = 'http://127.0.0.1:8888/orange.html'
+        self.start_page = 'http://127.0.0.1:{0:d}/orange.html'.format(options.messageport)
         self.block_domains = [
             "tracking-protection.cdn.mozilla.net",
             "shavar.services.mozilla.com",
@@ -79,7 +86,7 @@ class Firefox(DesktopBrowser):
             "snippets.cdn.mozilla.net",
             "content-signature-2.cdn.mozilla.net",
             "aus5.mozilla.org"]
-        self.duplicates = []
+        self.duplicates = set()
 
     def prepare(self, job, task):
         """Prepare the profile/OS for the browser"""
@@ -95,9 +102,8 @@ class Firefox(DesktopBrowser):
         os.environ["MOZ_LOG"] = moz_log_env
         logging.debug('MOZ_LOG = %s', moz_log_env)
         DesktopBrowser.prepare(self, job, task)
-        profile_template = os.path.join(os.path.abspath(os.path.dirname(__file__)),
-                                        'support', 'Firefox', 'profile')
-        if not task['cached'] and os.path.isdir(profile_template):
+        profile_template = self.get_support_profile()
+        if not task['cached'] and os.path.isdir(profile_template) and 'profile_template' not in task:
             try:
                 if os.path.isdir(task['profile']):
                     shutil.rmtree(task['profile'])
@@ -136,6 +142,27 @@ class Firefox(DesktopBrowser):
                     config[name] = task[name]
             self.job['message_server'].config = config
 
+    def get_profile_template_sources(self):
+        """The template is rebuilt when the agent's profile changes"""
+        return [self.get_support_profile()]
+
+    def get_support_profile(self):
+        """The profile that ships with the agent"""
+        return os.path.join(os.path.abspath(os.path.dirname(__file__)), 'support', 'Firefox', 'profile')
+
+    def build_profile_template(self, profile_dir):
+        """Launch the browser headless against the agent's profile to initialize it.
+        Returns True if the profile was initialized."""
+        from .profile_cache import clone_tree, warm_profile
+        support_profile = self.get_support_profile()
+        if os.path.isdir(support_profile):
+            clone_tree(support_profile, profile_dir)
+        args = [self.path, '-headless', '-no-remote', '-profile', profile_dir, 'about:blank']
+        expected = [os.path.join(profile_dir, 'compatibility.ini'),
+                    os.path.join(profile_dir, 'times.json')]
+        locks = [os.path.join(profile_dir, name) for name in ['lock', '.parentlock', 'parent.lock']]
+        return warm_profile(args, expected, locks)
+
     def start_firefox(self, job, task):
         """Start Firefox using WebDriver"""
         if self.must_exit:
@@ -197,8 +224,29 @@ class Firefox(DesktopBrowser):
 
         logging.debug('Installing extension')
         extension_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'support', 'Firefox', 'extension')
+        if self.options.messageport != 8888:
+            extension_path = self.get_extension_for_port(extension_path, task)
         self.driver.install_addon(extension_path, temporary=True)
 
+    def get_extension_for_port(self, extension_path, task):
+        """Copy of the extension that talks to the message server on a non-default port"""
+        port_extension = task['profile'] + '.extension'
+        try:
+            if os.path.isdir(port_extension):
+                shutil.rmtree(port_extension)
+            shutil.copytree(extension_path, port_extension)
+            background = os.path.join(port_extension, 'background.js')
+            with open(background, 'rt') as f_in:
+                script = f_in.read()
+            script = script.replace('http://127.0.0.1:8888/',
+                                    'http://127.0.0.1:{0:d}/'.format(self.options.messageport))
+            with open(background, 'wt') as f_out:
+                f_out.write(script)
+            extension_path = port_extension
+        except Exception:
+            logging.exception('Error configuring the extension for port %d', self.options.messageport)
+        return extension_path
+
     def launch(self, job, task):
         """Launch the browser"""
         if self.must_exit:
@@ -318,6 +366,7 @@ class Firefox(DesktopBrowser):
 
     def stop(self, job, task):
         """Kill the browser"""
+        self.stop_moz_log_monitor()
         self.close_browser(job, task)
         DesktopBrowser.stop(self, job, task)
         # delete the raw log files
@@ -391,18 +440,23 @@ class Firefox(DesktopBrowser):
                 if not recording and command['record']:
                     recording = True
                     self.on_start_recording(task)
+                if command['record']:
+                    self.profile_start('firefox.navigate')
                 try:
                     self.process_command(command)
                 except Exception:
                     logging.exception("Exception running task")
                 if command['record']:
                     self.wait_for_page_load()
+                    self.profile_end('firefox.navigate')
                     if not task['combine_steps'] or not task['script']:
                         self.on_stop_capture(task)
                         self.on_stop_recording(task)
                         recording = False
+                        self.profile_start('firefox.processing')
                         self.on_start_processing(task)
                         self.wait_for_processing(task)
+                        self.profile_end('firefox.processing')
                         self.step_complete(task)
                         if task['log_data']:
                             # Move on to the next step
@@ -583,15 +637,13 @@ class Firefox(DesktopBrowser):
                         logging.debug(custom_metrics[name])
                 except Exception:
                     logging.exception('Error collecting custom metrics')
-            path = os.path.join(task['dir'], task['prefix'] + '_metrics.json.gz')
-            with gzip.open(path, GZIP_TEXT, 7) as outfile:
-                outfile.write(json.dumps(custom_metrics))
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.publish(os.path.join(task['dir'], task['prefix'] + '_metrics.json.gz'), custom_metrics)
         logging.debug("Collecting user timing metrics")
         user_timing = self.run_js_file('user_timing.js')
         if user_timing is not None:
-            path = os.path.join(task['dir'], task['prefix'] + '_timed_events.json.gz')
-            with gzip.open(path, GZIP_TEXT, 7) as outfile:
-                outfile.write(json.dumps(user_timing))
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.publish(os.path.join(task['dir'], task['prefix'] + '_timed_events.json.gz'), user_timing)
         logging.debug("Collecting page-level metrics")
         page_data = self.run_js_file('page_data.js')
         if page_data is not None:
@@ -621,7 +673,7 @@ class Firefox(DesktopBrowser):
                 elif message['path'] == 'wptagent.overrideHost':
                     requestId = message['body']['requestId']
                     logging.debug('adding to override duplicate list %s', requestId)
-                    self.duplicates.append(requestId)
+                    self.duplicates.add(requestId)
                     if requestId in self.requests:
                         logging.debug('deleting duplicate request %s', requestId)
                         del self.requests[requestId]
@@ -802,6 +854,15 @@ class Firefox(DesktopBrowser):
         DesktopBrowser.on_start_recording(self, task)
         logging.debug('Starting measurement')
         task['start_time'] = datetime.utcnow()
+        # Parse the moz logs as they are written so the request timings are ready when recording stops
+        self.moz_log_requests = None
+        if self.moz_log is not None and self.options.livemozlog:
+            self.moz_log_monitor_done = False
+            self.moz_log_monitor_thread = threading.Thread(target=self.monitor_moz_log,
+                                                           args=(dict(self.log_pos),
+                                                                 task['start_time']))
+            self.moz_log_monitor_thread.daemon = True
+            self.moz_log_monitor_thread.start()
 
     def on_stop_capture(self, task):
         """Do any quick work to stop things that are capturing data"""
@@ -822,9 +883,8 @@ class Firefox(DesktopBrowser):
         self.collect_browser_metrics(task)
         # Write out the long tasks
         try:
-            long_tasks_file = os.path.join(task['dir'], task['prefix'] + '_long_tasks.json.gz')
-            with gzip.open(long_tasks_file, GZIP_TEXT, 7) as f_out:
-                f_out.write(json.dumps(self.long_tasks))
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.publish(os.path.join(task['dir'], task['prefix'] + '_long_tasks.json.gz'), list(self.long_tasks))
         except Exception:
             logging.exception("Error writing the long tasks")
         try:
@@ -835,9 +895,8 @@ class Firefox(DesktopBrowser):
                 last_end = period[1]
             test_end = int((monotonic() - task['run_start_time']) * 1000)
             interactive_periods.append([last_end, test_end])
-            interactive_file = os.path.join(task['dir'], task['prefix'] + '_interactive.json.gz')
-            with gzip.open(interactive_file, GZIP_TEXT, 7) as f_out:
-                f_out.write(json.dumps(interactive_periods))
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.publish(os.path.join(task['dir'], task['prefix'] + '_interactive.json.gz'), interactive_periods)
         except Exception:
             logging.exception("Error writing the interactive periods")
         # Run Axe before we close the browser
@@ -846,8 +905,10 @@ class Firefox(DesktopBrowser):
         # Close the browser if we are done testing (helps flush logs)
         if not len(task['script']):
             self.close_browser(self.job, task)
-        # Copy the log files
-        if self.moz_log is not None and not self.must_exit:
+        # Finish parsing the logs (after the browser has flushed them)
+        self.stop_moz_log_monitor()
+        # Copy the log files for processing if they weren't parsed during the test
+        if self.moz_log is not None and not self.must_exit and self.moz_log_requests is None:
             task['moz_log'] = os.path.join(task['dir'], task['prefix'] + '_moz.log')
             files = sorted(glob.glob(self.moz_log + '*'))
             for path in files:
@@ -873,6 +934,51 @@ class Firefox(DesktopBrowser):
                 except Exception:
                     logging.exception('Error copying log files')
 
+    def monitor_moz_log(self, log_pos, start_time):
+        """Incrementally parse the moz logs while the browser is writing them"""
+        from internal.support.firefox_log_parser import FirefoxLogParser
+        parser = FirefoxLogParser('http://127.0.0.1:{0:d}/'.format(self.options.messageport))
+        parser.start_live(start_time.strftime('%Y-%m-%d %H:%M:%S.%f'))
+        files = {}
+        try:
+            while not self.must_exit:
+                # Check for the end before reading so the final pass picks up everything
+                done = self.moz_log_monitor_done
+                read_data = False
+                for path in sorted(glob.glob(self.moz_log + '*')):
+                    if path not in files:
+                        files[path] = open(path, 'rb')
+                        if path in log_pos:
+                            files[path].seek(log_pos[path])
+                    data = files[path].read(1024 * 1024)
+                    if data:
+                        read_data = True
+                        parser.process_log_data(path, data)
+                if done and not read_data:
+                    requests = parser.finish_live()
+                    # Only hand off the results if the monitor wasn't abandoned
+                    if threading.current_thread() is self.moz_log_monitor_thread:
+                        self.moz_log_requests = requests
+                    break
+                elif not read_data:
+                    time.sleep(0.5)
+        except Exception:
+            logging.exception('Error monitoring moz logs')
+        for path in files:
+            try:
+                files[path].close()
+            except Exception:
+                pass
+
+    def stop_moz_log_monitor(self):
+        """Wait for the live moz log parsing to finish"""
+        if self.moz_log_monitor_thread is not None:
+            self.moz_log_monitor_done = True
+            self.moz_log_monitor_thread.join(60)
+            if self.moz_log_monitor_thread.is_alive():
+                logging.warning('Timed out waiting for the moz log parsing to finish')
+            self.moz_log_monitor_thread = None
+
     def on_start_processing(self, task):
         """Start any processing of the captured data"""
         DesktopBrowser.on_start_processing(self, task)
@@ -880,9 +986,13 @@ class Firefox(DesktopBrowser):
             return
         # Parse the moz log for the accurate request timings
         request_timings = []
-        if 'moz_log' in task:
+        if self.moz_log_requests is not None:
+            logging.debug('Using the moz log request timings collected during the test')
+            request_timings = self.moz_log_requests
+            self.moz_log_requests = None
+        elif 'moz_log' in task:
             from internal.support.firefox_log_parser import FirefoxLogParser
-            parser = FirefoxLogParser()
+            parser = FirefoxLogParser('http://127.0.0.1:{0:d}/'.format(self.options.messageport))
             start_time = task['start_time'].strftime('%Y-%m-%d %H:%M:%S.%f')
             logging.debug('Parsing moz logs relative to %s start time', start_time)
             request_timings = parser.process_logs(task['moz_log'], start_time)
@@ -929,6 +1039,7 @@ class Firefox(DesktopBrowser):
         logging.debug("Processing script command:")
         logging.debug(command)
         if command['command'] == 'navigate':
+            metrics.observe_first_navigation(self.task)
             self.task['page_data']['URL'] = command['target']
             url = str(command['target']).replace('"', '\"')
             script = 'window.location="{0}";'.format(url)
@@ -1080,61 +1191,61 @@ class Firefox(DesktopBrowser):
             result['pageData']['metadata'] = self.job['metadata']
         devtools_file = os.path.join(task['dir'], task['prefix'] + '_devtools_requests.json.gz')
         with gzip.open(devtools_file, GZIP_TEXT, 7) as f_out:
-            json.dump(result, f_out)
+            dump(result, f_out)
 
     def get_empty_request(self, request_id, url):
         """Return and empty, initialized request"""
         parts = urlsplit(url)
-        request = {'type': 3,
-                   'id': request_id,
-                   'request_id': request_id,
-                   'ip_addr': '',
-                   'full_url': url,
-                   'is_secure': 1 if parts.scheme == 'https' else 0,
-                   'method': '',
-                   'host': parts.netloc,
-                   'url': parts.path,
-                   'responseCode': -1,
-                   'load_start': -1,
-                   'load_ms': -1,
-                   'ttfb_ms': -1,
-                   'dns_start': -1,
-                   'dns_end': -1,
-                   'dns_ms': -1,
-                   'connect_start': -1,
-                   'connect_end': -1,
-                   'connect_ms': -1,
-                   'ssl_start': -1,
-                   'ssl_end': -1,
-                   'ssl_ms': -1,
-                   'bytesIn': 0,
-                   'bytesOut': 0,
-                   'objectSize': 0,
-                   'initiator': '',
-                   'initiator_line': '',
-                   'initiator_column': '',
-                   'server_rtt': None,
-                   'headers': {'request': [], 'response': []},
-                   'score_cache': -1,
-                   'score_cdn': -1,
-                   'score_gzip': -1,
-                   'score_cookies': -1,
-                   'score_keep-alive': -1,
-                   'score_minify': -1,
-                   'score_combine': -1,
-                   'score_compress': -1,
-                   'score_etags': -1,
-                   'gzip_total': None,
-                   'gzip_save': None,
-                   'minify_total': None,
-                   'minify_save': None,
-                   'image_total': None,
-                   'image_save': None,
-                   'cache_time': None,
-                   'cdn_provider': None,
-                   'server_count': None,
-                   'socket': -1
-                   }
+        request = Request({'type': 3,
+                           'id': request_id,
+                           'request_id': request_id,
+                           'ip_addr': '',
+                           'full_url': url,
+                           'is_secure': 1 if parts.scheme == 'https' else 0,
+                           'method': '',
+                           'host': parts.netloc,
+                           'url': parts.path,
+                           'responseCode': -1,
+                           'load_start': -1,
+                           'load_ms': -1,
+                           'ttfb_ms': -1,
+                           'dns_start': -1,
+                           'dns_end': -1,
+                           'dns_ms': -1,
+                           'connect_start': -1,
+                           'connect_end': -1,
+                           'connect_ms': -1,
+                           'ssl_start': -1,
+                           'ssl_end': -1,
+                           'ssl_ms': -1,
+                           'bytesIn': 0,
+                           'bytesOut': 0,
+                           'objectSize': 0,
+                           'initiator': '',
+                           'initiator_line': '',
+                           'initiator_column': '',
+                           'server_rtt': None,
+                           'headers': {'request': [], 'response': []},
+                           'score_cache': -1,
+                           'score_cdn': -1,
+                           'score_gzip': -1,
+                           'score_cookies': -1,
+                           'score_keep-alive': -1,
+                           'score_minify': -1,
+                           'score_combine': -1,
+                           'score_compress': -1,
+                           'score_etags': -1,
+                           'gzip_total': None,
+                           'gzip_save': None,
+                           'minify_total': None,
+                           'minify_save': None,
+                           'image_total': None,
+                           'image_save': None,
+                           'cache_time': None,
+                           'cdn_provider': None,
+                           'server_count': None,
+                           'socket': -1
+                           })
         if len(parts.query):
             request['url'] += '?' + parts.query
         return request
@@ -1205,17 +1316,24 @@ class Firefox(DesktopBrowser):
                     requests.append(request)
             except Exception:
                 logging.exception('Error merging request')
-        # Overwrite them with the same requests from the logs
+        # Overwrite them with the same requests from the logs (matched in order by URL)
+        log_requests = {}
+        for req in request_timings:
+            if 'claimed' not in req and 'url' in req and 'start' in req:
+                if req['url'] not in log_requests:
+                    log_requests[req['url']] = deque()
+                log_requests[req['url']].append(req)
         for request in requests:
-            for req in request_timings:
-                try:
-                    if 'claimed' not in req and 'url' in req and 'full_url' in request \
-                            and 'start' in req and request['full_url'] == req['url']:
-                        req['claimed'] = True
-                        self.populate_request(request, req)
-                        break
-                except Exception:
-                    logging.exception('Error populating request')
+            try:
+                if 'full_url' in request and request['full_url'] in log_requests:
+                    matches = log_requests[request['full_url']]
+                    req = matches.popleft()
+                    if not matches:
+                        del log_requests[request['full_url']]
+                    req['claimed'] = True
+                    self.populate_request(request, req)
+            except Exception:
+                logging.exception('Error populating request')
         # Add any events from the logs that weren't reported by the extension
         for req in request_timings:
             try:
@@ -0,0 +1,134 @@
+# Copyright 2021 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Streaming HAR writer that serializes the log one page/entry at a time"""
+import gzip
+import os
+import sys
+if (sys.version_info >= (3, 0)):
+    GZIP_TEXT = 'wt'
+else:
+    GZIP_TEXT = 'w'
+try:
+    import ujson as json
+except BaseException:
+    import json
+
+COMPRESSORS = {'gzip': '.gz', 'brotli': '.br', 'none': ''}
+
+
+def get_separators():
+    """The item and key separators the json module uses so the streamed output matches json.dump"""
+    sample = json.dumps({'a': [1, 2]})
+    return sample[sample.index('1') + 1:sample.index('2')], sample[4:sample.index('[')]
+
+
+class BrotliTextFile(object):
+    """Minimal text-mode file object that compresses with brotli as it is written"""
+    def __init__(self, path, level):
+        import brotli
+        self.file = open(path, 'wb')
+        self.compressor = brotli.Compressor(quality=level)
+
+    def write(self, text):
+        """Compress and write a chunk of text"""
+        self.file.write(self.compressor.process(text.encode('utf-8')))
+
+    def close(self):
+        """Flush the compressor and close the file"""
+        self.file.write(self.compressor.finish())
+        self.file.close()
+
+
+def open_output(path, compressor='gzip', level=7):
+    """Open the output file for writing text with the given compressor"""
+    if compressor == 'brotli':
+        return BrotliTextFile(path, level)
+    if compressor == 'none':
+        return open(path, 'wt')
+    return gzip.open(path, GZIP_TEXT, level)
+
+
+class HarWriter(object):
+    """Writes a JSON document incrementally. Objects and arrays are opened and closed
+    explicitly and values are serialized (and released) as they are added, so the
+    whole HAR never has to be held in memory. The output is identical to json.dump
+    of the equivalent document."""
+    def __init__(self, path, compressor='gzip', level=7):
+        self.path = path + COMPRESSORS.get(compressor, '')
+        self.file = open_output(self.path, compressor, level)
+        self.item_separator, self.key_separator = get_separators()
+        # The closing character for each open object/array and whether it has members yet
+        self.stack = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def start_member(self, key):
+        """Write the separator (and key) for the next member of the current object/array"""
+        if self.stack:
+            if self.stack[-1][1]:
+                self.file.write(self.item_separator)
+            self.stack[-1][1] = True
+        if key is not None:
+            self.file.write(json.dumps(key) + self.key_separator)
+
+    def begin_object(self, key=None):
+        """Open an object (as a member of the current object if key is given)"""
+        self.start_member(key)
+        self.file.write('{')
+        self.stack.append(['}', False])
+
+    def end_object(self):
+        """Close the current object"""
+        self.stack.pop()
+        self.file.write('}')
+
+    def begin_array(self, key=None):
+        """Open an array (as a member of the current object if key is given)"""
+        self.start_member(key)
+        self.file.write('[')
+        self.stack.append([']', False])
+
+    def end_array(self):
+        """Close the current array"""
+        self.stack.pop()
+        self.file.write(']')
+
+    def add(self, value, key=None):
+        """Serialize a complete value into the current object (with key) or array"""
+        self.start_member(key)
+        self.file.write(json.dumps(value))
+
+    def add_items(self, values):
+        """Serialize each value from an iterable (or generator) into the current array"""
+        for value in values:
+            self.add(value)
+
+    def abort(self):
+        """Close and delete the partial file (so a truncated HAR is never left behind)"""
+        if self.file is not None:
+            try:
+                self.file.close()
+            except Exception:
+                pass
+            self.file = None
+            try:
+                if os.path.isfile(self.path):
+                    os.remove(self.path)
+            except Exception:
+                pass
+
+    def close(self):
+        """Close any open objects/arrays and the file"""
+        if self.file is not None:
+            while self.stack:
+                self.file.write(self.stack.pop()[0])
+            self.file.close()
+            self.file = None
@@ -12,6 +12,7 @@ import threading
 import time
 import tornado.ioloop
 import tornado.web
+from internal.metrics import CONTENT_TYPE, LAST_HEALTHY_AGE, METRICS
 if (sys.version_info >= (3, 0)):
     from time import monotonic
 else:
@@ -41,6 +42,16 @@ class TornadoRequestHandler(tornado.web.RequestHandler):
             self.set_header("Access-Control-Allow-Origin", "*")
             self.write(response)
 
+class MetricsRequestHandler(tornado.web.RequestHandler):
+    """Prometheus/OpenMetrics scrape endpoint"""
+    def get(self):
+        """Handle GET requests"""
+        LAST_HEALTHY_AGE.set(round(monotonic() - HEALTH_CHECK_SERVER.last_healthy, 3))
+        self.set_status(200)
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.set_header("Referrer-Policy", "no-referrer")
+        self.write(METRICS.render())
+
 class HealthCheckServer(object):
     """Local HTTP server for interacting with the extension"""
     def __init__(self, server_port):
@@ -98,7 +109,8 @@ class HealthCheckServer(object):
             asyncio.set_event_loop(asyncio.new_event_loop())
         except Exception:
             pass
-        application = tornado.web.Application([(r"/.*", TornadoRequestHandler)])
+        application = tornado.web.Application([(r"/metrics", MetricsRequestHandler),
+                                               (r"/.*", TornadoRequestHandler)])
         application.listen(self.server_port, '0.0.0.0')
         self.__is_started.set()
         tornado.ioloop.IOLoop.instance().start()
@@ -0,0 +1,117 @@
+# Copyright 2020 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Indexed DNS override and domain blocking rules"""
+import logging
+import os
+import re
+import threading
+
+STATIC_BLOCK_LISTS = [os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                                   'support', 'adblock', 'nocoin', 'hosts.txt')]
+HOSTNAME_RE = re.compile(r'^[a-zA-Z0-9\-\.]+$')
+IPV4_RE = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
+
+static_block_domains = None
+static_block_lock = threading.Lock()
+
+
+def get_static_block_domains():
+    """Domains from the bundled hosts-format block lists (loaded once per process)"""
+    global static_block_domains
+    with static_block_lock:
+        if static_block_domains is None:
+            domains = []
+            for block_list in STATIC_BLOCK_LISTS:
+                if os.path.exists(block_list):
+                    try:
+                        with open(block_list, 'rt') as f_in:
+                            for line in f_in:
+                                if line.startswith('0.0.0.0'):
+                                    domains.append(line[8:].strip())
+                    except Exception:
+                        logging.exception('Error loading block list %s', block_list)
+            static_block_domains = tuple(domains)
+    return static_block_domains
+
+
+def add_block_domains(task, domains, address):
+    """Add a list of domains (comma or space-separated) to block for the task,
+    mapping them to the given address for the hosts-file based blocking"""
+    if 'host_rules' not in task:
+        task['host_rules'] = []
+    if 'block_domains' not in task:
+        task['block_domains'] = []
+    if 'dns_override' not in task:
+        task['dns_override'] = []
+    for domain in re.split('[, ]', domains):
+        domain = domain.strip()
+        if len(domain) and domain.find('"') == -1:
+            task['block_domains'].append(domain)
+            task['host_rules'].append('"MAP {0} 127.0.0.1"'.format(domain))
+            if HOSTNAME_RE.match(domain):
+                task['dns_override'].append([domain, address])
+
+
+class HostRules(object):
+    """Hash-indexed view of a task's DNS overrides and blocked domains.
+    Matches behave like the underlying lists: the first override for a host wins
+    (like the hosts file) and blocked domains match exactly, or as a suffix for
+    wildcard (*.example.com) entries. The browsers still get the lists (as command-line
+    host rules, extension config or hosts-file entries) and match them themselves; the
+    table is for the agent-side lookups (i.e. the local DNS resolver)."""
+    def __init__(self):
+        self.overrides = {}
+        self.blocked = set()
+        self.blocked_suffixes = set()
+
+    @staticmethod
+    def from_task(task):
+        """Build the rules table from the lists in a task"""
+        rules = HostRules()
+        if 'dns_override' in task:
+            for host, address in task['dns_override']:
+                rules.add_override(host, address)
+        if 'block_domains' in task:
+            for domain in task['block_domains']:
+                rules.add_block(domain)
+        return rules
+
+    def add_override(self, host, address):
+        """Map the host to the given address (unless it is already overridden)"""
+        host = host.lower().rstrip('.')
+        if host not in self.overrides:
+            self.overrides[host] = address
+
+    def add_block(self, domain):
+        """Block the given domain (supports a leading *. wildcard)"""
+        domain = domain.lower().rstrip('.')
+        if domain.startswith('*.'):
+            self.blocked_suffixes.add(domain[2:])
+        else:
+            self.blocked.add(domain)
+
+    def get_override(self, host):
+        """The overridden address for the host or None"""
+        return self.overrides.get(host.lower().rstrip('.'))
+
+    def is_blocked(self, host):
+        """See if requests to the host should be blocked"""
+        host = host.lower().rstrip('.')
+        if host in self.blocked:
+            return True
+        if self.blocked_suffixes:
+            pos = host.find('.')
+            while pos >= 0:
+                if host[pos + 1:] in self.blocked_suffixes:
+                    return True
+                pos = host.find('.', pos + 1)
+        return False
+
+    def resolve(self, host):
+        """The address the host should resolve to (0.0.0.0 for blocked hosts) or None
+        if the host is not affected by the rules"""
+        address = self.get_override(host)
+        if address is None and self.is_blocked(host):
+            address = '0.0.0.0'
+        return address
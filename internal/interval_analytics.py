@@ -0,0 +1,177 @@
+# Copyright 2021 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Interval analytics over sorted numpy interval arrays for the interactivity metrics
+(TTI, First Interactive, Total Blocking Time, max FID and generic quiet windows).
+Intervals are [start, end] pairs in ms. Arrays are used for filtering and searching and
+the reported values are taken from the original (python) inputs so the results keep
+their int/float types."""
+
+QUIET_WINDOW = 5000
+MAX_QUIET_REQUESTS = 2
+BLOCKING_THRESHOLD = 50
+
+
+def to_intervals(intervals, keep_type=False):
+    """An n x 2 float64 array of the [start, end] pairs (or int64 if they are all ints and keep_type is set)"""
+    import numpy as np
+    if not len(intervals):
+        return np.zeros((0, 2))
+    try:
+        array = np.asarray(intervals)[:, :2]
+    except Exception:
+        array = np.asarray([[interval[0], interval[1]] for interval in intervals])
+    if keep_type and array.dtype.kind == 'i':
+        return array
+    return array.astype(np.float64, copy=False)
+
+
+def last_interval(intervals, floor):
+    """Index of the interval that extends furthest (first one if tied, only intervals ending
+    after 0 count and, if none of them end after the floor, the first of those)"""
+    import numpy as np
+    index = None
+    if len(intervals):
+        ends = intervals[:, 1]
+        furthest = int(np.argmax(ends))
+        if ends[furthest] > floor:
+            index = furthest
+        else:
+            positive = np.flatnonzero(ends > 0)
+            if len(positive):
+                index = int(positive[0])
+    return index
+
+
+def long_intervals(intervals, after, min_duration):
+    """Indexes (in order) of the intervals that end after the given time and last at least min_duration"""
+    import numpy as np
+    if not len(intervals):
+        return np.zeros(0, dtype=np.int64)
+    mask = (intervals[:, 1] > after) & (intervals[:, 1] - intervals[:, 0] >= min_duration)
+    return np.flatnonzero(mask)
+
+
+def quiet_windows(starts, ends, max_active, min_duration, end):
+    """Sweep the start/end events of a set of activities (requests, tasks...) for the quiet
+    window that leads up to the point where more than max_active are first in flight: from
+    the last activity to finish before then (or 0) until that point (or end if it never
+    happens). Returned as an array with the window if it lasts at least min_duration."""
+    import numpy as np
+    if not len(starts):
+        return np.zeros((0, 2))
+    count = len(starts)
+    times = np.empty(count * 2, dtype=np.float64)
+    times[0::2] = starts
+    times[1::2] = ends
+    deltas = np.empty(count * 2, dtype=np.int64)
+    deltas[0::2] = 1
+    deltas[1::2] = -1
+    # Stable so simultaneous events stay in activity order (start before end)
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    deltas = deltas[order]
+    busy = np.flatnonzero(np.cumsum(deltas) > max_active)
+    window_end = end
+    if len(busy):
+        window_end = times[busy[0]]
+        deltas = deltas[:busy[0]]
+    finished = np.flatnonzero(deltas < 0)
+    window_start = times[finished[-1]] if len(finished) else 0.0
+    windows = np.asarray([[window_start, window_end]], dtype=np.float64)
+    return windows[windows[:, 1] - windows[:, 0] >= min_duration]
+
+
+def first_overlapping(intervals, windows, min_overlap):
+    """Index of the first interval (in order) that overlaps any of the windows by at least
+    min_overlap. The windows must be sorted and non-overlapping."""
+    import numpy as np
+    if not len(intervals) or not len(windows):
+        return None
+    # Sweep: the candidate windows for each interval are the ones that end after it
+    # starts and start before it ends
+    first = np.searchsorted(windows[:, 1], intervals[:, 0], side='right')
+    last = np.searchsorted(windows[:, 0], intervals[:, 1], side='left')
+    for index in range(len(intervals)):
+        if last[index] > first[index]:
+            candidates = windows[first[index]:last[index]]
+            overlap = np.minimum(candidates[:, 1], intervals[index, 1]) - \
+                np.maximum(candidates[:, 0], intervals[index, 0])
+            if np.any(overlap >= min_overlap):
+                return index
+    return None
+
+
+def blocking_time(tasks, start_time, end_time, threshold=BLOCKING_THRESHOLD):
+    """Total blocking time (https://web.dev/tbt/ - time over the threshold for each task,
+    clipped to the measurement range) and the longest blocking period (max possible FID)"""
+    import numpy as np
+    total = 0
+    longest = 0
+    if end_time > start_time and len(tasks):
+        intervals = to_intervals(tasks, keep_type=True)
+        if intervals.dtype.kind == 'i' and all(isinstance(value, int) for value in [start_time, end_time, threshold]):
+            # All integers, the array math is exact
+            busy = np.minimum(intervals[:, 1], end_time) - (np.maximum(intervals[:, 0], start_time) + threshold)
+            busy = busy[busy > 0]
+            if len(busy):
+                total = int(busy.sum())
+                longest = int(busy.max())
+            return total, longest
+        # Mixed types, use the arrays to find the blocking tasks and keep python's int/float results
+        busy = np.minimum(intervals[:, 1], end_time) - (np.maximum(intervals[:, 0], start_time) + threshold)
+        for index in np.flatnonzero(busy > 0):
+            task = tasks[index]
+            busy_time = min(task[1], end_time) - (max(task[0], start_time) + threshold)
+            total += busy_time
+            if busy_time > longest:
+                longest = busy_time
+    return total, longest
+
+
+def interactive_metrics(interactive_periods, requests, long_tasks, start_time,
+                        quiet_window=QUIET_WINDOW, max_requests=MAX_QUIET_REQUESTS):
+    """TTI and the related metrics in a single pass over the interval arrays.
+    A page is interactive at the start of the first main-thread interactive window of at least
+    quiet_window ms that overlaps the network quiet window (no more than max_requests GET
+    requests in flight) by at least the same length (and no earlier than start_time)."""
+    metrics = {'tti': None, 'first_interactive': None, 'last_interactive': 0, 'measurement_end': 0,
+               'max_fid': None, 'total_blocking_time': None}
+    periods = to_intervals(interactive_periods)
+
+    # The absolute last interaction measurement
+    index = last_interval(periods, start_time)
+    if index is not None:
+        metrics['measurement_end'] = max(interactive_periods[index][1], start_time)
+        metrics['last_interactive'] = max(interactive_periods[index][0], start_time)
+
+    # The long-enough interactive windows that don't end before the start time
+    candidates = long_intervals(periods, start_time, quiet_window)
+    if len(candidates):
+        earliest = candidates[int(periods[candidates, 0].argmin())]
+        metrics['first_interactive'] = max(interactive_periods[earliest][0], start_time)
+
+    # The window with no more than max_requests document requests in flight
+    if len(candidates) and requests:
+        starts = []
+        ends = []
+        for request in requests:
+            if 'contentType' in request and \
+                    'load_start' in request and request['load_start'] >= 0 and \
+                    'load_end' in request and request['load_end'] > start_time:
+                if 'method' not in request or request['method'] == 'GET':
+                    starts.append(request['load_start'])
+                    ends.append(request['load_end'])
+        if starts:
+            # A quiet window that is still open runs until the end of the last interactive period
+            end = interactive_periods[-1][1]
+            windows = quiet_windows(starts, ends, max_requests, quiet_window, end)
+            match = first_overlapping(periods[candidates], windows, quiet_window)
+            if match is not None:
+                metrics['tti'] = max(start_time, interactive_periods[candidates[match]][0])
+
+    # Total blocking time and the max possible FID up until TTI
+    if long_tasks:
+        end_time = metrics['tti'] if metrics['tti'] is not None else metrics['last_interactive']
+        metrics['total_blocking_time'], metrics['max_fid'] = blocking_time(long_tasks, start_time, end_time)
+    return metrics
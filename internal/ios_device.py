@@ -5,6 +5,7 @@
 # found in the LICENSE.md file.
 """Interface for iWptBrowser on iOS devices"""
 import base64
+import binascii
 import logging
 import multiprocessing
 import os
@@ -23,6 +24,9 @@ try:
 except BaseException:
     import json
 
+RECV_SIZE = 65536
+WHITESPACE = frozenset(bytearray(b' \t\r\n\x0b\x0c'))
+
 
 class iOSDevice(object):
     """iOS device interface"""
@@ -304,7 +308,8 @@ class iOSDevice(object):
 
     def pump_messages(self):
         """Background thread for reading messages from the browser"""
-        buff = ""
+        buff = bytearray()
+        scan_start = 0
         try:
             while not self.must_disconnect and self.socket != None:
                 rlo, _, xlo = select.select([self.socket], [], [self.socket])
@@ -314,25 +319,60 @@ class iOSDevice(object):
                         self.messages.put({"msg": "disconnected"})
                         return
                     if rlo:
-                        data_in = self.socket.recv(8192)
+                        data_in = self.socket.recv(RECV_SIZE)
                         if not data_in:
                             logging.debug("iWptBrowser disconnected")
                             self.messages.put({"msg": "disconnected"})
                             return
                         buff += data_in
-                        pos = 0
-                        while pos >= 0:
-                            pos = buff.find("\n")
-                            if pos >= 0:
-                                message = buff[:pos].strip()
-                                buff = buff[pos + 1:]
-                                if message:
-                                    self.process_raw_message(message)
+                        consumed = self.process_buffer(buff, scan_start)
+                        if consumed:
+                            del buff[:consumed]
+                        # Only the new data needs to be scanned for the end of the current message
+                        scan_start = len(buff)
                 except Exception:
                     logging.exception('Error pumping message')
         except Exception:
             pass
 
+    def process_buffer(self, buff, scan_start):
+        """Process the complete (newline-terminated) messages in the receive buffer.
+        Returns the number of bytes consumed."""
+        start = 0
+        pos = buff.find(b'\n', scan_start)
+        while pos >= 0:
+            # A bad message is dropped so it can't stall the ones that follow it
+            try:
+                self.process_buffered_message(buff, start, pos)
+            except Exception:
+                logging.exception('Error processing message from iWptBrowser')
+            start = pos + 1
+            pos = buff.find(b'\n', start)
+        return start
+
+    def process_buffered_message(self, buff, start, end):
+        """Process a single message in the receive buffer. Video data is decoded straight
+        from the buffer into the video file without building a message for it."""
+        while start < end and buff[start] in WHITESPACE:
+            start += 1
+        while end > start and buff[end - 1] in WHITESPACE:
+            end -= 1
+        if start < end:
+            ts_end = buff.find(b'\t', start, end)
+            event_end = buff.find(b'\t', ts_end + 1, end) if ts_end > start else -1
+            if event_end > ts_end + 1:
+                event = bytes(buff[ts_end + 1:event_end]).decode('utf-8')
+                parts = event.split(':')[-1].strip().split('!')
+                if parts[0].strip() == 'VideoData':
+                    with memoryview(buff) as view:
+                        with view[event_end + 1:end] as payload:
+                            if 'encoded' in parts:
+                                self.add_video_data(binascii.a2b_base64(payload))
+                            else:
+                                self.add_video_data(payload)
+                    return
+            self.process_raw_message(bytes(buff[start:end]).decode('utf-8'))
+
     def process_raw_message(self, message):
         """Process a single message string"""
         ts_end = message.find("\t")
@@ -366,13 +406,7 @@ class iOSDevice(object):
     def process_message(self, msg):
         """Handle a single decoded message"""
         if msg['msg'] == 'VideoData' and 'data' in msg:
-            now = monotonic()
-            self.video_size += len(msg['data'])
-            if self.last_video_data is None or now - self.last_video_data >= 0.5:
-                logging.debug('<<< Video data (current size: %d)', self.video_size)
-                self.last_video_data = now
-            if self.video_file is not None:
-                self.video_file.write(msg['data'])
+            self.add_video_data(msg['data'])
         elif 'id' in msg:
             logging.debug('<<< %s:%s', msg['id'], msg['msg'])
             try:
@@ -385,3 +419,13 @@ class iOSDevice(object):
                 self.notification_queue.put(msg)
             except Exception:
                 logging.exception('Error adding message to notification queue')
+
+    def add_video_data(self, data):
+        """Append a chunk of video data to the video file"""
+        now = monotonic()
+        self.video_size += len(data)
+        if self.last_video_data is None or now - self.last_video_data >= 0.5:
+            logging.debug('<<< Video data (current size: %d)', self.video_size)
+            self.last_video_data = now
+        if self.video_file is not None:
+            self.video_file.write(data)
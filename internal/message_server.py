@@ -113,9 +113,10 @@ class TornadoRequestHandler(tornado.web.RequestHandler):
 
 class MessageServer(object):
     """Local HTTP server for interacting with the extension"""
-    def __init__(self):
+    def __init__(self, port=8888):
         global MESSAGE_SERVER
         MESSAGE_SERVER = self
+        self.port = port
         self.thread = None
         self.messages = JoinableQueue()
         self.config = None
@@ -171,7 +172,7 @@ class MessageServer(object):
         proxies = {"http": None, "https": None}
         while not server_ok and monotonic() < end_time:
             try:
-                response = requests.get('http://127.0.0.1:8888/ping', timeout=10, proxies=proxies)
+                response = requests.get('http://127.0.0.1:{0:d}/ping'.format(self.port), timeout=10, proxies=proxies)
                 if response.text == 'pong':
                     server_ok = True
             except Exception:
@@ -182,12 +183,12 @@ class MessageServer(object):
 
     def run(self):
         """Main server loop"""
-        logging.debug('Starting extension server on port 8888')
+        logging.debug('Starting extension server on port %d', self.port)
         try:
             asyncio.set_event_loop(asyncio.new_event_loop())
         except Exception:
             pass
         application = tornado.web.Application([(r"/.*", TornadoRequestHandler)])
-        application.listen(8888, '127.0.0.1')
+        application.listen(self.port, '127.0.0.1')
         self.__is_started.set()
         tornado.ioloop.IOLoop.instance().start()
@@ -0,0 +1,188 @@
+# Copyright 2020 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Agent metrics in the Prometheus/OpenMetrics text exposition format"""
+import logging
+import os
+import sys
+import threading
+if (sys.version_info >= (3, 0)):
+    from time import monotonic
+else:
+    from monotonic import monotonic
+
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+BYTES_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 52428800, 104857600, 524288000)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_value(value):
+    """Format a sample value for the exposition format"""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return '{0:d}'.format(int(value))
+    return '{0}'.format(value)
+
+
+def format_labels(names, values, extra=None):
+    """Build the {name="value",...} label block for a sample"""
+    labels = []
+    for index, name in enumerate(names):
+        value = str(values[index]).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        labels.append('{0}="{1}"'.format(name, value))
+    if extra is not None:
+        labels.append('{0}="{1}"'.format(extra[0], extra[1]))
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Histogram(object):
+    """Cumulative histogram, optionally split by label values"""
+    def __init__(self, name, help_text, buckets=DURATION_BUCKETS, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        """Record a single observation"""
+        if value is None or value < 0:
+            return
+        with self.lock:
+            if label_values not in self.series:
+                self.series[label_values] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            series = self.series[label_values]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self, lines):
+        """Append the exposition lines for the histogram"""
+        lines.append('# HELP {0} {1}'.format(self.name, self.help_text))
+        lines.append('# TYPE {0} histogram'.format(self.name))
+        with self.lock:
+            for label_values in sorted(self.series):
+                series = self.series[label_values]
+                cumulative = 0
+                for index, bound in enumerate(self.buckets):
+                    cumulative += series['counts'][index]
+                    lines.append('{0}_bucket{1} {2:d}'.format(
+                        self.name, format_labels(self.label_names, label_values,
+                                                 ('le', format_value(float(bound)))),
+                        cumulative))
+                labels = format_labels(self.label_names, label_values)
+                lines.append('{0}_sum{1} {2}'.format(self.name, labels, format_value(series['sum'])))
+                lines.append('{0}_count{1} {2:d}'.format(self.name, labels, series['count']))
+
+
+class Counter(object):
+    """Monotonically increasing counter"""
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, value=1):
+        """Increment the counter"""
+        with self.lock:
+            self.value += value
+
+    def render(self, lines):
+        """Append the exposition lines for the counter"""
+        lines.append('# HELP {0} {1}'.format(self.name, self.help_text))
+        lines.append('# TYPE {0} counter'.format(self.name))
+        lines.append('{0}_total {1}'.format(self.name, format_value(self.value)))
+
+
+class Gauge(object):
+    """Point-in-time value, either set directly or collected by a callback at scrape time"""
+    def __init__(self, name, help_text, callback=None):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.value = 0
+
+    def set(self, value):
+        """Set the current value"""
+        self.value = value
+
+    def render(self, lines):
+        """Append the exposition lines for the gauge"""
+        value = self.value
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception:
+                logging.exception('Error collecting the %s metric', self.name)
+                return
+        lines.append('# HELP {0} {1}'.format(self.name, self.help_text))
+        lines.append('# TYPE {0} gauge'.format(self.name))
+        lines.append('{0} {1}'.format(self.name, format_value(value)))
+
+
+class MetricsRegistry(object):
+    """The collection of metrics exposed by the agent"""
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        """Register a metric and return it"""
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """The exposition text for all of the metrics"""
+        lines = []
+        for metric in self.metrics:
+            metric.render(lines)
+        return '\n'.join(lines) + '\n'
+
+
+def observe_first_navigation(task):
+    """Record the time from the start of the browser launch to the first navigation of the run"""
+    if task is not None and 'launch_start' in task and 'first_navigation' not in task:
+        task['first_navigation'] = monotonic()
+        elapsed = task['first_navigation'] - task['launch_start']
+        logging.debug("Browser launch to first navigation: %0.3f seconds", elapsed)
+        FIRST_NAVIGATION_DURATION.observe(elapsed)
+
+
+def count_child_processes():
+    """Number of processes running under the agent"""
+    import psutil
+    return len(psutil.Process(os.getpid()).children(recursive=True))
+
+
+METRICS = MetricsRegistry()
+JOB_DURATION = METRICS.add(Histogram('wptagent_job_duration_seconds',
+                                     'Time to run a job from start to end (all runs).'))
+RUN_DURATION = METRICS.add(Histogram('wptagent_run_duration_seconds',
+                                     'Time to run a single test run (before processing and upload).'))
+PROCESSING_DURATION = METRICS.add(Histogram('wptagent_processing_duration_seconds',
+                                            'Time to post-process a test run.'))
+UPLOAD_DURATION = METRICS.add(Histogram('wptagent_upload_duration_seconds',
+                                        'Time to process and upload the result of a test run.'))
+IDLE_WAIT_DURATION = METRICS.add(Histogram('wptagent_idle_wait_duration_seconds',
+                                           'Time spent waiting for work between jobs.'))
+BROWSER_LAUNCH_DURATION = METRICS.add(Histogram('wptagent_browser_launch_duration_seconds',
+                                                'Time to prepare and launch the browser.'))
+FIRST_NAVIGATION_DURATION = METRICS.add(Histogram('wptagent_launch_to_navigation_seconds',
+                                                  'Time from the start of the browser launch to the first navigation.'))
+PROFILE_DURATION = METRICS.add(Histogram('wptagent_profile_event_duration_seconds',
+                                         'Duration of the profiled agent events (profile_start/end).',
+                                         label_names=('event',)))
+UPLOAD_SIZE = METRICS.add(Histogram('wptagent_upload_size_bytes',
+                                    'Size of the uploaded result files.', buckets=BYTES_BUCKETS))
+BYTES_UPLOADED = METRICS.add(Counter('wptagent_uploaded_bytes', 'Total bytes of result files uploaded.'))
+JOBS = METRICS.add(Counter('wptagent_jobs', 'Number of jobs run.'))
+CHILD_PROCESSES = METRICS.add(Gauge('wptagent_child_processes',
+                                    'Number of processes currently running under the agent.',
+                                    count_child_processes))
+LAST_HEALTHY_AGE = METRICS.add(Gauge('wptagent_last_healthy_age_seconds',
+                                     'Time since the agent was last marked as healthy.'))
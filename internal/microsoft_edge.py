@@ -765,16 +765,14 @@ class Edge(DesktopBrowser):
                         logging.debug(custom_metrics[name])
                 except Exception:
                     logging.exception('Error collecting custom metric')
-            path = os.path.join(task['dir'], task['prefix'] + '_metrics.json.gz')
-            with gzip.open(path, GZIP_TEXT, 7) as outfile:
-                outfile.write(json.dumps(custom_metrics))
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.publish(os.path.join(task['dir'], task['prefix'] + '_metrics.json.gz'), custom_metrics)
         # Collect the regular browser metrics
         logging.debug("Collecting user timing metrics")
         user_timing = self.run_js_file('user_timing.js')
         if user_timing is not None:
-            path = os.path.join(task['dir'], task['prefix'] + '_timed_events.json.gz')
-            with gzip.open(path, GZIP_TEXT, 7) as outfile:
-                outfile.write(json.dumps(user_timing))
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.publish(os.path.join(task['dir'], task['prefix'] + '_timed_events.json.gz'), user_timing)
         logging.debug("Collecting page-level metrics")
         page_data = self.run_js_file('page_data.js')
         if page_data is not None:
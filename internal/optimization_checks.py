@@ -28,6 +28,8 @@ try:
     import ujson as json
 except BaseException:
     import json
+from . import metrics
+from .spans import SPANS
 
 
 class OptimizationChecks(object):
@@ -1298,12 +1300,16 @@ class OptimizationChecks(object):
 
     def profile_start(self, event_name):
         event_name = 'opt.' + event_name
+        SPANS.start(event_name)
         if self.task is not None and 'profile_data' in self.task:
             with self.task['profile_data']['lock']:
                 self.task['profile_data'][event_name] = {'s': round(monotonic() - self.task['profile_data']['start'], 3)}
 
     def profile_end(self, event_name):
         event_name = 'opt.' + event_name
+        elapsed = SPANS.end(event_name)
+        if elapsed is not None:
+            metrics.PROFILE_DURATION.observe(elapsed, event_name)
         if self.task is not None and 'profile_data' in self.task:
             with self.task['profile_data']['lock']:
                 if event_name in self.task['profile_data']:
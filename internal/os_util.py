@@ -15,7 +15,13 @@ import socket
 
 def kill_all(exe, force, timeout=30):
     """Terminate all instances of the given process"""
+    from internal.process_tracker import TRACKER
+    # Processes the agent launched itself are killed (and waited on) as whole trees first.
+    # The sweep still runs for anything that escaped the trees or was left behind by an
+    # earlier agent instance.
+    tracked = TRACKER.kill(exe, force, timeout)
     logging.debug("Terminating all instances of %s", exe)
+    found = True
     plat = platform.system()
     if plat == "Windows":
         if force:
@@ -24,24 +30,28 @@ def kill_all(exe, force, timeout=30):
             subprocess.call(['taskkill', '/IM', exe])
     elif plat == "Linux" or plat == "Darwin":
         if force:
-            subprocess.call(['killall', '-s', 'SIGKILL', exe])
+            found = subprocess.call(['killall', '-s', 'SIGKILL', exe]) == 0
         else:
-            subprocess.call(['killall', exe])
-    wait_for_all(exe, timeout)
+            found = subprocess.call(['killall', exe]) == 0
+    # killall fails when there was nothing left to signal
+    if found or not tracked:
+        wait_for_all(exe, timeout)
 
 def wait_for_all(exe, timeout=30):
     """Wait for the given process to exit"""
+    from internal.process_tracker import TRACKER
+    tracked = TRACKER.get(exe)
+    if tracked:
+        logging.debug("Waiting up to %d seconds for %s to exit", timeout, exe)
+        TRACKER.wait_for(tracked, timeout)
+        return
     import psutil
     processes = []
-    for proc in psutil.process_iter():
-        try:
-            pinfo = proc.as_dict(attrs=['pid', 'name', 'exe'])
-        except psutil.NoSuchProcess:
-            pass
-        else:
-            if 'exe' in pinfo and pinfo['exe'] is not None and\
-                    os.path.basename(pinfo['exe']) == exe:
-                processes.append(proc)
+    # Only the executable path is needed (not the name, which child processes can change)
+    for proc in psutil.process_iter(['exe']):
+        proc_exe = proc.info['exe']
+        if proc_exe is not None and os.path.basename(proc_exe) == exe:
+            processes.append(proc)
     if len(processes):
         logging.debug("Waiting up to %d seconds for %s to exit", timeout, exe)
         psutil.wait_procs(processes, timeout=timeout)
@@ -49,6 +59,8 @@ def wait_for_all(exe, timeout=30):
 def flush_dns():
     """Flush the OS DNS resolver"""
     logging.debug("Flushing DNS")
+    from .dns_resolver import RESOLVER
+    RESOLVER.flush()
     plat = platform.system()
     if plat == "Windows":
         run_elevated('ipconfig', '/flushdns')
@@ -56,22 +56,26 @@ class ProcessTest(object):
     
     def run_processing(self):
         """Run the post-processing for the given test step"""
-        self.load_data()
+        from .spans import SPANS
+        with SPANS.span('process.load_data'):
+            self.load_data()
         page_data = self.data['pageData']
 
-        self.merge_user_timing_events()
-        self.merge_custom_metrics()
-        self.merge_interactive_periods()
-        self.merge_long_tasks()
-        self.calculate_visual_metrics()
-        self.process_chrome_timings()
-        self.merge_blink_features()
-        self.merge_priority_streams()
-        self.calculate_TTI()
-        self.add_summary_metrics()
-        self.merge_crux_data()
-        self.merge_lighthouse_data()
-        self.merge_trace_page_data()
+        for stage in [self.merge_user_timing_events,
+                      self.merge_custom_metrics,
+                      self.merge_interactive_periods,
+                      self.merge_long_tasks,
+                      self.calculate_visual_metrics,
+                      self.process_chrome_timings,
+                      self.merge_blink_features,
+                      self.merge_priority_streams,
+                      self.calculate_TTI,
+                      self.add_summary_metrics,
+                      self.merge_crux_data,
+                      self.merge_lighthouse_data,
+                      self.merge_trace_page_data]:
+            with SPANS.span('process.' + stage.__name__):
+                stage()
 
         # Mark the data as having been processed so the server can know not to re-process it
         page_data['edge-processed'] = True
@@ -103,10 +107,12 @@ class ProcessTest(object):
         except Exception:
             logging.exception('Error extracting metrics for pubsub result')
 
-        self.save_data()
+        with SPANS.span('process.save_data'):
+            self.save_data()
 
         if self.options.har or 'gcs_har_upload' in self.job:
-            self.generate_har()
+            with SPANS.span('process.generate_har'):
+                self.generate_har()
 
         # TODO: Delete any stand-alone files that were post-processed (keep them as backup for now)
         """
@@ -120,6 +126,7 @@ class ProcessTest(object):
 
     def load_data(self):
         """Load the main page and requests data file (basis for post-processing)"""
+        from .support.request_record import load_requests
         devtools_file = os.path.join(self.task['dir'], self.prefix + '_devtools_requests.json.gz')
         if os.path.isfile(devtools_file):
             with gzip.open(devtools_file, GZIP_READ_TEXT) as f:
@@ -141,6 +148,7 @@ class ProcessTest(object):
                         self.task['page_data']['date'] = self.step_start
 
                     if self.data and 'requests' in self.data:
+                        load_requests(self.data['requests'])
                         self.fix_up_request_times()
                         self.add_response_body_flags()
                         self.add_script_timings()
@@ -155,50 +163,54 @@ class ProcessTest(object):
 
     def save_data(self):
         """Write-out the post-processed devtools data"""
+        from .support.request_record import dump
         devtools_file = os.path.join(self.task['dir'], self.prefix + '_devtools_requests.json.gz')
         with gzip.open(devtools_file, GZIP_TEXT, 7) as f:
-            json.dump(self.data, f)
+            dump(self.data, f)
+
+    def load_json(self, path):
+        """Load one of the json results for the run (published in-memory by the browser or from the file)"""
+        from .artifact_store import ARTIFACTS
+        return ARTIFACTS.load(path)
 
     def merge_user_timing_events(self):
         """Load and process the timed_events json file"""
         try:
             page_data = self.data['pageData']
             timed_events_file = os.path.join(self.task['dir'], self.prefix + '_timed_events.json.gz')
-            if os.path.isfile(timed_events_file):
-                with gzip.open(timed_events_file, GZIP_READ_TEXT) as f:
-                    events = json.load(f)
-                    if events:
-                        self.delete.append(timed_events_file)
-                        last_event = 0
-                        for event in events:
-                            try:
-                                if event and 'name' in event and 'startTime' in event and 'entryType' in event:
-                                    name = re.sub(r'[^a-zA-Z0-9\.\-_\(\) ]', '_', event['name'])
-                                    # Marks
-                                    if event['entryType'] == 'mark':
-                                        time = round(event['startTime'])
-                                        if time > 0 and time < 3600000:
-                                            if event['startTime'] > last_event:
-                                                last_event = event['startTime']
-                                            page_data['userTime.{}'.format(name)] = time
-                                            if 'userTimes' not in page_data:
-                                                page_data['userTimes'] = {}
-                                            page_data['userTimes'][name] = time
-                                    # Measures
-                                    elif event['entryType'] == 'measure' and 'duration' in event: # User timing measure
-                                        duration = round(event['duration'])
-                                        page_data['userTimingMeasure.{}'.format(name)] = duration
-                                        if 'userTimingMeasures' not in page_data:
-                                            page_data['userTimingMeasures'] = []
-                                        page_data['userTimingMeasures'].append({
-                                            'name': name,
-                                            'startTime': event['startTime'],
-                                            'duration': event['duration']
-                                        })
-                            except Exception:
-                                logging.exception('Error processing timed event')
-                        # Overall time is the time of the last mark
-                        page_data['userTime'] = round(last_event)
+            events = self.load_json(timed_events_file)
+            if events:
+                self.delete.append(timed_events_file)
+                last_event = 0
+                for event in events:
+                    try:
+                        if event and 'name' in event and 'startTime' in event and 'entryType' in event:
+                            name = re.sub(r'[^a-zA-Z0-9\.\-_\(\) ]', '_', event['name'])
+                            # Marks
+                            if event['entryType'] == 'mark':
+                                time = round(event['startTime'])
+                                if time > 0 and time < 3600000:
+                                    if event['startTime'] > last_event:
+                                        last_event = event['startTime']
+                                    page_data['userTime.{}'.format(name)] = time
+                                    if 'userTimes' not in page_data:
+                                        page_data['userTimes'] = {}
+                                    page_data['userTimes'][name] = time
+                            # Measures
+                            elif event['entryType'] == 'measure' and 'duration' in event: # User timing measure
+                                duration = round(event['duration'])
+                                page_data['userTimingMeasure.{}'.format(name)] = duration
+                                if 'userTimingMeasures' not in page_data:
+                                    page_data['userTimingMeasures'] = []
+                                page_data['userTimingMeasures'].append({
+                                    'name': name,
+                                    'startTime': event['startTime'],
+                                    'duration': event['duration']
+                                })
+                    except Exception:
+                        logging.exception('Error processing timed event')
+                # Overall time is the time of the last mark
+                page_data['userTime'] = round(last_event)
         except Exception:
             logging.exception('Error merging user timing events')
 
@@ -207,24 +219,22 @@ class ProcessTest(object):
         try:
             page_data = self.data['pageData']
             metrics_file = os.path.join(self.task['dir'], self.prefix + '_metrics.json.gz')
-            if os.path.isfile(metrics_file):
-                with gzip.open(metrics_file, GZIP_READ_TEXT) as f:
-                    metrics = json.load(f)
-                    if metrics:
-                        self.delete.append(metrics_file)
-                        page_data['custom'] = []
-                        for name in metrics:
-                            try:
-                                value = metrics[name]
-                                if isinstance(value, string_types):
-                                    if re.match(r'^[0-9]+$', value):
-                                        value = int(value)
-                                    elif re.match(r'^[0-9]*\.[0-9]+$', value):
-                                        value = float(value)
-                                page_data[name] = value
-                                page_data['custom'].append(name)
-                            except Exception:
-                                logging.exception('Error processing custom metric %s', name)
+            metrics = self.load_json(metrics_file)
+            if metrics:
+                self.delete.append(metrics_file)
+                page_data['custom'] = []
+                for name in metrics:
+                    try:
+                        value = metrics[name]
+                        if isinstance(value, string_types):
+                            if re.match(r'^[0-9]+$', value):
+                                value = int(value)
+                            elif re.match(r'^[0-9]*\.[0-9]+$', value):
+                                value = float(value)
+                        page_data[name] = value
+                        page_data['custom'].append(name)
+                    except Exception:
+                        logging.exception('Error processing custom metric %s', name)
         except Exception:
             logging.exception('Error merging custom metrics')
 
@@ -232,11 +242,9 @@ class ProcessTest(object):
         try:
             page_data = self.data['pageData']
             metrics_file = os.path.join(self.task['dir'], self.prefix + '_interactive.json.gz')
-            if os.path.isfile(metrics_file):
-                with gzip.open(metrics_file, GZIP_READ_TEXT) as f:
-                    metrics = json.load(f)
-                    if metrics:
-                        page_data['interactivePeriods'] = metrics
+            metrics = self.load_json(metrics_file)
+            if metrics:
+                page_data['interactivePeriods'] = metrics
         except Exception:
             logging.exception('Error merging interactive periods')
 
@@ -244,12 +252,10 @@ class ProcessTest(object):
         try:
             page_data = self.data['pageData']
             metrics_file = os.path.join(self.task['dir'], self.prefix + '_long_tasks.json.gz')
-            if os.path.isfile(metrics_file):
-                with gzip.open(metrics_file, GZIP_READ_TEXT) as f:
-                    metrics = json.load(f)
-                    if metrics:
-                        page_data['longTasks'] = metrics
-                        self.delete.append(metrics_file)
+            metrics = self.load_json(metrics_file)
+            if metrics:
+                page_data['longTasks'] = metrics
+                self.delete.append(metrics_file)
         except Exception:
             logging.exception('Error merging long tasks')
 
@@ -257,39 +263,37 @@ class ProcessTest(object):
         try:
             page_data = self.data['pageData']
             progress_file = os.path.join(self.task['dir'], self.prefix + '_visual_progress.json.gz')
-            if os.path.isfile(progress_file):
-                with gzip.open(progress_file, GZIP_READ_TEXT) as f:
-                    progress = json.load(f)
-                    if progress:
-                        speed_index = 0.0
-                        last_time = 0
-                        last_progress = 0
-                        frame = 0
-                        for entry in progress:
-                            try:
-                                if 'time' in entry and 'progress' in entry:
-                                    frame += 1
-                                    progress = min(round(entry['progress']), 100)
-                                    elapsed = max(entry['time'] - last_time, 0)
-                                    speed_index += (float(100 - last_progress) / 100.0) * float(elapsed)
-                                    if 'render' not in page_data and frame > 1:
-                                        page_data['render'] = entry['time']
-                                    page_data['lastVisualChange'] = entry['time']
-                                    if progress >= 85 and 'visualComplete85' not in page_data:
-                                        page_data['visualComplete85'] = entry['time']
-                                    if progress >= 90 and 'visualComplete90' not in page_data:
-                                        page_data['visualComplete90'] = entry['time']
-                                    if progress >= 95 and 'visualComplete95' not in page_data:
-                                        page_data['visualComplete95'] = entry['time']
-                                    if progress >= 99 and 'visualComplete99' not in page_data:
-                                        page_data['visualComplete99'] = entry['time']
-                                    if progress >= 100 and 'visualComplete' not in page_data:
-                                        page_data['visualComplete'] = entry['time']
-                                    last_time = entry['time']
-                                    last_progress = progress
-                            except Exception:
-                                logging.exception('Error processing visual metrics entry')
-                        page_data['SpeedIndex'] = round(speed_index)
+            progress = self.load_json(progress_file)
+            if progress:
+                speed_index = 0.0
+                last_time = 0
+                last_progress = 0
+                frame = 0
+                for entry in progress:
+                    try:
+                        if 'time' in entry and 'progress' in entry:
+                            frame += 1
+                            progress = min(round(entry['progress']), 100)
+                            elapsed = max(entry['time'] - last_time, 0)
+                            speed_index += (float(100 - last_progress) / 100.0) * float(elapsed)
+                            if 'render' not in page_data and frame > 1:
+                                page_data['render'] = entry['time']
+                            page_data['lastVisualChange'] = entry['time']
+                            if progress >= 85 and 'visualComplete85' not in page_data:
+                                page_data['visualComplete85'] = entry['time']
+                            if progress >= 90 and 'visualComplete90' not in page_data:
+                                page_data['visualComplete90'] = entry['time']
+                            if progress >= 95 and 'visualComplete95' not in page_data:
+                                page_data['visualComplete95'] = entry['time']
+                            if progress >= 99 and 'visualComplete99' not in page_data:
+                                page_data['visualComplete99'] = entry['time']
+                            if progress >= 100 and 'visualComplete' not in page_data:
+                                page_data['visualComplete'] = entry['time']
+                            last_time = entry['time']
+                            last_progress = progress
+                    except Exception:
+                        logging.exception('Error processing visual metrics entry')
+                page_data['SpeedIndex'] = round(speed_index)
         except Exception:
             logging.exception('Error calculating visual metrics')
 
@@ -298,260 +302,258 @@ class ProcessTest(object):
         try:
             page_data = self.data['pageData']
             events_file = os.path.join(self.task['dir'], self.prefix + '_user_timing.json.gz')
-            if os.path.isfile(events_file):
-                with gzip.open(events_file, GZIP_READ_TEXT) as f:
-                    events = json.load(f)
-                    if events:
-                        layout_shifts = []
-                        user_timing = None
-                        start_time = None
-                        events.sort(key=lambda x: x['CompareTimestamps'] if 'CompareTimestamps' in x else 0)
-
-                        # Make a first pass looking to see if the start time is explicitly set
-                        for event in events:
-                            try:
-                                if 'startTime' in event:
-                                    start_time = event['startTime']
-                            except Exception:
-                                pass
+            events = self.load_json(events_file)
+            if events:
+                layout_shifts = []
+                user_timing = None
+                start_time = None
+                events.sort(key=lambda x: x['CompareTimestamps'] if 'CompareTimestamps' in x else 0)
+
+                # Make a first pass looking to see if the start time is explicitly set
+                for event in events:
+                    try:
+                        if 'startTime' in event:
+                            start_time = event['startTime']
+                    except Exception:
+                        pass
                         
-                        # Make a pass looking for explicitly tagged main frames
-                        main_frames = []
-                        for event in events:
-                            try:
-                                if 'name' in event and 'args' in event and 'frame' in event['args'] and event['args']['frame'] not in main_frames:
-                                    if 'data' in event['args'] and \
-                                            'isLoadingMainFrame' in event['args']['data'] and event['args']['data']['isLoadingMainFrame'] and \
-                                            'documentLoaderURL' in event['args']['data'] and len(event['args']['data']['documentLoaderURL']):
-                                        main_frames.append(event['args']['frame'])
-                                    elif 'data' in event['args'] and 'isMainFrame' in event['args']['data'] and event['args']['data']['isMainFrame']:
-                                        main_frames.append(event['args']['frame'])
-                                    elif event['name'] == 'markAsMainFrame':
-                                        main_frames.append(event['args']['frame'])
-                            except Exception:
-                                logging.exception('Error looking for main frame')
-
-                        # Find the first navigation to determine which is the main frame
-                        for event in events:
-                            try:
-                                if 'name' in event and 'ts' in event:
-                                    if start_time is None:
-                                        start_time = event['ts']
-                                    if not main_frames and event['name'] in ['navigationStart', 'unloadEventStart', 'redirectStart', 'domLoading']:
-                                        if 'args' in event and 'frame' in event['args']:
-                                            main_frames.append(event['args']['frame'])
-                                            break
-                            except Exception:
-                                logging.exception('Error looking for first navigation')
-
-                        if main_frames and start_time is not None:
-                            # Pre-process the "LargestXXX" events, just recording the biggest one
-                            largest = {}
-                            for event in events:
+                # Make a pass looking for explicitly tagged main frames
+                main_frames = []
+                for event in events:
+                    try:
+                        if 'name' in event and 'args' in event and 'frame' in event['args'] and event['args']['frame'] not in main_frames:
+                            if 'data' in event['args'] and \
+                                    'isLoadingMainFrame' in event['args']['data'] and event['args']['data']['isLoadingMainFrame'] and \
+                                    'documentLoaderURL' in event['args']['data'] and len(event['args']['data']['documentLoaderURL']):
+                                main_frames.append(event['args']['frame'])
+                            elif 'data' in event['args'] and 'isMainFrame' in event['args']['data'] and event['args']['data']['isMainFrame']:
+                                main_frames.append(event['args']['frame'])
+                            elif event['name'] == 'markAsMainFrame':
+                                main_frames.append(event['args']['frame'])
+                    except Exception:
+                        logging.exception('Error looking for main frame')
+
+                # Find the first navigation to determine which is the main frame
+                for event in events:
+                    try:
+                        if 'name' in event and 'ts' in event:
+                            if start_time is None:
+                                start_time = event['ts']
+                            if not main_frames and event['name'] in ['navigationStart', 'unloadEventStart', 'redirectStart', 'domLoading']:
+                                if 'args' in event and 'frame' in event['args']:
+                                    main_frames.append(event['args']['frame'])
+                                    break
+                    except Exception:
+                        logging.exception('Error looking for first navigation')
+
+                if main_frames and start_time is not None:
+                    # Pre-process the "LargestXXX" events, just recording the biggest one
+                    largest = {}
+                    for event in events:
+                        try:
+                            if 'name' in event and 'ts' in event and 'args' in event and 'frame' in event['args'] and \
+                                    event['args']['frame'] in main_frames and \
+                                    (event['ts'] >= start_time or 'value' in event['args']) and \
+                                    event['name'].lower().find('largest') >= 0 and \
+                                    'data' in event['args'] and 'size' in event['args']['data']:
+                                name = event['name']
+                                if name not in largest or event['args']['data']['size'] > largest[name]['args']['data']['size']:
+                                    time = None
+                                    if 'durationInMilliseconds' in event['args']['data']:
+                                        time = event['args']['data']['durationInMilliseconds']
+                                    elif 'value' in event['args']:
+                                        time = event['args']['value']
+                                    else:
+                                        time = round(float(event['ts'] - start_time) / 1000.0)
+                                    if time is not None:
+                                        event['time'] = time
+                                        largest[name] = event
+                                        paint_event = {
+                                            'event': name,
+                                            'time': time,
+                                            'size': event['args']['data']['size']
+                                        }
+                                        if 'DOMNodeId' in event['args']['data']:
+                                            paint_event['DOMNodeId'] = event['args']['data']['DOMNodeId']
+                                        if 'node' in event['args']['data']:
+                                            paint_event['nodeInfo'] = event['args']['data']['node']
+                                        if 'element' in event['args']['data']:
+                                            paint_event['element'] = event['args']['data']['element']
+                                        if 'type' in event['args']['data']:
+                                            paint_event['type'] = event['args']['data']['type']
+                                        if 'imageUrl' in event['args']['data'] and len(event['args']['data']['imageUrl']):
+                                            paint_event['imageUrl'] = event['args']['data']['imageUrl']
+                                        if 'url' in event['args']['data'] and len(event['args']['data']['url']):
+                                            paint_event['url'] = event['args']['data']['url']
+                                        if 'largestPaints' not in page_data:
+                                            page_data['largestPaints'] = []
+                                        page_data['largestPaints'].append(paint_event)
+
+                            # grab the element timing stuff while we're here to avoid a separate loop
+                            if 'name' in event and 'ts' in event and 'args' in event and 'frame' in event['args'] and \
+                                    event['args']['frame'] in main_frames and event['name'] == 'PerformanceElementTiming':
                                 try:
-                                    if 'name' in event and 'ts' in event and 'args' in event and 'frame' in event['args'] and \
-                                            event['args']['frame'] in main_frames and \
-                                            (event['ts'] >= start_time or 'value' in event['args']) and \
-                                            event['name'].lower().find('largest') >= 0 and \
-                                            'data' in event['args'] and 'size' in event['args']['data']:
-                                        name = event['name']
-                                        if name not in largest or event['args']['data']['size'] > largest[name]['args']['data']['size']:
-                                            time = None
-                                            if 'durationInMilliseconds' in event['args']['data']:
-                                                time = event['args']['data']['durationInMilliseconds']
-                                            elif 'value' in event['args']:
-                                                time = event['args']['value']
-                                            else:
-                                                time = round(float(event['ts'] - start_time) / 1000.0)
-                                            if time is not None:
-                                                event['time'] = time
-                                                largest[name] = event
-                                                paint_event = {
-                                                    'event': name,
-                                                    'time': time,
-                                                    'size': event['args']['data']['size']
-                                                }
-                                                if 'DOMNodeId' in event['args']['data']:
-                                                    paint_event['DOMNodeId'] = event['args']['data']['DOMNodeId']
-                                                if 'node' in event['args']['data']:
-                                                    paint_event['nodeInfo'] = event['args']['data']['node']
-                                                if 'element' in event['args']['data']:
-                                                    paint_event['element'] = event['args']['data']['element']
-                                                if 'type' in event['args']['data']:
-                                                    paint_event['type'] = event['args']['data']['type']
-                                                if 'imageUrl' in event['args']['data'] and len(event['args']['data']['imageUrl']):
-                                                    paint_event['imageUrl'] = event['args']['data']['imageUrl']
-                                                if 'url' in event['args']['data'] and len(event['args']['data']['url']):
-                                                    paint_event['url'] = event['args']['data']['url']
-                                                if 'largestPaints' not in page_data:
-                                                    page_data['largestPaints'] = []
-                                                page_data['largestPaints'].append(paint_event)
-
-                                    # grab the element timing stuff while we're here to avoid a separate loop
-                                    if 'name' in event and 'ts' in event and 'args' in event and 'frame' in event['args'] and \
-                                            event['args']['frame'] in main_frames and event['name'] == 'PerformanceElementTiming':
-                                        try:
-                                            if 'elementTiming' not in page_data:
-                                                page_data['elementTiming'] = []
-                                            page_data['elementTiming'].append({
-                                                'identifier': event['args']['data']['identifier'],
-                                                'time': event['args']['data']['renderTime'],
-                                                'elementType': event['args']['data']['elementType'],
-                                                'url': event['args']['data']['url']
-                                            })
-                                            page_data['elementTiming.{}'.format(event['args']['data']['identifier'])] = event['args']['data']['renderTime']
-                                        except Exception:
-                                            logging.exception('Error processing element timing entry')
+                                    if 'elementTiming' not in page_data:
+                                        page_data['elementTiming'] = []
+                                    page_data['elementTiming'].append({
+                                        'identifier': event['args']['data']['identifier'],
+                                        'time': event['args']['data']['renderTime'],
+                                        'elementType': event['args']['data']['elementType'],
+                                        'url': event['args']['data']['url']
+                                    })
+                                    page_data['elementTiming.{}'.format(event['args']['data']['identifier'])] = event['args']['data']['renderTime']
                                 except Exception:
-                                    logging.exception('Error processing "largest" event')
-
-                            # Calculate CLS
-                            total_layout_shift = 0.0
-                            max_layout_window = 0
-                            first_shift = 0
-                            prev_shift = 0
-                            curr = 0
-                            shift_window_count = 0
-                            for event in events:
-                                try:
-                                    if 'name' in event and 'ts' in event and 'args' in event and 'frame' in event['args'] and \
-                                            event['args']['frame'] in main_frames and \
-                                            (event['ts'] >= start_time or 'value' in event['args']):
-                                        if user_timing is None:
-                                            user_timing = []
-                                        name = event['name']
-                                        time = None
-                                        if 'data' in event['args'] and 'durationInMilliseconds' in event['args']['data']:
-                                            time = event['args']['data']['durationInMilliseconds']
-                                        elif 'value' in event['args']:
-                                            time = event['args']['value']
-                                        else:
-                                            time = round(float(event['ts'] - start_time) / 1000.0)
-                                        if name == 'LayoutShift' and 'data' in event['args'] and \
-                                                'is_main_frame' in event['args']['data'] and event['args']['data']['is_main_frame'] and \
-                                                'score' in event['args']['data']:
-                                            if time is not None:
-                                                if total_layout_shift is None:
-                                                    total_layout_shift = 0
-                                                total_layout_shift += event['args']['data']['score']
-
-                                                if time - first_shift > 5000 or time - prev_shift > 1000:
-                                                    # New shift window
-                                                    first_shift = time
-                                                    curr = 0
-                                                    shift_window_count += 1
+                                    logging.exception('Error processing element timing entry')
+                        except Exception:
+                            logging.exception('Error processing "largest" event')
+
+                    # Calculate CLS
+                    total_layout_shift = 0.0
+                    max_layout_window = 0
+                    first_shift = 0
+                    prev_shift = 0
+                    curr = 0
+                    shift_window_count = 0
+                    for event in events:
+                        try:
+                            if 'name' in event and 'ts' in event and 'args' in event and 'frame' in event['args'] and \
+                                    event['args']['frame'] in main_frames and \
+                                    (event['ts'] >= start_time or 'value' in event['args']):
+                                if user_timing is None:
+                                    user_timing = []
+                                name = event['name']
+                                time = None
+                                if 'data' in event['args'] and 'durationInMilliseconds' in event['args']['data']:
+                                    time = event['args']['data']['durationInMilliseconds']
+                                elif 'value' in event['args']:
+                                    time = event['args']['value']
+                                else:
+                                    time = round(float(event['ts'] - start_time) / 1000.0)
+                                if name == 'LayoutShift' and 'data' in event['args'] and \
+                                        'is_main_frame' in event['args']['data'] and event['args']['data']['is_main_frame'] and \
+                                        'score' in event['args']['data']:
+                                    if time is not None:
+                                        if total_layout_shift is None:
+                                            total_layout_shift = 0
+                                        total_layout_shift += event['args']['data']['score']
+
+                                        if time - first_shift > 5000 or time - prev_shift > 1000:
+                                            # New shift window
+                                            first_shift = time
+                                            curr = 0
+                                            shift_window_count += 1
                                                 
-                                                prev_shift = time
-                                                curr += event['args']['data']['score']
-                                                max_layout_window = max(curr, max_layout_window)
-
-                                                shift = {
-                                                    'time': time,
-                                                    'score': event['args']['data']['score'],
-                                                    'cumulative_score': total_layout_shift,
-                                                    'window_score': curr,
-                                                    'shift_window_num': shift_window_count
-                                                }
-
-                                                if 'region_rects' in event['args']['data']:
-                                                    shift['rects'] = event['args']['data']['region_rects']
-                                                if 'sources' in event['args']['data']:
-                                                    sources_str = json.dumps(event['args']['data']['sources'])
-                                                    if len(sources_str) < 1000000:
-                                                        shift['sources'] = event['args']['data']['sources']
-                                                layout_shifts.append(shift)
-
-                                        if name is not None and time is not None and name not in largest:
-                                            user_timing.append({'name': name, 'time': time})
-                                except Exception:
-                                    logging.exception('Error calculating CLS')
+                                        prev_shift = time
+                                        curr += event['args']['data']['score']
+                                        max_layout_window = max(curr, max_layout_window)
+
+                                        shift = {
+                                            'time': time,
+                                            'score': event['args']['data']['score'],
+                                            'cumulative_score': total_layout_shift,
+                                            'window_score': curr,
+                                            'shift_window_num': shift_window_count
+                                        }
+
+                                        if 'region_rects' in event['args']['data']:
+                                            shift['rects'] = event['args']['data']['region_rects']
+                                        if 'sources' in event['args']['data']:
+                                            sources_str = json.dumps(event['args']['data']['sources'])
+                                            if len(sources_str) < 1000000:
+                                                shift['sources'] = event['args']['data']['sources']
+                                        layout_shifts.append(shift)
+
+                                if name is not None and time is not None and name not in largest:
+                                    user_timing.append({'name': name, 'time': time})
+                        except Exception:
+                            logging.exception('Error calculating CLS')
 
-                            for name in largest:
-                                try:
-                                    event = largest[name]
-                                    if user_timing is None:
-                                        user_timing = []
-                                    user_timing.append({'name': event['name'], 'time': event['time']})
-                                except Exception:
-                                    logging.exception('Error processing largest events')
+                    for name in largest:
+                        try:
+                            event = largest[name]
+                            if user_timing is None:
+                                user_timing = []
+                            user_timing.append({'name': event['name'], 'time': event['time']})
+                        except Exception:
+                            logging.exception('Error processing largest events')
                             
-                            try:
-                                if 'LargestContentfulPaint' in largest:
-                                    event = largest['LargestContentfulPaint']
-                                    if 'args' in event and 'data' in event['args'] and 'type' in event['args']['data']:
-                                        page_data['LargestContentfulPaintType'] = event['args']['data']['type']
-                                        # For images, extract the URL if there is one
-                                        if event['args']['data']['type'] == 'image' and 'largestPaints' in page_data:
-                                            for paint_event in page_data['largestPaints']:
-                                                if paint_event['event'] == 'LargestImagePaint' and paint_event['time'] == event['time']:
-                                                    if 'nodeInfo' in paint_event and 'nodeType' in paint_event['nodeInfo']:
-                                                        page_data['LargestContentfulPaintNodeType'] = paint_event['nodeInfo']['nodeType']
-                                                    if 'nodeInfo' in paint_event and 'sourceURL' in paint_event['nodeInfo']:
-                                                        page_data['LargestContentfulPaintImageURL'] = paint_event['nodeInfo']['sourceURL']
-                                                    elif 'nodeInfo' in paint_event and 'styles' in paint_event['nodeInfo'] and 'background-image' in paint_event['nodeInfo']['styles']:
-                                                        matches = re.match(r'url\("?\'?([^"\'\)]+)', paint_event['nodeInfo']['styles']['background-image'])
-                                                        if matches:
-                                                            page_data['LargestContentfulPaintType'] = 'background-image'
-                                                            page_data['LargestContentfulPaintImageURL'] = matches.group(1)
-                                                    if 'imageUrl' in paint_event:
-                                                        page_data['LargestContentfulPaintImageURL'] = paint_event['imageUrl']
-                                        elif 'largestPaints' in page_data:
-                                            for paint_event in page_data['largestPaints']:
-                                                if paint_event['event'] == 'LargestTextPaint' and paint_event['time'] == event['time']:
-                                                    if 'nodeInfo' in paint_event  and 'nodeType' in paint_event['nodeInfo']:
-                                                        page_data['LargestContentfulPaintNodeType'] = paint_event['nodeInfo']['nodeType']
-                            except Exception:
-                                logging.exception('Error processing LCP event')
-
-                            try:
-                                if user_timing is None:
-                                    user_timing = []
-                                user_timing.append({'name': 'TotalLayoutShift', 'value': total_layout_shift})
-                                user_timing.append({'name': 'CumulativeLayoutShift', 'value': max_layout_window})
-                            except Exception:
-                                logging.exception('Error appending CLS')
-
-                        # process the user_timing data
-                        if user_timing is not None:
-                            page_data['chromeUserTiming'] = user_timing
-                            try:
-                                for value in user_timing:
-                                    key = 'chromeUserTiming.{}'.format(value['name'])
-                                    if 'time' in value:
-                                        # Prefer the earliest for "first" events and the latest for others
-                                        if 'first' in value['name'].lower():
-                                            if key not in page_data or value['time'] < page_data[key]:
-                                                page_data[key] = value['time']
-                                        elif key not in page_data or value['time'] > page_data[key]:
-                                            page_data[key] = value['time']
-                                    elif 'value' in value:
-                                        page_data[key] = value['value']
-                            except Exception:
-                                logging.exception('Error flattening chromeUserTiming')
-
-                        if layout_shifts:
-                            try:
-                                page_data['LayoutShifts'] = layout_shifts
-
-                                # Count the number of LayoutShifts before first paint
-                                if 'chromeUserTiming.TotalLayoutShift' in page_data and 'chromeUserTiming.firstPaint' in page_data:
-                                    count = 0
-                                    cls = 0
-                                    fraction = 0
-                                    for shift in page_data['LayoutShifts']:
-                                        if 'time' in shift and shift['time'] <= page_data['chromeUserTiming.firstPaint']:
-                                            count += 1
-                                            cls = shift['cumulative_score']
-                                    if page_data['chromeUserTiming.TotalLayoutShift'] > 0:
-                                        fraction = float(cls) / float(page_data['chromeUserTiming.TotalLayoutShift'])
-
-                                    page_data['LayoutShiftsBeforePaint'] = {
-                                        'count': count,
-                                        'cumulative_score': cls,
-                                        'fraction_of_total': fraction
-                                    }
-                            except Exception:
-                                logging.exception('Error appending layout shifts')
+                    try:
+                        if 'LargestContentfulPaint' in largest:
+                            event = largest['LargestContentfulPaint']
+                            if 'args' in event and 'data' in event['args'] and 'type' in event['args']['data']:
+                                page_data['LargestContentfulPaintType'] = event['args']['data']['type']
+                                # For images, extract the URL if there is one
+                                if event['args']['data']['type'] == 'image' and 'largestPaints' in page_data:
+                                    for paint_event in page_data['largestPaints']:
+                                        if paint_event['event'] == 'LargestImagePaint' and paint_event['time'] == event['time']:
+                                            if 'nodeInfo' in paint_event and 'nodeType' in paint_event['nodeInfo']:
+                                                page_data['LargestContentfulPaintNodeType'] = paint_event['nodeInfo']['nodeType']
+                                            if 'nodeInfo' in paint_event and 'sourceURL' in paint_event['nodeInfo']:
+                                                page_data['LargestContentfulPaintImageURL'] = paint_event['nodeInfo']['sourceURL']
+                                            elif 'nodeInfo' in paint_event and 'styles' in paint_event['nodeInfo'] and 'background-image' in paint_event['nodeInfo']['styles']:
+                                                matches = re.match(r'url\("?\'?([^"\'\)]+)', paint_event['nodeInfo']['styles']['background-image'])
+                                                if matches:
+                                                    page_data['LargestContentfulPaintType'] = 'background-image'
+                                                    page_data['LargestContentfulPaintImageURL'] = matches.group(1)
+                                            if 'imageUrl' in paint_event:
+                                                page_data['LargestContentfulPaintImageURL'] = paint_event['imageUrl']
+                                elif 'largestPaints' in page_data:
+                                    for paint_event in page_data['largestPaints']:
+                                        if paint_event['event'] == 'LargestTextPaint' and paint_event['time'] == event['time']:
+                                            if 'nodeInfo' in paint_event  and 'nodeType' in paint_event['nodeInfo']:
+                                                page_data['LargestContentfulPaintNodeType'] = paint_event['nodeInfo']['nodeType']
+                    except Exception:
+                        logging.exception('Error processing LCP event')
+
+                    try:
+                        if user_timing is None:
+                            user_timing = []
+                        user_timing.append({'name': 'TotalLayoutShift', 'value': total_layout_shift})
+                        user_timing.append({'name': 'CumulativeLayoutShift', 'value': max_layout_window})
+                    except Exception:
+                        logging.exception('Error appending CLS')
+
+                # process the user_timing data
+                if user_timing is not None:
+                    page_data['chromeUserTiming'] = user_timing
+                    try:
+                        for value in user_timing:
+                            key = 'chromeUserTiming.{}'.format(value['name'])
+                            if 'time' in value:
+                                # Prefer the earliest for "first" events and the latest for others
+                                if 'first' in value['name'].lower():
+                                    if key not in page_data or value['time'] < page_data[key]:
+                                        page_data[key] = value['time']
+                                elif key not in page_data or value['time'] > page_data[key]:
+                                    page_data[key] = value['time']
+                            elif 'value' in value:
+                                page_data[key] = value['value']
+                    except Exception:
+                        logging.exception('Error flattening chromeUserTiming')
+
+                if layout_shifts:
+                    try:
+                        page_data['LayoutShifts'] = layout_shifts
+
+                        # Count the number of LayoutShifts before first paint
+                        if 'chromeUserTiming.TotalLayoutShift' in page_data and 'chromeUserTiming.firstPaint' in page_data:
+                            count = 0
+                            cls = 0
+                            fraction = 0
+                            for shift in page_data['LayoutShifts']:
+                                if 'time' in shift and shift['time'] <= page_data['chromeUserTiming.firstPaint']:
+                                    count += 1
+                                    cls = shift['cumulative_score']
+                            if page_data['chromeUserTiming.TotalLayoutShift'] > 0:
+                                fraction = float(cls) / float(page_data['chromeUserTiming.TotalLayoutShift'])
+
+                            page_data['LayoutShiftsBeforePaint'] = {
+                                'count': count,
+                                'cumulative_score': cls,
+                                'fraction_of_total': fraction
+                            }
+                    except Exception:
+                        logging.exception('Error appending layout shifts')
         except Exception:
             logging.exception('Error processing Chrome timings')
 
@@ -560,30 +562,24 @@ class ProcessTest(object):
         try:
             page_data = self.data['pageData']
             metrics_file = os.path.join(self.task['dir'], self.prefix + '_feature_usage.json.gz')
-            if os.path.isfile(metrics_file):
-                with gzip.open(metrics_file, GZIP_READ_TEXT) as f:
-                    metrics = json.load(f)
-                    if metrics:
-                        page_data['blinkFeatureFirstUsed'] = metrics
-                        self.delete.append(metrics_file)
+            metrics = self.load_json(metrics_file)
+            if metrics:
+                page_data['blinkFeatureFirstUsed'] = metrics
+                self.delete.append(metrics_file)
         except Exception:
             logging.exception('Error merging blink features')
 
     def merge_trace_page_data(self):
         """Merge any page data that was extracted from the trace events"""
+        from .artifact_store import ARTIFACTS
         try:
             page_data = self.data['pageData']
             metrics_file = os.path.join(self.task['dir'], self.prefix + '_trace_page_data.json.gz')
-            if os.path.isfile(metrics_file):
-                with gzip.open(metrics_file, GZIP_READ_TEXT) as f:
-                    metrics = json.load(f)
-                    if metrics:
-                        for key in metrics:
-                            page_data[key] = metrics[key]
-                try:
-                    os.unlink(metrics_file)
-                except Exception:
-                    pass
+            metrics = self.load_json(metrics_file)
+            if metrics:
+                for key in metrics:
+                    page_data[key] = metrics[key]
+            ARTIFACTS.discard(metrics_file)
         except Exception:
             logging.exception('Error merging trace page data')
 
@@ -592,12 +588,10 @@ class ProcessTest(object):
         try:
             page_data = self.data['pageData']
             metrics_file = os.path.join(self.task['dir'], self.prefix + '_priority_streams.json.gz')
-            if os.path.isfile(metrics_file):
-                with gzip.open(metrics_file, GZIP_READ_TEXT) as f:
-                    metrics = json.load(f)
-                    if metrics:
-                        page_data['priorityStreams'] = metrics
-                        self.delete.append(metrics_file)
+            metrics = self.load_json(metrics_file)
+            if metrics:
+                page_data['priorityStreams'] = metrics
+                self.delete.append(metrics_file)
         except Exception:
             logging.exception('Error merging priority streams')
 
@@ -629,88 +623,15 @@ class ProcessTest(object):
 
                 # Run the actual TTI calculation
                 if start_time > 0:
-                    # See when the absolute last interaction measurement was
-                    for window in interactive_periods:
-                        if window[1] > measurement_end:
-                            measurement_end = max(window[1], start_time)
-                            last_interactive = max(window[0], start_time)
-
-                    # Start by filtering the interactive windows to only include 5 second windows that don't
-                    # end before the start time.                
-                    end = 0
-                    iw = []
-                    for window in interactive_periods:
-                        end = window[1]
-                        duration = window[1] - window[0]
-                        if end > start_time and duration >= 5000:
-                            iw.append(window)
-                            if first_interactive is None or window[0] < first_interactive:
-                                first_interactive = max(window[0], start_time)
-                    
-                    # Find all of the request windows with 5 seconds of no more than 2 concurrent document requests
-                    rw = []
-                    requests = self.data['requests']
-                    if iw and requests:
-                        # Build a list of start/end events for document requests
-                        req = []
-                        for request in requests:
-                            if 'contentType' in request and \
-                                    'load_start' in request and request['load_start'] >= 0 and \
-                                    'load_end' in request and request['load_end'] > start_time:
-                                if 'method' not in request or request['method'] == 'GET':
-                                    req.append({'type': 'start', 'time': request['load_start']})
-                                    req.append({'type': 'end', 'time': request['load_end']})
-                    
-                        # walk the list of events tracking the number of in-flight requests and log any windows > 5 seconds
-                        if req:
-                            req.sort(key=lambda x: x['time'])
-                            window_start = 0
-                            in_flight = 0
-                            for e in req:
-                                if e['type'] == 'start':
-                                    in_flight += 1
-                                    if window_start is not None and in_flight > 2:
-                                        window_end = e['time']
-                                        if window_end - window_start >= 5000:
-                                            rw.append([window_start, window_end])
-                                        window_start = None
-                                else:
-                                    in_flight -= 1
-                                    if window_start is not None and in_flight <= 2:
-                                        window_start = e['time']
-                            if window_start is not None and end - window_start >= 5000:
-                                rw.append([window_start, end])
-                    
-                    # Find the first interactive window that also has at least a 5 second intersection with one of the request windows
-                    if rw:
-                        window = None
-                        for i in iw:
-                            if window is None:
-                                for r in rw:
-                                    if window is None:
-                                        intersect = [max(i[0], r[0]), min(i[1], r[1])]
-                                        if intersect[1] - intersect[0] >= 5000:
-                                            window = i
-                                            break
-                        if window is not None:
-                            tti = max(start_time, window[0])
-                    
-                    # Calculate the total blocking time - https://web.dev/tbt/
-                    # and the max possible FID (longest task)
-                    end_time = tti if tti is not None else last_interactive
-                    if long_tasks:
-                        total_blocking_time = 0
-                        max_fid = 0
-                        if end_time > start_time:
-                            for task in long_tasks:
-                                start = max(task[0], start_time) + 50 # "blocking" time excludes the first 50ms
-                                end = min(task[1], end_time)
-                                busy_time = end - start
-                                if busy_time > 0:
-                                    total_blocking_time += busy_time
-                                    if busy_time > max_fid:
-                                        max_fid = busy_time
-                    
+                    from .interval_analytics import interactive_metrics
+                    metrics = interactive_metrics(interactive_periods, self.data['requests'], long_tasks, start_time)
+                    tti = metrics['tti']
+                    first_interactive = metrics['first_interactive']
+                    last_interactive = metrics['last_interactive']
+                    measurement_end = metrics['measurement_end']
+                    max_fid = metrics['max_fid']
+                    total_blocking_time = metrics['total_blocking_time']
+
                     # DOM Content loaded is the floor for any possible TTI times
                     if dcl is not None:
                         if tti is not None and tti > 0 and dcl > tti:
@@ -820,14 +741,12 @@ class ProcessTest(object):
             metrics_file = os.path.join(self.job['test_shared_dir'], file_name)
             if os.path.isfile(local_file) and not os.path.isfile(metrics_file):
                 shutil.copyfile(local_file, metrics_file)
-            if os.path.isfile(metrics_file):
-                with gzip.open(metrics_file, GZIP_READ_TEXT) as f:
-                    metrics = json.load(f)
-                    if metrics:
-                        if 'record' in metrics:
-                            page_data['CrUX'] = metrics['record']
-                        else:
-                            page_data['CrUX'] = metrics
+            metrics = self.load_json(metrics_file)
+            if metrics:
+                if 'record' in metrics:
+                    page_data['CrUX'] = metrics['record']
+                else:
+                    page_data['CrUX'] = metrics
         except Exception:
             logging.exception('Error merging CrUX data')
 
@@ -841,13 +760,11 @@ class ProcessTest(object):
             metrics_file = os.path.join(self.job['test_shared_dir'], file_name)
             if os.path.isfile(local_file) and not os.path.isfile(metrics_file):
                 shutil.copyfile(local_file, metrics_file)
-            if os.path.isfile(metrics_file):
-                with gzip.open(metrics_file, GZIP_READ_TEXT) as f:
-                    audits = json.load(f)
-                    if audits:
-                        logging.debug(audits)
-                        for name in audits:
-                            page_data['lighthouse.{}'.format(name)] = audits[name]
+            audits = self.load_json(metrics_file)
+            if audits:
+                logging.debug(audits)
+                for name in audits:
+                    page_data['lighthouse.{}'.format(name)] = audits[name]
         except Exception:
             logging.exception('Error merging lighthouse data')
 
@@ -937,74 +854,81 @@ class ProcessTest(object):
         requests = self.data['requests']
         try:
             script_timings_file = os.path.join(self.task['dir'], self.prefix + '_script_timing.json.gz')
-            if os.path.isfile(script_timings_file):
-                with gzip.open(script_timings_file, GZIP_READ_TEXT) as f:
-                    timings = json.load(f)
-                    if timings and 'main_thread' in timings and timings['main_thread'] in timings:
-                        js_timing = timings[timings['main_thread']]
-                        used = {}
-                        for request in requests:
-                            if 'full_url' in request and request['full_url'] in js_timing and request['full_url'] not in used:
-                                used[request['full_url']] = True
-                                all_total = 0.0
-                                for cpu_event in js_timing[request['full_url']]:
-                                    times = js_timing[request['full_url']][cpu_event]
-                                    total = 0.0
-                                    for pair in times:
-                                        elapsed = pair[1] - pair[0]
-                                        if elapsed > 0:
-                                            total += elapsed
-                                    if total > 0:
-                                        all_total += total
-                                        total = int(round(total))
-                                        if 'cpuTimes' not in request:
-                                            request['cpuTimes'] = {}
-                                        request['cpuTimes'][cpu_event] = total
-                                        request['cpu.{}'.format(cpu_event)] = total
-                                all_total = int(round(all_total))
-                                request['cpuTime'] = all_total
+            timings = self.load_json(script_timings_file)
+            if timings and 'main_thread' in timings and timings['main_thread'] in timings:
+                js_timing = timings[timings['main_thread']]
+                used = {}
+                for request in requests:
+                    if 'full_url' in request and request['full_url'] in js_timing and request['full_url'] not in used:
+                        used[request['full_url']] = True
+                        all_total = 0.0
+                        for cpu_event in js_timing[request['full_url']]:
+                            times = js_timing[request['full_url']][cpu_event]
+                            total = 0.0
+                            for pair in times:
+                                elapsed = pair[1] - pair[0]
+                                if elapsed > 0:
+                                    total += elapsed
+                            if total > 0:
+                                all_total += total
+                                total = int(round(total))
+                                if 'cpuTimes' not in request:
+                                    request['cpuTimes'] = {}
+                                request['cpuTimes'][cpu_event] = total
+                                request['cpu.{}'.format(cpu_event)] = total
+                        all_total = int(round(all_total))
+                        request['cpuTime'] = all_total
         except Exception:
             logging.exception('Error processing script timings')
 
     def generate_har(self):
-        """Generate a HAR file for the current step"""
+        """Generate a HAR file for the current step, streaming it out a page/entry at a time"""
         try:
+            from .har_writer import HarWriter
             page_data = self.data['pageData']
-            har = {'log': {
-                    'version': '1.1',
-                    'creator': {
-                        'name': 'WebPageTest',
-                        'version': self.job['agent_version'] if 'agent_version' in self.job else ''},
-                    'browser': {
-                        'name': self.job['browser'] if 'browser' in self.job else '',
-                        'version': self.task['page_data']['browser_version'] if 'browser_version' in page_data else ''},
-                    'pages':[],
-                    'entries':[]
-                    }}
-
-            # Add the lighthouse data
-            try:
-                lighthouse_file = os.path.join(self.task['dir'], 'lighthouse.json.gz')
-                if os.path.isfile(lighthouse_file):
-                    with gzip.open(lighthouse_file, GZIP_READ_TEXT) as f:
-                        har['_lighthouse'] = json.load(f)
-            except Exception:
-                logging.exception('Error adding lighthouse data to HAR')
-
-            # Add the page data
-            pd = self.get_har_page_data()
-            har['log']['pages'].append(pd)
-
-            # Add each request
-            if 'requests' in self.data:
-                for request in self.data['requests']:
-                    har['log']['entries'].append(self.process_har_request(pd, request))
+            requests = self.data['requests'] if 'requests' in self.data else []
+            har_file = os.path.join(self.task['dir'], self.prefix + '_har.json')
+            with HarWriter(har_file, self.options.harcompressor, self.options.harlevel) as har:
+                har_file = har.path
+                har.begin_object()
+                har.begin_object('log')
+                har.add('1.1', 'version')
+                har.add({'name': 'WebPageTest',
+                         'version': self.job['agent_version'] if 'agent_version' in self.job else ''}, 'creator')
+                har.add({'name': self.job['browser'] if 'browser' in self.job else '',
+                         'version': self.task['page_data']['browser_version'] if 'browser_version' in page_data else ''},
+                        'browser')
+
+                # Add the page data
+                pd = self.get_har_page_data()
+                har.begin_array('pages')
+                har.add(pd)
+                har.end_array()
+
+                # Add each request (serialized as it is generated)
+                bodies = None
+                bodies_zip = os.path.join(self.task['dir'], self.prefix + '_bodies.zip')
+                if os.path.isfile(bodies_zip):
+                    bodies = zipfile.ZipFile(bodies_zip, 'r')
+                try:
+                    har.begin_array('entries')
+                    har.add_items(self.process_har_request(pd, request, bodies) for request in requests)
+                    har.end_array()
+                finally:
+                    if bodies is not None:
+                        bodies.close()
+                har.end_object()
+
+                # Add the lighthouse data
+                try:
+                    lighthouse_file = os.path.join(self.task['dir'], 'lighthouse.json.gz')
+                    if os.path.isfile(lighthouse_file):
+                        with gzip.open(lighthouse_file, GZIP_READ_TEXT) as f:
+                            har.add(json.load(f), '_lighthouse')
+                except Exception:
+                    logging.exception('Error adding lighthouse data to HAR')
+                har.end_object()
 
-            # Write out the HAR file
-            har_file = os.path.join(self.task['dir'], self.prefix + '_har.json.gz')
-            with gzip.open(har_file, GZIP_TEXT, 7) as f:
-                json.dump(har, f)
-            
             # Upload the HAR to GCS for "successful" tests
             if 'gcs_har_upload' in self.job and \
                     'bucket' in self.job['gcs_har_upload'] and \
@@ -1016,7 +940,8 @@ class ProcessTest(object):
                     client = storage.Client()
                     bucket = client.get_bucket(self.job['gcs_har_upload']['bucket'])
                     prefix = '' if self.prefix == '1' else '_' + self.prefix
-                    gcs_path = os.path.join(self.job['gcs_har_upload']['path'], self.task['id'] + prefix + '.har.gz')
+                    extension = har_file[har_file.rfind('.json') + 5:]
+                    gcs_path = os.path.join(self.job['gcs_har_upload']['path'], self.task['id'] + prefix + '.har' + extension)
                     blob = bucket.blob(gcs_path)
                     if not blob.exists():
                         blob.upload_from_filename(filename=har_file)
@@ -1056,17 +981,16 @@ class ProcessTest(object):
                 pd['_' + key] = page_data[key]
 
             # Add the console log
-            console_log_file = os.path.join(self.task['dir'], self.prefix + '_console_log.json.gz')
-            if os.path.isfile(console_log_file):
-                with gzip.open(console_log_file, GZIP_READ_TEXT) as f:
-                    pd['_consoleLog'] = json.load(f)
+            console_log = self.load_json(os.path.join(self.task['dir'], self.prefix + '_console_log.json.gz'))
+            if console_log is not None:
+                pd['_consoleLog'] = console_log
         except Exception:
             logging.exception('Error generating HAR page data')
 
         return pd
 
-    def process_har_request(self, pd, request):
-        """Process an individual request for the HAR"""
+    def process_har_request(self, pd, request, bodies=None):
+        """Process an individual request for the HAR (bodies is the open bodies zip, if any)"""
         entry = {}
         try:
             from datetime import datetime
@@ -1180,7 +1104,10 @@ class ProcessTest(object):
 
             # Add the response body
             try:
-                if 'body_file' in request:
+                if 'body_file' in request and bodies is not None:
+                    with bodies.open(request['body_file']) as body_file:
+                        response['content']['text'] = body_file.read().decode('utf-8')
+                elif 'body_file' in request:
                     bodies_zip = os.path.join(self.task['dir'], self.prefix + '_bodies.zip')
                     if os.path.isfile(bodies_zip):
                         with zipfile.ZipFile(bodies_zip, 'r') as zip_file:
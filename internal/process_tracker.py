@@ -0,0 +1,159 @@
+# Copyright 2020 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Track the processes launched by the agent so they can be waited on and killed
+without sweeping the whole process table"""
+import logging
+import os
+import platform
+import select
+import signal
+import sys
+import threading
+if (sys.version_info >= (3, 0)):
+    from time import monotonic
+else:
+    from monotonic import monotonic
+
+
+class TrackedProcess(object):
+    """A process launched by the agent"""
+    def __init__(self, proc, name):
+        self.proc = proc
+        self.name = name
+        self.pid = proc.pid
+        self.pgid = None
+        if platform.system() != 'Windows':
+            try:
+                pgid = os.getpgid(proc.pid)
+                # Only signal the process group if it isn't the agent's own
+                if pgid != os.getpgid(0):
+                    self.pgid = pgid
+            except Exception:
+                pass
+
+    def is_running(self):
+        """See if the process is still running (reaps it if it exited)"""
+        try:
+            return self.proc.poll() is None
+        except Exception:
+            return False
+
+    def descendants(self):
+        """All of the processes under this one"""
+        children = []
+        try:
+            import psutil
+            children = psutil.Process(self.pid).children(recursive=True)
+        except Exception:
+            pass
+        return children
+
+    def signal_tree(self, force):
+        """Signal the process, its process group and anything it launched"""
+        children = self.descendants()
+        sig = signal.SIGKILL if force else signal.SIGTERM
+        if self.pgid is not None:
+            try:
+                os.killpg(self.pgid, sig)
+            except Exception:
+                pass
+        for child in children:
+            try:
+                child.send_signal(sig)
+            except Exception:
+                pass
+        try:
+            self.proc.send_signal(sig)
+        except Exception:
+            pass
+
+
+class ProcessTracker(object):
+    """Registry of the processes launched by the agent, grouped by executable name"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processes = []
+
+    def track(self, proc, name):
+        """Start tracking a process (a subprocess.Popen) under the given executable name"""
+        if proc is not None:
+            with self.lock:
+                self.prune()
+                self.processes.append(TrackedProcess(proc, name))
+        return proc
+
+    def prune(self):
+        """Drop the processes that have exited (must hold the lock)"""
+        self.processes = [tracked for tracked in self.processes if tracked.is_running()]
+
+    def get(self, name):
+        """The tracked processes for the given executable name that are still running"""
+        with self.lock:
+            self.prune()
+            return [tracked for tracked in self.processes if tracked.name == name]
+
+    def is_tracked(self, name):
+        """See if there are running processes launched by the agent for the executable"""
+        return len(self.get(name)) > 0
+
+    def wait(self, name, timeout=30):
+        """Wait for the tracked processes to exit. Returns True if they all exited."""
+        return self.wait_for(self.get(name), timeout)
+
+    def kill(self, name, force, timeout=30):
+        """Terminate the process trees for the executable and wait for them to exit.
+        Not used on Windows where taskkill handles graceful shutdown of the process trees."""
+        processes = [] if platform.system() == 'Windows' else self.get(name)
+        if processes:
+            logging.debug("Terminating %d tracked instances of %s", len(processes), name)
+            for tracked in processes:
+                tracked.signal_tree(force)
+            if not self.wait_for(processes, timeout) and not force:
+                logging.debug("Killing the remaining instances of %s", name)
+                for tracked in processes:
+                    if tracked.is_running():
+                        tracked.signal_tree(True)
+                self.wait_for(processes, 5)
+        return processes
+
+    def wait_for(self, processes, timeout):
+        """Wait for the given processes to exit (using pidfd notifications where available)"""
+        end_time = monotonic() + timeout
+        pending = [tracked for tracked in processes if tracked.is_running()]
+        if pending and hasattr(os, 'pidfd_open'):
+            poll = select.poll()
+            pidfds = {}
+            try:
+                for tracked in pending:
+                    try:
+                        pidfd = os.pidfd_open(tracked.pid)
+                        pidfds[pidfd] = tracked
+                        poll.register(pidfd, select.POLLIN)
+                    except Exception:
+                        pass
+                while pidfds:
+                    remaining = end_time - monotonic()
+                    if remaining <= 0:
+                        break
+                    for pidfd, _ in poll.poll(remaining * 1000):
+                        poll.unregister(pidfd)
+                        os.close(pidfd)
+                        pidfds[pidfd].is_running()
+                        del pidfds[pidfd]
+            finally:
+                for pidfd in pidfds:
+                    os.close(pidfd)
+        # Fall back to waiting on the process handles directly
+        for tracked in pending:
+            remaining = end_time - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                tracked.proc.wait(remaining)
+            except Exception:
+                pass
+        return not any(tracked.is_running() for tracked in pending)
+
+
+TRACKER = ProcessTracker()
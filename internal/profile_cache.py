@@ -0,0 +1,267 @@
+# Copyright 2020 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Pre-built browser profile templates that are cloned for each run and a background
+reaper for deleting the profiles once the run is done"""
+import glob
+import hashlib
+import logging
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+if (sys.version_info >= (3, 0)):
+    from time import monotonic
+else:
+    from monotonic import monotonic
+
+# Bump to invalidate the existing templates when the way they are built changes
+TEMPLATE_VERSION = 1
+TEMPLATE_MARKER = '.wpt-template'
+WARM_TIMEOUT = 30
+REAP_ATTEMPTS = 10
+# Linux ioctl for a copy-on-write clone of a file (btrfs, xfs, bcachefs...)
+FICLONE = 0x40049409
+
+
+def clone_file(src, dst, reflink):
+    """Copy a single file, sharing the data with a copy-on-write clone if reflink is set.
+    Returns False if the clone wasn't supported (and a regular copy was made)."""
+    if reflink:
+        try:
+            import fcntl
+            with open(src, 'rb') as f_in:
+                with open(dst, 'wb') as f_out:
+                    fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+            shutil.copystat(src, dst)
+            return True
+        except Exception:
+            pass
+    shutil.copy2(src, dst)
+    return False
+
+
+def clone_tree(src, dst):
+    """Copy the directory tree using the fastest mechanism available (copy-on-write clones
+    where the filesystem supports them, a regular copy otherwise)"""
+    if not os.path.isdir(dst):
+        os.makedirs(dst)
+    if platform.system() == 'Darwin':
+        # APFS clonefile
+        if subprocess.call(['cp', '-c', '-R', '-p', src + '/.', dst]) == 0:
+            marker = os.path.join(dst, TEMPLATE_MARKER)
+            if os.path.isfile(marker):
+                os.remove(marker)
+            return
+    reflink = platform.system() == 'Linux'
+    pending = [(src, dst)]
+    while pending:
+        src_dir, dst_dir = pending.pop()
+        for name in os.listdir(src_dir):
+            if name == TEMPLATE_MARKER:
+                continue
+            src_path = os.path.join(src_dir, name)
+            dst_path = os.path.join(dst_dir, name)
+            if os.path.islink(src_path):
+                os.symlink(os.readlink(src_path), dst_path)
+            elif os.path.isdir(src_path):
+                os.mkdir(dst_path)
+                pending.append((src_path, dst_path))
+            else:
+                # Stop trying to clone as soon as the filesystem says it isn't supported
+                reflink = clone_file(src_path, dst_path, reflink)
+
+
+def template_key(paths):
+    """Hash identifying the browser build and the files the template is built from"""
+    md5 = hashlib.md5()
+    md5.update('{0:d}'.format(TEMPLATE_VERSION).encode('utf-8'))
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = []
+            for root, _, names in os.walk(path):
+                files.extend([os.path.join(root, name) for name in names])
+        for file_path in sorted(files):
+            try:
+                stat = os.stat(file_path)
+                md5.update('{0}:{1:d}:{2:d}'.format(os.path.realpath(file_path), stat.st_size,
+                                                    int(stat.st_mtime)).encode('utf-8'))
+            except Exception:
+                pass
+    return md5.hexdigest()[:16]
+
+
+def warm_profile(args, expected, lock_files, timeout=WARM_TIMEOUT):
+    """Run the browser against the profile until it has written the expected files, then
+    shut it down gracefully and remove its lock files. Returns True if the files were written."""
+    done = False
+    proc = None
+    try:
+        logging.debug(' '.join(args))
+        if platform.system() == 'Windows':
+            proc = subprocess.Popen(args)
+        else:
+            proc = subprocess.Popen(args, preexec_fn=os.setsid)
+        end_time = monotonic() + timeout
+        while not done and monotonic() < end_time and proc.poll() is None:
+            time.sleep(0.5)
+            done = all(os.path.exists(path) for path in expected)
+        if done:
+            # Give the browser a moment to finish initializing the profile
+            time.sleep(2)
+    except Exception:
+        logging.exception('Error warming the browser profile')
+    if proc is not None and proc.poll() is None:
+        try:
+            if platform.system() == 'Windows':
+                proc.terminate()
+            else:
+                os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(10)
+        except Exception:
+            try:
+                if platform.system() != 'Windows':
+                    os.killpg(proc.pid, signal.SIGKILL)
+                proc.kill()
+                proc.wait(10)
+            except Exception:
+                pass
+    for path in lock_files:
+        try:
+            if os.path.islink(path) or os.path.isfile(path):
+                os.remove(path)
+        except Exception:
+            pass
+    return done
+
+
+class ProfileTemplates(object):
+    """Warmed profile templates, built once for each browser build"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Templates that failed to warm up aren't retried until the browser build changes
+        self.failed = set()
+
+    def get_template(self, root, name, sources, build):
+        """Path to the template profile for the browser, building it if needed.
+        sources are the browser executable and the files the template is built from
+        (any change to them triggers a rebuild) and build(path) populates a new template,
+        returning False if it failed. Returns None if there is no template available
+        (including when building it already failed for this build of the browser)."""
+        template = None
+        key = template_key(sources)
+        templates_dir = os.path.join(root, 'profiles')
+        path = os.path.join(templates_dir, '{0}-{1}'.format(name, key))
+        with self.lock:
+            if os.path.isfile(os.path.join(path, TEMPLATE_MARKER)):
+                return path
+            if path in self.failed:
+                return None
+            # Build into a temporary directory so a partial template is never used
+            tmp_path = '{0}.{1:d}.tmp'.format(path, os.getpid())
+            try:
+                if os.path.isdir(tmp_path):
+                    shutil.rmtree(tmp_path)
+                os.makedirs(tmp_path)
+                start = monotonic()
+                logging.debug('Building the %s profile template', name)
+                if build(tmp_path):
+                    with open(os.path.join(tmp_path, TEMPLATE_MARKER), 'wt') as f_out:
+                        f_out.write(key)
+                    logging.debug('Built the %s profile template in %0.3f seconds', name, monotonic() - start)
+                    if os.path.isdir(path) and not os.path.isfile(os.path.join(path, TEMPLATE_MARKER)):
+                        REAPER.remove(path)
+                    if not os.path.isdir(path):
+                        try:
+                            os.rename(tmp_path, path)
+                        except Exception:
+                            # Lost the race with another agent on the same machine
+                            pass
+                    if os.path.isfile(os.path.join(path, TEMPLATE_MARKER)):
+                        template = path
+                else:
+                    logging.warning('Warming the %s profile template failed, not using a template', name)
+            except Exception:
+                logging.exception('Error building the %s profile template', name)
+            if template is None:
+                self.failed.add(path)
+            if os.path.isdir(tmp_path):
+                REAPER.remove(tmp_path)
+            # Templates for previous builds of the browser are no longer needed
+            if template is not None:
+                for old in glob.glob(os.path.join(templates_dir, '{0}-*'.format(name))):
+                    if old != template and not old.endswith('.tmp') and \
+                            os.path.isfile(os.path.join(old, TEMPLATE_MARKER)):
+                        REAPER.remove(old)
+        return template
+
+
+class ProfileReaper(object):
+    """Deletes the directories it is handed in a background thread"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.swept = set()
+        self.count = 0
+        self.event = threading.Event()
+        self.thread = None
+
+    def remove(self, path):
+        """Move the directory out of the way and queue it for deletion.
+        Returns False if it couldn't be moved (and the caller has to delete it)."""
+        if not os.path.isdir(path):
+            return True
+        parent = os.path.dirname(os.path.abspath(path))
+        with self.lock:
+            self.count += 1
+            reap_path = '{0}.{1:d}.{2:d}.reap'.format(path, os.getpid(), self.count)
+            try:
+                os.rename(path, reap_path)
+            except Exception:
+                logging.debug('Error moving %s for deletion', path)
+                return False
+            if parent not in self.swept:
+                # Pick up anything that was left behind by a previous instance of the agent
+                self.swept.add(parent)
+                for leftover in glob.glob(os.path.join(parent, '*.reap')):
+                    if leftover != reap_path:
+                        self.pending.append([leftover, 0])
+            self.pending.append([reap_path, 0])
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.reap)
+                self.thread.daemon = True
+                self.thread.start()
+        self.event.set()
+        return True
+
+    def reap(self):
+        """Background thread for deleting the queued directories"""
+        while True:
+            self.event.wait(10)
+            self.event.clear()
+            with self.lock:
+                pending = self.pending
+                self.pending = []
+            retry = []
+            for entry in pending:
+                shutil.rmtree(entry[0], ignore_errors=True)
+                if os.path.isdir(entry[0]):
+                    entry[1] += 1
+                    if entry[1] < REAP_ATTEMPTS:
+                        retry.append(entry)
+                    else:
+                        logging.warning('Unable to delete %s', entry[0])
+            if retry:
+                time.sleep(1)
+                with self.lock:
+                    self.pending.extend(retry)
+                self.event.set()
+
+
+TEMPLATES = ProfileTemplates()
+REAPER = ProfileReaper()
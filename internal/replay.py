@@ -0,0 +1,556 @@
+# Copyright 2021 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Deterministic offline replay of the post-processing for archived runs.
+
+An archived run (written by the agent with --archiveruns) has:
+- replay.json: the job and task as they were when the post-processing started
+- input/: the run directory at that point, including the raw inputs (trace, devtools log,
+  pcap and video frames) that are normally deleted after they have been parsed
+- expected/: the json results the agent produced for the run
+
+The replay re-runs the trace, pcap, video and devtools parsing for every step from the raw
+inputs that are available and then the test post-processing (ProcessTest) in a scratch
+directory, timing each stage, and compares the outputs with the archived ones."""
+import glob
+import gzip
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+if (sys.version_info >= (3, 0)):
+    from time import monotonic
+    GZIP_TEXT = 'wt'
+    GZIP_READ_TEXT = 'rt'
+else:
+    from monotonic import monotonic
+    GZIP_TEXT = 'w'
+    GZIP_READ_TEXT = 'r'
+try:
+    import ujson as json
+except BaseException:
+    import json
+
+ARCHIVE_VERSION = 1
+MANIFEST = 'replay.json'
+MAX_DIFFS = 20
+RESULT_FILES = ['*.json', '*.json.gz', '*.json.br']
+# Raw inputs that are replayed instead of being compared
+RAW_INPUTS = ['_devtools.json.gz', '_trace.json.gz']
+
+
+def json_safe(data):
+    """Copy of the data with anything that can't be serialized to json dropped"""
+    if isinstance(data, dict):
+        safe = {}
+        for key in data:
+            value = json_safe(data[key])
+            if value is not None or data[key] is None:
+                safe[str(key)] = value
+        return safe
+    if isinstance(data, (list, tuple)):
+        return [json_safe(value) for value in data]
+    if data is None or isinstance(data, (bool, int, float, str)):
+        return data
+    if sys.version_info < (3, 0) and isinstance(data, (long, unicode)): # pylint: disable=undefined-variable
+        return data
+    return None
+
+
+def archive_path(root, task):
+    """Directory that the run is archived to"""
+    name = '{0}.{1:d}.{2:d}'.format(task['id'], task['run'], 1 if task['cached'] else 0)
+    return os.path.join(root, re.sub(r'[^\w\-\.]', '_', name))
+
+
+def copy_tree(src, dest):
+    """Copy the contents of a directory, replacing any existing files"""
+    for root, _, files in os.walk(src):
+        target = os.path.join(dest, os.path.relpath(root, src))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for name in files:
+            shutil.copyfile(os.path.join(root, name), os.path.join(target, name))
+
+
+def list_results(directory):
+    """The json result files at the top level of a run directory"""
+    files = []
+    for pattern in RESULT_FILES:
+        files.extend(glob.glob(os.path.join(directory, pattern)))
+    return sorted([os.path.basename(path) for path in files
+                   if not any(path.endswith(suffix) for suffix in RAW_INPUTS)])
+
+
+def archive_files(root, task, paths):
+    """Keep a copy of raw inputs that are deleted once they have been parsed"""
+    try:
+        directory = os.path.join(archive_path(root, task), 'input')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for path in paths:
+            if os.path.isfile(path):
+                shutil.copyfile(path, os.path.join(directory, os.path.basename(path)))
+    except Exception:
+        logging.exception('Error archiving the raw inputs')
+
+
+def archive_run(root, options, job, task, stage):
+    """Archive the run for replaying. The 'input' stage is archived before the
+    post-processing and the 'expected' stage once the results are written."""
+    try:
+        directory = archive_path(root, task)
+        if stage == 'input':
+            copy_tree(task['dir'], os.path.join(directory, 'input'))
+            offset = time.altzone if time.daylight and time.localtime().tm_isdst > 0 else time.timezone
+            manifest = {'version': ARCHIVE_VERSION,
+                        'job': json_safe(job),
+                        'task': json_safe(task),
+                        'har': bool(options.har),
+                        'harcompressor': options.harcompressor,
+                        'harlevel': options.harlevel,
+                        'utc_offset': -offset}
+            with open(os.path.join(directory, MANIFEST), 'wt') as f_out:
+                json.dump(manifest, f_out)
+        elif stage == 'expected':
+            expected = os.path.join(directory, 'expected')
+            if os.path.isdir(expected):
+                shutil.rmtree(expected)
+            os.makedirs(expected)
+            for name in list_results(task['dir']):
+                shutil.copyfile(os.path.join(task['dir'], name), os.path.join(expected, name))
+        logging.debug('Archived the %s for replay in %s', stage, directory)
+    except Exception:
+        logging.exception('Error archiving the run for replay')
+
+
+def load_file(path):
+    """Load a json result file (gzip, brotli or plain)"""
+    if path.endswith('.gz'):
+        with gzip.open(path, GZIP_READ_TEXT) as f_in:
+            return json.load(f_in)
+    if path.endswith('.br'):
+        import brotli
+        with open(path, 'rb') as f_in:
+            return json.loads(brotli.decompress(f_in.read()).decode('utf-8'))
+    with open(path, 'rt') as f_in:
+        return json.load(f_in)
+
+
+def compare_json(expected, actual, path, diffs):
+    """Append the differences (json path and both values) to diffs, up to MAX_DIFFS"""
+    if len(diffs) >= MAX_DIFFS:
+        return
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(set(expected) | set(actual)):
+            child = '{0}.{1}'.format(path, key)
+            if key not in actual:
+                diffs.append((child, expected[key], '<missing>'))
+            elif key not in expected:
+                diffs.append((child, '<missing>', actual[key]))
+            else:
+                compare_json(expected[key], actual[key], child, diffs)
+            if len(diffs) >= MAX_DIFFS:
+                return
+    elif isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            diffs.append((path + '.length', len(expected), len(actual)))
+        for index in range(min(len(expected), len(actual))):
+            compare_json(expected[index], actual[index], '{0}[{1:d}]'.format(path, index), diffs)
+            if len(diffs) >= MAX_DIFFS:
+                return
+    elif isinstance(expected, bool) != isinstance(actual, bool) or expected != actual:
+        diffs.append((path, expected, actual))
+
+
+def compare_files(expected_file, actual_file, label):
+    """Differences between two json files as a list of {file, path, expected, actual}"""
+    if not os.path.isfile(actual_file):
+        return [{'file': label, 'path': '', 'expected': '<file>', 'actual': '<missing>'}]
+    diffs = []
+    try:
+        compare_json(load_file(expected_file), load_file(actual_file), '', diffs)
+    except Exception as err:
+        diffs.append(('', '<json>', 'Error loading: {0}'.format(err)))
+    return [{'file': label, 'path': diff[0] or '.', 'expected': diff[1], 'actual': diff[2]}
+            for diff in diffs]
+
+
+class ErrorCounter(logging.Handler):
+    """Collects the errors logged while replaying (the processing logs and swallows them)"""
+    def __init__(self):
+        logging.Handler.__init__(self, logging.ERROR)
+        self.errors = []
+
+    def emit(self, record):
+        try:
+            self.errors.append(record.getMessage())
+        except Exception:
+            pass
+
+
+class Replay(object):
+    """Replays the post-processing of a single archived run"""
+    def __init__(self, archive):
+        self.archive = archive
+        self.input_dir = os.path.join(archive, 'input')
+        self.expected_dir = os.path.join(archive, 'expected')
+        with open(os.path.join(archive, MANIFEST), 'rt') as f_in:
+            self.manifest = json.load(f_in)
+        self.support_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'support')
+        self.tracemalloc = None
+        self.child_peak = 0
+        self.timings = []
+        self.memory = {}
+        self.outputs = []
+        self.mode = None
+        self.diffs = []
+        self.job = None
+        self.task = None
+
+    def prepare(self, scratch):
+        """Copy the inputs to the scratch directory and set up the job and task to process them"""
+        directory = os.path.join(scratch, os.path.basename(os.path.normpath(self.archive)))
+        copy_tree(self.input_dir, directory)
+        shared = os.path.join(scratch, 'shared')
+        os.makedirs(shared)
+        self.job = json.loads(json.dumps(self.manifest['job']))
+        self.task = json.loads(json.dumps(self.manifest['task']))
+        self.job['test_shared_dir'] = shared
+        # Nothing leaves the machine
+        self.job.pop('gcs_har_upload', None)
+        self.task['dir'] = directory
+        self.timings = []
+        self.memory = {}
+        self.outputs = []
+        self.diffs = []
+
+    def run(self, scratch, trace_memory=False, mode=None):
+        """Replay the run in the scratch directory. Returns the stage timings (and peak memory)
+        and, depending on the mode, compares the outputs with the archived ones ('compare')
+        or replaces the archived ones with them ('update')."""
+        from .spans import SPANS
+        self.prepare(scratch)
+        self.mode = mode
+        self.tracemalloc = None
+        if trace_memory:
+            try:
+                import tracemalloc
+                self.tracemalloc = tracemalloc
+            except ImportError:
+                logging.warning('tracemalloc is not available, skipping the memory measurements')
+        errors = ErrorCounter()
+        logging.getLogger().addHandler(errors)
+        timezone = self.set_timezone()
+        try:
+            for step in self.task.get('steps', []):
+                path_base = os.path.join(self.task['dir'], step['prefix'])
+                self.run_stage('trace', self.process_trace, path_base)
+                self.run_stage('pcap', self.process_pcap, path_base)
+                self.run_stage('video', self.process_video, step, path_base)
+                self.run_stage('devtools', self.process_devtools, path_base)
+            SPANS.begin_job('replay')
+            self.run_stage('process', self.process_test)
+            if self.mode == 'compare':
+                self.compare_results()
+            elif self.mode == 'update':
+                self.update_results()
+        finally:
+            self.restore_timezone(timezone)
+            logging.getLogger().removeHandler(errors)
+            if self.tracemalloc is not None and self.tracemalloc.is_tracing():
+                self.tracemalloc.stop()
+        # The breakdown of the post-processing from the spans it records
+        breakdown = {}
+        for event in SPANS.get_trace()['traceEvents']:
+            if event['ph'] == 'X' and event['name'].startswith('process.'):
+                breakdown[event['name']] = breakdown.get(event['name'], 0) + event['dur'] / 1000000.0
+        return {'stages': self.timings, 'process': breakdown, 'memory': self.memory,
+                'errors': errors.errors, 'diffs': self.diffs}
+
+    def run_stage(self, name, function, *args):
+        """Run one stage, adding up the time (and peak memory) across the steps"""
+        if self.tracemalloc is not None:
+            # Restarting clears the traces so the peak is just for this stage
+            if self.tracemalloc.is_tracing():
+                self.tracemalloc.stop()
+            self.tracemalloc.start()
+        self.child_peak = 0
+        start = monotonic()
+        ran = function(*args)
+        elapsed = monotonic() - start
+        if ran is False:
+            return
+        for index, timing in enumerate(self.timings):
+            if timing[0] == name:
+                self.timings[index] = (name, timing[1] + elapsed)
+                break
+        else:
+            self.timings.append((name, elapsed))
+        if self.tracemalloc is not None:
+            peak = max(self.tracemalloc.get_traced_memory()[1], self.child_peak)
+            self.tracemalloc.stop()
+            self.memory[name] = max(self.memory.get(name, 0), peak)
+        # Check the intermediate files now, the post-processing rewrites some of them
+        for stage, path in self.outputs:
+            archived = os.path.join(self.input_dir, os.path.basename(path))
+            if self.mode == 'compare' and os.path.isfile(archived) and os.path.isfile(path):
+                self.diffs.extend(compare_files(archived, path, '{0}:{1}'.format(stage, os.path.basename(path))))
+            elif self.mode == 'update' and os.path.isfile(path):
+                shutil.copyfile(path, archived)
+        self.outputs = []
+
+    def add_output(self, stage, path):
+        """Remove a stage's output before it is regenerated so it can be checked afterwards"""
+        if os.path.isfile(path):
+            os.unlink(path)
+        self.outputs.append((stage, path))
+
+    def process_trace(self, path_base):
+        """Parse the trace, the same outputs as devtools.stop_processing_trace"""
+        trace_file = path_base + '_trace.json.gz'
+        if not os.path.isfile(trace_file):
+            return False
+        from .support.trace_parser import Trace
+        outputs = [('_user_timing.json.gz', 'WriteUserTiming')]
+        if self.job.get('timeline'):
+            outputs.extend([('_timeline_cpu.json.gz', 'WriteCPUSlices'),
+                            ('_script_timing.json.gz', 'WriteScriptTimings'),
+                            ('_interactive.json.gz', 'WriteInteractive'),
+                            ('_long_tasks.json.gz', 'WriteLongTasks'),
+                            ('_timeline_requests.json.gz', 'WriteTimelineRequests')])
+        outputs.extend([('_feature_usage.json.gz', 'WriteFeatureUsage'),
+                        ('_trace_page_data.json.gz', 'WritePageData')])
+        if not self.job.get('streaming_netlog'):
+            outputs.append(('_netlog_requests.json.gz', 'WriteNetlog'))
+        outputs.append(('_v8stats.json.gz', 'WriteV8Stats'))
+        for suffix, _ in outputs:
+            self.add_output('trace', path_base + suffix)
+        trace = Trace()
+        trace.Process(trace_file)
+        for suffix, method in outputs:
+            getattr(trace, method)(path_base + suffix)
+        return True
+
+    def process_pcap(self, path_base):
+        """Parse the packet capture into the bandwidth slices, the same as desktop_browser.process_pcap"""
+        pcap_file = path_base + '.cap.gz'
+        if not os.path.isfile(pcap_file):
+            return False
+        from .support.pcap_parser import Pcap
+        slices_file = path_base + '_pcap_slices.json.gz'
+        self.add_output('pcap', slices_file)
+        pcap = Pcap()
+        pcap.Process(pcap_file)
+        pcap.SaveDetails(slices_file)
+        page_data = self.task.setdefault('page_data', {})
+        for key, name in [('in', 'pcapBytesIn'), ('out', 'pcapBytesOut'), ('in_dup', 'pcapBytesInDup')]:
+            if key in pcap.bytes:
+                page_data[name] = pcap.bytes[key]
+        return True
+
+    def process_video(self, step, path_base):
+        """Calculate the histograms and visual progress from the extracted video frames
+        (the frames are already de-duplicated and resized so this is the visualmetrics pass
+        that video_processing runs on them)"""
+        video_dir = os.path.join(self.task['dir'], step['video_subdirectory'])
+        if not glob.glob(os.path.join(video_dir, 'ms_*')):
+            return False
+        if step['num'] == 1:
+            filename = '{0:d}.{1:d}.histograms.json.gz'.format(self.task['run'], self.task['cached'])
+        else:
+            filename = '{0:d}.{1:d}.{2:d}.histograms.json.gz'.format(self.task['run'], self.task['cached'],
+                                                                     step['num'])
+        histograms = os.path.join(self.task['dir'], filename)
+        progress_file = path_base + '_visual_progress.json.gz'
+        self.add_output('video', histograms)
+        self.add_output('video', progress_file)
+        args = [sys.executable, os.path.join(self.support_path, 'visualmetrics.py'), '-d', video_dir,
+                '--histogram', histograms, '--progress', progress_file]
+        if self.job.get('fullSizeVideo'):
+            args.append('--full')
+        if 'thumbsize' in self.job:
+            try:
+                thumbsize = int(self.job['thumbsize'])
+                if thumbsize > 0 and thumbsize <= 2000:
+                    args.extend(['--thumbsize', str(thumbsize)])
+            except Exception:
+                pass
+        self.run_command(args)
+        return True
+
+    def run_command(self, args):
+        """Run a support script, sampling its memory use if memory is being measured"""
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen(args, stdout=devnull)
+            if self.tracemalloc is None:
+                proc.wait()
+                return
+            import psutil
+            try:
+                process = psutil.Process(proc.pid)
+                while proc.poll() is None:
+                    self.child_peak = max(self.child_peak, process.memory_info().rss)
+                    time.sleep(0.01)
+            except Exception:
+                pass
+            proc.wait()
+
+    def process_devtools(self, path_base):
+        """Parse the devtools log into the requests, the same inputs as
+        devtools_browser.process_devtools_requests"""
+        devtools_file = path_base + '_devtools.json.gz'
+        if not os.path.isfile(devtools_file):
+            return False
+        from .support.devtools_parser import DevToolsParser
+        out_file = path_base + '_devtools_requests.json.gz'
+        self.add_output('devtools', out_file)
+        options = {'devtools': devtools_file, 'cached': self.task['cached'], 'out': out_file}
+        for key, suffix in [('netlog', '_netlog_requests.json.gz'),
+                            ('requests', '_timeline_requests.json.gz'),
+                            ('optimization', '_optimization.json.gz'),
+                            ('user', '_user_timing.json.gz'),
+                            ('coverage', '_coverage.json.gz'),
+                            ('cpu', '_timeline_cpu.json.gz'),
+                            ('v8stats', '_v8stats.json.gz')]:
+            options[key] = path_base + suffix if os.path.isfile(path_base + suffix) else None
+        options['noheaders'] = bool(self.job.get('noheaders'))
+        parser = DevToolsParser(options)
+        if 'metadata' in self.job:
+            parser.metadata = self.job['metadata']
+        parser.process()
+        return True
+
+    def process_test(self):
+        """The test post-processing"""
+        import argparse
+        from .process_test import ProcessTest
+        options = argparse.Namespace(har=self.manifest.get('har', False),
+                                     harcompressor=self.manifest.get('harcompressor', 'gzip'),
+                                     harlevel=self.manifest.get('harlevel', 7))
+        ProcessTest(options, self.job, self.task)
+        return True
+
+    def set_timezone(self):
+        """Use the agent's UTC offset so the local times in the HAR match"""
+        offset = self.manifest.get('utc_offset')
+        if offset is None or not hasattr(time, 'tzset'):
+            return False
+        previous = os.environ.get('TZ')
+        sign = '-' if offset >= 0 else '+'
+        offset = abs(offset)
+        os.environ['TZ'] = 'WPT{0}{1:02d}:{2:02d}'.format(sign, offset // 3600, (offset % 3600) // 60)
+        time.tzset()
+        return previous
+
+    def restore_timezone(self, previous):
+        """Put the timezone back after replaying"""
+        if previous is False:
+            return
+        if previous is None:
+            os.environ.pop('TZ', None)
+        else:
+            os.environ['TZ'] = previous
+        time.tzset()
+
+    def compare_results(self):
+        """Compare the results with the expected ones"""
+        diffs = self.diffs
+        if os.path.isdir(self.expected_dir):
+            expected = list_results(self.expected_dir)
+            for name in expected:
+                diffs.extend(compare_files(os.path.join(self.expected_dir, name),
+                                           os.path.join(self.task['dir'], name), name))
+            # Results that weren't there before (and weren't inputs)
+            for name in list_results(self.task['dir']):
+                if name not in expected and not os.path.isfile(os.path.join(self.input_dir, name)):
+                    diffs.append({'file': name, 'path': '', 'expected': '<missing>', 'actual': '<file>'})
+        else:
+            diffs.append({'file': 'expected', 'path': '', 'expected': '<directory>', 'actual': '<missing>'})
+
+    def update_results(self):
+        """Replace the expected results with the replayed ones"""
+        if os.path.isdir(self.expected_dir):
+            shutil.rmtree(self.expected_dir)
+        os.makedirs(self.expected_dir)
+        for name in list_results(self.task['dir']):
+            shutil.copyfile(os.path.join(self.task['dir'], name), os.path.join(self.expected_dir, name))
+
+
+def replay_archive(archive, repeat=1, memory=True, update=False):
+    """Replay an archived run repeat times (and once more to measure the memory if requested).
+    The outputs of the first run are compared (or used to update the archive)."""
+    replay = Replay(archive)
+    runs = []
+    diffs = []
+    errors = []
+    peak = {}
+    for index in range(repeat + (1 if memory else 0)):
+        scratch = tempfile.mkdtemp(prefix='wpt-replay-')
+        try:
+            measuring = memory and index == repeat
+            mode = None
+            if index == 0:
+                mode = 'update' if update else 'compare'
+            result = replay.run(scratch, trace_memory=measuring, mode=mode)
+            if measuring:
+                peak = result['memory']
+            else:
+                runs.append(result)
+            if index == 0:
+                errors = result['errors']
+                diffs = result['diffs']
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+    # Per-stage min/median across the runs
+    stages = []
+    names = [name for name, _ in runs[0]['stages']] if runs else []
+    names.append('total')
+    names.extend(sorted(set([name for run in runs for name in run['process']])))
+    for name in names:
+        times = []
+        for run in runs:
+            if name == 'total':
+                times.append(sum([elapsed for _, elapsed in run['stages']]))
+            elif name in run['process']:
+                times.append(run['process'][name])
+            else:
+                times.extend([elapsed for stage, elapsed in run['stages'] if stage == name])
+        times.sort()
+        if times:
+            stages.append({'stage': name,
+                           'min': times[0],
+                           'median': times[len(times) // 2],
+                           'peak_memory': peak.get(name)})
+    return {'archive': archive,
+            'runs': len(runs),
+            'steps': len(replay.manifest['task'].get('steps', [])),
+            'stages': stages,
+            'diffs': diffs,
+            'errors': errors}
+
+
+def format_results(result):
+    """Text report for a replayed archive"""
+    lines = ['{0} ({1:d} step(s), {2:d} run(s))'.format(result['archive'], result['steps'], result['runs']),
+             '  {0:<42} {1:>10} {2:>10} {3:>10}'.format('stage', 'min ms', 'median ms', 'peak MB')]
+    for stage in result['stages']:
+        name = stage['stage'] if not stage['stage'].startswith('process.') else '  ' + stage['stage'][8:]
+        peak = '' if stage['peak_memory'] is None else '{0:0.2f}'.format(stage['peak_memory'] / 1048576.0)
+        lines.append('  {0:<42} {1:>10.2f} {2:>10.2f} {3:>10}'.format(name, stage['min'] * 1000.0,
+                                                                       stage['median'] * 1000.0, peak))
+    for error in result['errors']:
+        lines.append('  error: {0}'.format(error))
+    if result['diffs']:
+        lines.append('  {0:d} difference(s):'.format(len(result['diffs'])))
+        for diff in result['diffs']:
+            lines.append('    {0} {1}: expected {2} got {3}'.format(diff['file'], diff['path'],
+                                                                  json.dumps(diff['expected'])[:80],
+                                                                  json.dumps(diff['actual'])[:80]))
+    else:
+        lines.append('  no differences')
+    return '\n'.join(lines)
@@ -21,6 +21,7 @@ try:
 except BaseException:
     import json
 from .desktop_browser import DesktopBrowser
+from .support.request_record import Request, dump
 
 
 class SafariDesktop(DesktopBrowser):
@@ -363,15 +364,13 @@ class SafariDesktop(DesktopBrowser):
                         logging.debug(custom_metrics[name])
                 except Exception:
                     logging.exception('Error collecting custom metrics')
-            path = os.path.join(task['dir'], task['prefix'] + '_metrics.json.gz')
-            with gzip.open(path, 'wt', 7) as outfile:
-                outfile.write(json.dumps(custom_metrics))
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.publish(os.path.join(task['dir'], task['prefix'] + '_metrics.json.gz'), custom_metrics)
         logging.debug("Collecting user timing metrics")
         user_timing = self.run_js_file('user_timing.js')
         if user_timing is not None:
-            path = os.path.join(task['dir'], task['prefix'] + '_timed_events.json.gz')
-            with gzip.open(path, 'wt', 7) as outfile:
-                outfile.write(json.dumps(user_timing))
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.publish(os.path.join(task['dir'], task['prefix'] + '_timed_events.json.gz'), user_timing)
         logging.debug("Collecting page-level metrics")
         page_data = self.run_js_file('page_data.js')
         if page_data is not None:
@@ -444,9 +443,8 @@ class SafariDesktop(DesktopBrowser):
         self.collect_browser_metrics(task)
         # Write out the long tasks
         try:
-            long_tasks_file = os.path.join(task['dir'], task['prefix'] + '_long_tasks.json.gz')
-            with gzip.open(long_tasks_file, 'wt', 7) as f_out:
-                f_out.write(json.dumps(self.long_tasks))
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.publish(os.path.join(task['dir'], task['prefix'] + '_long_tasks.json.gz'), list(self.long_tasks))
         except Exception:
             logging.exception("Error writing the long tasks")
         try:
@@ -457,9 +455,8 @@ class SafariDesktop(DesktopBrowser):
                 last_end = period[1]
             test_end = int((monotonic() - task['run_start_time']) * 1000)
             interactive_periods.append([last_end, test_end])
-            interactive_file = os.path.join(task['dir'], task['prefix'] + '_interactive.json.gz')
-            with gzip.open(interactive_file, 'wt', 7) as f_out:
-                f_out.write(json.dumps(interactive_periods))
+            from .artifact_store import ARTIFACTS
+            ARTIFACTS.publish(os.path.join(task['dir'], task['prefix'] + '_interactive.json.gz'), interactive_periods)
         except Exception:
             logging.exception("Error writing the interactive periods")
         # Close the browser if we are done testing (helps flush logs)
@@ -592,61 +589,61 @@ class SafariDesktop(DesktopBrowser):
             result['pageData']['metadata'] = self.job['metadata']
         devtools_file = os.path.join(task['dir'], task['prefix'] + '_devtools_requests.json.gz')
         with gzip.open(devtools_file, 'wt', 7) as f_out:
-            json.dump(result, f_out)
+            dump(result, f_out)
 
     def get_empty_request(self, request_id, url):
         """Return and empty, initialized request"""
         parts = urlsplit(url)
-        request = {'type': 3,
-                   'id': request_id,
-                   'request_id': request_id,
-                   'ip_addr': '',
-                   'full_url': url,
-                   'is_secure': 1 if parts.scheme == 'https' else 0,
-                   'method': '',
-                   'host': parts.netloc,
-                   'url': parts.path,
-                   'responseCode': -1,
-                   'load_start': -1,
-                   'load_ms': -1,
-                   'ttfb_ms': -1,
-                   'dns_start': -1,
-                   'dns_end': -1,
-                   'dns_ms': -1,
-                   'connect_start': -1,
-                   'connect_end': -1,
-                   'connect_ms': -1,
-                   'ssl_start': -1,
-                   'ssl_end': -1,
-                   'ssl_ms': -1,
-                   'bytesIn': 0,
-                   'bytesOut': 0,
-                   'objectSize': 0,
-                   'initiator': '',
-                   'initiator_line': '',
-                   'initiator_column': '',
-                   'server_rtt': None,
-                   'headers': {'request': [], 'response': []},
-                   'score_cache': -1,
-                   'score_cdn': -1,
-                   'score_gzip': -1,
-                   'score_cookies': -1,
-                   'score_keep-alive': -1,
-                   'score_minify': -1,
-                   'score_combine': -1,
-                   'score_compress': -1,
-                   'score_etags': -1,
-                   'gzip_total': None,
-                   'gzip_save': None,
-                   'minify_total': None,
-                   'minify_save': None,
-                   'image_total': None,
-                   'image_save': None,
-                   'cache_time': None,
-                   'cdn_provider': None,
-                   'server_count': None,
-                   'socket': -1
-                   }
+        request = Request({'type': 3,
+                           'id': request_id,
+                           'request_id': request_id,
+                           'ip_addr': '',
+                           'full_url': url,
+                           'is_secure': 1 if parts.scheme == 'https' else 0,
+                           'method': '',
+                           'host': parts.netloc,
+                           'url': parts.path,
+                           'responseCode': -1,
+                           'load_start': -1,
+                           'load_ms': -1,
+                           'ttfb_ms': -1,
+                           'dns_start': -1,
+                           'dns_end': -1,
+                           'dns_ms': -1,
+                           'connect_start': -1,
+                           'connect_end': -1,
+                           'connect_ms': -1,
+                           'ssl_start': -1,
+                           'ssl_end': -1,
+                           'ssl_ms': -1,
+                           'bytesIn': 0,
+                           'bytesOut': 0,
+                           'objectSize': 0,
+                           'initiator': '',
+                           'initiator_line': '',
+                           'initiator_column': '',
+                           'server_rtt': None,
+                           'headers': {'request': [], 'response': []},
+                           'score_cache': -1,
+                           'score_cdn': -1,
+                           'score_gzip': -1,
+                           'score_cookies': -1,
+                           'score_keep-alive': -1,
+                           'score_minify': -1,
+                           'score_combine': -1,
+                           'score_compress': -1,
+                           'score_etags': -1,
+                           'gzip_total': None,
+                           'gzip_save': None,
+                           'minify_total': None,
+                           'minify_save': None,
+                           'image_total': None,
+                           'image_save': None,
+                           'cache_time': None,
+                           'cdn_provider': None,
+                           'server_count': None,
+                           'socket': -1
+                           })
         if len(parts.query):
             request['url'] += '?' + parts.query
         return request
@@ -412,16 +412,14 @@ class iWptBrowser(BaseBrowser):
                 except Exception:
                     logging.exception('Error collecting custom metric')
             if  self.path_base is not None:
-                path = self.path_base + '_metrics.json.gz'
-                with gzip.open(path, GZIP_TEXT, 7) as outfile:
-                    outfile.write(json.dumps(custom_metrics))
+                from internal.artifact_store import ARTIFACTS
+                ARTIFACTS.publish(self.path_base + '_metrics.json.gz', custom_metrics)
         logging.debug("Collecting user timing metrics")
         user_timing = self.run_js_file('user_timing.js')
         logging.debug(user_timing)
         if user_timing is not None and self.path_base is not None:
-            path = self.path_base + '_timed_events.json.gz'
-            with gzip.open(path, GZIP_TEXT, 7) as outfile:
-                outfile.write(json.dumps(user_timing))
+            from internal.artifact_store import ARTIFACTS
+            ARTIFACTS.publish(self.path_base + '_timed_events.json.gz', user_timing)
         logging.debug("Collecting page-level metrics")
         page_data = self.run_js_file('page_data.js')
         logging.debug(page_data)
@@ -889,8 +887,10 @@ class iWptBrowser(BaseBrowser):
                     self.timeline = gzip.open(timeline_path, GZIP_TEXT, 7)
                     if self.timeline:
                         self.timeline.write('[\n')
+                from internal.artifact_store import ARTIFACTS
                 from internal.support.trace_parser import Trace
                 self.trace_parser = Trace()
+                self.trace_parser.artifacts = ARTIFACTS
                 self.trace_parser.cpu['main_thread'] = '0'
                 self.trace_parser.threads['0'] = {}
             self.ios.show_orange()
@@ -1007,9 +1007,8 @@ class iWptBrowser(BaseBrowser):
                 self.video_processing = subprocess.Popen(args, close_fds=True)
             # Save the console logs
             if self.console_log and self.path_base is not None:
-                log_file = self.path_base + '_console_log.json.gz'
-                with gzip.open(log_file, GZIP_TEXT, 7) as f_out:
-                    json.dump(self.console_log, f_out)
+                from internal.artifact_store import ARTIFACTS
+                ARTIFACTS.publish(self.path_base + '_console_log.json.gz', list(self.console_log))
             # Process the timeline data
             if self.trace_parser is not None and self.path_base is not None:
                 start = monotonic()
@@ -0,0 +1,135 @@
+# Copyright 2020 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Concurrent probing of the work servers with per-server health scores and backoff"""
+import logging
+import random
+import sys
+import threading
+if (sys.version_info >= (3, 0)):
+    from time import monotonic
+else:
+    from monotonic import monotonic
+
+BACKOFF_BASE = 5.0
+BACKOFF_MAX = 600.0
+SCORE_WEIGHT = 0.3
+
+
+class ServerHealth(object):
+    """Rolling health of a single server"""
+    def __init__(self):
+        self.score = 1.0
+        self.latency = None
+        self.failures = 0
+        self.retry_after = None
+
+    def success(self, elapsed):
+        """Record a successful request"""
+        self.score = self.score * (1.0 - SCORE_WEIGHT) + SCORE_WEIGHT
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency = self.latency * (1.0 - SCORE_WEIGHT) + elapsed * SCORE_WEIGHT
+        self.failures = 0
+        self.retry_after = None
+
+    def failure(self, now):
+        """Record a failed request and back off exponentially (with jitter)"""
+        self.score = self.score * (1.0 - SCORE_WEIGHT)
+        self.failures += 1
+        backoff = min(BACKOFF_BASE * 2 ** (self.failures - 1), BACKOFF_MAX)
+        self.retry_after = now + backoff * random.uniform(0.5, 1.0)
+
+    def is_backing_off(self, now):
+        """See if the server should be left alone for now"""
+        return self.retry_after is not None and now < self.retry_after
+
+
+class ServerProber(object):
+    """Tracks the health of the work servers and contacts them concurrently"""
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.Lock()
+        self.health = {}
+
+    def get_health(self, server):
+        """The health record for the server (must hold the lock)"""
+        if server not in self.health:
+            self.health[server] = ServerHealth()
+        return self.health[server]
+
+    def record(self, server, succeeded, elapsed=None):
+        """Record the result of a request to the server"""
+        with self.lock:
+            health = self.get_health(server)
+            if succeeded:
+                health.success(elapsed)
+            else:
+                health.failure(monotonic())
+                logging.debug("Server %s failed %d times in a row, backing off", server, health.failures)
+
+    def is_available(self, server):
+        """See if the server can be contacted (it is not backing off)"""
+        with self.lock:
+            return not self.get_health(server).is_backing_off(monotonic())
+
+    def order_servers(self, servers):
+        """The servers to poll, healthiest first. Servers that are backing off are skipped
+        unless all of them are, in which case the one that has been failing the least is kept.
+        Equally healthy servers are shuffled to spread the load."""
+        servers = list(servers)
+        random.shuffle(servers)
+        now = monotonic()
+        with self.lock:
+            servers.sort(key=lambda server: (self.get_health(server).is_backing_off(now),
+                                             -round(self.get_health(server).score, 1),
+                                             self.get_health(server).failures))
+            available = [server for server in servers if not self.get_health(server).is_backing_off(now)]
+        if not available and servers:
+            available = servers[:1]
+        return available
+
+    def fetch(self, server, url, timeout, proxies=None, session=None):
+        """GET the url from the server, recording the result against the server's health.
+        Request errors are raised to the caller."""
+        if session is None:
+            session = self.session
+        start = monotonic()
+        try:
+            response = session.get(url, timeout=timeout, proxies=proxies)
+        except Exception:
+            self.record(server, False)
+            raise
+        self.record(server, response.status_code < 500, monotonic() - start)
+        return response
+
+    def probe(self, requests, timeout, deadline, proxies=None):
+        """Issue the list of (server, url) requests concurrently, skipping servers that are
+        backing off. Returns the responses in the same order (None for requests that failed,
+        were skipped or didn't complete before the deadline)."""
+        responses = [None] * len(requests)
+        available = [self.is_available(request[0]) for request in requests]
+        threads = []
+        for index, request in enumerate(requests):
+            if available[index]:
+                thread = threading.Thread(target=self.probe_thread,
+                                          args=(request[0], request[1], timeout, proxies, responses, index))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        end_time = monotonic() + deadline
+        for thread in threads:
+            remaining = end_time - monotonic()
+            if remaining <= 0:
+                break
+            thread.join(remaining)
+        return list(responses)
+
+    def probe_thread(self, server, url, timeout, proxies, responses, index):
+        """Background thread for a single probe request"""
+        try:
+            responses[index] = self.fetch(server, url, timeout, proxies)
+        except Exception as err:
+            logging.debug("Error probing %s: %s", server, err)
+
@@ -0,0 +1,142 @@
+# Copyright 2021 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Always-on, low-overhead timing spans for the agent's own work (launch, navigation,
+trace collection, processing, upload...). The spans for each job are written out as a
+Chrome trace-event file that can be loaded into a trace viewer (chrome://tracing, Perfetto)."""
+import glob
+import gzip
+import logging
+import os
+import re
+import sys
+import threading
+if (sys.version_info >= (3, 0)):
+    from time import monotonic
+    GZIP_TEXT = 'wt'
+else:
+    from monotonic import monotonic
+    GZIP_TEXT = 'w'
+try:
+    import ujson as json
+except BaseException:
+    import json
+
+# Limits to keep the always-on recording bounded
+MAX_EVENTS = 100000
+MAX_FILES = 100
+
+
+class Span(object):
+    """Context manager for timing a block of code"""
+    def __init__(self, recorder, name, args):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.recorder.start(self.name, self.args)
+        return self
+
+    def __exit__(self, *args):
+        self.recorder.end(self.name)
+
+
+class SpanRecorder(object):
+    """Records the spans for the current job"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.origin = monotonic()
+        self.job_id = None
+        self.events = []
+        self.open = {}
+        self.threads = {}
+
+    def begin_job(self, job_id):
+        """Start recording the spans for a new job"""
+        with self.lock:
+            self.origin = monotonic()
+            self.job_id = job_id
+            self.events = []
+            self.open = {}
+
+    def start(self, name, args=None):
+        """Start a span (spans are matched up by name on each thread, like the profile_start/end
+        events, and a span started again before it ends is nested inside the outer one)"""
+        now = monotonic()
+        thread = threading.current_thread()
+        with self.lock:
+            self.open.setdefault((thread.ident, name), []).append((now, args))
+            if thread.ident not in self.threads:
+                self.threads[thread.ident] = thread.name
+
+    def end(self, name):
+        """End the most recent span that was started with the same name on this thread.
+        Returns the duration of the span in seconds (None if it wasn't started)."""
+        now = monotonic()
+        tid = threading.current_thread().ident
+        with self.lock:
+            started = self.open.get((tid, name))
+            if not started:
+                return None
+            start = started.pop()
+            if not started:
+                del self.open[(tid, name)]
+            if len(self.events) < MAX_EVENTS:
+                self.events.append((name, start[0], now, tid, start[1]))
+        return now - start[0]
+
+    def span(self, name, args=None):
+        """Time a block of code: with SPANS.span('name'):"""
+        return Span(self, name, args)
+
+    def get_trace(self):
+        """The spans recorded for the current job in the Chrome trace-event format"""
+        with self.lock:
+            events = list(self.events)
+            origin = self.origin
+            job_id = self.job_id
+            threads = dict(self.threads)
+        pid = os.getpid()
+        trace_events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                         'args': {'name': 'wptagent'}}]
+        used = set([event[3] for event in events])
+        for tid in sorted(used):
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                 'args': {'name': threads.get(tid, str(tid))}})
+        for name, start, end, tid, args in sorted(events, key=lambda event: event[1]):
+            # The prefix of the event name (wpt., dt., opt...) is used as the category
+            event = {'name': name,
+                     'cat': name.split('.', 1)[0] if '.' in name else 'agent',
+                     'ph': 'X',
+                     'ts': int(round((start - origin) * 1000000.0)),
+                     'dur': int(round((end - start) * 1000000.0)),
+                     'pid': pid,
+                     'tid': tid}
+            if args:
+                event['args'] = args
+            trace_events.append(event)
+        return {'traceEvents': trace_events,
+                'displayTimeUnit': 'ms',
+                'metadata': {'job': job_id}}
+
+    def write_job(self, directory):
+        """Write the spans for the current job to <directory>/<job id>.trace.json.gz,
+        keeping the most recent MAX_FILES traces. Returns the path of the file."""
+        path = None
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            name = re.sub(r'[^\w\-\.]', '_', self.job_id) if self.job_id else 'agent'
+            path = os.path.join(directory, '{0}.trace.json.gz'.format(name))
+            with gzip.open(path, GZIP_TEXT, 7) as f_out:
+                json.dump(self.get_trace(), f_out)
+            files = sorted(glob.glob(os.path.join(directory, '*.trace.json.gz')), key=os.path.getmtime)
+            for old in files[:-MAX_FILES]:
+                os.remove(old)
+        except Exception:
+            logging.exception('Error writing the agent spans')
+        return path
+
+
+SPANS = SpanRecorder()
@@ -0,0 +1,156 @@
+# Copyright 2021 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Fast agent startup (--faststartup): the results of the expensive startup probes (browser
+discovery, browser and tool versions...) are cached across restarts, keyed on the size and
+modification time of the executables involved, and the modules the agent needs are only
+located at startup (they are imported when a job uses them)."""
+import logging
+import os
+import shutil
+import sys
+import threading
+try:
+    import ujson as json
+except BaseException:
+    import json
+
+CACHE_VERSION = 1
+CACHE_FILE = 'startup_cache.json'
+
+
+def which(executable):
+    """Full path to the executable (as found on the path), None if it isn't available"""
+    if executable is None:
+        return None
+    executable = executable.strip('"')
+    if os.path.isabs(executable):
+        return executable if os.path.isfile(executable) else None
+    if sys.version_info >= (3, 3):
+        return shutil.which(executable)
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, executable)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def signature(paths):
+    """[path, size, mtime] of each of the files (size and mtime are None if it doesn't exist)"""
+    files = []
+    for path in paths:
+        entry = [path, None, None]
+        if path is not None:
+            try:
+                stat = os.stat(path)
+                entry = [path, stat.st_size, stat.st_mtime]
+            except Exception:
+                pass
+        files.append(entry)
+    return files
+
+
+def find_module(module):
+    """See if a module is installed without importing it"""
+    if sys.version_info >= (3, 4):
+        import importlib.util
+        try:
+            return importlib.util.find_spec(module) is not None
+        except Exception:
+            return False
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def installed_version(package):
+    """Installed version of a pip package (from its metadata, without importing it)"""
+    version = None
+    try:
+        from importlib import metadata
+        version = metadata.version(package)
+    except Exception:
+        pass
+    return version
+
+
+class StartupCache(object):
+    """Cached probe results, each one keyed by the signature of the files it depends on.
+    Nothing is cached until a cache file has been loaded."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.path = None
+        self.entries = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path):
+        """Use (and load) the given cache file"""
+        with self.lock:
+            self.path = path
+            self.entries = {}
+            try:
+                if os.path.isfile(path):
+                    with open(path, 'rt') as f_in:
+                        cache = json.load(f_in)
+                    if cache.get('version') == CACHE_VERSION and cache.get('python') == sys.executable:
+                        self.entries = cache['entries']
+            except Exception:
+                logging.exception('Error loading the startup cache')
+
+    def cached(self, key, paths, probe):
+        """The result of the probe, re-used for as long as none of the files change.
+        Exceptions from the probe are passed along (and nothing is cached)."""
+        files = signature(paths)
+        with self.lock:
+            if self.path is not None and key in self.entries and self.entries[key]['files'] == files:
+                self.hits += 1
+                return self.entries[key]['value']
+        value = probe()
+        with self.lock:
+            self.misses += 1
+            if self.path is not None:
+                self.entries[key] = {'files': files, 'value': value}
+                self.dirty = True
+        return value
+
+    def save(self):
+        """Write the cache file if anything changed"""
+        with self.lock:
+            if self.path is None or not self.dirty:
+                return
+            try:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                tmp = '{0}.{1:d}.tmp'.format(self.path, os.getpid())
+                with open(tmp, 'wt') as f_out:
+                    json.dump({'version': CACHE_VERSION, 'python': sys.executable,
+                               'entries': self.entries}, f_out)
+                if sys.version_info >= (3, 3):
+                    os.replace(tmp, self.path)
+                else:
+                    os.rename(tmp, self.path)
+                self.dirty = False
+            except Exception:
+                logging.exception('Error saving the startup cache')
+
+
+def startup_breakdown(trace):
+    """The total startup time (in seconds) and (name, seconds) for each of the startup steps
+    in the agent spans, in the order they ran"""
+    total = 0
+    steps = []
+    for event in trace['traceEvents']:
+        if event.get('ph') == 'X':
+            if event['name'] == 'startup':
+                total = event['dur'] / 1000000.0
+            elif event['name'].startswith('startup.'):
+                steps.append((event['name'][8:], event['dur'] / 1000000.0))
+    return total, steps
+
+
+STARTUP_CACHE = StartupCache()
@@ -0,0 +1,290 @@
+# Copyright 2020 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Supervisor for running multiple isolated agent workers on one machine"""
+import logging
+import multiprocessing
+import os
+import platform
+import signal
+import subprocess
+import sys
+import time
+if (sys.version_info >= (3, 0)):
+    from time import monotonic
+else:
+    from monotonic import monotonic
+
+XVFB_DISPLAY_BASE = 90
+PORT_STRIDE = 2
+CDP_PORT_STRIDE = 500
+ADMISSION_INTERVAL = 30
+ADMISSION_SAMPLES = 3
+ADMISSION_MARGIN = 0.1
+RESTART_DELAY = 10
+# A worker that hasn't touched its alive file for this long is considered hung
+ALIVE_TIMEOUT = 1800
+# Browsers that the browser-based (chrome) traffic-shaper can't throttle
+UNSHAPED_BROWSER_TYPES = ['Firefox', 'Safari', 'WebKitGTK']
+# Options the supervisor sets for each worker (and whether they take a value)
+WORKER_OPTIONS = {'--instances': True, '--pincpus': False, '--minheadroom': True, '--name': True,
+                  '--messageport': True, '--cdpport': True, '--healthcheckport': True,
+                  '--xvfbdisplay': True, '--cpus': True, '--pausefile': True, '--alive': True,
+                  # The system-wide DNS resolver can't be shared between workers
+                  '--dnsresolver': False, '--dnsupstream': True}
+
+
+def worker_argv(argv):
+    """The command-line arguments without the ones the supervisor sets for each worker"""
+    args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+            continue
+        name = arg.split('=', 1)[0]
+        if name in WORKER_OPTIONS:
+            skip = WORKER_OPTIONS[name] and '=' not in arg
+            continue
+        args.append(arg)
+    return args
+
+
+def split_cpus(cpu_count, instances):
+    """Divide the CPUs into a contiguous block for each worker"""
+    cpus = []
+    for index in range(instances):
+        if instances >= cpu_count:
+            cpus.append([index % cpu_count])
+        else:
+            start = int(index * cpu_count / instances)
+            end = int((index + 1) * cpu_count / instances)
+            cpus.append(list(range(start, end)))
+    return cpus
+
+
+def unshaped_browsers(browsers):
+    """The configured browsers that the browser-based traffic-shaper can't throttle"""
+    return sorted([name for name in browsers
+                   if 'type' in browsers[name] and browsers[name]['type'] in UNSHAPED_BROWSER_TYPES])
+
+
+def touch(path):
+    """Create the file or update its modification time"""
+    with open(path, 'a'):
+        os.utime(path, None)
+
+
+class Worker(object):
+    """A single agent process run by the supervisor"""
+    def __init__(self, index, args, pause_file, alive_file):
+        self.index = index
+        self.args = args
+        self.pause_file = pause_file
+        self.alive_file = alive_file
+        self.proc = None
+        self.next_start = 0
+        self.paused = False
+
+    def start(self):
+        """Launch the agent process"""
+        logging.info("Starting agent worker %d", self.index)
+        logging.debug(' '.join(self.args))
+        # A freshly started worker counts as alive until it gets a chance to touch the file itself
+        touch(self.alive_file)
+        self.proc = subprocess.Popen(self.args)
+
+    def is_running(self):
+        """See if the agent process is still running"""
+        return self.proc is not None and self.proc.poll() is None
+
+    def is_alive(self, timeout):
+        """See if the agent touched its watchdog file recently"""
+        try:
+            return time.time() - os.path.getmtime(self.alive_file) < timeout
+        except Exception:
+            return False
+
+    def set_paused(self, paused):
+        """Stop (or resume) the worker picking up new jobs. A running job is allowed to finish."""
+        self.paused = paused
+        try:
+            if paused:
+                touch(self.pause_file)
+            elif os.path.isfile(self.pause_file):
+                os.remove(self.pause_file)
+        except Exception:
+            logging.exception('Error updating the pause file for worker %d', self.index)
+
+    def stop(self):
+        """Ask the agent to exit (it re-queues any job it has)"""
+        if self.is_running():
+            try:
+                self.proc.send_signal(signal.SIGTERM)
+            except Exception:
+                logging.exception('Error stopping worker %d', self.index)
+
+    def wait(self, timeout):
+        """Wait for the agent to exit, killing it if it takes too long"""
+        if self.is_running():
+            try:
+                self.proc.wait(timeout)
+            except Exception:
+                logging.error('Worker %d did not exit, killing it', self.index)
+                self.proc.kill()
+
+
+class Supervisor(object):
+    """Run N agent workers, each with its own display, ports, work directory and (optionally) CPUs.
+    Workers are admitted to take jobs one at a time while a CPU benchmark shows enough headroom.
+    The supervisor owns the watchdog (--alive) file and the exit/shutdown files for all of the workers."""
+    def __init__(self, options, argv, root_path):
+        from internal import os_util
+        self.options = options
+        self.root_path = root_path
+        self.exit_file = os.path.join(root_path, 'exit')
+        self.shutdown_file = os.path.join(root_path, 'shutdown')
+        self.must_exit = False
+        self.needs_shutdown = False
+        self.baseline = None
+        self.samples = []
+        name = options.name if options.name is not None else os_util.pc_name()
+        base_args = [sys.executable, os.path.join(root_path, 'wptagent.py')] + worker_argv(argv)
+        if options.shaper is None:
+            # Host-level shaping can't be shared between workers, throttle in the browser instead
+            logging.info("Using browser-based traffic-shaping for the agent workers")
+            base_args.extend(['--shaper', 'chrome'])
+        use_xvfb = platform.system() == 'Linux' and (options.xvfb or 'DISPLAY' not in os.environ)
+        if use_xvfb and '--xvfb' not in base_args:
+            base_args.append('--xvfb')
+        cpus = split_cpus(multiprocessing.cpu_count(), options.instances) if options.pincpus else None
+        work_dir = os.path.join(root_path, 'work')
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+        self.workers = []
+        for index in range(options.instances):
+            worker_name = '{0}-{1:d}'.format(name, index)
+            pause_file = os.path.join(work_dir, worker_name + '.paused')
+            alive_file = os.path.join(work_dir, worker_name + '.alive')
+            args = list(base_args)
+            args.extend(['--name', worker_name,
+                         '--messageport', str(options.messageport + index * PORT_STRIDE),
+                         '--cdpport', str(options.cdpport + index * CDP_PORT_STRIDE),
+                         '--pausefile', pause_file,
+                         '--alive', alive_file])
+            if options.healthcheckport:
+                args.extend(['--healthcheckport', str(options.healthcheckport + index * PORT_STRIDE)])
+            if use_xvfb:
+                args.extend(['--xvfbdisplay', str(XVFB_DISPLAY_BASE + index)])
+            if cpus is not None:
+                args.extend(['--cpus', ','.join([str(cpu) for cpu in cpus[index]])])
+            self.workers.append(Worker(index, args, pause_file, alive_file))
+
+    def signal_handler(self, signum, frame):
+        """Ctrl+C handler"""
+        logging.info("Exiting...")
+        self.must_exit = True
+
+    def run(self):
+        """Start the workers and supervise them until exit"""
+        signal.signal(signal.SIGTERM, self.signal_handler)
+        signal.signal(signal.SIGINT, self.signal_handler)
+        self.baseline = self.measure_cpu()
+        logging.info("CPU benchmark baseline: %0.3f seconds", self.baseline)
+        # Only the first worker is admitted up front, the rest are admitted as headroom allows
+        for worker in self.workers:
+            worker.set_paused(worker.index > 0)
+            worker.start()
+        next_admission = monotonic() + ADMISSION_INTERVAL
+        while not self.must_exit:
+            time.sleep(1)
+            if self.check_exit_files():
+                break
+            self.alive()
+            now = monotonic()
+            running = False
+            for worker in self.workers:
+                if worker.is_running():
+                    running = True
+                elif not self.options.exit and not self.must_exit:
+                    if not worker.next_start:
+                        logging.warning("Agent worker %d exited, restarting in %d seconds",
+                                        worker.index, RESTART_DELAY)
+                        worker.next_start = now + RESTART_DELAY
+                    elif now >= worker.next_start:
+                        worker.next_start = 0
+                        worker.start()
+                        running = True
+            # With --exit the workers exit on their own schedule and the supervisor follows them
+            if not running and self.options.exit:
+                break
+            if now >= next_admission and not self.must_exit:
+                self.admit()
+                next_admission = monotonic() + ADMISSION_INTERVAL
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.wait(300)
+            worker.set_paused(False)
+        if self.needs_shutdown and platform.system() == "Linux":
+            subprocess.call(['sudo', 'poweroff'])
+
+    def check_exit_files(self):
+        """Handle the exit and shutdown files on behalf of all of the workers (they don't look for them)"""
+        for path in [self.exit_file, self.shutdown_file]:
+            if os.path.isfile(path):
+                logging.info("Found %s, stopping the agent workers", path)
+                try:
+                    os.remove(path)
+                except Exception:
+                    pass
+                self.must_exit = True
+                self.needs_shutdown = path == self.shutdown_file
+                return True
+        return False
+
+    def alive(self):
+        """Touch the watchdog file as long as every worker is still touching its own"""
+        if self.options.alive:
+            hung = [worker.index for worker in self.workers if not worker.is_alive(ALIVE_TIMEOUT)]
+            if hung:
+                logging.debug("Agent workers %s are not updating their alive files", hung)
+            else:
+                try:
+                    touch(self.options.alive)
+                except Exception:
+                    logging.exception('Error updating the alive file')
+
+    def measure_cpu(self):
+        """Median time of a few runs of the agent CPU benchmark"""
+        from internal.webpagetest import cpu_benchmark
+        times = sorted([cpu_benchmark() for _ in range(ADMISSION_SAMPLES)])
+        return times[int(len(times) / 2)]
+
+    def get_headroom(self):
+        """Speed of the CPU benchmark relative to the idle baseline (1.0 = no contention)"""
+        from internal.webpagetest import cpu_benchmark
+        self.samples.append(cpu_benchmark())
+        if len(self.samples) > ADMISSION_SAMPLES:
+            self.samples.pop(0)
+        elapsed = sorted(self.samples)[int(len(self.samples) / 2)]
+        return self.baseline / elapsed if elapsed > 0 else 1.0
+
+    def admit(self):
+        """Pause a worker when the host is short on CPU and admit another one when there is headroom"""
+        headroom = self.get_headroom()
+        active = [worker for worker in self.workers if not worker.paused]
+        paused = [worker for worker in self.workers if worker.paused]
+        logging.debug("CPU headroom: %0.2f with %d of %d workers admitted",
+                      headroom, len(active), len(self.workers))
+        if headroom < self.options.minheadroom and len(active) > 1:
+            worker = active[-1]
+            logging.info("CPU headroom %0.2f is below %0.2f, pausing worker %d",
+                         headroom, self.options.minheadroom, worker.index)
+            worker.set_paused(True)
+            self.samples = []
+        elif headroom >= self.options.minheadroom + ADMISSION_MARGIN and paused:
+            worker = paused[0]
+            logging.info("CPU headroom %0.2f, admitting worker %d", headroom, worker.index)
+            worker.set_paused(False)
+            self.samples = []
@@ -33,6 +33,10 @@ try:
     import ujson as json
 except BaseException:
     import json
+try:
+    from .request_record import Request, dump
+except (ImportError, ValueError):
+    from request_record import Request, dump
 
 class DevToolsParser(object):
     """Main class"""
@@ -132,10 +136,10 @@ class DevToolsParser(object):
                     _, ext = os.path.splitext(self.out_file)
                     if ext.lower() == '.gz':
                         with gzip.open(self.out_file, GZIP_TEXT) as f_out:
-                            json.dump(self.result, f_out)
+                            dump(self.result, f_out)
                     else:
                         with open(self.out_file, 'w') as f_out:
-                            json.dump(self.result, f_out)
+                            dump(self.result, f_out)
                 except Exception:
                     logging.exception("Error writing to " + self.out_file)
 
@@ -468,7 +472,7 @@ class DevToolsParser(object):
             if 'url' in raw_request:
                 url = raw_request['url'].split('#', 1)[0]
                 parts = urlsplit(url)
-                request = {'type': 3, 'id': raw_request['id'], 'request_id': raw_request['id']}
+                request = Request({'type': 3, 'id': raw_request['id'], 'request_id': raw_request['id']})
                 request['ip_addr'] = ''
                 request['full_url'] = url
                 request['is_secure'] = 1 if parts.scheme == 'https' else 0
@@ -799,7 +803,7 @@ class DevToolsParser(object):
                             end_offset > page_data['fullyLoaded']:
                         page_data['fullyLoaded'] = end_offset
                 if request['load_start'] >= 0:
-                    requests.append(dict(request))
+                    requests.append(request)
         page_data['connections'] = len(connections)
         if len(requests):
             requests.sort(key=lambda x: x['load_start_float'])
@@ -998,7 +1002,7 @@ class DevToolsParser(object):
             for entry in netlog or []:
                 if 'claimed' not in entry and 'url' in entry and 'start' in entry:
                     index += 1
-                    request = {'type': 3, 'full_url': entry['url']}
+                    request = Request({'type': 3, 'full_url': entry['url']})
                     parts = urlsplit(entry['url'])
                     request['id'] = '99999.99999.{0:d}'.format(index)
                     request['is_secure'] = 1 if parts.scheme == 'https' else 0
@@ -9,6 +9,7 @@ found in the LICENSE.md file.
 import glob
 import gzip
 import logging
+import multiprocessing
 import os
 import re
 import sys
@@ -27,17 +28,42 @@ try:
 except BaseException:
     import json
 
+# Parser state that tracks the multi-line events within a single process log
+SOURCE_STATE_KEYS = ['current_channel', 'creating_trans_id', 'current_transaction',
+                     'request_headers', 'current_socket', 'current_socket_transaction']
+# Tables that are merged across the individual process logs
+HTTP_TABLES = ['channels', 'requests', 'connections', 'sockets', 'streams']
+
+def parse_log_file_tables(args):
+    """Worker entry point: parse a single log file into partial tables"""
+    path, start_time = args
+    parser = FirefoxLogParser()
+    parser.set_start_time(start_time)
+    try:
+        parser.process_log_file(path)
+    except Exception:
+        logging.exception('Error processing log file')
+    return parser.get_tables()
+
 class FirefoxLogParser(object):
     """Handle parsing of firefox logs"""
-    def __init__(self):
+    def __init__(self, message_server='http://127.0.0.1:8888/'):
+        # The agent's own message server requests are left out of the results
+        self.message_server = message_server
         self.start_time = None
         self.start_day = None
         self.unique_id = 0
+        # Transaction IDs in the order their requests were created
+        self.creations = []
         self.int_map = {}
         for val in range(0, 100):
             self.int_map['{0:02d}'.format(val)] = float(val)
         self.dns = {}
+        self.dns_ends = {}
         self.http = {'channels': {}, 'requests': {}, 'connections': {}, 'sockets': {}, 'streams': {}}
+        self.pending = {}
+        self.source_state = {}
+        self.current_source = None
         self.logline = re.compile(r'^(?P<timestamp>\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d\.\d+) \w+ - '
                                   r'\[(?P<thread>[^\]]+)\]: (?P<level>\w)/(?P<category>[^ ]+) '
                                   r'(?P<message>[^\r\n]+)')
@@ -51,18 +77,142 @@ class FirefoxLogParser(object):
         usecond = float(int(timestamp[21:])) / 1000000
         self.start_time = float(hour * 3600 + minute * 60 + second) + usecond
 
-    def process_logs(self, log_file, start_time):
-        """Process multiple child logs and generate a resulting requests and page data file"""
-        self.__init__()
+    def process_logs(self, log_file, start_time, processes=None):
+        """Process multiple child logs and generate a resulting requests and page data file.
+        Each log is parsed in a separate worker process (up to the number of CPU cores
+        unless processes is specified) and the partial tables are merged in file order."""
+        self.__init__(self.message_server)
         files = sorted(glob.glob(log_file + '*'))
         self.set_start_time(start_time)
-        for path in files:
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        processes = min(processes, len(files))
+        tables = None
+        if processes > 1:
+            pool = None
             try:
-                self.process_log_file(path)
+                pool = multiprocessing.Pool(processes)
+                tables = pool.map(parse_log_file_tables,
+                                  [(path, start_time) for path in files], 1)
             except Exception:
-                logging.exception('Error processing log file')
+                logging.exception('Error processing log files in parallel')
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        if tables is not None:
+            for table in tables:
+                self.merge_tables(table)
+        else:
+            self.__init__(self.message_server)
+            self.set_start_time(start_time)
+            for path in files:
+                try:
+                    self.process_log_file(path)
+                except Exception:
+                    logging.exception('Error processing log file')
         return self.finish_processing()
 
+    def get_tables(self):
+        """The parsed tables for merging with the results from other log files"""
+        tables = {'dns': self.dns,
+                  'dns_ends': self.dns_ends,
+                  'unique_id': self.unique_id,
+                  'creations': self.creations}
+        for name in HTTP_TABLES:
+            tables[name] = self.http[name]
+        return tables
+
+    def merge_tables(self, tables):
+        """Merge the tables from a single log file (in the same order the logs would be
+        processed serially) so the results match processing the files in sequence"""
+        # DNS lookups keep the first start time and the first completion after it
+        for hostname in tables['dns']:
+            if hostname not in self.dns:
+                self.dns[hostname] = tables['dns'][hostname]
+            elif 'end' not in self.dns[hostname] and hostname in tables['dns_ends']:
+                self.dns[hostname]['end'] = tables['dns_ends'][hostname]
+        for hostname in tables['dns_ends']:
+            if hostname not in self.dns_ends:
+                self.dns_ends[hostname] = tables['dns_ends'][hostname]
+            if hostname in self.dns and hostname not in tables['dns'] and \
+                    'end' not in self.dns[hostname]:
+                self.dns[hostname]['end'] = tables['dns_ends'][hostname]
+        # Replay the transaction creations in log order so transactions that reuse an ID
+        # (within the file or from an earlier file) are moved aside with the same unique IDs
+        requests = self.http['requests']
+        created = {}
+        for request_id in tables['requests']:
+            separator = request_id.rfind('.')
+            if separator >= 0:
+                trans_id = request_id[:separator]
+                order = int(request_id[separator + 1:])
+            else:
+                trans_id = request_id
+                order = tables['unique_id'] + 1
+            if trans_id not in created:
+                created[trans_id] = []
+            created[trans_id].append((order, tables['requests'][request_id]))
+        for trans_id in created:
+            created[trans_id].sort(key=lambda entry: entry[0])
+            created[trans_id].reverse()
+        for trans_id in tables['creations']:
+            if trans_id in requests:
+                tmp_request = requests[trans_id]
+                del requests[trans_id]
+                self.unique_id += 1
+                requests['{0}.{1:d}'.format(trans_id, self.unique_id)] = tmp_request
+            requests[trans_id] = created[trans_id].pop()[1]
+        for name in ['channels', 'connections', 'sockets', 'streams']:
+            for key in tables[name]:
+                if key in self.http[name]:
+                    self.http[name][key].update(tables[name][key])
+                else:
+                    self.http[name][key] = tables[name][key]
+
+    def start_live(self, start_time):
+        """Reset the parser to be fed log data incrementally while the logs are being written"""
+        self.__init__(self.message_server)
+        self.set_start_time(start_time)
+
+    def process_log_data(self, path, data):
+        """Process a chunk of raw data appended to the given log file.
+        Any trailing partial line is held until the rest of it arrives."""
+        if path in self.pending:
+            data = self.pending[path] + data
+        end = data.rfind(b'\n')
+        if end < 0:
+            self.pending[path] = data
+            return
+        self.pending[path] = data[end + 1:]
+        self.switch_source(path)
+        for line in data[:end].split(b'\n'):
+            self.process_log_line(line.decode('utf-8', 'ignore').rstrip('\r'))
+
+    def finish_live(self):
+        """Flush any partial lines and generate the requests from the incremental data"""
+        for path in sorted(self.pending):
+            if self.pending[path]:
+                self.switch_source(path)
+                self.process_log_line(self.pending[path].decode('utf-8', 'ignore').rstrip('\r'))
+        self.pending = {}
+        return self.finish_processing()
+
+    def switch_source(self, path):
+        """Swap in the in-progress event state for the log file being processed.
+        Each log file is written by a different process so the incremental feed
+        keeps their multi-line state separate while interleaving the files."""
+        if path != self.current_source:
+            if self.current_source is not None:
+                state = {}
+                for key in SOURCE_STATE_KEYS:
+                    if key in self.http:
+                        state[key] = self.http[key]
+                        del self.http[key]
+                self.source_state[self.current_source] = state
+            if path in self.source_state:
+                self.http.update(self.source_state[path])
+            self.current_source = path
+
     def finish_processing(self):
         """Do the post-parse processing"""
         logging.debug('Processing network requests from moz log')
@@ -81,24 +231,30 @@ class FirefoxLogParser(object):
         # Pull out the network requests and sort them
         for request_id in self.http['requests']:
             request = self.http['requests'][request_id]
-            if 'url' in request and request['url'][0:22] != 'http://127.0.0.1:8888/'\
+            if 'url' in request and not request['url'].startswith(self.message_server)\
                     and 'start' in request:
                 request['id'] = request_id
                 requests.append(dict(request))
         if len(requests):
             requests.sort(key=lambda x: x['start'] if 'start' in x else 0)
         # Attach the DNS lookups to the first request on each domain
-        for domain in self.dns:
-            if 'claimed' not in self.dns[domain]:
-                for request in requests:
+        if self.dns:
+            first_requests = {}
+            for request in requests:
+                try:
                     host = urlsplit(request['url']).hostname
-                    if host == domain:
-                        self.dns[domain]['claimed'] = True
-                        if 'start' in self.dns[domain]:
-                            request['dns_start'] = self.dns[domain]['start']
-                        if 'end' in self.dns[domain]:
-                            request['dns_end'] = self.dns[domain]['end']
-                        break
+                except Exception:
+                    continue
+                if host not in first_requests:
+                    first_requests[host] = request
+            for domain in self.dns:
+                if 'claimed' not in self.dns[domain] and domain in first_requests:
+                    request = first_requests[domain]
+                    self.dns[domain]['claimed'] = True
+                    if 'start' in self.dns[domain]:
+                        request['dns_start'] = self.dns[domain]['start']
+                    if 'end' in self.dns[domain]:
+                        request['dns_end'] = self.dns[domain]['end']
         # Attach the socket connect events to the first request on each connection
         for request in requests:
             if 'connection' in request and request['connection'] in self.http['connections']:
@@ -245,6 +401,7 @@ class FirefoxLogParser(object):
                         self.unique_id += 1
                         new_id = '{0}.{1:d}'.format(trans_id, self.unique_id)
                         self.http['requests'][new_id] = tmp_request
+                    self.creations.append(trans_id)
                     self.http['requests'][trans_id] = {'url': url,
                                                        'request_headers': [],
                                                        'response_headers': [],
@@ -500,6 +657,8 @@ class FirefoxLogParser(object):
             match = re.search(r'lookup completed for host \[(?P<host>[^\]]+)\]', msg['message'])
             if match:
                 hostname = match.groupdict().get('host')
+                if hostname not in self.dns_ends:
+                    self.dns_ends[hostname] = msg['timestamp']
                 if hostname in self.dns and 'end' not in self.dns[hostname]:
                     self.dns[hostname]['end'] = msg['timestamp']
 
@@ -515,6 +674,8 @@ def main():
     parser.add_argument('-s', '--start',
                         help="Start Time in UTC with microseconds YYYY-MM-DD HH:MM:SS.xxxxxx.")
     parser.add_argument('-o', '--out', help="Output requests json file.")
+    parser.add_argument('-p', '--processes', type=int,
+                        help="Number of worker processes for parsing the logs (defaults to the CPU count).")
     options, _ = parser.parse_known_args()
 
     # Set up logging
@@ -534,7 +695,7 @@ def main():
         parser.error("Input devtools file or start time is not specified.")
 
     parser = FirefoxLogParser()
-    requests = parser.process_logs(options.logfile, options.start)
+    requests = parser.process_logs(options.logfile, options.start, options.processes)
     if options.out:
         with open(options.out, 'w') as f_out:
             json.dump(requests, f_out, indent=4)
@@ -16,6 +16,10 @@ try:
     import ujson as json
 except BaseException:
     import json
+try:
+    from .request_record import NetlogRequest, dump, to_json
+except (ImportError, ValueError):
+    from request_record import NetlogRequest, dump, to_json
 
 ##########################################################################
 #   Netlog processing
@@ -285,14 +289,14 @@ class Netlog():
                     for url in self.netlog['urls']:
                         host = urlparse(url).hostname
                         if host in failed_hosts:
-                            request = {'url': url,
-                                       'created': failed_hosts[host]['start'],
-                                       'start': failed_hosts[host]['start'],
-                                       'end': failed_hosts[host]['end'],
-                                       'connect_start': failed_hosts[host]['start'],
-                                       'connect_end': failed_hosts[host]['end'],
-                                       'fromNet': True,
-                                       'status': 12029}
+                            request = NetlogRequest({'url': url,
+                                                     'created': failed_hosts[host]['start'],
+                                                     'start': failed_hosts[host]['start'],
+                                                     'end': failed_hosts[host]['end'],
+                                                     'connect_start': failed_hosts[host]['start'],
+                                                     'connect_end': failed_hosts[host]['end'],
+                                                     'fromNet': True,
+                                                     'status': 12029})
                             requests.append(request)
             if len(requests):
                 # Sort the requests by the start time
@@ -628,9 +632,9 @@ class Netlog():
                 self.netlog['url_request'] = {}
             request_id = self.netlog['next_request_id']
             self.netlog['next_request_id'] += 1
-            self.netlog['url_request'][request_id] = {'bytes_in': 0,
-                                                      'chunks': [],
-                                                      'created': event['time']}
+            self.netlog['url_request'][request_id] = NetlogRequest({'bytes_in': 0,
+                                                                    'chunks': [],
+                                                                    'created': event['time']})
             request = self.netlog['url_request'][request_id]
             stream_id = params['promised_stream_id']
             if stream_id not in entry['stream']:
@@ -834,9 +838,9 @@ class Netlog():
             self.netlog['url_request'] = {}
         request_id = event['source']['id']
         if request_id not in self.netlog['url_request']:
-            self.netlog['url_request'][request_id] = {'bytes_in': 0,
-                                                      'chunks': [],
-                                                      'created': event['time']}
+            self.netlog['url_request'][request_id] = NetlogRequest({'bytes_in': 0,
+                                                                    'chunks': [],
+                                                                    'created': event['time']})
         params = event['params'] if 'params' in event else {}
         entry = self.netlog['url_request'][request_id]
         name = event['type']
@@ -999,14 +1003,14 @@ def main():
             _, ext = os.path.splitext(options.out)
             if ext.lower() == '.gz':
                 with gzip.open(options.out, 'wt', encoding='utf-8') as f:
-                    json.dump(requests, f)
+                    dump(requests, f)
             else:
                 with open(options.out, 'wt', encoding='utf-8') as f:
-                    json.dump(requests, f)
+                    dump(requests, f)
         except BaseException:
             logging.exception("Error writing to " + options.out)
     else:
-        print(json.dumps(requests, indent=4, sort_keys=True))
+        print(json.dumps([to_json(request) for request in requests] if requests else requests, indent=4, sort_keys=True))
 
 
 if '__main__' == __name__:
@@ -21,6 +21,9 @@ else:
 
 #Globals
 options = None
+FILE_HEADER = struct.Struct("=LHHLLLL")
+PACKET_HEADER = struct.Struct("=LLLL")
+READ_CHUNK_SIZE = 1024 * 1024
 
 
 ########################################################################################################################
@@ -34,6 +37,13 @@ class Pcap():
     self.slices = {'in': [], 'out': [], 'in_dup': []}
     self.bytes = {'in': 0, 'out': 0, 'in_dup': 0}
     self.streams = {}
+    self.stream_ends = {}
+    self.connections = {}
+    self.linktype = None
+    self.linklen = None
+    self.buffer = bytearray()
+    self.header_parsed = False
+    self.ok = True
     return
 
 
@@ -66,6 +76,20 @@ class Pcap():
     f.close()
 
 
+  def SaveConnections(self, out):
+    _, ext = os.path.splitext(out)
+    if ext.lower() == '.gz':
+      f = gzip.open(out, GZIP_TEXT)
+    else:
+      f = open(out, 'w')
+    try:
+      json.dump(self.connections, f)
+      logging.info('Connection summary written to {0}'.format(out))
+    except:
+      logging.exception('Error writing connection summary to {0}'.format(out))
+    f.close()
+
+
   def Print(self):
     global options
     if options.json:
@@ -85,64 +109,12 @@ class Pcap():
         f = gzip.open(pcap, 'rb')
       else:
         f = open(pcap, 'rb')
-      bytes = f.read(24)
-      # File header:
-      # Magic Number - 4 bytes - 0xa1b2c3d4
-      # Major Version - 2 bytes
-      # Minor version - 2 bytes
-      # Tz offset - 4 bytes (always 0)
-      # Timestamp accuracy - 4 bytes (always 0)
-      # Snapshot length - 4 bytes
-      # Link layer header type - 4 bytes
-      #
-      # unpack constants:
-      # L - unsigned long (4 byte)
-      # H - unsigned short (2 byte)
-      # B - unsigned char (1 byte int)
-      file_header = struct.unpack("=LHHLLLL", bytes)
-
-      # ignore byte order reversals for now
-      if file_header[0] == 0xa1b2c3d4:
-        ok = True
-        self.linktype = file_header[6]
-        if self.linktype == 1:
-          self.linklen = 12
-        elif self.linktype == 113:
-          self.linklen = 14
-        else:
-          logging.critical("Unknown link layer header type: {0:d}".format(self.linktype))
-          ok = False
-
-        # Packet header:
-        # Time stamp (seconds) - 4 bytes
-        # Time stamp (microseconds value) - 4 bytes
-        # Captured data length - 4 bytes
-        # Original length - 4 bytes
-        while ok:
-          bytes = f.read(16)
-          if not bytes or len(bytes) < 16:
-            break
-          (seconds, useconds, captured_length, packet_length) = struct.unpack("=LLLL", bytes)
-          if self.start_seconds is None:
-            self.start_seconds = seconds
-          seconds -= self.start_seconds
-          if packet_length and captured_length <= packet_length:
-            packet_time = float(seconds) + float(useconds) / 1000000.0
-            packet_info = {}
-            packet_info['time'] = packet_time
-            packet_info['length'] = packet_length
-            packet_info['captured_length'] = captured_length
-            packet_info['valid'] = False
-            if captured_length:
-              packet_data = f.read(captured_length)
-            else:
-              packet_data = None
-            if len(packet_data) >= self.linklen:
-              try:
-                self.ProcessPacket(packet_data, packet_info)
-              except Exception:
-                logging.exception('Error processing packet')
-      else:
+      while self.ok:
+        data = f.read(READ_CHUNK_SIZE)
+        if not data:
+          break
+        self.Feed(data)
+      if not self.header_parsed:
         logging.critical("Invalid pcap file " + pcap)
     except:
       logging.exception("Error processing pcap " + pcap)
@@ -153,6 +125,88 @@ class Pcap():
     return
 
 
+  def Feed(self, data):
+    """Process as many complete packets as are available after appending the new capture data.
+    Partial packets at the end are kept until the rest of the data arrives so the capture
+    can be processed incrementally while it is still being written."""
+    if not self.ok:
+      return
+    if len(self.buffer):
+      self.buffer.extend(data)
+      buff = self.buffer
+    else:
+      buff = data
+    available = len(buff)
+    view = memoryview(buff)
+    offset = 0
+    try:
+      if not self.header_parsed:
+        if available < FILE_HEADER.size:
+          self.buffer = bytearray(buff)
+          return
+        # File header:
+        # Magic Number - 4 bytes - 0xa1b2c3d4
+        # Major Version - 2 bytes
+        # Minor version - 2 bytes
+        # Tz offset - 4 bytes (always 0)
+        # Timestamp accuracy - 4 bytes (always 0)
+        # Snapshot length - 4 bytes
+        # Link layer header type - 4 bytes
+        #
+        # unpack constants:
+        # L - unsigned long (4 byte)
+        # H - unsigned short (2 byte)
+        # B - unsigned char (1 byte int)
+        file_header = FILE_HEADER.unpack_from(view, 0)
+        offset = FILE_HEADER.size
+        self.header_parsed = True
+
+        # ignore byte order reversals for now
+        if file_header[0] == 0xa1b2c3d4:
+          self.linktype = file_header[6]
+          if self.linktype == 1:
+            self.linklen = 12
+          elif self.linktype == 113:
+            self.linklen = 14
+          else:
+            logging.critical("Unknown link layer header type: {0:d}".format(self.linktype))
+            self.ok = False
+        else:
+          logging.critical("Invalid pcap file header")
+          self.ok = False
+
+      # Packet header:
+      # Time stamp (seconds) - 4 bytes
+      # Time stamp (microseconds value) - 4 bytes
+      # Captured data length - 4 bytes
+      # Original length - 4 bytes
+      while self.ok and available - offset >= PACKET_HEADER.size:
+        (seconds, useconds, captured_length, packet_length) = PACKET_HEADER.unpack_from(view, offset)
+        data_start = offset + PACKET_HEADER.size
+        data_end = data_start + captured_length
+        if data_end > available:
+          break
+        offset = data_end
+        if self.start_seconds is None:
+          self.start_seconds = seconds
+        seconds -= self.start_seconds
+        if packet_length and captured_length <= packet_length and captured_length >= self.linklen:
+          packet_time = float(seconds) + float(useconds) / 1000000.0
+          packet_info = {}
+          packet_info['time'] = packet_time
+          packet_info['length'] = packet_length
+          packet_info['captured_length'] = captured_length
+          packet_info['valid'] = False
+          try:
+            self.ProcessPacket(view[data_start:data_end], packet_info)
+          except Exception:
+            logging.exception('Error processing packet')
+    finally:
+      view.release()
+      # Only the trailing partial packet (if any) gets carried over
+      self.buffer = bytearray(buff[offset:]) if offset < available else bytearray()
+
+
   def ProcessPacket(self, packet_data, packet_info):
     if self.linktype == 1:
       # Ethernet:
@@ -312,6 +366,21 @@ class Pcap():
     self.bytes[direction] += bytes
     self.slices[direction][bucket] += bytes
 
+    # Per-connection summary (keyed by the outbound direction of the connection)
+    if 'stream_id' in packet_info:
+      if direction == 'out':
+        connection_id = packet_info['stream_id']
+      else:
+        connection_id = '{0}:{1:d}->{2}:{3:d}'.format(packet_info['ip_dst_str'], packet_info['dst_port'],
+                                                      packet_info['ip_src_str'], packet_info['src_port'])
+      if connection_id not in self.connections:
+        self.connections[connection_id] = {'in': 0, 'out': 0, 'in_dup': 0, 'packets': 0,
+                                           'start': elapsed, 'end': elapsed}
+      connection = self.connections[connection_id]
+      connection[direction] += bytes
+      connection['packets'] += 1
+      connection['end'] = elapsed
+
     # If it is a tcp stream, keep track of the sequence numbers and see if any of the data overlaps with previous
     # ranges on the same connection.
     if direction == 'in' and\
@@ -325,13 +394,17 @@ class Pcap():
       stream_end = stream_start + data_len
       if stream not in self.streams:
         self.streams[stream] = []
+        self.stream_ends[stream] = stream_end
 
-      # Loop through all of the existing packets on the stream to see if the data is duplicate (a spurious retransmit)
+      # Loop through all of the existing packets on the stream to see if the data is duplicate (a spurious retransmit).
+      # In-order data that starts past everything seen so far can't overlap so the scan is skipped.
       duplicate_bytes = 0
-      for start, end in self.streams[stream]:
-        overlap = max(0, min(end, stream_end) - max(start, stream_start))
-        if overlap > duplicate_bytes:
-          duplicate_bytes = overlap
+      if stream_start < self.stream_ends[stream]:
+        for start, end in self.streams[stream]:
+          overlap = max(0, min(end, stream_end) - max(start, stream_start))
+          if overlap > duplicate_bytes:
+            duplicate_bytes = overlap
+      self.stream_ends[stream] = max(self.stream_ends[stream], stream_end)
 
       # If the entire payload is duplicate then the whole packet is duplicate
       if duplicate_bytes >= data_len:
@@ -340,6 +413,7 @@ class Pcap():
       if duplicate_bytes > 0:
         self.bytes['in_dup'] += duplicate_bytes
         self.slices['in_dup'][bucket] += duplicate_bytes
+        self.connections[connection_id]['in_dup'] += duplicate_bytes
 
       # Keep track of the current packet byte range
       self.streams[stream].append([stream_start, stream_end])
@@ -353,11 +427,12 @@ def main():
   import argparse
   parser = argparse.ArgumentParser(description='WebPageTest pcap parser.',
                                    prog='pcap-parser')
-  parser.add_argument('-v', '--verbose', action='count',
+  parser.add_argument('-v', '--verbose', action='count', default=0,
                       help="Increase verbosity (specify multiple times for more). -vvvv for full debug output.")
   parser.add_argument('-i', '--input', help="Input pcap file.")
   parser.add_argument('-s', '--stats', help="Output bandwidth information file.")
   parser.add_argument('-d', '--details', help="Output bandwidth details file (time sliced bandwidth data).")
+  parser.add_argument('-c', '--connections', help="Output per-connection summary file.")
   parser.add_argument('-j', '--json', action='store_true', default=False, help="Set output format to JSON")
   options = parser.parse_args()
 
@@ -384,6 +459,8 @@ def main():
     pcap.SaveStats(options.stats)
   if options.details:
     pcap.SaveDetails(options.details)
+  if options.connections:
+    pcap.SaveConnections(options.connections)
   pcap.Print()
 
   end = time.time()
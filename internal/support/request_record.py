@@ -0,0 +1,116 @@
+# Copyright 2021 Catchpoint Systems Inc.
+# Use of this source code is governed by the Polyform Shield 1.0.0 license that can be
+# found in the LICENSE.md file.
+"""Compact records for the per-request data that flows through the parsers, the
+post-processing and the HAR generation. A record is a slotted dict subclass so it has the
+speed of a dict for every operation the processing code uses (and serializes like one),
+but the records built from loaded json share their key strings: every request that was
+loaded with the same keys points at a single copy of them instead of holding its own copy
+of dozens of key strings. The conversion to and from the json shape (to_dict/from_dict)
+is lossless."""
+try:
+    import ujson as json
+except BaseException:
+    import json
+
+# Key tables are cached by their keys. Past this many the new tables aren't shared.
+MAX_KEY_TABLES = 10000
+# Number of records serialized with each json.dumps call
+DUMP_BATCH = 1000
+
+KEY_TABLES = {}
+
+
+def shared_keys(keys):
+    """The shared copy of the tuple of keys"""
+    table = KEY_TABLES.get(keys)
+    if table is None:
+        table = keys
+        if len(KEY_TABLES) < MAX_KEY_TABLES:
+            table = KEY_TABLES.setdefault(keys, keys)
+    return table
+
+
+class Record(dict):
+    """Base class for the compact records"""
+    __slots__ = ()
+
+    def __init__(self, data=None):
+        if data:
+            if isinstance(data, Record):
+                dict.__init__(self, data)
+            else:
+                dict.__init__(self, zip(shared_keys(tuple(data)), data.values()))
+        else:
+            dict.__init__(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Record with the same keys and values as the dict"""
+        return cls(data)
+
+    def to_dict(self):
+        """The record in the json (dict) shape"""
+        return dict(self)
+
+    def copy(self):
+        """Shallow copy"""
+        return self.__class__(self)
+
+    def __repr__(self):
+        return '{0}({1})'.format(self.__class__.__name__, dict.__repr__(self))
+
+
+class Request(Record):
+    """A request in the *_devtools_requests.json shape"""
+    __slots__ = ()
+
+
+class NetlogRequest(Record):
+    """A request extracted from the netlog events"""
+    __slots__ = ()
+
+
+def to_json(data):
+    """The json shape of a record (anything else is returned as-is)"""
+    return data.to_dict() if isinstance(data, Record) else data
+
+
+def dump(data, f_out):
+    """json.dump for a list of records or a dict that holds lists of records (i.e. the
+    devtools requests). The lists are written in batches so the json shape of all of the
+    records is never held in memory at once."""
+    if isinstance(data, dict):
+        f_out.write('{')
+        separator = ''
+        for key, value in data.items():
+            f_out.write(separator + json.dumps(key) + ':')
+            dump_value(value, f_out)
+            separator = ','
+        f_out.write('}')
+    else:
+        dump_value(data, f_out)
+
+
+def dump_value(value, f_out):
+    """Write a value, a list DUMP_BATCH items at a time"""
+    if isinstance(value, list):
+        f_out.write('[')
+        separator = ''
+        for start in range(0, len(value), DUMP_BATCH):
+            # The records serialize directly as the dicts they subclass
+            batch = json.dumps(value[start:start + DUMP_BATCH])
+            f_out.write(separator + batch[1:-1])
+            separator = ','
+        f_out.write(']')
+    else:
+        f_out.write(json.dumps(value))
+
+
+def load_requests(requests, record_type=Request):
+    """Convert a list of request dicts (i.e. from a loaded json file) into records, in place"""
+    if requests:
+        for index, request in enumerate(requests):
+            if isinstance(request, dict) and not isinstance(request, Record):
+                requests[index] = record_type(request)
+    return requests
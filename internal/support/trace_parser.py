@@ -28,6 +28,10 @@ try:
     import ujson as json
 except BaseException:
     import json
+try:
+    from .request_record import NetlogRequest, dump
+except (ImportError, ValueError):
+    from request_record import NetlogRequest, dump
 
 ##########################################################################
 #   Trace processing
@@ -35,6 +39,7 @@ except BaseException:
 class Trace():
     """Main class"""
     def __init__(self):
+        self.message_server = 'http://127.0.0.1:8888'
         self.thread_stack = {}
         self.ignore_threads = {}
         self.threads = {}
@@ -61,6 +66,8 @@ class Trace():
         self.netlog_event_types = {}
         self.v8stats = None
         self.v8stack = {}
+        # Optional store for publishing the results that are post-processed in-process
+        self.artifacts = None
         self.PRIORITY_MAP = {
             "VeryHigh": "Highest",
             "HIGHEST": "Highest",
@@ -75,16 +82,19 @@ class Trace():
     ##########################################################################
     #   Output Logging
     ##########################################################################
-    def write_json(self, out_file, json_data):
+    def write_json(self, out_file, json_data, publish=False):
         """Write out one of the internal structures as a json blob"""
         try:
+            if publish and self.artifacts is not None:
+                self.artifacts.publish(out_file, json_data, 9)
+                return
             _, ext = os.path.splitext(out_file)
             if ext.lower() == '.gz':
                 with gzip.open(out_file, GZIP_TEXT) as f:
-                    json.dump(json_data, f)
+                    dump(json_data, f)
             else:
                 with open(out_file, 'w') as f:
-                    json.dump(json_data, f)
+                    dump(json_data, f)
         except BaseException:
             logging.exception("Error writing to " + out_file)
 
@@ -92,7 +102,7 @@ class Trace():
         self.post_process_netlog_events()
         out = self.post_process_user_timing(dom_tree, performance_timing)
         if out is not None:
-            self.write_json(out_file, out)
+            self.write_json(out_file, out, True)
 
     def WriteCPUSlices(self, out_file):
         if self.cpu['valid']:
@@ -100,13 +110,13 @@ class Trace():
 
     def WriteScriptTimings(self, out_file):
         if self.scripts is not None:
-            self.write_json(out_file, self.scripts)
+            self.write_json(out_file, self.scripts, True)
 
     def WriteFeatureUsage(self, out_file):
         self.post_process_netlog_events()
         out = self.post_process_feature_usage()
         if out is not None:
-            self.write_json(out_file, out)
+            self.write_json(out_file, out, True)
     
     def WritePageData(self, out_file):
         if len(self.page_data) and self.start_time is not None:
@@ -118,7 +128,7 @@ class Trace():
                 if value >= self.start_time:
                     out[key] = int(round(float(value - self.start_time) / 1000.0))
             if len(out):
-                self.write_json(out_file, out)
+                self.write_json(out_file, out, True)
 
     def WriteInteractive(self, out_file):
         # Generate the interactive periods from the long-task data
@@ -137,11 +147,11 @@ class Trace():
                 elapsed = end_time - last_end
                 if elapsed > 0:
                     interactive.append([last_end, end_time])
-            self.write_json(out_file, interactive)
+            self.write_json(out_file, interactive, True)
     
     def WriteLongTasks(self, out_file):
         if self.long_tasks is not None:
-            self.write_json(out_file, self.long_tasks)
+            self.write_json(out_file, self.long_tasks, True)
 
     def WriteNetlog(self, out_file):
         out = self.post_process_netlog_events()
@@ -496,7 +506,7 @@ class Trace():
                 'args' in trace_event and \
                 'data' in trace_event['args'] and \
                 'url' in trace_event['args']['data'] and \
-                trace_event['args']['data']['url'] == 'http://127.0.0.1:8888/wpt-start-recording':
+                trace_event['args']['data']['url'] == self.message_server + '/wpt-start-recording':
             self.marked_start_time = trace_event['ts']
             self.start_time = trace_event['ts']
 
@@ -504,7 +514,7 @@ class Trace():
         if 'args' in trace_event and 'data' in trace_event['args'] and \
                 thread not in self.ignore_threads:
             if 'url' in trace_event['args']['data'] and \
-                    trace_event['args']['data']['url'].startswith('http://127.0.0.1:8888'):
+                    trace_event['args']['data']['url'].startswith(self.message_server):
                 self.ignore_threads[thread] = True
             if self.cpu['main_thread'] is None or 'isMainFrame' in trace_event['args']['data']:
                 if ('isMainFrame' in trace_event['args']['data'] and \
@@ -1138,14 +1148,14 @@ class Trace():
                     for url in self.netlog['urls']:
                         host = urlparse(url).hostname
                         if host in failed_hosts:
-                            request = {'url': url,
-                                       'created': failed_hosts[host]['start'],
-                                       'start': failed_hosts[host]['start'],
-                                       'end': failed_hosts[host]['end'],
-                                       'connect_start': failed_hosts[host]['start'],
-                                       'connect_end': failed_hosts[host]['end'],
-                                       'fromNet': True,
-                                       'status': 12029}
+                            request = NetlogRequest({'url': url,
+                                                     'created': failed_hosts[host]['start'],
+                                                     'start': failed_hosts[host]['start'],
+                                                     'end': failed_hosts[host]['end'],
+                                                     'connect_start': failed_hosts[host]['start'],
+                                                     'connect_end': failed_hosts[host]['end'],
+                                                     'fromNet': True,
+                                                     'status': 12029})
                             requests.append(request)
             if len(requests):
                 # Sort the requests by the start time
@@ -1432,9 +1442,9 @@ class Trace():
                 self.netlog['url_request'] = {}
             request_id = self.netlog['next_request_id']
             self.netlog['next_request_id'] += 1
-            self.netlog['url_request'][request_id] = {'bytes_in': 0,
-                                                      'chunks': [],
-                                                      'created': trace_event['ts']}
+            self.netlog['url_request'][request_id] = NetlogRequest({'bytes_in': 0,
+                                                                    'chunks': [],
+                                                                    'created': trace_event['ts']})
             request = self.netlog['url_request'][request_id]
             stream_id = params['promised_stream_id']
             if stream_id not in entry['stream']:
@@ -1636,9 +1646,9 @@ class Trace():
             self.netlog['url_request'] = {}
         request_id = trace_event['id']
         if request_id not in self.netlog['url_request']:
-            self.netlog['url_request'][request_id] = {'bytes_in': 0,
-                                                      'chunks': [],
-                                                      'created': trace_event['ts']}
+            self.netlog['url_request'][request_id] = NetlogRequest({'bytes_in': 0,
+                                                                    'chunks': [],
+                                                                    'created': trace_event['ts']})
         params = trace_event['args']['params'] if 'params' in trace_event['args'] else {}
         entry = self.netlog['url_request'][request_id]
         name = trace_event['name']
@@ -234,6 +234,33 @@ def remove_orange_frames(directory, orange_file):
             else:
                 break
 
+def find_color_edge(line, background, start, stop, threshold=15):
+    """Find the first pixel in a row or column of pixels (walking from start
+    towards stop, exclusive) that does not match the background color.
+    Uses the same similarity test as colors_are_similar but checks the whole
+    range at once. Returns None if every pixel in the range matches."""
+    import numpy as np
+    step = 1 if stop >= start else -1
+    indices = np.arange(start, stop, step)
+    if not len(indices):
+        return None
+    delta = np.abs(line[indices, :3].astype(np.int32) - np.array(background[:3], dtype=np.int32))
+    different = np.logical_or(np.any(delta > threshold, axis=1),
+                              np.sum(delta, axis=1) > threshold)
+    if not different.any():
+        return None
+    return int(indices[np.argmax(different)])
+
+
+def load_image_pixels(im):
+    """Load a PIL image as a height x width x channels numpy array"""
+    import numpy as np
+    pixels = np.asarray(im)
+    if pixels.ndim != 3 or pixels.shape[2] < 3:
+        raise ValueError('Unsupported image mode {0}'.format(im.mode))
+    return pixels
+
+
 def find_image_viewport(file):
     logging.debug("Finding the viewport for %s", file)
     im = None
@@ -243,54 +270,29 @@ def find_image_viewport(file):
         width, height = im.size
         x = int(math.floor(width / 2))
         y = int(math.floor(height / 2))
-        pixels = im.load()
-        background = pixels[x, y]
+        pixels = load_image_pixels(im)
+        background = pixels[y, x]
+        row = pixels[y, :]
+        column = pixels[:, x]
 
         # Find the left edge
-        left = None
-        while left is None and x >= 0:
-            if not colors_are_similar(background, pixels[x, y]):
-                left = x + 1
-            else:
-                x -= 1
-        if left is None:
-            left = 0
+        left = find_color_edge(row, background, x, -1)
+        left = 0 if left is None else left + 1
         logging.debug('Viewport left edge is %d', left)
 
         # Find the right edge
-        x = int(math.floor(width / 2))
-        right = None
-        while right is None and x < width:
-            if not colors_are_similar(background, pixels[x, y]):
-                right = x - 1
-            else:
-                x += 1
-        if right is None:
-            right = width
+        right = find_color_edge(row, background, x, width)
+        right = width if right is None else right - 1
         logging.debug('Viewport right edge is {0:d}'.format(right))
 
         # Find the top edge
-        x = int(math.floor(width / 2))
-        top = None
-        while top is None and y >= 0:
-            if not colors_are_similar(background, pixels[x, y]):
-                top = y + 1
-            else:
-                y -= 1
-        if top is None:
-            top = 0
+        top = find_color_edge(column, background, y, -1)
+        top = 0 if top is None else top + 1
         logging.debug('Viewport top edge is {0:d}'.format(top))
 
         # Find the bottom edge
-        y = int(math.floor(height / 2))
-        bottom = None
-        while bottom is None and y < height:
-            if not colors_are_similar(background, pixels[x, y]):
-                bottom = y - 1
-            else:
-                y += 1
-        if bottom is None:
-            bottom = height
+        bottom = find_color_edge(column, background, y, height)
+        bottom = height if bottom is None else bottom - 1
         logging.debug('Viewport bottom edge is {0:d}'.format(bottom))
 
         viewport = {
@@ -312,6 +314,51 @@ def find_image_viewport(file):
     return viewport
 
 
+def find_notification_viewport(file):
+    """Find the viewport below the device notification bar (and above the navigation bar)"""
+    logging.debug("Finding the notification viewport for %s", file)
+    viewport = None
+    im = None
+    try:
+        from PIL import Image
+        im = Image.open(file)
+        width, height = im.size
+        pixels = load_image_pixels(im)
+        middle = int(math.floor(height / 2))
+        # Find the top edge (at ~40% in to deal with browsers that
+        # color the notification area)
+        x = int(width * 0.4)
+        background = pixels[0, x]
+        top = find_color_edge(pixels[:, x], background, 0, middle)
+        if top is None:
+            top = 0
+        logging.debug('Window top edge is {0:d}'.format(top))
+
+        # Find the bottom edge
+        bottom = find_color_edge(pixels[:, 0], background, height - 1, middle)
+        if bottom is None:
+            bottom = height - 1
+        logging.debug('Window bottom edge is {0:d}'.format(bottom))
+
+        viewport = {
+            'x': 0,
+            'y': top,
+            'width': width,
+            'height': (
+                bottom -
+                top)}
+    except Exception:
+        logging.exception('Error finding vieport pixels')
+
+    if im is not None:
+        try:
+            im.close()
+        except Exception:
+            pass
+
+    return viewport
+
+
 def find_video_viewport(video, directory, find_viewport, viewport_time):
     logging.debug("Finding Video Viewport...")
     viewport = None
@@ -331,55 +378,7 @@ def find_video_viewport(video, directory, find_viewport, viewport_time):
                 width, height = im.size
                 logging.debug('%s is %dx%d', frame, width, height)
             if options.notification:
-                im = None
-                try:
-                    im = Image.open(frame)
-                    pixels = im.load()
-                    middle = int(math.floor(height / 2))
-                    # Find the top edge (at ~40% in to deal with browsers that
-                    # color the notification area)
-                    x = int(width * 0.4)
-                    y = 0
-                    background = pixels[x, y]
-                    top = None
-                    while top is None and y < middle:
-                        if not colors_are_similar(background, pixels[x, y]):
-                            top = y
-                        else:
-                            y += 1
-                    if top is None:
-                        top = 0
-                    logging.debug('Window top edge is {0:d}'.format(top))
-
-                    # Find the bottom edge
-                    x = 0
-                    y = height - 1
-                    bottom = None
-                    while bottom is None and y > middle:
-                        if not colors_are_similar(background, pixels[x, y]):
-                            bottom = y
-                        else:
-                            y -= 1
-                    if bottom is None:
-                        bottom = height - 1
-                    logging.debug('Window bottom edge is {0:d}'.format(bottom))
-
-                    viewport = {
-                        'x': 0,
-                        'y': top,
-                        'width': width,
-                        'height': (
-                            bottom -
-                            top)}
-                except Exception:
-                    logging.exception('Error finding vieport pixels')
-
-                if im is not None:
-                    try:
-                        im.close()
-                    except Exception:
-                        pass
-
+                viewport = find_notification_viewport(frame)
             elif find_viewport:
                 viewport = find_image_viewport(frame)
             else:
@@ -1462,33 +1461,161 @@ def calculate_speed_index(progress):
 
 
 def calculate_perceptual_speed_index(progress, directory):
-    from ssim import compute_ssim # pylint: disable=import-error
     x = len(progress)
     dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), directory)
-    first_paint_frame = os.path.join(
-        dir, "ms_{0:06d}.png".format(
-            progress[1]["time"]))
     target_frame = os.path.join(
         dir, "ms_{0:06d}.png".format(progress[x - 1]["time"]))
-    ssim_1 = compute_ssim(first_paint_frame, target_frame)
-    per_si = float(progress[1]['time'])
-    last_ms = progress[1]['time']
     # Full Path of the Target Frame
     logging.debug("Target image for perSI is %s" % target_frame)
-    ssim = ssim_1
-    for p in progress[1:]:
+    frames = [os.path.join(dir, "ms_{0:06d}.png".format(p["time"])) for p in progress[1:]]
+    scale = 1.0
+    batch_size = 8
+    if options is not None:
+        scale = options.perceptualscale
+        batch_size = options.perceptualbatch
+    scores = calculate_ssim_scores(frames, target_frame, scale, batch_size)
+    per_si = float(progress[1]['time'])
+    last_ms = progress[1]['time']
+    ssim = scores[0]
+    for index, p in enumerate(progress[1:]):
         elapsed = p['time'] - last_ms
-        # Full Path of the Current Frame
-        current_frame = os.path.join(dir, "ms_{0:06d}.png".format(p["time"]))
-        logging.debug("Current Image is %s" % current_frame)
-        # Takes full path of PNG frames to compute SSIM value
         per_si += elapsed * (1.0 - ssim)
-        ssim = compute_ssim(current_frame, target_frame)
-        gc.collect()
+        ssim = scores[index]
+        logging.debug('{0:d}ms - SSIM {1:0.4f} ({2})'.format(p['time'], ssim, frames[index]))
         last_ms = p['time']
     return int(per_si)
 
 
+def get_ssim_kernel(width=11, sigma=1.5):
+    """1D gaussian kernel (same shape as the one pyssim uses)"""
+    import numpy as np
+    kernel = np.arange(0, width, 1.)
+    kernel -= width / 2
+    kernel = np.exp(-0.5 * kernel ** 2 / sigma ** 2)
+    return kernel / np.sum(kernel)
+
+
+def ssim_blur(images, kernel):
+    """Separable gaussian blur of a stack of grayscale images (N x H x W)
+    with mirrored edges, applied to every image in the stack at once.
+    The kernel is applied one tap at a time so the working memory stays
+    at a couple of copies of the stack."""
+    import numpy as np
+    size = len(kernel)
+    before = size // 2
+    after = size - before - 1
+    for axis in (1, 2):
+        pad = [(0, 0), (0, 0), (0, 0)]
+        pad[axis] = (before, after)
+        padded = np.pad(images, pad, mode='symmetric')
+        length = images.shape[axis]
+        blurred = np.zeros(images.shape, dtype=images.dtype)
+        scratch = np.empty(images.shape, dtype=images.dtype)
+        for tap, weight in enumerate(kernel):
+            window = padded[:, tap:tap + length, :] if axis == 1 else padded[:, :, tap:tap + length]
+            np.multiply(window, weight, out=scratch)
+            blurred += scratch
+        del padded, scratch
+        images = blurred
+    return images
+
+
+def load_ssim_image(file, size=None, scale=1.0):
+    """Load an image as a grayscale float32 array for SSIM comparisons"""
+    import numpy as np
+    from PIL import Image, ImageOps
+    resampling = getattr(Image, 'Resampling', Image)
+    with Image.open(file) as img:
+        if size is not None and size != img.size:
+            img = img.resize(size, resampling.LANCZOS)
+        if scale < 1.0:
+            width, height = img.size
+            img = img.resize((max(1, int(round(width * scale))), max(1, int(round(height * scale)))),
+                             resampling.BOX)
+        gray = np.asarray(ImageOps.grayscale(img), dtype=np.float32)
+        if 'A' in img.getbands():
+            gray = gray.copy()
+            alpha = np.asarray(img.split()[-1])
+            gray[alpha == 255] = 0
+        return gray, img.size
+
+
+# Upper limit on the number of (scaled) pixels compared in one SSIM batch. The working set
+# is about 40 bytes per pixel so this keeps a batch to ~160MB (two 1080p frames).
+SSIM_BATCH_PIXELS = 2 * 1920 * 1080
+
+
+def calculate_ssim_scores(frames, target_frame, scale=1.0, batch_size=8, max_pixels=SSIM_BATCH_PIXELS):
+    """Calculate the SSIM of each frame against the target frame.
+    The target is only decoded and blurred once (per frame size) and the
+    frames are compared in batches of stacked arrays, limited to batch_size
+    frames and max_pixels pixels. Frames can optionally be downscaled first
+    (scale < 1) to trade accuracy for speed."""
+    import numpy as np
+    from PIL import Image
+    c_1 = (0.01 * 255) ** 2
+    c_2 = (0.03 * 255) ** 2
+    kernel = get_ssim_kernel().astype(np.float32)
+    targets = {}
+    scores = [None] * len(frames)
+    sizes = []
+    for frame in frames:
+        with Image.open(frame) as img:
+            sizes.append(img.size)
+    # Batch up runs of frames that are the same size
+    batches = []
+    batch = []
+    batch_size = max(1, batch_size)
+    for index, size in enumerate(sizes):
+        pixels = max(1.0, size[0] * size[1] * min(scale, 1.0) ** 2)
+        if batch and (len(batch) >= batch_size or size != sizes[batch[0]] or
+                      (len(batch) + 1) * pixels > max_pixels):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    for batch in batches:
+        size = sizes[batch[0]]
+        if size not in targets:
+            target, _ = load_ssim_image(target_frame, size, scale)
+            target = target[np.newaxis, :, :]
+            target_mu = ssim_blur(target, kernel)
+            target_sigma = ssim_blur(target ** 2, kernel)
+            target_sigma -= target_mu ** 2
+            targets[size] = (target, target_mu, target_sigma)
+        target, target_mu, target_sigma = targets[size]
+        images = np.stack([load_ssim_image(frames[index], None, scale)[0] for index in batch])
+        mu = ssim_blur(images, kernel)
+        sigma = ssim_blur(images ** 2, kernel)
+        sigma -= mu ** 2
+        images *= target
+        sigma_12 = ssim_blur(images, kernel)
+        del images
+        mu_12 = mu * target_mu
+        sigma_12 -= mu_12
+        # numerator: (2 * mu_12 + c_1) * (2 * sigma_12 + c_2)
+        mu_12 *= 2
+        mu_12 += c_1
+        sigma_12 *= 2
+        sigma_12 += c_2
+        mu_12 *= sigma_12
+        # denominator: (mu ** 2 + target_mu ** 2 + c_1) * (sigma + target_sigma + c_2)
+        mu *= mu
+        mu += target_mu ** 2
+        mu += c_1
+        sigma += target_sigma
+        sigma += c_2
+        mu *= sigma
+        mu_12 /= mu
+        values = np.mean(mu_12, axis=(1, 2), dtype=np.float64)
+        for position, index in enumerate(batch):
+            scores[index] = float(values[position])
+        del mu, sigma, mu_12, sigma_12
+        gc.collect()
+    return scores
+
+
 ##########################################################################
 #   Check any dependencies
 ##########################################################################
@@ -1523,6 +1650,14 @@ def check_config():
         logging.critical('Pillow:  FAIL')
         ok = False
 
+    try:
+        import numpy
+
+        logging.critical('numpy:   OK')
+    except BaseException:
+        logging.critical('numpy:   FAIL')
+        ok = False
+
     try:
         from ssim import compute_ssim # pylint: disable=import-error
 
@@ -1563,7 +1698,7 @@ def main():
         prog='visualmetrics')
     parser.add_argument('--version', action='version', version='%(prog)s 0.1')
     parser.add_argument('-c', '--check', action='store_true', default=False,
-                        help="Check dependencies (ffmpeg, imagemagick, PIL, SSIM).")
+                        help="Check dependencies (ffmpeg, imagemagick, PIL, numpy, SSIM).")
     parser.add_argument(
         '-v',
         '--verbose',
@@ -1643,6 +1778,13 @@ def main():
                              "sampling (to 10fps, 1fps, etc).")
     parser.add_argument('-k', '--perceptual', action='store_true', default=False,
                         help="Calculate perceptual Speed Index")
+    parser.add_argument('--perceptualscale', type=float, default=1.0,
+                        help="Scale factor to downsize frames by before calculating SSIM for "
+                             "the perceptual Speed Index (defaults to 1.0, full size).")
+    parser.add_argument('--perceptualbatch', type=int, default=8,
+                        help="Maximum number of frames to compare against the final frame at a time "
+                             "when calculating the perceptual Speed Index (defaults to 8, batches "
+                             "are also limited to two 1080p frames worth of pixels).")
     parser.add_argument('-j', '--json', action='store_true', default=False,
                         help="Set output format to JSON")
     parser.add_argument('--progress', help="Visual progress output file.")
@@ -9,15 +9,31 @@ import logging
 import os
 import platform
 import re
+import select
+import socket
+import struct
 import subprocess
 import sys
+import threading
 if (sys.version_info >= (3, 0)):
+    from time import monotonic
     from urllib.parse import urlparse # pylint: disable=import-error
     GZIP_TEXT = 'wt'
 else:
+    from monotonic import monotonic
     from urlparse import urlparse # pylint: disable=import-error
     GZIP_TEXT = 'w'
 
+MAX_HOPS = 30
+PROBE_TIMEOUT = 1.0
+BASE_PORT = 33434
+# Linux socket error queue support (not exposed by the socket module)
+IP_RECVERR = 11
+MSG_ERRQUEUE = 0x2000
+SO_EE_ORIGIN_ICMP = 2
+ICMP_DEST_UNREACH = 3
+ICMP_TIME_EXCEEDED = 11
+
 class Traceroute(object):
     """Traceroute (desktop)"""
     def __init__(self, options, job):
@@ -39,6 +55,8 @@ class Traceroute(object):
             hostname = urlparse(self.job['url']).hostname
             if platform.system() == 'Windows':
                 last_hop, results = self.windows_traceroute(hostname)
+            elif self.options.nativetraceroute and platform.system() == 'Linux':
+                last_hop, results = self.native_traceroute(hostname, self.options.tracerouteprobes)
             else:
                 last_hop, results = self.unix_traceroute(hostname)
             if last_hop > 0 and results is not None and len(results):
@@ -177,6 +195,126 @@ class Traceroute(object):
                 logging.exception('Error processing traceroute')
         return last_hop, ret
 
+    def native_traceroute(self, hostname, probes=3):
+        """Traceroute that probes every hop at the same time using UDP probes and
+        the socket error queue (no root required, Linux only)"""
+        ret = {}
+        last_hop = 0
+        try:
+            addr = socket.gethostbyname(hostname)
+        except Exception:
+            logging.exception('Error resolving %s for traceroute', hostname)
+            return last_hop, ret
+        ret[0] = {'ms': '', 'hostname': hostname, 'addr': addr}
+        probes = max(1, probes)
+        sockets = {}
+        times = {}
+        replies = {}
+        destination_hop = None
+        poll = select.poll()
+        try:
+            # Send all of the probes up front
+            for hop in range(1, MAX_HOPS + 1):
+                for probe in range(probes):
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, hop)
+                    sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+                    sock.setblocking(False)
+                    sockets[sock.fileno()] = (sock, hop)
+                    poll.register(sock.fileno(), select.POLLERR)
+                    port = BASE_PORT + (hop - 1) * probes + probe
+                    times[sock.fileno()] = monotonic()
+                    try:
+                        sock.sendto(b'\x00' * 32, (addr, port))
+                    except Exception:
+                        pass
+            # Collect the ICMP errors as they arrive
+            end_time = monotonic() + PROBE_TIMEOUT
+            outstanding = len(sockets)
+            while outstanding > 0:
+                remaining = end_time - monotonic()
+                if remaining <= 0:
+                    break
+                for fileno, _ in poll.poll(remaining * 1000):
+                    sock, hop = sockets[fileno]
+                    reply = self.read_probe_error(sock)
+                    poll.unregister(fileno)
+                    if reply is not None:
+                        icmp_type, offender = reply
+                        elapsed = (monotonic() - times[fileno]) * 1000.0
+                        replies[fileno] = True
+                        if hop not in ret or (ret[hop]['addr'] == offender and
+                                              elapsed < float(ret[hop]['ms'])):
+                            ret[hop] = {'ms': elapsed, 'addr': offender}
+                        if icmp_type == ICMP_DEST_UNREACH and \
+                                (destination_hop is None or hop < destination_hop):
+                            destination_hop = hop
+                    else:
+                        replies[fileno] = False
+                # Only wait for the probes up to the destination once it has been reached
+                outstanding = 0
+                for fileno in sockets:
+                    if fileno not in replies and \
+                            (destination_hop is None or sockets[fileno][1] <= destination_hop):
+                        outstanding += 1
+        except Exception:
+            logging.exception('Error running traceroute')
+        for fileno in sockets:
+            try:
+                sockets[fileno][0].close()
+            except Exception:
+                pass
+        # Build the hop list the same way the traceroute output is reported
+        hops = MAX_HOPS if destination_hop is None else destination_hop
+        for hop in range(1, MAX_HOPS + 1):
+            if hop > hops:
+                if hop in ret:
+                    del ret[hop]
+            elif hop in ret:
+                ret[hop]['ms'] = '{0:0.3f}'.format(ret[hop]['ms'])
+                last_hop = hop
+            else:
+                ret[hop] = {'ms': '', 'hostname': '', 'addr': ''}
+        self.resolve_hop_names(ret, last_hop)
+        return last_hop, ret
+
+    def read_probe_error(self, sock):
+        """Read the ICMP error for a probe from the socket error queue.
+        Returns the ICMP type and the address of the router that sent it."""
+        ret = None
+        try:
+            _, ancdata, _, _ = sock.recvmsg(512, 512, MSG_ERRQUEUE)
+            for level, msg_type, data in ancdata:
+                if level == socket.IPPROTO_IP and msg_type == IP_RECVERR and len(data) >= 24:
+                    # struct sock_extended_err followed by the offender sockaddr_in
+                    _, origin, icmp_type, _, _, _, _ = struct.unpack_from('=IBBBBII', data)
+                    if origin == SO_EE_ORIGIN_ICMP:
+                        offender = socket.inet_ntoa(data[20:24])
+                        ret = (icmp_type, offender)
+        except Exception:
+            pass
+        return ret
+
+    def resolve_hop_names(self, ret, last_hop):
+        """Reverse-lookup the hop addresses in parallel (falls back to the address)"""
+        def lookup(entry):
+            try:
+                entry['hostname'] = socket.gethostbyaddr(entry['addr'])[0]
+            except Exception:
+                entry['hostname'] = entry['addr']
+        threads = []
+        for hop in range(1, last_hop + 1):
+            if hop in ret and ret[hop]['addr'] and 'hostname' not in ret[hop]:
+                thread = threading.Thread(target=lookup, args=(ret[hop],))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join(10)
+        for hop in range(1, last_hop + 1):
+            if hop in ret and 'hostname' not in ret[hop]:
+                ret[hop]['hostname'] = ret[hop]['addr']
+
     def run_lighthouse_test(self, task):
         """Stub for lighthouse test"""
         pass
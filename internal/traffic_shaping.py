@@ -11,6 +11,10 @@ import re
 import subprocess
 import sys
 import time
+if (sys.version_info >= (3, 0)):
+    from time import monotonic
+else:
+    from monotonic import monotonic
 
 class TrafficShaper(object):
     """Main traffic-shaper interface"""
@@ -529,19 +533,29 @@ class RemoteDummynet(Dummynet):
 # netem
 #
 class NetEm(object):
-    """Linux traffic-shaper using netem/tc"""
+    """Linux traffic-shaper using netem/tc.
+    Changes are applied as a single tc (or ip) batch and the current root qdisc
+    is checked so re-applying the same settings is skipped."""
     def __init__(self, options, out_interface=None, in_interface=None):
         self.interface = out_interface
         self.in_interface = in_interface
         self.options = options
+        self.dry_run = options.shaperdryrun
+        self.applied = {}
+        self.apply_time = None
 
-    def install(self):
-        """Install and configure the traffic-shaper"""
-        ret = False
-
-        # Figure out the default interface
+    def get_default_interface(self):
+        """Find the interface for the default route"""
+        interface = None
         try:
-            if self.interface is None:
+            if os.path.isfile('/proc/net/route'):
+                with open('/proc/net/route', 'r') as f_in:
+                    for line in f_in:
+                        fields = line.split()
+                        if len(fields) >= 8 and fields[1] == '00000000' and fields[7] == '00000000':
+                            interface = fields[0]
+                            break
+            else:
                 if (sys.version_info >= (3, 0)):
                     out = subprocess.check_output(['route'], encoding='UTF-8')
                 else:
@@ -554,36 +568,88 @@ class NetEm(object):
                     if fields:
                         destination = fields.group(1)
                         if destination == 'default':
-                            self.interface = fields.group(2)
-                            logging.debug("Default interface: %s", self.interface)
+                            interface = fields.group(2)
                             break
+        except Exception:
+            logging.exception('Error looking up the default interface')
+        return interface
+
+    def run_batch(self, tool, commands):
+        """Run a list of tc or ip commands (without the tool name) as a single batch"""
+        ret = False
+        batch = ''.join(command + '\n' for command in commands)
+        if self.dry_run:
+            logging.info('%s batch (dry run):\n%s', tool, batch)
+            return True
+        logging.debug('%s batch:\n%s', tool, batch)
+        start = monotonic()
+        try:
+            proc = subprocess.Popen(['sudo', tool, '-force', '-batch', '-'],
+                                    stdin=subprocess.PIPE)
+            proc.communicate(batch.encode('utf-8'))
+            ret = proc.returncode == 0
+        except Exception:
+            logging.exception('Error running %s batch', tool)
+        self.apply_time = monotonic() - start
+        logging.debug('%d %s commands applied in %0.3f seconds', len(commands), tool,
+                      self.apply_time)
+        return ret
+
+    def get_root_qdiscs(self):
+        """The current root qdisc for each interface (as reported by tc)"""
+        qdiscs = {}
+        try:
+            if (sys.version_info >= (3, 0)):
+                out = subprocess.check_output(['tc', 'qdisc', 'show'], encoding='UTF-8')
+            else:
+                out = subprocess.check_output(['tc', 'qdisc', 'show'])
+            for line in out.splitlines():
+                fields = line.split()
+                if 'dev' in fields and 'root' in fields:
+                    index = fields.index('dev') + 1
+                    if index < len(fields):
+                        qdiscs[fields[index]] = line.strip()
+        except Exception:
+            qdiscs = None
+        return qdiscs
+
+    def install(self):
+        """Install and configure the traffic-shaper"""
+        ret = False
+
+        # Figure out the default interface
+        try:
+            if self.interface is None:
+                self.interface = self.get_default_interface()
+                logging.debug("Default interface: %s", self.interface)
 
             if self.interface:
                 if self.in_interface is None:
                     self.in_interface = 'ifb0'
                 # Set up the ifb interface so inbound traffic can be shaped
                 if self.in_interface.startswith('ifb'):
+                    commands = []
                     if self.options.dockerized:
-                        subprocess.call(['sudo', 'ip', 'link', 'add', 'ifb0', 'type', 'ifb'])
-                    else:
+                        commands.append('link add ifb0 type ifb')
+                    elif not self.dry_run:
                         subprocess.call(['sudo', 'modprobe', 'ifb'])
-                    subprocess.call(['sudo', 'ip', 'link', 'set', 'dev', 'ifb0', 'up'])
-                    subprocess.call(['sudo', 'tc', 'qdisc', 'add', 'dev', self.interface,
-                                     'ingress'])
-                    subprocess.call(['sudo', 'tc', 'filter', 'add', 'dev', self.interface, 'parent',
-                                     'ffff:', 'protocol', 'ip', 'u32', 'match', 'u32', '0', '0',
-                                     'flowid', '1:1', 'action', 'mirred', 'egress', 'redirect',
-                                     'dev', 'ifb0'])
+                    commands.append('link set dev ifb0 up')
+                    self.run_batch('ip', commands)
+                    self.run_batch('tc', [
+                        'qdisc add dev {0} ingress'.format(self.interface),
+                        'filter add dev {0} parent ffff: protocol ip u32 match u32 0 0 '
+                        'flowid 1:1 action mirred egress redirect dev ifb0'.format(self.interface)])
                 # Turn off tcp offload acceleration on the interfaces
-                try:
-                    subprocess.call(['sudo', 'ethtool', '-K', self.interface, 'tso', 'off', 'gso', 'off', 'gro', 'off'])
-                    subprocess.call(['sudo', 'ethtool', '-K', self.in_interface, 'tso', 'off', 'gso', 'off', 'gro', 'off'])
-                except Exception:
-                    logging.exception('Error disabling tso on interfaces for traffic shaping')
+                if not self.dry_run:
+                    try:
+                        subprocess.call(['sudo', 'ethtool', '-K', self.interface, 'tso', 'off', 'gso', 'off', 'gro', 'off'])
+                        subprocess.call(['sudo', 'ethtool', '-K', self.in_interface, 'tso', 'off', 'gso', 'off', 'gro', 'off'])
+                    except Exception:
+                        logging.exception('Error disabling tso on interfaces for traffic shaping')
                 self.reset()
                 ret = True
             else:
-                logging.critical("Unable to identify default interface using 'route'")
+                logging.critical("Unable to identify the default interface")
         except Exception as err:
             logging.exception("Error configuring netem: %s", err.__str__())
         return ret
@@ -591,20 +657,28 @@ class NetEm(object):
     def remove(self):
         """Uninstall traffic-shaping"""
         if self.interface:
-            subprocess.call(['sudo', 'tc', 'qdisc', 'del', 'dev', self.interface,
-                             'ingress'])
+            self.applied = {}
+            self.run_batch('tc', ['qdisc del dev {0} ingress'.format(self.interface)])
             if self.in_interface is not None and self.in_interface.startswith('ifb'):
-                subprocess.call(['sudo', 'ip', 'link', 'set', 'dev', 'ifb0', 'down'])
+                self.run_batch('ip', ['link set dev ifb0 down'])
         return True
 
     def reset(self):
         """Disable traffic-shaping"""
         ret = False
         if self.interface is not None and self.in_interface is not None:
-            ret = subprocess.call(['sudo', 'tc', 'qdisc', 'del', 'dev', self.in_interface,
-                                   'root']) == 0 and\
-                  subprocess.call(['sudo', 'tc', 'qdisc', 'del', 'dev', self.interface,
-                                   'root']) == 0
+            commands = []
+            qdiscs = None if self.dry_run else self.get_root_qdiscs()
+            for interface in [self.in_interface, self.interface]:
+                # Only remove the root qdisc if it is (or might be) a netem one
+                if qdiscs is None or qdiscs.get(interface, '').find('netem') >= 0:
+                    commands.append('qdisc del dev {0} root'.format(interface))
+                if interface in self.applied:
+                    del self.applied[interface]
+            if commands:
+                ret = self.run_batch('tc', commands)
+            else:
+                ret = True
         return ret
 
     def configure(self, in_bps, out_bps, rtt, plr, shaperLimit):
@@ -614,13 +688,36 @@ class NetEm(object):
             in_latency = rtt / 2
             if rtt % 2:
                 in_latency += 1
-            if self.configure_interface(self.in_interface, in_bps, in_latency, plr, shaperLimit):
-                ret = self.configure_interface(self.interface, out_bps, rtt / 2, plr, shaperLimit)
+            settings = [(self.in_interface, self.build_netem_args(in_bps, in_latency, plr, shaperLimit)),
+                        (self.interface, self.build_netem_args(out_bps, rtt / 2, plr, shaperLimit))]
+            pending = []
+            qdiscs = None
+            if self.applied and not self.dry_run:
+                qdiscs = self.get_root_qdiscs()
+            for interface, netem in settings:
+                command = ' '.join(['qdisc', 'replace', 'dev', interface, 'root'] + netem)
+                # Skip interfaces that are already configured (and haven't been changed since)
+                if interface in self.applied and self.applied[interface]['command'] == command and \
+                        (self.dry_run or (qdiscs is not None and
+                                          self.applied[interface]['qdisc'] == qdiscs.get(interface))):
+                    logging.debug('Traffic shaping for %s is already configured', interface)
+                else:
+                    pending.append((interface, command))
+                    if interface in self.applied:
+                        del self.applied[interface]
+            ret = True
+            if pending:
+                ret = self.run_batch('tc', [command for _, command in pending])
+                if ret:
+                    qdiscs = None if self.dry_run else self.get_root_qdiscs()
+                    for interface, command in pending:
+                        qdisc = qdiscs.get(interface) if qdiscs is not None else None
+                        self.applied[interface] = {'command': command, 'qdisc': qdisc}
         return ret
 
-    def build_command_args(self, interface, bps, latency, plr, shaperLimit):
-        args = ['sudo', 'tc', 'qdisc', 'add', 'dev', interface, 'root',
-                'netem', 'delay', '{0:d}ms'.format(int(latency))]
+    def build_netem_args(self, bps, latency, plr, shaperLimit):
+        """Build the netem qdisc parameters"""
+        args = ['netem', 'delay', '{0:d}ms'.format(int(latency))]
         if bps > 0:
             kbps = int(bps / 1000)
             args.extend(['rate', '{0:d}kbit'.format(int(kbps))])
@@ -630,12 +727,6 @@ class NetEm(object):
             args.extend(['limit', '{0:d}'.format(shaperLimit)])
         return args
 
-    def configure_interface(self, interface, bps, latency, plr, shaperLimit):
-        """Configure traffic-shaping for a single interface"""
-        args = self.build_command_args(interface, bps, latency, plr, shaperLimit)
-        logging.debug(' '.join(args))
-        return subprocess.call(args) == 0
-
     def set_devtools(self, devtools):
         """Stub for configuring the devtools interface"""
         return
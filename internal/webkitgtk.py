@@ -17,7 +17,7 @@ class WebKitGTK(DesktopBrowser, DevtoolsBrowser):
         self.options = options
         DesktopBrowser.__init__(self, path, options, job)
         DevtoolsBrowser.__init__(self, options, job, use_devtools_video=False, is_webkit=True)
-        self.start_page = 'http://127.0.0.1:8888/orange.html'
+        self.start_page = 'http://127.0.0.1:{0:d}/orange.html'.format(options.messageport)
         self.connected = False
 
     def shutdown(self):
@@ -25,6 +25,10 @@ import time
 import zipfile
 import psutil
 from internal import os_util
+from internal.host_rules import HostRules, add_block_domains, get_static_block_domains
+from internal.server_probe import ServerProber
+from internal import metrics
+from internal.spans import SPANS
 
 if (sys.version_info >= (3, 0)):
     from time import monotonic
@@ -53,6 +57,21 @@ http_client.HTTPConnection.debuglevel = 1
 
 DEFAULT_JPEG_QUALITY = 30
 
+
+def cpu_benchmark():
+    """Time a fixed hashing workload (~1 second on the reference machine)"""
+    hash_val = hashlib.sha256()
+    with open(__file__, 'rb') as f_in:
+        hash_data = f_in.read(4096)
+    start = monotonic()
+    # 106k iterations takes ~1 second on the reference machine
+    iteration = 0
+    while iteration < 106000:
+        hash_val.update(hash_data)
+        iteration += 1
+    return monotonic() - start
+
+
 class WebPageTest(object):
     """Controller for interfacing with the WebPageTest server"""
     # pylint: disable=E0611
@@ -71,6 +90,13 @@ class WebPageTest(object):
         self.session.headers.update({'User-Agent': 'wptagent'})
         self.extension_session = requests.Session()
         self.extension_session.headers.update({'User-Agent': 'wptagent'})
+        # The prefetch thread polls with its own session while the current job uploads on the main one
+        self.prefetch_session = requests.Session()
+        self.prefetch_session.headers.update({'User-Agent': 'wptagent'})
+        self.server_prober = ServerProber(self.session)
+        self.prefetch_lock = threading.Lock()
+        self.prefetched = []
+        self.prefetch_thread = None
         self.options = options
         self.last_test_id = None
         self.fps = options.fps
@@ -80,6 +106,7 @@ class WebPageTest(object):
         self.log_handler = None
         # Configurable options
         self.work_servers = []
+        self.work_servers_str = None
         self.needs_zip = []
         self.url = ''
         if options.server is not None:
@@ -158,14 +185,15 @@ class WebPageTest(object):
             self.load_from_gce()
         self.block_metadata()
         # Set the session authentication options
-        if self.auth_name is not None:
-            self.session.auth = (self.auth_name, self.auth_password)
-        self.session.verify = self.validate_server_certificate
-        if options.cert is not None:
-            if options.certkey is not None:
-                self.session.cert = (options.cert, options.certkey)
-            else:
-                self.session.cert = options.cert
+        for session in [self.session, self.prefetch_session]:
+            if self.auth_name is not None:
+                session.auth = (self.auth_name, self.auth_password)
+            session.verify = self.validate_server_certificate
+            if options.cert is not None:
+                if options.certkey is not None:
+                    session.cert = (options.cert, options.certkey)
+                else:
+                    session.cert = options.cert
         # Set up the temporary directories
         self.workdir = os.path.join(workdir, self.pc_name)
         self.persistent_dir = self.workdir + '.data'
@@ -179,11 +207,16 @@ class WebPageTest(object):
         # commit as the version
         self.version = '23.07'
         try:
+            from .startup import STARTUP_CACHE
             directory = os.path.abspath(os.path.dirname(__file__))
+            # The reflog changes with every commit, checkout or pull
+            reflog = os.path.join(os.path.dirname(directory), '.git', 'logs', 'HEAD')
             if (sys.version_info >= (3, 0)):
-                out = subprocess.check_output('git log -1 --format=%cd --date=raw', shell=True, cwd=directory, encoding='UTF-8')
+                out = STARTUP_CACHE.cached('git_version', [reflog], lambda: subprocess.check_output(
+                    'git log -1 --format=%cd --date=raw', shell=True, cwd=directory, encoding='UTF-8'))
             else:
-                out = subprocess.check_output('git log -1 --format=%cd --date=raw', shell=True, cwd=directory)
+                out = STARTUP_CACHE.cached('git_version', [reflog], lambda: subprocess.check_output(
+                    'git log -1 --format=%cd --date=raw', shell=True, cwd=directory))
             if out is not None:
                 matches = re.search(r'^(\d+)', out)
                 if matches:
@@ -222,18 +255,8 @@ class WebPageTest(object):
         """Benchmark the CPU for mobile emulation"""
         self.cpu_scale_multiplier = 1.0
         if not self.options.android and not self.options.iOS:
-            import hashlib
             logging.debug('Starting CPU benchmark')
-            hash_val = hashlib.sha256()
-            with open(__file__, 'rb') as f_in:
-                hash_data = f_in.read(4096)
-            start = monotonic()
-            # 106k iterations takes ~1 second on the reference machine
-            iteration = 0
-            while iteration < 106000:
-                hash_val.update(hash_data)
-                iteration += 1
-            elapsed = monotonic() - start
+            elapsed = cpu_benchmark()
             self.cpu_scale_multiplier = min(1.0 / elapsed, float(self.options.maxcpuscale))
             logging.debug('CPU Benchmark elapsed time: %0.3f, multiplier: %0.3f',
                           elapsed, self.cpu_scale_multiplier)
@@ -494,20 +517,27 @@ class WebPageTest(object):
         else:
             subprocess.call(['sudo', 'reboot'])
 
-    def get_cpid(self, node = None):
+    def get_cpid(self, node = None, salt = None):
         """Get a salt-signed header for the scheduler"""
         entity = node if node else self.scheduler_node
-        hash_src = entity.upper() + ';' + datetime.now().strftime('%Y%m') + self.scheduler_salt
+        salt = salt if salt else self.scheduler_salt
+        hash_src = entity.upper() + ';' + datetime.now().strftime('%Y%m') + salt
         hash_string = base64.b64encode(hashlib.sha1(hash_src.encode('ascii')).digest()).decode('ascii')
         cpid_header = 'm;' + entity + ';' + hash_string
         return cpid_header
 
     def process_job_json(self, test_json):
         """Process the JSON of a test into a job file"""
+        state = {'url': self.url, 'scheduler_node': self.scheduler_node, 'raw_job': dict(test_json)}
+        state['job'] = self.prepare_job(test_json, self.scheduler_node)
+        self.apply_job_state(state)
+        return self.job
+
+    def prepare_job(self, test_json, scheduler_node):
+        """Fill in the job defaults without making it the current job (or touching the agent state)"""
         if self.cpu_scale_multiplier is None:
             self.benchmark_cpu()
         job = test_json
-        self.raw_job = dict(test_json)
         if job is not None:
             try:
                 logging.debug("Job: %s", json.dumps(job))
@@ -566,15 +596,6 @@ class WebPageTest(object):
                         throttle *= self.cpu_scale_multiplier
                     job['throttle_cpu_requested'] = job['throttle_cpu']
                     job['throttle_cpu'] = throttle
-                if 'work_servers' in job and job['work_servers'] != self.work_servers_str:
-                        self.work_servers_str = job['work_servers']
-                        self.work_servers = self.work_servers_str.split(',')
-                        logging.debug("Servers changed to: %s", self.work_servers_str)
-                if 'wpthost' in job:
-                    self.wpthost = job['wpthost']
-                job['started'] = time.time()
-                if 'testinfo' in job:
-                    job['testinfo']['started'] = job['started']
                 # Add the security insights custom metrics locally if requested
                 if 'securityInsights' in job:
                     js_directory = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'js')
@@ -594,54 +615,156 @@ class WebPageTest(object):
                     job['timeline'] = 1
                 if self.options.location is not None:
                     job['location'] = self.options.location
-                if self.scheduler_node is not None and 'saas_test_id' in job:
-                    job['saas_node_id'] = self.scheduler_node
-                # For CLI tests, write out the raw job file
-                if self.options.testurl or self.options.testspec or 'saas_test_id' in job:
-                    if not os.path.isdir(self.workdir):
-                        os.makedirs(self.workdir)
-                    job_path = os.path.join(self.workdir, 'job.json')
-                    logging.debug('Job Path: {}'.format(job_path))
-                    with open(job_path, 'wt') as f_out:
-                        json.dump(job, f_out)
-                    self.needs_zip.append({'path': job_path, 'name': 'job.json'})
-                    if 'testinfo' in job:
-                        job['testinfo']['started'] = job['started']
-
-                # Add the non-serializable members
-                if self.health_check_server is not None:
-                    job['health_check_server'] = self.health_check_server
-                # add any locally-defined custom metrics (server versions override locals with the same name)
-                if self.custom_metrics:
-                    if 'customMetrics' not in job:
-                        job['customMetrics'] = {}
-                    for name in self.custom_metrics:
-                        if name not in job['customMetrics']:
-                            job['customMetrics'][name] = self.custom_metrics[name]
+                if scheduler_node is not None and 'saas_test_id' in job:
+                    job['saas_node_id'] = scheduler_node
             except Exception:
                 logging.exception("Error processing job json")
-        self.job = job
         return job
 
+    def start_job(self, job):
+        """Finish setting up a job as it becomes the current job (prefetched jobs were claimed earlier)"""
+        try:
+            job['started'] = time.time()
+            if 'testinfo' in job:
+                job['testinfo']['started'] = job['started']
+            # For CLI tests, write out the raw job file
+            if self.options.testurl or self.options.testspec or 'saas_test_id' in job:
+                if not os.path.isdir(self.workdir):
+                    os.makedirs(self.workdir)
+                job_path = os.path.join(self.workdir, 'job.json')
+                logging.debug('Job Path: {}'.format(job_path))
+                with open(job_path, 'wt') as f_out:
+                    json.dump(job, f_out)
+                self.needs_zip.append({'path': job_path, 'name': 'job.json'})
+
+            # Add the non-serializable members
+            if self.health_check_server is not None:
+                job['health_check_server'] = self.health_check_server
+            # add any locally-defined custom metrics (server versions override locals with the same name)
+            if self.custom_metrics:
+                if 'customMetrics' not in job:
+                    job['customMetrics'] = {}
+                for name in self.custom_metrics:
+                    if name not in job['customMetrics']:
+                        job['customMetrics'][name] = self.custom_metrics[name]
+        except Exception:
+            logging.exception("Error processing job json")
+
     def get_test(self, browsers):
         """Get a job from the server"""
-        if self.is_rebooting or self.is_dead or self.options.pubsub:
+        job, state = self.poll_for_test(browsers, False)
+        if state is not None:
+            self.apply_job_state(state)
+        return job
+
+    def apply_job_state(self, state):
+        """Make the server state from polling for a job the current state.
+        Polling only records the server and scheduler changes in the state so that a job can be
+        prefetched without affecting the one that is still running."""
+        self.url = state['url']
+        self.scheduler_node = state['scheduler_node']
+        self.raw_job = state['raw_job']
+        job = state['job'] if 'job' in state else None
+        servers_str = state['work_servers_str'] if 'work_servers_str' in state else None
+        if job is not None and 'work_servers' in job:
+            servers_str = job['work_servers']
+        if servers_str and servers_str != self.work_servers_str:
+            self.work_servers_str = servers_str
+            self.work_servers = self.work_servers_str.split(',')
+            logging.debug("Servers changed to: %s", self.work_servers_str)
+        if 'scheduler' in state:
+            self.scheduler = state['scheduler']
+            self.scheduler_salt = state['scheduler_salt']
+            self.scheduler_nodes = state['scheduler_nodes']
+        if 'job' in state:
+            self.job = job
+            if job is not None:
+                if 'wpthost' in job:
+                    self.wpthost = job['wpthost']
+                self.start_job(job)
+
+    def prefetch_tests(self, browsers, limit):
+        """Claim jobs ahead of time while the current job finishes (called from a background thread).
+        At most limit jobs are held at a time so work isn't hoarded from other agents."""
+        if self.scheduler:
             return
+        while not self.is_dead:
+            with self.prefetch_lock:
+                if len(self.prefetched) >= limit:
+                    break
+            job, state = self.poll_for_test(browsers, True)
+            if job is None:
+                break
+            logging.debug("Prefetched job %s", job['Test ID'] if 'Test ID' in job else '')
+            # Warm the caches the job needs before it starts
+            self.install_extensions(job)
+            get_static_block_domains()
+            with self.prefetch_lock:
+                self.prefetched.append(state)
+        if self.is_dead:
+            self.requeue_prefetched_tests()
+
+    def start_prefetch(self, browsers, limit):
+        """Start prefetching jobs in a background thread (if it isn't already running)"""
+        if self.prefetch_thread is None and not self.is_dead:
+            self.prefetch_thread = threading.Thread(target=self.prefetch_tests, args=(browsers, limit))
+            self.prefetch_thread.daemon = True
+            self.prefetch_thread.start()
+
+    def wait_for_prefetch(self, timeout=None):
+        """Wait for the background prefetch to finish"""
+        thread = self.prefetch_thread
+        if thread is not None:
+            thread.join(timeout)
+            if not thread.is_alive():
+                self.prefetch_thread = None
+
+    def get_prefetched_test(self):
+        """Make the oldest prefetched job the current job (None if there aren't any)"""
+        state = None
+        with self.prefetch_lock:
+            if self.prefetched:
+                state = self.prefetched.pop(0)
+        if state is None:
+            return None
+        self.apply_job_state(state)
+        return state['job']
+
+    def requeue_prefetched_tests(self):
+        """Return the jobs that were claimed ahead of time to the server"""
+        with self.prefetch_lock:
+            prefetched = self.prefetched
+            self.prefetched = []
+        for state in prefetched:
+            try:
+                self.requeue_job(state['raw_job'], state['scheduler_node'])
+            except Exception:
+                logging.exception('Error re-queueing a prefetched job')
+
+    def poll_for_test(self, browsers, prefetch):
+        """Poll the servers for a job without changing the state of the current job.
+        Returns the job and the server state that goes with it (None if no servers were polled).
+        When prefetching, reboot requests are left for the next regular poll."""
+        if self.is_rebooting or self.is_dead or self.options.pubsub:
+            return None, None
         import requests
         proxies = {"http": None, "https": None}
         from .os_util import get_free_disk_space
         if len(self.work_servers) == 0 and len(self.scheduler_nodes) == 0:
-            return None
+            return None, None
         job = None
-        self.raw_job = None
+        session = self.prefetch_session if prefetch else self.session
+        scheduler = self.scheduler
+        scheduler_salt = self.scheduler_salt
+        state = {'url': self.url, 'scheduler_node': self.scheduler_node, 'raw_job': {}}
         scheduler_nodes = list(self.scheduler_nodes)
         if len(scheduler_nodes) > 0:
             random.shuffle(scheduler_nodes)
-            self.scheduler_node = str(scheduler_nodes.pop(0)).strip(', ')
-        servers = list(self.work_servers)
-        if len(servers) >0 :
-            random.shuffle(servers)
-            self.url = str(servers.pop(0))
+            state['scheduler_node'] = str(scheduler_nodes.pop(0)).strip(', ')
+        # Poll the healthiest servers first and skip the ones that are backing off
+        servers = self.server_prober.order_servers(self.work_servers)
+        if len(servers) > 0:
+            state['url'] = str(servers.pop(0))
         locations = list(self.test_locations) if len(self.test_locations) > 1 else [self.location]
         if len(locations) > 0:
             random.shuffle(locations)
@@ -649,12 +772,13 @@ class WebPageTest(object):
         # Shuffle the list order
         if len(self.test_locations) > 1:
             self.test_locations.append(str(self.test_locations.pop(0)))
+        free_disk = get_free_disk_space()
         count = 0
         retry = True
         while count < 3 and retry:
             retry = False
             count += 1
-            url = self.url + "getwork.php?f=json&shards=1&reboot=1&servers=1&testinfo=1"
+            url = state['url'] + "getwork.php?f=json&shards=1&reboot=1&servers=1&testinfo=1"
             url += "&location=" + quote_plus(location)
             url += "&pc=" + quote_plus(self.pc_name)
             if self.key is not None:
@@ -672,7 +796,6 @@ class WebPageTest(object):
                 url += '&screenheight={0:d}'.format(self.screen_height)
             if self.dns_servers is not None:
                 url += '&dns=' + quote_plus(self.dns_servers)
-            free_disk = get_free_disk_space()
             url += '&freedisk={0:0.3f}'.format(free_disk)
             uptime = self.get_uptime_minutes()
             if uptime is not None:
@@ -687,14 +810,14 @@ class WebPageTest(object):
                 browser_versions = ','.join(versions)
                 url += '&browsers=' + quote_plus(browser_versions)
             try:
-                if self.scheduler and self.scheduler_salt and self.scheduler_node:
-                    url = self.scheduler + 'hawkscheduleserver/wpt-dequeue.ashx?machine={}'.format(quote_plus(self.pc_name))
-                    logging.info("Checking for work for node %s: %s", self.scheduler_node, url)
-                    response = self.session.get(url, timeout=10, proxies=proxies, headers={'CPID': self.get_cpid(self.scheduler_node)})
+                if scheduler and scheduler_salt and state['scheduler_node']:
+                    url = scheduler + 'hawkscheduleserver/wpt-dequeue.ashx?machine={}'.format(quote_plus(self.pc_name))
+                    logging.info("Checking for work for node %s: %s", state['scheduler_node'], url)
+                    response = session.get(url, timeout=10, proxies=proxies, headers={'CPID': self.get_cpid(state['scheduler_node'], scheduler_salt)})
                     response_text = response.text if len(response.text) else None
                 else:
                     logging.info("Checking for work: %s", url)
-                    response = self.session.get(url, timeout=10, proxies=proxies)
+                    response = self.server_prober.fetch(state['url'], url, 10, proxies, session)
                     response_text = response.text if len(response.text) else None
                 if self.options.alive:
                     with open(self.options.alive, 'a'):
@@ -704,30 +827,34 @@ class WebPageTest(object):
                 self.first_failure = None
                 if response_text is not None:
                     if response_text == 'Reboot':
-                        self.reboot()
-                        return None
+                        if not prefetch:
+                            self.reboot()
+                        return None, state
                     elif response_text.startswith('Servers:') or response_text.startswith('Scheduler:'):
                         for line in response_text.splitlines():
                             line = line.strip()
                             if line.startswith('Servers:'):
                                 servers_str = line[8:]
-                                if servers_str and servers_str != self.work_servers_str:
-                                    self.work_servers_str = servers_str
-                                    self.work_servers = self.work_servers_str.split(',')
-                                    logging.debug("Servers changed to: %s", self.work_servers_str)
+                                if servers_str:
+                                    state['work_servers_str'] = servers_str
                             elif line.startswith('Scheduler:'):
                                 scheduler_parts = line[10:].split(' ')
                                 if scheduler_parts and len(scheduler_parts) == 3:
-                                    self.scheduler = scheduler_parts[0].strip()
-                                    self.scheduler_salt = scheduler_parts[1].strip()
-                                    self.scheduler_node = scheduler_parts[2].strip()
-                                    self.scheduler_nodes = [self.scheduler_node]
+                                    scheduler = scheduler_parts[0].strip()
+                                    scheduler_salt = scheduler_parts[1].strip()
+                                    state['scheduler'] = scheduler
+                                    state['scheduler_salt'] = scheduler_salt
+                                    state['scheduler_node'] = scheduler_parts[2].strip()
+                                    state['scheduler_nodes'] = [state['scheduler_node']]
                                     retry = True
-                                    logging.debug("Scheduler configured: '%s' Salt: '%s' Node: %s", self.scheduler, self.scheduler_salt, self.scheduler_node)
-                    job = self.process_job_json(json.loads(response_text))
+                                    logging.debug("Scheduler configured: '%s' Salt: '%s' Node: %s", scheduler, scheduler_salt, state['scheduler_node'])
+                    test_json = json.loads(response_text)
+                    state['raw_job'] = dict(test_json)
+                    job = self.prepare_job(test_json, state['scheduler_node'])
+                    state['job'] = job
                     # Store the raw job info in case we need to re-queue it
                     if job is not None and 'Test ID' in job and 'signature' in job and 'work_server' in job:
-                        self.raw_job = {
+                        state['raw_job'] = {
                             'id': job['Test ID'],
                             'signature': job['signature'],
                             'work_server': job['work_server'],
@@ -735,14 +862,14 @@ class WebPageTest(object):
                             'payload': str(response.text)
                         }
                         if 'jobID' in job:
-                            self.raw_job['jobID'] = job['jobID']
+                            state['raw_job']['jobID'] = job['jobID']
                 # Rotate through the list of locations
-                if job is None and len(locations) > 0 and not self.scheduler:
+                if job is None and len(locations) > 0 and not scheduler:
                     location = str(locations.pop(0))
                     count -= 1
                     retry = True
-                if job is None and len(scheduler_nodes) > 0 and self.scheduler:
-                    self.scheduler_node = str(scheduler_nodes.pop(0)).strip(', ')
+                if job is None and len(scheduler_nodes) > 0 and scheduler:
+                    state['scheduler_node'] = str(scheduler_nodes.pop(0)).strip(', ')
                     count -= 1
                     retry = True
             except requests.exceptions.RequestException as err:
@@ -752,20 +879,20 @@ class WebPageTest(object):
                     self.first_failure = now
                 # Reboot if we haven't been able to reach the server for 30 minutes
                 elapsed = now - self.first_failure
-                if elapsed > 1800:
+                if elapsed > 1800 and not prefetch:
                     self.reboot()
                 time.sleep(0.1)
             except Exception:
                 pass
             # Rotate through the list of servers
-            if not retry and job is None and len(servers) > 0 and not self.scheduler:
-                self.url = str(servers.pop(0))
+            if not retry and job is None and len(servers) > 0 and not scheduler:
+                state['url'] = str(servers.pop(0))
                 locations = list(self.test_locations) if len(self.test_locations) > 1 else [self.location]
                 random.shuffle(locations)
                 location = str(locations.pop(0))
                 count -= 1
                 retry = True
-        return job
+        return job, state
 
     def notify_test_started(self, job):
         """Tell the server that we have started the test. Used when the queueing isn't handled directly by the server responsible for a test"""
@@ -851,7 +978,7 @@ class WebPageTest(object):
                     except Exception:
                         pass
                 # Set up the task configuration options
-                task['port'] = 9222 + (self.test_run_count % 500)
+                task['port'] = self.options.cdpport + (self.test_run_count % 500)
                 task['task_prefix'] = "{0:d}".format(run)
                 if task['cached']:
                     task['task_prefix'] += "_Cached"
@@ -909,31 +1036,16 @@ class WebPageTest(object):
                         if len(block):
                             task['block'].append(block)
                 if 'blockDomains' in job:
-                    if 'host_rules' not in task:
-                        task['host_rules'] = []
-                    if 'block_domains' not in task:
-                        task['block_domains'] = []
+                    add_block_domains(task, job['blockDomains'], "0.0.0.0")
+                # Add the crypto mining block list (only loaded from disk once)
+                static_block_domains = get_static_block_domains()
+                if static_block_domains:
                     if 'dns_override' not in task:
                         task['dns_override'] = []
-                    domains = re.split('[, ]', job['blockDomains'])
-                    for domain in domains:
-                        domain = domain.strip()
-                        if len(domain) and domain.find('"') == -1:
-                            task['block_domains'].append(domain)
-                            task['host_rules'].append('"MAP {0} 127.0.0.1"'.format(domain))
-                            if re.match(r'^[a-zA-Z0-9\-\.]+$', domain):
-                                task['dns_override'].append([domain, "0.0.0.0"])
-                # Load the crypto mining block list
-                crypto_list = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'support', 'adblock', 'nocoin', 'hosts.txt')
-                if os.path.exists(crypto_list):
-                    with open(crypto_list, 'rt') as f_in:
-                        if 'dns_override' not in task:
-                            task['dns_override'] = []
-                        for line in f_in:
-                            if line.startswith('0.0.0.0'):
-                                domain = line[8:].strip()
-                                task['dns_override'].append([domain, "0.0.0.0"])
+                    task['dns_override'].extend([[domain, "0.0.0.0"] for domain in static_block_domains])
                 self.build_script(job, task)
+                # Indexed copy of the rules for the local DNS resolver (the browsers get the lists)
+                task['host_rules_table'] = HostRules.from_task(task)
                 task['width'] = job['width']
                 task['height'] = job['height']
                 if 'mobile' in job and job['mobile']:
@@ -985,7 +1097,7 @@ class WebPageTest(object):
 
     def running_another_test(self, task):
         """Increment the port for Chrome and the run count"""
-        task['port'] = 9222 + (self.test_run_count % 500)
+        task['port'] = self.options.cdpport + (self.test_run_count % 500)
         self.test_run_count += 1
 
     def build_script(self, job, task):
@@ -1087,20 +1199,7 @@ class WebPageTest(object):
                     elif command == 'blockdomains':
                         keep = False
                         if target is not None:
-                            if 'block_domains' not in task:
-                                task['block_domains'] = []
-                            if 'host_rules' not in task:
-                                task['host_rules'] = []
-                            if 'dns_override' not in task:
-                                task['dns_override'] = []
-                            domains = re.split('[, ]', target)
-                            for domain in domains:
-                                domain = domain.strip()
-                                if len(domain) and domain.find('"') == -1:
-                                    task['block_domains'].append(domain)
-                                    task['host_rules'].append('"MAP {0} 127.0.0.1"'.format(domain))
-                                    if re.match(r'^[a-zA-Z0-9\-\.]+$', domain):
-                                        task['dns_override'].append([domain, "127.0.0.1"])
+                            add_block_domains(task, target, "127.0.0.1")
                     elif command == 'blockdomainsexcept':
                         keep = False
                         if target is not None:
@@ -1584,17 +1683,32 @@ class WebPageTest(object):
         if self.is_dead:
             return
         logging.info('Uploading result')
+        upload_start = monotonic()
         self.profile_start(task, 'wpt.upload')
         self.cpu_pct = None
         self.update_browser_viewport(task)
         if task['run'] == 1 and not task['cached']:
             self.collect_crux_data(task)
+        from internal.artifact_store import ARTIFACTS
+        if self.options.archiveruns:
+            from internal.replay import archive_run
+            ARTIFACTS.flush()
+            archive_run(self.options.archiveruns, self.options, self.job, task, 'input')
         # Post-process the given test run
+        processing_start = monotonic()
+        self.profile_start(task, 'wpt.process_test')
         try:
             from internal.process_test import ProcessTest
             ProcessTest(self.options, self.job, task)
         except Exception:
             logging.exception('Error post-processing test')
+        self.profile_end(task, 'wpt.process_test')
+        metrics.PROCESSING_DURATION.observe(monotonic() - processing_start)
+        # Make sure all of the results are on disk for the upload
+        ARTIFACTS.flush()
+        ARTIFACTS.release(task['dir'])
+        if self.options.archiveruns:
+            archive_run(self.options.archiveruns, self.options, self.job, task, 'expected')
         # Stop logging to the file
         if self.log_handler is not None:
             try:
@@ -1693,6 +1807,7 @@ class WebPageTest(object):
             except Exception:
                 pass
         self.profile_end(task, 'wpt.upload')
+        metrics.UPLOAD_DURATION.observe(monotonic() - upload_start)
         if 'profile_data' in task:
             try:
                 self.profile_end(task, 'test')
@@ -1719,7 +1834,10 @@ class WebPageTest(object):
         response = None
         try:
             if file_path is not None and os.path.isfile(file_path):
-                logging.debug('Uploading filename : %d bytes', os.path.getsize(file_path))
+                file_size = os.path.getsize(file_path)
+                logging.debug('Uploading filename : %d bytes', file_size)
+                metrics.UPLOAD_SIZE.observe(file_size)
+                metrics.BYTES_UPLOADED.inc(file_size)
                 response = self.session.post(url,
                                   files={'file': (filename, open(file_path, 'rb'))},
                                   timeout=600)
@@ -1746,11 +1864,15 @@ class WebPageTest(object):
             self.post_data('https://license.webpagetest.org/', data)
 
     def profile_start(self, task, event_name):
+        SPANS.start(event_name)
         if task is not None and 'profile_data' in task:
             with task['profile_data']['lock']:
                 task['profile_data'][event_name] = {'s': round(monotonic() - task['profile_data']['start'], 3)}
 
     def profile_end(self, task, event_name):
+        elapsed = SPANS.end(event_name)
+        if elapsed is not None:
+            metrics.PROFILE_DURATION.observe(elapsed, event_name)
         if task is not None and 'profile_data' in task:
             with task['profile_data']['lock']:
                 if event_name in task['profile_data']:
@@ -1802,38 +1924,35 @@ class WebPageTest(object):
             try:
                 from .os_util import get_free_disk_space
                 proxies = {"http": None, "https": None}
+                query = "&pc=" + quote_plus(self.pc_name)
+                query += "&cpu={0:0.2f}".format(cpu)
+                if self.key is not None:
+                    query += "&key=" + quote_plus(self.key)
+                if self.instance_id is not None:
+                    query += "&ec2=" + quote_plus(self.instance_id)
+                if self.zone is not None:
+                    query += "&ec2zone=" + quote_plus(self.zone)
+                if self.options.android:
+                    query += '&apk=1'
+                query += '&version={0}'.format(self.version)
+                if self.screen_width is not None:
+                    query += '&screenwidth={0:d}'.format(self.screen_width)
+                if self.screen_height is not None:
+                    query += '&screenheight={0:d}'.format(self.screen_height)
+                if self.dns_servers is not None:
+                    query += '&dns=' + quote_plus(self.dns_servers)
+                query += '&freedisk={0:0.3f}'.format(get_free_disk_space())
+                uptime = self.get_uptime_minutes()
+                if uptime is not None:
+                    query += '&upminutes={0:d}'.format(uptime)
+                if self.job is not None and 'Test ID' in self.job:
+                    query += '&test=' + quote_plus(self.job['Test ID'])
+                # Ping all of the server/location pairs at the same time
+                pings = []
                 for server in self.work_servers:
                     for location in self.test_locations:
-                        url = server + 'ping.php?'
-                        url += "location=" + quote_plus(location)
-                        url += "&pc=" + quote_plus(self.pc_name)
-                        url += "&cpu={0:0.2f}".format(cpu)
-                        if self.key is not None:
-                            url += "&key=" + quote_plus(self.key)
-                        if self.instance_id is not None:
-                            url += "&ec2=" + quote_plus(self.instance_id)
-                        if self.zone is not None:
-                            url += "&ec2zone=" + quote_plus(self.zone)
-                        if self.options.android:
-                            url += '&apk=1'
-                        url += '&version={0}'.format(self.version)
-                        if self.screen_width is not None:
-                            url += '&screenwidth={0:d}'.format(self.screen_width)
-                        if self.screen_height is not None:
-                            url += '&screenheight={0:d}'.format(self.screen_height)
-                        if self.dns_servers is not None:
-                            url += '&dns=' + quote_plus(self.dns_servers)
-                        free_disk = get_free_disk_space()
-                        url += '&freedisk={0:0.3f}'.format(free_disk)
-                        uptime = self.get_uptime_minutes()
-                        if uptime is not None:
-                            url += '&upminutes={0:d}'.format(uptime)
-                        if self.job is not None and 'Test ID' in self.job:
-                            url += '&test=' + quote_plus(self.job['Test ID'])
-                        try:
-                            self.session.get(url, timeout=5, proxies=proxies)
-                        except Exception:
-                            pass
+                        pings.append((server, server + 'ping.php?location=' + quote_plus(location) + query))
+                self.server_prober.probe(pings, 5, 10, proxies)
             except Exception:
                 logging.exception('Error reporting diagnostics')
 
@@ -1880,27 +1999,37 @@ class WebPageTest(object):
         """Agent is dying.  Re-queue the test if possible and if we have one"""
         if not self.is_dead:
             self.is_dead = True
+            # Let a prefetch that is in flight finish claiming its job so it gets re-queued too
+            self.wait_for_prefetch(60)
             # requeue the raw test through the original server
             if self.raw_job is not None and 'work_server' in self.raw_job:
-                url = self.raw_job['work_server'] + 'requeue.php?id=' + quote_plus(self.raw_job['id'])
-                url += '&sig=' + quote_plus(self.raw_job['signature'])
-                url += '&location=' + quote_plus(self.raw_job['location'])
-                if self.scheduler_node is not None:
-                    url += '&node=' + quote_plus(self.scheduler_node)
-                if 'jobID' in self.raw_job:
-                    url += '&jobID=' + quote_plus(self.raw_job['jobID'])
-                proxies = {"http": None, "https": None}
-                self.session.post(url, headers={'Content-Type': 'text/plain'}, data=self.raw_job['payload'], timeout=30, proxies=proxies)
+                self.requeue_job(self.raw_job, self.scheduler_node)
                 self.scheduler_job_done()
+            self.requeue_prefetched_tests()
+
+    def requeue_job(self, raw_job, scheduler_node):
+        """Send a claimed job back to the server it came from"""
+        if raw_job is not None and 'work_server' in raw_job:
+            url = raw_job['work_server'] + 'requeue.php?id=' + quote_plus(raw_job['id'])
+            url += '&sig=' + quote_plus(raw_job['signature'])
+            url += '&location=' + quote_plus(raw_job['location'])
+            if scheduler_node is not None:
+                url += '&node=' + quote_plus(scheduler_node)
+            if 'jobID' in raw_job:
+                url += '&jobID=' + quote_plus(raw_job['jobID'])
+            proxies = {"http": None, "https": None}
+            self.session.post(url, headers={'Content-Type': 'text/plain'}, data=raw_job['payload'], timeout=30, proxies=proxies)
 
-    def install_extensions(self):
+    def install_extensions(self, job=None):
         """Download and cache the requested extensions from the Chrome web store"""
-        if self.job is not None and 'extensions' in self.job:
+        if job is None:
+            job = self.job
+        if job is not None and 'extensions' in job:
             now = time.time()
             cache_time = 604800 # Default to a one-week extension cache
-            if 'extensions_cache_time' in self.job:
+            if 'extensions_cache_time' in job:
                 try:
-                    cache_time = int(self.job['extensions_cache_time'])
+                    cache_time = int(job['extensions_cache_time'])
                 except Exception:
                     logging.exception('Error setting extension cache time')
             expired = now - cache_time
@@ -1910,7 +2039,7 @@ class WebPageTest(object):
                     os.makedirs(extensions_dir, exist_ok=True)
                 except Exception:
                     pass
-            extensions = self.job['extensions'].split(',')
+            extensions = job['extensions'].split(',')
             for extension in extensions:
                 extension = extension.strip()
                 if extension.isalnum():
@@ -0,0 +1,236 @@
+import copy
+import logging
+import random
+
+import pytest
+
+from internal import interval_analytics
+from internal.process_test import ProcessTest
+
+
+def legacy_calculate_tti(data):
+    """calculate_TTI as it was before the interval-analytics module (the reference for the new one)"""
+    try:
+        page_data = data['pageData']
+        if 'interactivePeriods' in page_data and page_data['interactivePeriods']:
+            interactive_periods = page_data['interactivePeriods']
+            start_time = 0
+            tti = None
+            last_interactive = 0
+            first_interactive = None
+            measurement_end = 0
+            max_fid = None
+            total_blocking_time = None
+            if 'render' in page_data and page_data['render'] > 0:
+                start_time = page_data['render']
+            elif 'firstContentfulPaint' in page_data and page_data['firstContentfulPaint'] > 0:
+                start_time = page_data['firstContentfulPaint']
+            elif 'firstPaint' in page_data and page_data['firstPaint'] > 0:
+                start_time = page_data['firstPaint']
+            dcl = None
+            if 'domContentLoadedEventEnd' in page_data:
+                dcl = page_data['domContentLoadedEventEnd']
+            long_tasks = None
+            if 'longTasks' in page_data:
+                long_tasks = page_data['longTasks']
+
+            # Run the actual TTI calculation
+            if start_time > 0:
+                # See when the absolute last interaction measurement was
+                for window in interactive_periods:
+                    if window[1] > measurement_end:
+                        measurement_end = max(window[1], start_time)
+                        last_interactive = max(window[0], start_time)
+
+                # Start by filtering the interactive windows to only include 5 second windows that don't
+                # end before the start time.
+                end = 0
+                iw = []
+                for window in interactive_periods:
+                    end = window[1]
+                    duration = window[1] - window[0]
+                    if end > start_time and duration >= 5000:
+                        iw.append(window)
+                        if first_interactive is None or window[0] < first_interactive:
+                            first_interactive = max(window[0], start_time)
+
+                # Find all of the request windows with 5 seconds of no more than 2 concurrent document requests
+                rw = []
+                requests = data['requests']
+                if iw and requests:
+                    # Build a list of start/end events for document requests
+                    req = []
+                    for request in requests:
+                        if 'contentType' in request and \
+                                'load_start' in request and request['load_start'] >= 0 and \
+                                'load_end' in request and request['load_end'] > start_time:
+                            if 'method' not in request or request['method'] == 'GET':
+                                req.append({'type': 'start', 'time': request['load_start']})
+                                req.append({'type': 'end', 'time': request['load_end']})
+
+                    # walk the list of events tracking the number of in-flight requests and log any windows > 5 seconds
+                    if req:
+                        req.sort(key=lambda x: x['time'])
+                        window_start = 0
+                        in_flight = 0
+                        for e in req:
+                            if e['type'] == 'start':
+                                in_flight += 1
+                                if window_start is not None and in_flight > 2:
+                                    window_end = e['time']
+                                    if window_end - window_start >= 5000:
+                                        rw.append([window_start, window_end])
+                                    window_start = None
+                            else:
+                                in_flight -= 1
+                                if window_start is not None and in_flight <= 2:
+                                    window_start = e['time']
+                        if window_start is not None and end - window_start >= 5000:
+                            rw.append([window_start, end])
+
+                # Find the first interactive window that also has at least a 5 second intersection with one of the request windows
+                if rw:
+                    window = None
+                    for i in iw:
+                        if window is None:
+                            for r in rw:
+                                if window is None:
+                                    intersect = [max(i[0], r[0]), min(i[1], r[1])]
+                                    if intersect[1] - intersect[0] >= 5000:
+                                        window = i
+                                        break
+                    if window is not None:
+                        tti = max(start_time, window[0])
+
+                # Calculate the total blocking time - https://web.dev/tbt/
+                # and the max possible FID (longest task)
+                end_time = tti if tti is not None else last_interactive
+                if long_tasks:
+                    total_blocking_time = 0
+                    max_fid = 0
+                    if end_time > start_time:
+                        for task in long_tasks:
+                            start = max(task[0], start_time) + 50 # "blocking" time excludes the first 50ms
+                            end = min(task[1], end_time)
+                            busy_time = end - start
+                            if busy_time > 0:
+                                total_blocking_time += busy_time
+                                if busy_time > max_fid:
+                                    max_fid = busy_time
+
+                # DOM Content loaded is the floor for any possible TTI times
+                if dcl is not None:
+                    if tti is not None and tti > 0 and dcl > tti:
+                        tti = dcl
+                    if first_interactive is not None and first_interactive > 0 and dcl > first_interactive:
+                        first_interactive = dcl
+
+            # Merge the metrics into the page data
+            if first_interactive is not None and first_interactive > 0:
+                page_data['FirstInteractive'] = first_interactive
+            if tti is not None and tti > 0:
+                page_data['TimeToInteractive'] = tti
+            if max_fid is not None:
+                page_data['maxFID'] = max_fid
+            if measurement_end > 0:
+                page_data['TTIMeasurementEnd'] = measurement_end
+            if last_interactive > 0:
+                page_data['LastInteractive'] = last_interactive
+            if 'TimeToInteractive' not in page_data and measurement_end > 0 and last_interactive > 0 and measurement_end - last_interactive >= 5000:
+                page_data['TimeToInteractive'] = last_interactive
+                if 'FirstInteractive' not in page_data:
+                    page_data['FirstInteractive'] = last_interactive
+            if 'FirstInteractive' in page_data:
+                page_data['FirstCPUIdle'] = page_data['FirstInteractive']
+            if total_blocking_time is not None:
+                page_data['TotalBlockingTime'] = total_blocking_time
+    except Exception:
+        logging.exception('Error calculating TTI')
+
+
+def random_page(rand):
+    """Page data and requests with randomized interactive windows, requests and long tasks.
+    Times are on a coarse grid (to get ties) and either ints or floats."""
+    as_float = rand.random() < 0.5
+
+    def ms(value):
+        return value + rand.choice([0.0, 0.25, 0.5]) if as_float else value
+    page_data = {}
+    end = 0
+    periods = []
+    for _ in range(rand.randint(1, 8)):
+        start = end + rand.randint(0, 40) * 250
+        end = start + rand.randint(0, 40) * 250
+        periods.append([ms(start), ms(end)])
+    page_data['interactivePeriods'] = periods
+    for key in ['render', 'firstContentfulPaint', 'firstPaint']:
+        if rand.random() < 0.5:
+            page_data[key] = ms(rand.randint(-1, 20) * 250)
+    if rand.random() < 0.7:
+        page_data['domContentLoadedEventEnd'] = ms(rand.randint(0, 60) * 250)
+    if rand.random() < 0.8:
+        tasks = []
+        for _ in range(rand.randint(0, 12)):
+            start = rand.randint(0, 120) * 125
+            tasks.append([ms(start), ms(start + rand.randint(0, 8) * 50)])
+        page_data['longTasks'] = tasks
+    requests = []
+    for _ in range(rand.randint(0, 25)):
+        start = rand.randint(-1, 80) * 250
+        request = {'load_start': ms(start), 'load_end': ms(start + rand.randint(0, 40) * 250)}
+        if rand.random() < 0.9:
+            request['contentType'] = 'text/html'
+        if rand.random() < 0.3:
+            request['method'] = rand.choice(['GET', 'POST'])
+        requests.append(request)
+    return {'pageData': page_data, 'requests': requests}
+
+
+def calculate_tti(data):
+    process = ProcessTest.__new__(ProcessTest)
+    process.data = data
+    process.calculate_TTI()
+    return data['pageData']
+
+
+def typed(page_data):
+    return {key: (type(value), value) for key, value in page_data.items()}
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_matches_legacy_calculation(seed):
+    rand = random.Random(seed)
+    found = set()
+    for _ in range(500):
+        data = random_page(rand)
+        expected = copy.deepcopy(data)
+        legacy_calculate_tti(expected)
+        page_data = calculate_tti(data)
+        assert typed(page_data) == typed(expected['pageData'])
+        found.update(key for key in ['TimeToInteractive', 'FirstInteractive', 'TotalBlockingTime', 'maxFID']
+                     if key in page_data)
+    assert found == set(['TimeToInteractive', 'FirstInteractive', 'TotalBlockingTime', 'maxFID'])
+
+
+def test_quiet_window():
+    # Three requests in flight from 12s, the network is quiet from 1s (when the second one finishes) until then
+    requests = [{'contentType': 'text/html', 'load_start': 0, 'load_end': 1000},
+                {'contentType': 'text/html', 'load_start': 500, 'load_end': 1000},
+                {'contentType': 'image/png', 'load_start': 12000, 'load_end': 15000},
+                {'contentType': 'image/png', 'load_start': 12000, 'load_end': 16000},
+                {'contentType': 'image/png', 'load_start': 12000, 'load_end': 17000},
+                {'contentType': 'text/html', 'method': 'POST', 'load_start': 100, 'load_end': 30000}]
+    metrics = interval_analytics.interactive_metrics([[0, 2000], [2500, 8000], [9000, 30000]], requests,
+                                                     [[1000, 1800], [2000, 2600], [9500, 9540]], 1500)
+    assert metrics['tti'] == 2500
+    assert metrics['first_interactive'] == 2500
+    assert metrics['last_interactive'] == 9000
+    assert metrics['measurement_end'] == 30000
+    # Blocking time is clipped to between the start time and TTI
+    assert metrics['total_blocking_time'] == 250 + 450
+    assert metrics['max_fid'] == 450
+    # The window has to overlap the quiet network by the full 5 seconds
+    metrics = interval_analytics.interactive_metrics([[0, 2000], [8000, 14000]], requests, None, 1500)
+    assert metrics['tti'] is None
+    assert metrics['first_interactive'] == 8000
+    assert metrics['total_blocking_time'] is None
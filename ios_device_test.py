@@ -0,0 +1,92 @@
+import base64
+import io
+import queue
+import random
+import socket
+import threading
+
+from internal.ios_device import iOSDevice
+
+
+def message(timestamp, event, data=None, encoded=False):
+    """Build one line of iWptBrowser traffic"""
+    line = '{0}\t{1}'.format(timestamp, event).encode('utf-8')
+    if encoded:
+        line += b'!encoded'
+    if data is not None:
+        line += b'\t' + (base64.b64encode(data) if encoded else data)
+    return line + b'\n'
+
+
+def replay(device, traffic, seed=0):
+    """Feed the traffic to the message pump over a local socket in random-sized chunks"""
+    device_end, agent_end = socket.socketpair()
+    device.socket = agent_end
+    pump = threading.Thread(target=device.pump_messages)
+    pump.daemon = True
+    pump.start()
+    rand = random.Random(seed)
+    pos = 0
+    while pos < len(traffic):
+        size = rand.choice([1, 7, 100, 4096, 65536, 200000])
+        device_end.sendall(traffic[pos:pos + size])
+        pos += size
+    device_end.close()
+    pump.join(30)
+    assert not pump.is_alive()
+    agent_end.close()
+
+
+def drain(msg_queue):
+    messages = []
+    while True:
+        try:
+            messages.append(msg_queue.get(timeout=1))
+        except queue.Empty:
+            break
+    return messages
+
+
+def test_replay_device_traffic():
+    rand = random.Random(1)
+    frames = [bytes(rand.getrandbits(8) for _ in range(size)) for size in [10, 300000, 70000, 1]]
+    traffic = b''.join([
+        message('100.0', '1:OK'),
+        message('100.1', 'VideoData', frames[0], encoded=True),
+        message('100.2', '2:OK', b'some\ttabbed\nresult', encoded=True),
+        message('100.3', 'VideoData', frames[1], encoded=True),
+        # Malformed: the payload isn't valid base64
+        message('100.4', '3:OK!encoded', b'abcde'),
+        message('100.5', 'VideoData', frames[2], encoded=True),
+        # Malformed: the event isn't valid UTF-8
+        b'100.6\t\xff\xfe:OK\tdata\n',
+        b'\r\n',
+        message('100.7', 'PageLoaded'),
+        message('100.8', 'VideoData', frames[3], encoded=True),
+        message('100.9', '4:OK', b'done'),
+    ])
+    device = iOSDevice()
+    device.video_file = io.BytesIO()
+    device.notification_queue = queue.Queue()
+    replay(device, traffic)
+
+    assert device.video_file.getvalue() == b''.join(frames)
+    assert device.video_size == sum(len(frame) for frame in frames)
+    messages = drain(device.messages)
+    assert [(msg.get('id'), msg['msg'], msg.get('data')) for msg in messages] == [
+        ('1', 'OK', None),
+        ('2', 'OK', b'some\ttabbed\nresult'),
+        ('4', 'OK', 'done'),
+        (None, 'disconnected', None)]
+    notifications = drain(device.notification_queue)
+    assert [msg['msg'] for msg in notifications] == ['PageLoaded']
+
+
+def test_chunking_does_not_change_messages():
+    traffic = b''.join(message('1.{0:d}'.format(i), '{0:d}:OK'.format(i), 'result {0:d}'.format(i).encode('utf-8'))
+                       for i in range(200))
+    for seed in range(3):
+        device = iOSDevice()
+        replay(device, traffic, seed)
+        messages = drain(device.messages)
+        assert [msg['data'] for msg in messages[:-1]] == ['result {0:d}'.format(i) for i in range(200)]
@@ -0,0 +1,228 @@
+import gzip
+import json
+import random
+import struct
+import threading
+import time
+import types
+
+from internal.support.pcap_parser import Pcap
+
+CLIENT_MAC = b'\x02\x00\x00\x00\x00\x01'
+SERVER_MAC = b'\x02\x00\x00\x00\x00\x02'
+BROADCAST_MAC = b'\xff\xff\xff\xff\xff\xff'
+CLIENT_IP = bytes([192, 168, 1, 10])
+SERVER_IP = bytes([203, 0, 113, 5])
+
+
+def ipv4(src, dst, protocol, payload):
+    header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), 0, 0, 64, protocol, 0, src, dst)
+    return header + payload
+
+
+def tcp(src_port, dst_port, sequence, payload_length):
+    return struct.pack('!HHLLBBHHH', src_port, dst_port, sequence, 0, 5 << 4, 0x18, 65535, 0, 0) + \
+        b'x' * payload_length
+
+
+def udp(src_port, dst_port, payload):
+    return struct.pack('!HHHH', src_port, dst_port, 8 + len(payload), 0) + payload
+
+
+def ethernet(src, dst, ip_packet):
+    return dst + src + b'\x08\x00' + ip_packet
+
+
+def cooked(packet_type, ip_packet):
+    return struct.pack('!HHHLL', packet_type, 1, 6, 0, 0) + b'\x08\x00' + ip_packet
+
+
+def write_pcap(path, linktype, packets):
+    """packets are (seconds, frame) tuples"""
+    with open(path, 'wb') as f_out:
+        f_out.write(struct.pack('=LHHLLLL', 0xa1b2c3d4, 2, 4, 0, 0, 65535, linktype))
+        for seconds, frame in packets:
+            whole = int(seconds)
+            f_out.write(struct.pack('=LLLL', 1600000000 + whole, int(round((seconds - whole) * 1000000)),
+                                    len(frame), len(frame)))
+            f_out.write(frame)
+
+
+def ethernet_capture():
+    """A DNS lookup, a connection and a spurious retransmit plus broadcast noise, with the
+    byte counts the parser should report"""
+    out = [ethernet(CLIENT_MAC, SERVER_MAC, ipv4(CLIENT_IP, SERVER_IP, 17, udp(40000, 53, b'q' * 30))),
+           ethernet(CLIENT_MAC, SERVER_MAC, ipv4(CLIENT_IP, SERVER_IP, 6, tcp(50000, 443, 1000, 0))),
+           ethernet(CLIENT_MAC, SERVER_MAC, ipv4(CLIENT_IP, SERVER_IP, 6, tcp(50000, 443, 1000, 517)))]
+    data_in = [ethernet(SERVER_MAC, CLIENT_MAC, ipv4(SERVER_IP, CLIENT_IP, 6, tcp(443, 50000, 5000, 1400))),
+               ethernet(SERVER_MAC, CLIENT_MAC, ipv4(SERVER_IP, CLIENT_IP, 6, tcp(443, 50000, 6400, 1400)))]
+    duplicate = ethernet(SERVER_MAC, CLIENT_MAC, ipv4(SERVER_IP, CLIENT_IP, 6, tcp(443, 50000, 5000, 1400)))
+    noise = ethernet(SERVER_MAC, BROADCAST_MAC, ipv4(SERVER_IP, CLIENT_IP, 17, udp(67, 68, b'd' * 200)))
+    packets = [(0.1, out[0]), (0.15, noise), (0.2, out[1]), (0.35, data_in[0]), (0.4, out[2]),
+               (0.55, data_in[1]), (1.25, duplicate)]
+    expected = {'in': sum(len(frame) for frame in data_in) + len(duplicate),
+                'out': sum(len(frame) for frame in out),
+                'in_dup': len(duplicate)}
+    return packets, expected
+
+
+def cooked_capture():
+    """The same kind of exchange in a Linux cooked capture (i.e. android) where the
+    direction comes from the capture itself"""
+    syn = cooked(4, ipv4(CLIENT_IP, SERVER_IP, 6, tcp(50000, 8080, 1, 0)))
+    data_in = cooked(0, ipv4(SERVER_IP, CLIENT_IP, 6, tcp(8080, 50000, 100, 1200)))
+    data_out = cooked(4, ipv4(CLIENT_IP, SERVER_IP, 6, tcp(50000, 8080, 1, 300)))
+    other = cooked(3, ipv4(SERVER_IP, CLIENT_IP, 6, tcp(8080, 50001, 100, 1200)))
+    packets = [(0.5, syn), (0.6, data_in), (0.7, other), (0.8, data_out), (0.9, data_in)]
+    expected = {'in': 2 * len(data_in), 'out': len(syn) + len(data_out), 'in_dup': len(data_in)}
+    return packets, expected
+
+
+def test_process_fixture_captures(tmp_path):
+    for name, linktype, capture in [('ethernet', 1, ethernet_capture), ('cooked', 113, cooked_capture)]:
+        packets, expected = capture()
+        path = str(tmp_path.joinpath(name + '.cap'))
+        write_pcap(path, linktype, packets)
+        pcap = Pcap()
+        pcap.Process(path)
+        assert pcap.bytes == expected, name
+        for direction in ['in', 'out', 'in_dup']:
+            assert sum(pcap.slices[direction]) == expected[direction]
+        # The gzipped capture the agent uploads parses the same
+        with open(path, 'rb') as f_in:
+            with gzip.open(path + '.gz', 'wb') as f_out:
+                f_out.write(f_in.read())
+        compressed = Pcap()
+        compressed.Process(path + '.gz')
+        assert compressed.bytes == expected
+        assert compressed.slices == pcap.slices
+
+
+def test_feed_in_chunks_matches_process(tmp_path):
+    packets, _ = ethernet_capture()
+    path = str(tmp_path.joinpath('capture.cap'))
+    write_pcap(path, 1, packets * 5)
+    expected = Pcap()
+    expected.Process(path)
+    with open(path, 'rb') as f_in:
+        data = f_in.read()
+    rng = random.Random(0)
+    for _ in range(20):
+        pcap = Pcap()
+        offset = 0
+        while offset < len(data):
+            size = rng.randint(1, 200)
+            pcap.Feed(data[offset:offset + size])
+            offset += size
+        assert pcap.bytes == expected.bytes
+        assert pcap.slices == expected.slices
+        assert pcap.connections == expected.connections
+
+
+def fake_browser(tmp_path, pcap_file):
+    from internal.desktop_browser import DesktopBrowser
+    browser = types.SimpleNamespace(must_exit=False, pcap_file=pcap_file, pcap_result=None,
+                                    task={'dir': str(tmp_path), 'prefix': '1', 'page_data': {}})
+    browser.profile_start = lambda name: None
+    browser.profile_end = lambda name: None
+    browser.run_pcap_parser = lambda *args: DesktopBrowser.run_pcap_parser(browser, *args)
+    browser.monitor_pcap = lambda path, monitor: DesktopBrowser.monitor_pcap(browser, path, monitor)
+    browser.process_pcap = lambda: DesktopBrowser.process_pcap(browser)
+    return browser
+
+
+def test_monitor_follows_growing_capture(tmp_path):
+    packets, expected = ethernet_capture()
+    full = str(tmp_path.joinpath('full.cap'))
+    write_pcap(full, 1, packets)
+    with open(full, 'rb') as f_in:
+        data = f_in.read()
+    path = str(tmp_path.joinpath('1.cap'))
+    browser = fake_browser(tmp_path, path)
+    monitor = {'done': False, 'abandoned': False, 'result': None}
+    thread = threading.Thread(target=browser.monitor_pcap, args=(path, monitor))
+    thread.daemon = True
+    thread.start()
+    # tcpdump writing the capture a piece at a time (splitting packets)
+    with open(path, 'wb') as f_out:
+        for offset in range(0, len(data), 97):
+            f_out.write(data[offset:offset + 97])
+            f_out.flush()
+            time.sleep(0.01)
+    monitor['done'] = True
+    thread.join(10)
+    assert not thread.is_alive()
+    assert monitor['result'] is not None
+    assert monitor['result'].bytes == expected
+
+
+def test_abandoned_monitor_leaves_no_result(tmp_path):
+    packets, _ = ethernet_capture()
+    path = str(tmp_path.joinpath('1.cap'))
+    write_pcap(path, 1, packets)
+    browser = fake_browser(tmp_path, path)
+    monitor = {'done': False, 'abandoned': False, 'result': None}
+    thread = threading.Thread(target=browser.monitor_pcap, args=(path, monitor))
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.2)
+    monitor['abandoned'] = True
+    monitor['done'] = True
+    thread.join(10)
+    assert not thread.is_alive()
+    assert monitor['result'] is None
+
+
+def test_process_pcap_with_stand_alone_parser(tmp_path):
+    packets, expected = ethernet_capture()
+    path = str(tmp_path.joinpath('1.cap'))
+    write_pcap(path, 1, packets)
+    browser = fake_browser(tmp_path, path)
+    browser.process_pcap()
+    page_data = browser.task['page_data']
+    assert page_data == {'pcapBytesIn': expected['in'], 'pcapBytesOut': expected['out'],
+                         'pcapBytesInDup': expected['in_dup']}
+    assert not tmp_path.joinpath('1.cap').exists()
+    assert tmp_path.joinpath('1.cap.gz').exists()
+    with gzip.open(str(tmp_path.joinpath('1_pcap_slices.json.gz')), 'rt') as f_in:
+        slices = json.load(f_in)
+    assert sum(slices['in']) == expected['in']
+    with gzip.open(str(tmp_path.joinpath('1_pcap_connections.json.gz')), 'rt') as f_in:
+        connections = json.load(f_in)
+    assert sum(connection['in'] for connection in connections.values()) == expected['in']
+
+
+def test_process_pcap_with_live_result(tmp_path):
+    packets, expected = cooked_capture()
+    path = str(tmp_path.joinpath('1.cap'))
+    write_pcap(path, 113, packets)
+    browser = fake_browser(tmp_path, path)
+    browser.pcap_result = Pcap()
+    browser.pcap_result.Process(path)
+    browser.run_pcap_parser = None
+    browser.process_pcap()
+    assert browser.task['page_data']['pcapBytesIn'] == expected['in']
+    assert browser.pcap_result is None
+    # Same summaries as the stand-alone parser writes
+    stand_alone = Pcap()
+    stand_alone.Process(path + '.gz')
+    with gzip.open(str(tmp_path.joinpath('1_pcap_slices.json.gz')), 'rt') as f_in:
+        assert json.load(f_in) == json.loads(json.dumps(stand_alone.slices))
+    with gzip.open(str(tmp_path.joinpath('1_pcap_connections.json.gz')), 'rt') as f_in:
+        assert json.load(f_in) == json.loads(json.dumps(stand_alone.connections))
+
+
+def test_process_pcap_compress_failure(tmp_path, monkeypatch):
+    packets, _ = ethernet_capture()
+    path = str(tmp_path.joinpath('1.cap'))
+    write_pcap(path, 1, packets)
+    browser = fake_browser(tmp_path, path)
+
+    def failing_open(*args, **kwargs):
+        raise IOError('disk full')
+    monkeypatch.setattr(gzip, 'open', failing_open)
+    browser.process_pcap()
+    # The capture is kept as-is and nothing is reported
+    assert tmp_path.joinpath('1.cap').exists()
+    assert not tmp_path.joinpath('1.cap.gz').exists()
+    assert browser.task['page_data'] == {}
@@ -0,0 +1,130 @@
+import os
+import platform
+import shutil
+import subprocess
+import time
+import uuid
+
+import psutil
+import pytest
+
+from internal import os_util
+from internal.process_tracker import TRACKER, ProcessTracker
+
+pytestmark = pytest.mark.skipif(platform.system() == 'Windows', reason='Signals process trees on Linux/macOS')
+
+
+def is_gone(pid):
+    """The process exited (zombies that haven't been reaped by init yet count as exited)"""
+    try:
+        return psutil.Process(pid).status() == psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return True
+
+
+def wait_gone(pids, timeout=5):
+    end_time = time.monotonic() + timeout
+    while time.monotonic() < end_time:
+        if all(is_gone(pid) for pid in pids):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def spawn_tree():
+    """A shell with a child and a grandchild, in its own session like the browsers"""
+    proc = subprocess.Popen(['/bin/sh', '-c', 'sleep 60 & /bin/sh -c "sleep 60 & wait" & wait'],
+                            start_new_session=True)
+    tree = psutil.Process(proc.pid)
+    end_time = time.monotonic() + 5
+    while len(tree.children(recursive=True)) < 3 and time.monotonic() < end_time:
+        time.sleep(0.05)
+    pids = [child.pid for child in tree.children(recursive=True)]
+    assert len(pids) == 3
+    return proc, pids
+
+
+@pytest.mark.parametrize('force', [False, True])
+def test_kill_tree(force):
+    tracker = ProcessTracker()
+    proc, pids = spawn_tree()
+    tracker.track(proc, 'sh')
+    assert tracker.is_tracked('sh')
+    start = time.monotonic()
+    killed = tracker.kill('sh', force, 10)
+    assert len(killed) == 1
+    assert time.monotonic() - start < 5
+    assert proc.poll() is not None
+    assert wait_gone(pids)
+    assert not tracker.is_tracked('sh')
+
+
+def test_wait_returns_on_exit():
+    tracker = ProcessTracker()
+    proc = tracker.track(subprocess.Popen(['sleep', '0.3']), 'sleep')
+    start = time.monotonic()
+    assert tracker.wait('sleep', 10)
+    elapsed = time.monotonic() - start
+    assert proc.returncode == 0
+    # Woken by the exit notification, not the timeout
+    assert elapsed < 5
+    # A process that doesn't exit in time
+    proc = tracker.track(subprocess.Popen(['sleep', '60']), 'sleep')
+    assert not tracker.wait('sleep', 0.5)
+    tracker.kill('sleep', True, 5)
+    assert proc.poll() is not None
+
+
+@pytest.mark.skipif(shutil.which('killall') is None, reason='killall is not installed')
+def test_kill_all_sweeps_untracked(tmp_path, monkeypatch):
+    """Same-name processes outside of the tracked tree are still killed"""
+    exe = 'wptsleep' + uuid.uuid4().hex[:6]
+    path = str(tmp_path.joinpath(exe))
+    shutil.copy(shutil.which('sleep'), path)
+    monkeypatch.setattr(TRACKER, 'processes', [])
+    tracked = TRACKER.track(subprocess.Popen([path, '60'], start_new_session=True), exe)
+    # Left over from an earlier agent (or escaped into its own session)
+    escaped = subprocess.Popen(['setsid', path, '60'])
+    end_time = time.monotonic() + 5
+    while time.monotonic() < end_time and \
+            len([proc for proc in psutil.process_iter(['name']) if proc.info['name'] == exe]) < 2:
+        time.sleep(0.05)
+    os_util.kill_all(exe, True, 10)
+    assert tracked.poll() is not None
+    escaped.wait(5)
+    assert not [proc for proc in psutil.process_iter(['name'])
+                if proc.info['name'] == exe and not is_gone(proc.pid)]
+    os.unlink(path)
+
+
+class FakeShaper(object):
+    def reset(self):
+        pass
+
+
+@pytest.mark.parametrize('exits', [True, False])
+def test_video_capture_stopped_through_the_tracker(tmp_path, monkeypatch, exits):
+    """Only the ffmpeg the browser launched is stopped (not the capture of another agent instance)"""
+    from internal import desktop_browser
+    from internal.desktop_browser import DesktopBrowser
+    monkeypatch.setattr(TRACKER, 'processes', [])
+    monkeypatch.setattr(desktop_browser, 'VIDEO_STOP_TIMEOUT', 0.5)
+    path = str(tmp_path.joinpath('ffmpeg'))
+    shutil.copy(shutil.which('sleep'), path)
+    other = subprocess.Popen([path, '60'])
+    browser = DesktopBrowser('/bin/true', None, {'shaper': FakeShaper()})
+    # An ffmpeg that stops on the q (or one that hangs)
+    script = 'read line; exit 0' if exits else 'read line; sleep 60'
+    browser.ffmpeg = subprocess.Popen(['/bin/sh', '-c', script], stdin=subprocess.PIPE, universal_newlines=True)
+    TRACKER.track(browser.ffmpeg, 'ffmpeg')
+    ffmpeg = browser.ffmpeg
+    start = time.monotonic()
+    browser.on_stop_recording(None)
+    assert time.monotonic() - start < 5
+    assert browser.ffmpeg is None
+    assert ffmpeg.poll() is not None
+    assert (ffmpeg.returncode == 0) == exits
+    assert not TRACKER.is_tracked('ffmpeg')
+    assert other.poll() is None
+    other.kill()
+    other.wait()
@@ -0,0 +1,83 @@
+import os
+import sys
+
+from internal.profile_cache import TEMPLATE_MARKER, ProfileTemplates, warm_profile
+
+# A stand-in browser that initializes the profile (or hangs without writing anything)
+FAKE_BROWSER = '''
+import os
+import sys
+import time
+profile = sys.argv[2]
+if sys.argv[1] == 'ok':
+    with open(os.path.join(profile, 'Local State'), 'w') as f_out:
+        f_out.write('{}')
+    with open(os.path.join(profile, 'lockfile'), 'w') as f_out:
+        f_out.write('')
+time.sleep(60)
+'''
+
+
+def fake_browser_args(tmp_path, mode, profile):
+    script = tmp_path.joinpath('browser.py')
+    script.write_text(FAKE_BROWSER)
+    return [sys.executable, str(script), mode, profile]
+
+
+def test_warm_profile(tmp_path):
+    profile = tmp_path.joinpath('profile')
+    profile.mkdir()
+    expected = [str(profile.joinpath('Local State'))]
+    locks = [str(profile.joinpath('lockfile'))]
+    assert warm_profile(fake_browser_args(tmp_path, 'ok', str(profile)), expected, locks, timeout=10)
+    assert profile.joinpath('Local State').exists()
+    assert not profile.joinpath('lockfile').exists()
+    assert not warm_profile(fake_browser_args(tmp_path, 'hang', str(profile)), [str(profile.joinpath('missing'))],
+                            locks, timeout=1)
+
+
+def test_template_built_once(tmp_path):
+    templates = ProfileTemplates()
+    source = tmp_path.joinpath('browser')
+    source.write_text('build 1')
+    builds = []
+
+    def build(path):
+        builds.append(path)
+        with open(os.path.join(path, 'Preferences'), 'w') as f_out:
+            f_out.write('{}')
+        return True
+    root = str(tmp_path.joinpath('persistent'))
+    template = templates.get_template(root, 'chrome', [str(source)], build)
+    assert template is not None
+    assert os.path.isfile(os.path.join(template, TEMPLATE_MARKER))
+    assert os.path.isfile(os.path.join(template, 'Preferences'))
+    assert templates.get_template(root, 'chrome', [str(source)], build) == template
+    assert len(builds) == 1
+
+
+def test_failed_warm_up_is_not_a_template(tmp_path):
+    templates = ProfileTemplates()
+    source = tmp_path.joinpath('browser')
+    source.write_text('build 1')
+    builds = []
+
+    def build(path):
+        builds.append(path)
+        with open(os.path.join(path, 'Preferences'), 'w') as f_out:
+            f_out.write('partial')
+        return False
+    root = str(tmp_path.joinpath('persistent'))
+    assert templates.get_template(root, 'firefox', [str(source)], build) is None
+    # The failure is remembered so later runs don't pay for the warm-up again
+    assert templates.get_template(root, 'firefox', [str(source)], build) is None
+    assert len(builds) == 1
+    profiles = os.path.join(root, 'profiles')
+    assert not [name for name in os.listdir(profiles)
+                if os.path.isfile(os.path.join(profiles, name, TEMPLATE_MARKER))]
+    # Until the browser is updated
+    source.write_text('build 10')
+    assert templates.get_template(root, 'firefox', [str(source)], build) is None
+    assert len(builds) == 2
+    assert templates.get_template(root, 'firefox', [str(source)], build) is None
+    assert len(builds) == 2
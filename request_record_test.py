@@ -0,0 +1,139 @@
+import copy
+import io
+import json
+import logging
+import pickle
+import threading
+
+import pytest
+
+from internal.devtools import DevTools
+from internal.support.request_record import NetlogRequest, Request, dump, load_requests, to_json
+
+DEVTOOLS_REQUEST = {
+    'type': 3,
+    'id': '1000.1',
+    'request_id': '1000.1',
+    'ip_addr': '203.0.113.5',
+    'full_url': 'https://www.example.com/index.html',
+    'is_secure': 1,
+    'method': 'GET',
+    'host': 'www.example.com',
+    'url': '/index.html',
+    'responseCode': 200,
+    'load_ms': 120,
+    'ttfb_ms': 80,
+    'load_start': 10,
+    'bytesIn': 15230,
+    'headers': {'request': ['GET /index.html HTTP/1.1'], 'response': ['HTTP/1.1 200 OK']},
+    'server_rtt': None,
+    'score_cache': -1,
+    'score_keep-alive': 100,
+    'chunks': [{'ts': 95, 'bytes': 1200}],
+    'securityDetails': {'protocol': 'TLS 1.3'},
+    # Keys that aren't in the field table
+    'cpu.ParseHTML': 12,
+    'custom_extension': {'nested': [1, 2, 3]},
+    '_unknown': 'kept as-is',
+}
+
+NETLOG_REQUEST = {
+    'bytes_in': 1200,
+    'chunks': [{'ts': 1.5, 'bytes': 1200}],
+    'created': 1.0,
+    'url': 'https://www.example.com/app.js',
+    'start': 1.1,
+    'request_headers': ['accept: */*'],
+    'protocol': 'h2',
+    'first_byte': 1.4,
+    'end': 1.6,
+    'stream_id': 3,
+    'status': 200,
+    'body_claimed': True,
+    'not_a_netlog_field': None,
+}
+
+
+@pytest.mark.parametrize('record_type,data', [(Request, DEVTOOLS_REQUEST), (NetlogRequest, NETLOG_REQUEST)])
+def test_round_trip(record_type, data):
+    record = record_type.from_dict(copy.deepcopy(data))
+    assert record.to_dict() == data
+    assert record == data
+    assert len(record) == len(data)
+    assert set(record.keys()) == set(data.keys())
+    for key, value in data.items():
+        assert key in record
+        assert record[key] == value
+    # dict -> record -> dict -> record
+    again = record_type.from_dict(record.to_dict())
+    assert again == record
+    assert again.to_dict() == data
+    # Through the json shape
+    assert record_type(json.loads(json.dumps(to_json(record)))) == data
+    # Through pickle (i.e. to the worker processes)
+    assert pickle.loads(pickle.dumps(record)).to_dict() == data
+    assert record.copy() == data
+
+
+def test_key_order_matches_the_dicts():
+    """The keys serialize in the same (insertion) order as the dicts the records replace"""
+    for record_type, data in [(Request, DEVTOOLS_REQUEST), (NetlogRequest, NETLOG_REQUEST)]:
+        record = record_type(data)
+        assert list(record.to_dict().keys()) == list(data.keys())
+        assert json.dumps(record) == json.dumps(data)
+        record['added'] = 1
+        assert list(record.keys())[-1] == 'added'
+
+
+def test_loaded_records_share_keys():
+    """Requests loaded from json don't each keep a copy of the key strings"""
+    # A copy of each key string per request, like ujson.loads makes
+    loaded = [dict(((key + '.')[:-1], value) for key, value in DEVTOOLS_REQUEST.items()) for _ in range(2)]
+    assert all(a is not b for a, b in zip(loaded[0], loaded[1]))
+    first, second = load_requests(loaded)
+    assert isinstance(first, Request)
+    assert all(a is b for a, b in zip(first, second))
+    assert first == DEVTOOLS_REQUEST and second == DEVTOOLS_REQUEST
+    # Records are left alone
+    assert load_requests([first])[0] is first
+
+
+def test_dict_operations():
+    record = Request({'id': '1', 'extra': 1})
+    assert record.get('url') is None
+    assert record.get('url', '') == ''
+    assert record.setdefault('url', '/') == '/'
+    assert record.pop('extra') == 1
+    assert record.pop('extra', 'gone') == 'gone'
+    del record['url']
+    with pytest.raises(KeyError):
+        del record['url']
+    with pytest.raises(KeyError):
+        record['missing']
+    record['other'] = None
+    assert record.to_dict() == {'id': '1', 'other': None}
+
+
+def test_dump_matches_json():
+    requests = [copy.deepcopy(DEVTOOLS_REQUEST), {'id': '2', 'url': '/', 'something_new': [1]}]
+    result = {'requests': requests, 'pageData': {'loadTime': 100}}
+    expected = json.loads(json.dumps(result))
+    records = {'requests': load_requests(copy.deepcopy(requests)), 'pageData': {'loadTime': 100}}
+    assert all(isinstance(request, Request) for request in records['requests'])
+    out = io.StringIO()
+    dump(records, out)
+    assert json.loads(out.getvalue()) == expected
+    out = io.StringIO()
+    dump(load_requests([copy.deepcopy(NETLOG_REQUEST)], NetlogRequest), out)
+    assert json.loads(out.getvalue()) == [NETLOG_REQUEST]
+
+
+def test_netlog_callback_logs_records(caplog):
+    devtools = DevTools.__new__(DevTools)
+    devtools.netlog_lock = threading.Lock()
+    devtools.netlog_requests = {}
+    devtools.netlog_urls = {}
+    with caplog.at_level(logging.DEBUG):
+        devtools.on_netlog_request_created(7, NetlogRequest(NETLOG_REQUEST))
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+    assert devtools.netlog_urls == {NETLOG_REQUEST['url']: [7]}
@@ -0,0 +1,90 @@
+# Compare the wall time of the batched perceptual speed index SSIM calculation
+# against the per-frame pyssim loop it replaced.
+#
+# Usage: python benchmark_psi.py [--dir <directory of ms_*.png frames>] [--frames 120]
+# If no directory is provided a synthetic video of progressively rendered frames is generated.
+import argparse
+import glob
+import os
+import random
+import shutil
+import sys
+import tempfile
+if (sys.version_info >= (3, 0)):
+    from time import monotonic
+else:
+    from monotonic import monotonic
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'internal', 'support'))
+import visualmetrics # pylint: disable=wrong-import-position,import-error
+
+
+def generate_frames(directory, count, width, height):
+    """Generate a fake page load: a white frame with blocks painted in over time"""
+    from PIL import Image, ImageDraw
+    random.seed(0)
+    img = Image.new('RGB', (width, height), (255, 255, 255))
+    for index in range(count):
+        draw = ImageDraw.Draw(img)
+        left, right = sorted([random.randint(0, width), random.randint(0, width)])
+        top, bottom = sorted([random.randint(0, height), random.randint(0, height)])
+        draw.rectangle([left, top, right, bottom],
+                       fill=(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)))
+        del draw
+        img.save(os.path.join(directory, 'ms_{0:06d}.png'.format(index * 100)))
+
+
+def legacy_scores(frames, target_frame):
+    """The original loop, one pyssim comparison per frame"""
+    from ssim import compute_ssim # pylint: disable=import-error
+    return [compute_ssim(frame, target_frame) for frame in frames]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark perceptual speed index SSIM calculation.')
+    parser.add_argument('--dir', help="Directory of ms_*.png video frames.")
+    parser.add_argument('--frames', type=int, default=120, help="Number of synthetic frames to generate.")
+    parser.add_argument('--width', type=int, default=400, help="Width of the synthetic frames.")
+    parser.add_argument('--height', type=int, default=400, help="Height of the synthetic frames.")
+    parser.add_argument('--scale', type=float, default=1.0, help="Downscale factor for the batched run.")
+    parser.add_argument('--batch', type=int, default=8, help="Batch size for the batched run.")
+    options = parser.parse_args()
+
+    temp_dir = None
+    directory = options.dir
+    if directory is None:
+        temp_dir = tempfile.mkdtemp(prefix='psi-')
+        directory = temp_dir
+        generate_frames(directory, options.frames, options.width, options.height)
+    try:
+        frames = sorted(glob.glob(os.path.join(directory, 'ms_*.png')))
+        if len(frames) < 2:
+            print("At least 2 frames are needed")
+            exit(1)
+        target_frame = frames[-1]
+        print("{0:d} frames".format(len(frames)))
+
+        start = monotonic()
+        batched = visualmetrics.calculate_ssim_scores(frames, target_frame, options.scale, options.batch)
+        batched_time = monotonic() - start
+        print("Batched: {0:0.3f}s".format(batched_time))
+
+        try:
+            start = monotonic()
+            legacy = legacy_scores(frames, target_frame)
+            legacy_time = monotonic() - start
+            print("Per-frame pyssim: {0:0.3f}s".format(legacy_time))
+            if batched_time > 0:
+                print("Speedup: {0:0.1f}x".format(legacy_time / batched_time))
+            delta = max([abs(legacy[i] - batched[i]) for i in range(len(frames))])
+            print("Max SSIM difference: {0:0.6f}".format(delta))
+        except ImportError:
+            print("pyssim is not installed, skipping the per-frame comparison")
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,155 @@
+# Compare the memory use and processing time of the per-request dicts against the compact
+# request records on a large synthetic page (the requests in the devtools requests shape).
+#
+# Usage: python benchmark_requests.py [--requests 5000] [--repeat 3]
+import argparse
+import gc
+import io
+import os
+import random
+import sys
+import tracemalloc
+if (sys.version_info >= (3, 0)):
+    from time import monotonic
+else:
+    from monotonic import monotonic
+try:
+    import ujson as json
+except BaseException:
+    import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'internal', 'support'))
+from request_record import Request, dump # pylint: disable=wrong-import-position,import-error
+
+
+def generate_requests(count):
+    """A page worth of requests with the fields the devtools parser fills in"""
+    random.seed(0)
+    requests = []
+    for index in range(count):
+        host = 'cdn{0:d}.example.com'.format(index % 40)
+        path = '/static/{0:d}/asset-{1:d}.js?v={2:d}'.format(index % 17, index, random.randint(0, 99999))
+        start = random.randint(0, 20000)
+        request = {'type': 3, 'id': '1000.{0:d}'.format(index), 'request_id': '1000.{0:d}'.format(index),
+                   'ip_addr': '192.0.2.{0:d}'.format(index % 250), 'full_url': 'https://' + host + path,
+                   'is_secure': 1, 'method': 'GET', 'host': host, 'url': path,
+                   'raw_id': '1000.{0:d}'.format(index), 'frame_id': 'F{0:d}'.format(index % 3),
+                   'documentURL': 'https://www.example.com/', 'responseCode': 200, 'request_type': 'Script',
+                   'load_ms': random.randint(1, 500), 'ttfb_ms': random.randint(1, 300),
+                   'load_start': start, 'load_start_float': start + 0.25, 'bytesIn': random.randint(100, 90000),
+                   'objectSize': random.randint(100, 90000), 'objectSizeUncompressed': random.randint(100, 300000),
+                   'chunks': [{'ts': start + chunk * 3.5, 'bytes': 1400} for chunk in range(3)],
+                   'expires': '', 'cacheControl': 'max-age=31536000', 'contentType': 'application/javascript',
+                   'contentEncoding': 'br', 'socket': index % 60, 'protocol': 'HTTP/2',
+                   'dns_start': -1, 'dns_end': -1, 'connect_start': -1, 'connect_end': -1,
+                   'ssl_start': -1, 'ssl_end': -1, 'initiator': 'https://www.example.com/',
+                   'initiator_line': '12', 'initiator_column': '40', 'initiator_type': 'parser',
+                   'priority': 'High', 'initial_priority': 'High', 'server_rtt': None,
+                   'headers': {'request': [':method: GET', ':path: ' + path, 'accept: */*'],
+                               'response': [':status: 200', 'content-type: application/javascript']},
+                   'bytesOut': random.randint(100, 900), 'score_cache': -1, 'score_cdn': -1,
+                   'score_gzip': -1, 'score_cookies': -1, 'score_keep-alive': -1, 'score_minify': -1,
+                   'score_combine': -1, 'score_compress': -1, 'score_etags': -1, 'dns_ms': -1,
+                   'connect_ms': -1, 'ssl_ms': -1, 'gzip_total': None, 'gzip_save': None,
+                   'minify_total': None, 'minify_save': None, 'image_total': None, 'image_save': None,
+                   'cache_time': None, 'cdn_provider': None, 'server_count': None}
+        requests.append(request)
+    return requests
+
+
+def process(requests):
+    """A pass like the post-processing (ProcessTest.fix_up_request_times) and HAR timings"""
+    total = 0
+    for index, request in enumerate(requests):
+        start = request['load_start']
+        request['load_end'] = start + request['load_ms']
+        request['ttfb_start'] = start
+        request['ttfb_end'] = start + request['ttfb_ms']
+        request['download_start'] = request['ttfb_end']
+        request['download_end'] = request['load_end']
+        request['download_ms'] = request['download_end'] - request['download_start']
+        request['all_start'] = request['dns_start'] if request['dns_start'] >= 0 else start
+        request['all_end'] = request['load_end']
+        request['all_ms'] = request['all_end'] - request['all_start']
+        request['index'] = index
+        request['number'] = index + 1
+        for key in ['dns_ms', 'connect_ms', 'ssl_ms', 'created', 'body_file']:
+            if key in request:
+                total += 1
+        total += request.get('bytesIn', 0)
+    return total
+
+
+def serialize(data, records):
+    """Write the requests out the way the devtools requests file is written"""
+    out = io.StringIO()
+    if records:
+        dump(data, out)
+    else:
+        json.dump(data, out)
+    return len(out.getvalue())
+
+
+def measure_memory(text, records):
+    """Memory held by the loaded requests (total and for the request containers alone)"""
+    gc.collect()
+    tracemalloc.start()
+    data = json.loads(text)
+    if records:
+        data['requests'] = [Request(request) for request in data['requests']]
+    gc.collect()
+    total, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    containers = sum(sys.getsizeof(request) for request in data['requests'])
+    return total, containers
+
+
+def run(text, records, repeat):
+    """Best time (seconds) for each stage"""
+    times = {}
+    for _ in range(repeat):
+        start = monotonic()
+        data = json.loads(text)
+        if records:
+            data['requests'] = [Request(request) for request in data['requests']]
+        load_end = monotonic()
+        process(data['requests'])
+        process_end = monotonic()
+        serialize(data, records)
+        serialize_end = monotonic()
+        for stage, elapsed in [('load', load_end - start), ('process', process_end - load_end),
+                               ('serialize', serialize_end - process_end)]:
+            times[stage] = min(times.get(stage, elapsed), elapsed)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the compact request records.')
+    parser.add_argument('--requests', type=int, default=5000, help="Number of synthetic requests.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of timed runs of each variant.")
+    options = parser.parse_args()
+
+    page = {'pageData': {'URL': 'https://www.example.com/', 'loadTime': 20000},
+            'requests': generate_requests(options.requests)}
+    text = json.dumps(page)
+    print("{0:d} requests ({1:0.1f} MB of json)".format(options.requests, len(text) / 1048576.0))
+
+    # Make sure the records round-trip to the same json
+    records = [Request(request) for request in page['requests']]
+    if any(record.to_dict() != request for record, request in zip(records, page['requests'])):
+        print("Records do not round-trip to the same requests")
+        sys.exit(1)
+
+    print("{0:10s} {1:>12s} {2:>14s} {3:>10s} {4:>10s} {5:>12s}".format(
+        'variant', 'memory MB', 'containers MB', 'load ms', 'process ms', 'serialize ms'))
+    for name, use_records in [('dict', False), ('record', True)]:
+        total, containers = measure_memory(text, use_records)
+        times = run(text, use_records, max(options.repeat, 1))
+        print("{0:10s} {1:12.2f} {2:14.2f} {3:10.1f} {4:10.1f} {5:12.1f}".format(
+            name, total / 1048576.0, containers / 1048576.0, times['load'] * 1000.0,
+            times['process'] * 1000.0, times['serialize'] * 1000.0))
+
+
+if '__main__' == __name__:
+    main()
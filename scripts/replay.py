@@ -0,0 +1,77 @@
+# Replay the post-processing of archived runs offline: re-run the trace, pcap, video and
+# devtools parsing and the test post-processing from the archived inputs, report the
+# per-stage timings and peak memory and compare the outputs with the archived results.
+#
+# Runs are archived by the agent with --archiveruns <directory>. With no arguments the
+# bundled corpus (scripts/replay_corpus) is replayed, exiting with an error if anything changed.
+#
+# Usage: python replay.py [archive or directory of archives ...] [--repeat 5] [--json results.json]
+#        python replay.py --update    (regenerate the expected results of the bundled corpus)
+import argparse
+import logging
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from internal.replay import MANIFEST, format_results, replay_archive # pylint: disable=wrong-import-position,import-error
+try:
+    import ujson as json
+except BaseException:
+    import json
+
+
+def find_archives(paths):
+    """The archived runs in the given paths (archives or directories of them)"""
+    archives = []
+    for path in paths:
+        if os.path.isfile(os.path.join(path, MANIFEST)):
+            archives.append(path)
+        elif os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, name, MANIFEST)):
+                    archives.append(os.path.join(path, name))
+    return archives
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the post-processing of archived runs.')
+    parser.add_argument('archives', nargs='*',
+                        help="Archived runs (or directories of them). Defaults to the bundled corpus.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of timed replays of each run.")
+    parser.add_argument('--nomemory', action='store_true', default=False,
+                        help="Skip the (slower) replay that measures the peak memory of each stage.")
+    parser.add_argument('--update', action='store_true', default=False,
+                        help="Replace the archived results with the replayed ones.")
+    parser.add_argument('--json', help="Write the results to a json file.")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="Increase verbosity (specify multiple times for more).")
+    options = parser.parse_args()
+
+    log_level = logging.CRITICAL
+    if options.verbose == 1:
+        log_level = logging.ERROR
+    elif options.verbose == 2:
+        log_level = logging.INFO
+    elif options.verbose >= 3:
+        log_level = logging.DEBUG
+    logging.basicConfig(level=log_level, format="%(asctime)s.%(msecs)03d - %(message)s", datefmt="%H:%M:%S")
+
+    paths = options.archives or [os.path.join(ROOT, 'scripts', 'replay_corpus')]
+    archives = find_archives(paths)
+    if not archives:
+        parser.error("No archived runs found in {0}".format(', '.join(paths)))
+    results = []
+    for archive in archives:
+        result = replay_archive(archive, max(options.repeat, 1), not options.nomemory, options.update)
+        print(format_results(result))
+        results.append(result)
+    if options.json:
+        with open(options.json, 'wt') as f_out:
+            json.dump(results, f_out)
+    if any(result['diffs'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import json
+import socket
+import threading
+import time
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import pytest
+import requests
+
+from internal import server_probe
+from internal.server_probe import ServerProber
+
+PROXIES = {'http': None, 'https': None}
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """A local work server with injected latency and error responses"""
+    daemon_threads = True
+
+    def __init__(self, latency=0, status=200):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.latency = latency
+        self.status = status
+        self.jobs = []
+        self.calls = []
+        self.requeued = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0:d}/'.format(self.server_address[1])
+
+    def add_job(self, test_id):
+        self.jobs.append({'Test ID': test_id, 'url': 'https://www.example.com/', 'runs': 1,
+                          'signature': 'sig-' + test_id, 'work_server': self.url})
+
+    def count(self, page):
+        with self.lock:
+            return len([path for path in self.calls if path.startswith('/' + page)])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def respond(self, body):
+        server = self.server
+        with server.lock:
+            server.calls.append(self.path)
+        if server.latency:
+            time.sleep(server.latency)
+        if server.status != 200:
+            self.send_response(server.status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        body = ''
+        if self.path.startswith('/getwork.php'):
+            with self.server.lock:
+                if self.server.jobs:
+                    job = self.server.jobs.pop(0)
+                    body = job if isinstance(job, str) else json.dumps(job)
+        self.respond(body)
+
+    def do_POST(self):
+        payload = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        if self.path.startswith('/requeue.php'):
+            with self.server.lock:
+                self.server.requeued.append((self.path, payload))
+        self.respond('')
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(**kwargs):
+        server = StubServer(**kwargs)
+        started.append(server)
+        return server
+    yield start
+    for server in started:
+        server.stop()
+
+
+def refused_url():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return 'http://127.0.0.1:{0:d}/'.format(port)
+
+
+def test_fetch_records_health(servers):
+    healthy = servers(latency=0.05)
+    failing = servers(status=500)
+    prober = ServerProber(requests.Session())
+    response = prober.fetch(healthy.url, healthy.url + 'getwork.php', 5, PROXIES)
+    assert response.status_code == 200
+    assert prober.health[healthy.url].latency >= 0.05
+    assert prober.is_available(healthy.url)
+    response = prober.fetch(failing.url, failing.url + 'getwork.php', 5, PROXIES)
+    assert response.status_code == 500
+    assert prober.health[failing.url].failures == 1
+    assert not prober.is_available(failing.url)
+    refused = refused_url()
+    with pytest.raises(requests.exceptions.RequestException):
+        prober.fetch(refused, refused + 'getwork.php', 5, PROXIES)
+    assert not prober.is_available(refused)
+    assert prober.order_servers([failing.url, refused, healthy.url]) == [healthy.url]
+    # When everything is backing off the least-failing server is still polled
+    prober.fetch(failing.url, failing.url + 'getwork.php', 5, PROXIES)
+    assert prober.order_servers([failing.url, refused]) == [refused]
+
+
+def test_backoff_grows_and_recovers(servers, monkeypatch):
+    server = servers(status=503)
+    prober = ServerProber(requests.Session())
+    monkeypatch.setattr(server_probe.random, 'uniform', lambda low, high: 1.0)
+    backoffs = []
+    for _ in range(10):
+        prober.fetch(server.url, server.url + 'ping.php', 5, PROXIES)
+        health = prober.health[server.url]
+        backoffs.append(health.retry_after - server_probe.monotonic())
+    assert backoffs[1] > backoffs[0] * 1.5
+    assert backoffs[-1] <= server_probe.BACKOFF_MAX
+    assert backoffs[-1] > server_probe.BACKOFF_MAX - 5
+    server.status = 200
+    prober.fetch(server.url, server.url + 'ping.php', 5, PROXIES)
+    assert prober.is_available(server.url)
+    assert prober.health[server.url].failures == 0
+
+
+def test_probe_is_concurrent_with_a_deadline(servers):
+    slow = [servers(latency=0.5) for _ in range(4)]
+    hung = servers(latency=3)
+    failing = servers(status=500)
+    prober = ServerProber(requests.Session())
+    pings = [(server.url, server.url + 'ping.php?location=test') for server in slow + [hung, failing]]
+    start = time.monotonic()
+    responses = prober.probe(pings, 10, 1.5, PROXIES)
+    elapsed = time.monotonic() - start
+    # The four slow servers are pinged at the same time and the hung one doesn't hold up the rest
+    assert elapsed < 1.5 + 0.5
+    assert [response.status_code for response in responses[:4]] == [200] * 4
+    assert responses[4] is None
+    assert responses[5].status_code == 500
+    # The failing server is skipped while it backs off
+    prober.probe(pings[5:], 10, 1.5, PROXIES)
+    assert failing.count('ping.php') == 1
@@ -0,0 +1,119 @@
+import gzip
+import json
+import os
+import threading
+import time
+
+from internal import spans
+from internal.spans import SpanRecorder
+
+
+def complete_events(trace):
+    return [event for event in trace['traceEvents'] if event['ph'] == 'X']
+
+
+def test_nested_spans():
+    recorder = SpanRecorder()
+    recorder.begin_job('T1')
+    recorder.start('wpt.run', {'run': 1})
+    with recorder.span('dt.navigate'):
+        # The same name again is nested inside the outer span
+        recorder.start('dt.navigate')
+        time.sleep(0.01)
+        inner = recorder.end('dt.navigate')
+    outer = recorder.end('wpt.run')
+    assert recorder.end('wpt.run') is None
+    assert recorder.end('never.started') is None
+    assert recorder.open == {}
+    assert outer > inner >= 0.01
+    events = complete_events(recorder.get_trace())
+    assert [event['name'] for event in events] == ['wpt.run', 'dt.navigate', 'dt.navigate']
+    run, navigate, nested = events
+    assert run['cat'] == 'wpt' and run['args'] == {'run': 1}
+    assert 'args' not in navigate
+    assert run['ts'] <= navigate['ts'] <= nested['ts']
+    assert nested['ts'] + nested['dur'] <= navigate['ts'] + navigate['dur'] <= run['ts'] + run['dur']
+    assert navigate['dur'] > nested['dur']
+
+
+def test_same_name_on_different_threads():
+    recorder = SpanRecorder()
+    recorder.begin_job('T1')
+    started = threading.Barrier(3)
+    durations = {}
+
+    def work(delay):
+        recorder.start('upload')
+        started.wait()
+        time.sleep(delay)
+        durations[threading.current_thread().name] = recorder.end('upload')
+    threads = [threading.Thread(target=work, args=(delay,), name='worker-{0:d}'.format(index))
+               for index, delay in enumerate([0.05, 0.15])]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    # Ending the span on this thread doesn't end one of the workers' spans
+    assert recorder.end('upload') is None
+    for thread in threads:
+        thread.join()
+    assert durations['worker-0'] >= 0.05
+    assert durations['worker-1'] >= 0.15
+    trace = recorder.get_trace()
+    events = complete_events(trace)
+    assert len(events) == 2
+    tids = dict((thread.ident, thread.name) for thread in threads)
+    assert set(event['tid'] for event in events) == set(tids)
+    names = dict((event['tid'], event['args']['name']) for event in trace['traceEvents']
+                 if event['name'] == 'thread_name')
+    assert names == tids
+
+
+def test_events_are_capped(monkeypatch):
+    monkeypatch.setattr(spans, 'MAX_EVENTS', 5)
+    recorder = SpanRecorder()
+    recorder.begin_job('T1')
+    for index in range(10):
+        recorder.start('step')
+        # Still timed for the metrics once the trace is full
+        assert recorder.end('step') is not None
+    assert len(recorder.events) == 5
+    recorder.begin_job('T2')
+    assert recorder.events == []
+
+
+def test_write_job(tmp_path):
+    recorder = SpanRecorder()
+    recorder.begin_job('210101_AB_1/run:2')
+    with recorder.span('wpt.upload', {'bytes': 10}):
+        pass
+    directory = tmp_path.joinpath('spans')
+    path = recorder.write_job(str(directory))
+    assert path == str(directory.joinpath('210101_AB_1_run_2.trace.json.gz'))
+    with gzip.open(path, 'rt') as f_in:
+        trace = json.load(f_in)
+    assert trace['displayTimeUnit'] == 'ms'
+    assert trace['metadata'] == {'job': '210101_AB_1/run:2'}
+    metadata = [event for event in trace['traceEvents'] if event['ph'] == 'M']
+    assert metadata[0] == {'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'tid': 0,
+                           'args': {'name': 'wptagent'}}
+    assert metadata[1]['name'] == 'thread_name'
+    assert metadata[1]['tid'] == threading.current_thread().ident
+    event = complete_events(trace)[0]
+    assert sorted(event.keys()) == ['args', 'cat', 'dur', 'name', 'ph', 'pid', 'tid', 'ts']
+    assert (event['name'], event['cat'], event['args']) == ('wpt.upload', 'wpt', {'bytes': 10})
+    assert isinstance(event['ts'], int) and isinstance(event['dur'], int)
+    # Without a job the spans go to agent.trace.json.gz
+    assert os.path.basename(SpanRecorder().write_job(str(directory))) == 'agent.trace.json.gz'
+
+
+def test_write_job_rotates(tmp_path, monkeypatch):
+    monkeypatch.setattr(spans, 'MAX_FILES', 3)
+    recorder = SpanRecorder()
+    directory = str(tmp_path)
+    paths = []
+    for index in range(5):
+        recorder.begin_job('T{0:d}'.format(index))
+        paths.append(recorder.write_job(directory))
+        # Distinct modification times for the oldest-first ordering
+        os.utime(paths[-1], (1000 + index, 1000 + index))
+    assert sorted(os.listdir(directory)) == ['T2.trace.json.gz', 'T3.trace.json.gz', 'T4.trace.json.gz']
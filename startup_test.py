@@ -0,0 +1,198 @@
+import json
+import os
+import socket
+import stat
+import sys
+
+import pytest
+
+from internal import startup
+from internal.startup import StartupCache
+from server_probe_test import servers  # pylint: disable=unused-import
+
+
+def make_cache(tmp_path):
+    cache = StartupCache()
+    cache.load(str(tmp_path.joinpath('startup_cache.json')))
+    return cache
+
+
+class Probe(object):
+    """Counts how often the expensive check actually runs"""
+    def __init__(self, value='1.0'):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if isinstance(self.value, Exception):
+            raise self.value
+        return self.value
+
+
+def test_changed_executable_invalidates(tmp_path):
+    exe = tmp_path.joinpath('tool')
+    exe.write_text('version 1')
+    cache = make_cache(tmp_path)
+    probe = Probe()
+    assert cache.cached('tool', [str(exe)], probe) == '1.0'
+    assert cache.cached('tool', [str(exe)], probe) == '1.0'
+    assert probe.calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    # A new size
+    exe.write_text('version 10')
+    probe.value = '10.0'
+    assert cache.cached('tool', [str(exe)], probe) == '10.0'
+    assert probe.calls == 2
+    # Same size, new modification time
+    exe.write_text('version 11')
+    mtime = os.stat(str(exe)).st_mtime
+    os.utime(str(exe), (mtime + 10, mtime + 10))
+    probe.value = '11.0'
+    assert cache.cached('tool', [str(exe)], probe) == '11.0'
+    assert probe.calls == 3
+    # Removed
+    exe.unlink()
+    probe.value = None
+    assert cache.cached('tool', [str(exe)], probe) is None
+    assert probe.calls == 4
+
+
+def test_cache_survives_a_restart(tmp_path):
+    exe = tmp_path.joinpath('tool')
+    exe.write_text('version 1')
+    # Sub-second modification times have to survive the trip through the file
+    os.utime(str(exe), (1600000000.123456789, 1600000000.123456789))
+    cache = make_cache(tmp_path)
+    probe = Probe({'version': '1.0'})
+    cache.cached('tool', [str(exe), None], probe)
+    cache.save()
+    assert not cache.dirty
+    restarted = make_cache(tmp_path)
+    assert restarted.cached('tool', [str(exe), None], probe) == {'version': '1.0'}
+    assert probe.calls == 1
+    assert restarted.hits == 1
+    # Nothing changed so nothing is written
+    os.remove(cache.path)
+    restarted.save()
+    assert not os.path.exists(restarted.path)
+
+
+def test_failing_probe_is_not_cached(tmp_path):
+    cache = make_cache(tmp_path)
+    probe = Probe(OSError('not installed'))
+    for _ in range(2):
+        with pytest.raises(OSError):
+            cache.cached('tool', [None], probe)
+    assert probe.calls == 2
+    assert cache.entries == {}
+    assert not cache.dirty
+    probe.value = '1.0'
+    assert cache.cached('tool', [None], probe) == '1.0'
+    assert cache.cached('tool', [None], probe) == '1.0'
+    assert probe.calls == 3
+
+
+def test_cache_from_another_interpreter_is_ignored(tmp_path):
+    exe = tmp_path.joinpath('tool')
+    exe.write_text('version 1')
+    cache = make_cache(tmp_path)
+    cache.cached('tool', [str(exe)], Probe())
+    cache.save()
+    with open(cache.path, 'rt') as f_in:
+        saved = json.load(f_in)
+    assert saved['python'] == sys.executable
+    assert saved['version'] == startup.CACHE_VERSION
+    for key, value in [('python', '/usr/bin/python2.7'), ('version', startup.CACHE_VERSION + 1)]:
+        changed = dict(saved)
+        changed[key] = value
+        with open(cache.path, 'wt') as f_out:
+            json.dump(changed, f_out)
+        probe = Probe()
+        assert make_cache(tmp_path).cached('tool', [str(exe)], probe) == '1.0'
+        assert probe.calls == 1
+    # A corrupt cache file is the same as no cache
+    with open(cache.path, 'wt') as f_out:
+        f_out.write('{"version": 1, "pyth')
+    assert make_cache(tmp_path).entries == {}
+
+
+def test_nothing_cached_without_a_cache_file():
+    cache = StartupCache()
+    probe = Probe()
+    cache.cached('tool', [None], probe)
+    cache.cached('tool', [None], probe)
+    assert probe.calls == 2
+    cache.save()
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_faststartup_reaches_getwork(tmp_path, monkeypatch, servers):
+    """The agent starts with --faststartup (twice, the second time from the cache) and polls for work.
+    The external tools are stand-ins on the path that record when they run."""
+    import wptagent
+    from internal.webpagetest import WebPageTest
+    bin_dir = tmp_path.joinpath('bin')
+    bin_dir.mkdir()
+    calls = tmp_path.joinpath('calls.txt')
+    outputs = {'node': 'v20.11.0', 'lighthouse': '11.4.0', 'xprop': '_NET_DESKTOP_GEOMETRY = 1920, 1200'}
+    for tool in ['convert', 'mogrify', 'traceroute', 'node', 'lighthouse', 'sudo', 'npm', 'xprop', 'chrome']:
+        path = bin_dir.joinpath(tool)
+        path.write_text('#!/bin/sh\necho {0} >> "{1}"\necho \'{2}\'\n'.format(tool, calls, outputs.get(tool, '')))
+        path.chmod(stat.S_IRWXU)
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ.get('PATH', ''))
+    monkeypatch.setenv('DISPLAY', ':99')
+    monkeypatch.setattr(wptagent, 'parse_ini', lambda path: {'Chrome': {'exe': str(bin_dir.joinpath('chrome'))}})
+    monkeypatch.setattr(startup, 'CACHE_FILE', str(tmp_path.joinpath('startup_cache.json')))
+    monkeypatch.setattr(startup, 'STARTUP_CACHE', StartupCache())
+    # Keep the agent's work directory, signal handlers and exit hooks out of the test process
+    monkeypatch.setattr(WebPageTest, 'block_metadata', lambda self: None)
+    init = WebPageTest.__init__
+    monkeypatch.setattr(WebPageTest, '__init__',
+                        lambda self, options, workdir: init(self, options, str(tmp_path.joinpath('work'))))
+    monkeypatch.setattr(wptagent.signal, 'signal', lambda *args: None)
+    monkeypatch.setattr(wptagent.atexit, 'register', lambda *args: None)
+    # Exit after the first poll for work
+    polled = []
+    get_next_job = wptagent.WPTAgent.get_next_job
+
+    def poll_once(self):
+        job = get_next_job(self)
+        polled.append(job)
+        self.must_exit = True
+        return job
+    monkeypatch.setattr(wptagent.WPTAgent, 'get_next_job', poll_once)
+    server = servers()
+
+    def start_agent():
+        # The message server from the last start is still listening so each start gets its own port
+        monkeypatch.setattr(sys, 'argv', [
+            'wptagent.py', '--faststartup', '--server', server.url, '--location', 'Test', '--shaper', 'none',
+            '--alive', str(tmp_path.joinpath('alive')), '--spandir', str(tmp_path.joinpath('spans')),
+            '--messageport', str(free_port()), '--healthcheckport', '0'])
+        wptagent.main()
+    start_agent()
+    assert polled == [None]
+    assert server.count('getwork.php') == 1
+    first = calls.read_text().split()
+    for tool in ['convert', 'mogrify', 'traceroute', 'node', 'lighthouse']:
+        assert tool in first
+    assert startup.STARTUP_CACHE.misses > 0
+    # The second start runs none of the cached probes
+    calls.unlink()
+    monkeypatch.setattr(startup, 'STARTUP_CACHE', StartupCache())
+    start_agent()
+    assert len(polled) == 2
+    assert server.count('getwork.php') == 2
+    second = calls.read_text().split() if calls.exists() else []
+    for tool in ['convert', 'mogrify', 'traceroute', 'node', 'lighthouse']:
+        assert tool not in second
+    assert startup.STARTUP_CACHE.hits > 0
+    assert startup.STARTUP_CACHE.misses == 0
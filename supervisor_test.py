@@ -0,0 +1,92 @@
+import argparse
+import os
+import signal
+import sys
+import time
+
+import pytest
+
+from internal import supervisor
+from internal.supervisor import Supervisor, unshaped_browsers, worker_argv
+
+
+def make_options(tmp_path, **kwargs):
+    options = argparse.Namespace(name='agent', shaper=None, xvfb=False, instances=3, pincpus=False,
+                                 messageport=8888, cdpport=9222, healthcheckport=None,
+                                 alive=str(tmp_path.joinpath('wptagent.alive')), exit=0, minheadroom=0.75)
+    for key in kwargs:
+        setattr(options, key, kwargs[key])
+    return options
+
+
+def option_value(args, name):
+    return args[args.index(name) + 1]
+
+
+@pytest.fixture
+def signal_handlers():
+    handlers = {signum: signal.getsignal(signum) for signum in [signal.SIGTERM, signal.SIGINT]}
+    yield
+    for signum in handlers:
+        signal.signal(signum, handlers[signum])
+
+
+def test_worker_argv():
+    argv = ['--server', 'http://example.com/work/', '--alive', '/tmp/wptagent', '--instances=3',
+            '--pincpus', '--name', 'agent', '-vvvv']
+    assert worker_argv(argv) == ['--server', 'http://example.com/work/', '-vvvv']
+
+
+def test_worker_alive_files(tmp_path):
+    argv = ['--alive', str(tmp_path.joinpath('wptagent.alive')), '--instances', '3']
+    sup = Supervisor(make_options(tmp_path), argv, str(tmp_path))
+    alive_files = [option_value(worker.args, '--alive') for worker in sup.workers]
+    assert len(set(alive_files)) == 3
+    assert str(tmp_path.joinpath('wptagent.alive')) not in alive_files
+    for worker in sup.workers:
+        assert worker.args.count('--alive') == 1
+        assert option_value(worker.args, '--shaper') == 'chrome'
+    # The supervisor only touches its own file while every worker is touching theirs
+    for worker in sup.workers:
+        supervisor.touch(worker.alive_file)
+    sup.alive()
+    assert os.path.isfile(sup.options.alive)
+    os.unlink(sup.options.alive)
+    stale = time.time() - supervisor.ALIVE_TIMEOUT - 60
+    os.utime(sup.workers[1].alive_file, (stale, stale))
+    sup.alive()
+    assert not os.path.isfile(sup.options.alive)
+
+
+@pytest.mark.parametrize('file_name', ['exit', 'shutdown'])
+def test_exit_files(tmp_path, file_name):
+    sup = Supervisor(make_options(tmp_path), [], str(tmp_path))
+    assert not sup.check_exit_files()
+    tmp_path.joinpath(file_name).write_text('')
+    assert sup.check_exit_files()
+    assert sup.must_exit
+    assert sup.needs_shutdown == (file_name == 'shutdown')
+    assert not tmp_path.joinpath(file_name).exists()
+
+
+def test_exit_file_stops_all_workers(tmp_path, monkeypatch, signal_handlers):
+    monkeypatch.setattr(Supervisor, 'measure_cpu', lambda self: 1.0)
+    sup = Supervisor(make_options(tmp_path), [], str(tmp_path))
+    for worker in sup.workers:
+        worker.args = [sys.executable, '-c', 'import time; time.sleep(60)']
+    tmp_path.joinpath('exit').write_text('')
+    start = time.monotonic()
+    sup.run()
+    assert time.monotonic() - start < 30
+    for worker in sup.workers:
+        assert worker.proc.returncode == -signal.SIGTERM
+        assert not os.path.exists(worker.pause_file)
+    assert not tmp_path.joinpath('exit').exists()
+
+
+def test_unshaped_browsers():
+    browsers = {'Chrome': {'exe': '/usr/bin/google-chrome'},
+                'Firefox': {'exe': '/usr/bin/firefox', 'type': 'Firefox'},
+                'Epiphany': {'exe': '/usr/bin/epiphany', 'type': 'WebKitGTK'}}
+    assert unshaped_browsers(browsers) == ['Epiphany', 'Firefox']
+    assert unshaped_browsers({'Chrome': {'exe': '/usr/bin/google-chrome'}}) == []
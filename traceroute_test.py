@@ -0,0 +1,253 @@
+import gzip
+import json
+import os
+import platform
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from internal import traceroute
+from internal.traceroute import Traceroute
+
+DESTINATION = '198.51.100.9'
+# The routers on the way to the destination (None for a hop that never answers)
+ROUTERS = ['192.0.2.1', None, '192.0.2.3']
+NAMES = {'192.0.2.1': 'gw.example.net', DESTINATION: 'www.example.com'}
+
+UNIX_OUTPUT = """traceroute to www.example.com (198.51.100.9), 30 hops max, 60 byte packets
+ 1  gw.example.net (192.0.2.1)  0.512 ms  0.431 ms  0.470 ms
+ 2  * * *
+ 3  192.0.2.3 (192.0.2.3)  5.140 ms  5.002 ms *
+ 4  www.example.com (198.51.100.9)  9.211 ms  9.188 ms  9.302 ms
+"""
+
+
+def extended_error(origin, icmp_type, offender):
+    """The IP_RECVERR control message: struct sock_extended_err and the offender sockaddr_in"""
+    return struct.pack('=IBBBBII', 113, origin, icmp_type, 0, 0, 0, 0) + \
+        struct.pack('!HH4s8x', socket.AF_INET, 0, socket.inet_aton(offender))
+
+
+class FakeSocket(object):
+    """A UDP probe socket whose ICMP reply is decided by its TTL"""
+    next_fileno = 1000
+
+    def __init__(self, network, *args):
+        self.network = network
+        self.ttl = None
+        self.reply = None
+        self.closed = False
+        self.fd = FakeSocket.next_fileno
+        FakeSocket.next_fileno += 1
+        network.sockets[self.fd] = self
+
+    def fileno(self):
+        return self.fd
+
+    def setsockopt(self, level, option, value):
+        if level == socket.IPPROTO_IP and option == socket.IP_TTL:
+            self.ttl = value
+
+    def setblocking(self, flag):
+        pass
+
+    def sendto(self, data, address):
+        self.network.sent.append((self.ttl, address))
+        if self.ttl <= len(ROUTERS):
+            router = ROUTERS[self.ttl - 1]
+            if router is not None:
+                self.reply = extended_error(traceroute.SO_EE_ORIGIN_ICMP, traceroute.ICMP_TIME_EXCEEDED, router)
+        else:
+            self.reply = extended_error(traceroute.SO_EE_ORIGIN_ICMP, traceroute.ICMP_DEST_UNREACH, address[0])
+
+    def recvmsg(self, bufsize, ancbufsize, flags):
+        assert flags == traceroute.MSG_ERRQUEUE
+        if self.reply is None:
+            raise BlockingIOError()
+        reply = self.reply
+        self.reply = None
+        return b'', [(socket.IPPROTO_IP, traceroute.IP_RECVERR, reply)], 0, None
+
+    def close(self):
+        self.closed = True
+
+
+class FakePoll(object):
+    def __init__(self, network):
+        self.network = network
+        self.registered = set()
+
+    def register(self, fd, events):
+        self.registered.add(fd)
+
+    def unregister(self, fd):
+        self.registered.discard(fd)
+
+    def poll(self, timeout):
+        ready = [(fd, 0) for fd in sorted(self.registered) if self.network.sockets[fd].reply is not None]
+        if not ready:
+            time.sleep(timeout / 1000.0)
+        return ready
+
+
+@pytest.fixture
+def network(monkeypatch):
+    state = SimpleNamespace(sockets={}, sent=[])
+    monkeypatch.setattr(traceroute, 'PROBE_TIMEOUT', 0.2)
+    monkeypatch.setattr(traceroute.socket, 'socket', lambda *args: FakeSocket(state, *args))
+    monkeypatch.setattr(traceroute.socket, 'gethostbyname', lambda hostname: DESTINATION)
+
+    def gethostbyaddr(addr):
+        if addr in NAMES:
+            return NAMES[addr], [], [addr]
+        raise socket.herror(1, 'Unknown host')
+    monkeypatch.setattr(traceroute.socket, 'gethostbyaddr', gethostbyaddr)
+    monkeypatch.setattr(traceroute.select, 'poll', lambda: FakePoll(state))
+    monkeypatch.setattr(traceroute.subprocess, 'check_output', lambda command, **kwargs: UNIX_OUTPUT)
+    return state
+
+
+def make_traceroute(native, probes=3):
+    options = SimpleNamespace(nativetraceroute=native, tracerouteprobes=probes)
+    return Traceroute(options, {'url': 'https://www.example.com/'})
+
+
+def test_read_probe_error():
+    tracer = make_traceroute(True)
+
+    class ErrorQueue(object):
+        def __init__(self, ancdata):
+            self.ancdata = ancdata
+
+        def recvmsg(self, bufsize, ancbufsize, flags):
+            if isinstance(self.ancdata, Exception):
+                raise self.ancdata
+            return b'', self.ancdata, 0, None
+    icmp = extended_error(traceroute.SO_EE_ORIGIN_ICMP, traceroute.ICMP_TIME_EXCEEDED, '192.0.2.1')
+    assert tracer.read_probe_error(ErrorQueue([(socket.IPPROTO_IP, traceroute.IP_RECVERR, icmp)])) == \
+        (traceroute.ICMP_TIME_EXCEEDED, '192.0.2.1')
+    unreachable = extended_error(traceroute.SO_EE_ORIGIN_ICMP, traceroute.ICMP_DEST_UNREACH, DESTINATION)
+    assert tracer.read_probe_error(ErrorQueue([(socket.IPPROTO_IP, 1, b''),
+                                               (socket.IPPROTO_IP, traceroute.IP_RECVERR, unreachable)])) == \
+        (traceroute.ICMP_DEST_UNREACH, DESTINATION)
+    # Errors that didn't come from an ICMP message (i.e. a local error)
+    local = extended_error(1, 0, '0.0.0.0')
+    assert tracer.read_probe_error(ErrorQueue([(socket.IPPROTO_IP, traceroute.IP_RECVERR, local)])) is None
+    # Another level, a truncated message or nothing queued
+    assert tracer.read_probe_error(ErrorQueue([(socket.SOL_SOCKET, traceroute.IP_RECVERR, icmp)])) is None
+    assert tracer.read_probe_error(ErrorQueue([(socket.IPPROTO_IP, traceroute.IP_RECVERR, icmp[:20])])) is None
+    assert tracer.read_probe_error(ErrorQueue([])) is None
+    assert tracer.read_probe_error(ErrorQueue(BlockingIOError())) is None
+
+
+def test_native_traceroute_hops(network):
+    tracer = make_traceroute(True)
+    start = time.time()
+    last_hop, hops = tracer.native_traceroute('www.example.com', 3)
+    # Every probe goes out at once and the silent hop only costs the probe timeout
+    assert time.time() - start < 2
+    assert len(network.sent) == traceroute.MAX_HOPS * 3
+    assert sorted(set(ttl for ttl, _ in network.sent)) == list(range(1, traceroute.MAX_HOPS + 1))
+    assert len(set(address[1] for _, address in network.sent)) == traceroute.MAX_HOPS * 3
+    assert all(sock.closed for sock in network.sockets.values())
+    assert last_hop == 4
+    assert sorted(hops.keys()) == [0, 1, 2, 3, 4]
+    assert hops[0] == {'ms': '', 'hostname': 'www.example.com', 'addr': DESTINATION}
+    assert hops[1]['addr'] == '192.0.2.1' and hops[1]['hostname'] == 'gw.example.net'
+    assert hops[2] == {'ms': '', 'hostname': '', 'addr': ''}
+    # No reverse DNS falls back to the address
+    assert hops[3]['addr'] == '192.0.2.3' and hops[3]['hostname'] == '192.0.2.3'
+    assert hops[4]['addr'] == DESTINATION and hops[4]['hostname'] == 'www.example.com'
+    for hop in [1, 3, 4]:
+        assert float(hops[hop]['ms']) >= 0
+        assert hops[hop]['ms'] == '{0:0.3f}'.format(float(hops[hop]['ms']))
+
+
+def test_native_traceroute_unresolvable(monkeypatch):
+    def fail(hostname):
+        raise socket.gaierror(-2, 'Name or service not known')
+    monkeypatch.setattr(traceroute.socket, 'gethostbyname', fail)
+    assert make_traceroute(True).native_traceroute('missing.example.com') == (0, {})
+
+
+def read_result(path):
+    with gzip.open(str(path), 'rt') as f_in:
+        return [line.split(',') for line in f_in.read().splitlines()]
+
+
+def test_native_output_matches_unix(tmp_path, network):
+    """The traceroute file is the same as the one from the traceroute command (other than the times)"""
+    results = {}
+    for native in [True, False]:
+        task_dir = tmp_path.joinpath('native' if native else 'unix')
+        task_dir.mkdir()
+        monkey = {'dir': str(task_dir), 'prefix': '1'}
+        if native and platform.system() != 'Linux':
+            pytest.skip('The native traceroute is only used on Linux')
+        make_traceroute(native).run_task(monkey)
+        results[native] = read_result(task_dir.joinpath('1_traceroute.txt.gz'))
+    native, unix = results[True], results[False]
+    assert len(native) == len(unix) == 6
+    assert native[0] == unix[0] == ['Hop', 'IP', 'ms', 'FQDN']
+    for native_row, unix_row in zip(native, unix):
+        assert [native_row[0], native_row[1], native_row[3]] == [unix_row[0], unix_row[1], unix_row[3]]
+        assert (native_row[2] == '') == (unix_row[2] == '')
+
+
+def netns(*args):
+    subprocess.check_call(['ip'] + list(args))
+
+
+@pytest.mark.skipif(platform.system() != 'Linux' or not hasattr(os, 'geteuid') or os.geteuid() != 0 or
+                    shutil.which('ip') is None, reason='Needs root and iproute2 on Linux')
+def test_native_traceroute_through_a_router():
+    """client -> router -> destination, each in its own network namespace"""
+    suffix = str(os.getpid())
+    client, router, dest = ['tr{0}{1}'.format(name, suffix) for name in ['c', 'r', 'd']]
+    created = []
+    try:
+        for name in [client, router, dest]:
+            netns('netns', 'add', name)
+            created.append(name)
+            netns('-n', name, 'link', 'set', 'lo', 'up')
+        netns('link', 'add', 'trc' + suffix, 'netns', client, 'type', 'veth', 'peer', 'name', 'trr' + suffix,
+              'netns', router)
+        netns('link', 'add', 'trd' + suffix, 'netns', dest, 'type', 'veth', 'peer', 'name', 'trs' + suffix,
+              'netns', router)
+        for name, link, addr in [(client, 'trc', '10.231.1.2/24'), (router, 'trr', '10.231.1.1/24'),
+                                 (router, 'trs', '10.231.2.1/24'), (dest, 'trd', '10.231.2.2/24')]:
+            netns('-n', name, 'addr', 'add', addr, 'dev', link + suffix)
+            netns('-n', name, 'link', 'set', link + suffix, 'up')
+        netns('-n', client, 'route', 'add', 'default', 'via', '10.231.1.1')
+        netns('-n', dest, 'route', 'add', 'default', 'via', '10.231.2.1')
+        subprocess.check_call(['ip', 'netns', 'exec', router, 'sysctl', '-q', '-w', 'net.ipv4.ip_forward=1'])
+        script = ('import json; from types import SimpleNamespace; from internal.traceroute import Traceroute; '
+                  'tracer = Traceroute(SimpleNamespace(), {}); '
+                  'print(json.dumps(tracer.native_traceroute("10.231.2.2", 3)))')
+        out = subprocess.check_output(['ip', 'netns', 'exec', client, sys.executable, '-c', script],
+                                      cwd=os.path.dirname(os.path.abspath(__file__)), timeout=60)
+        last_hop, hops = json.loads(out)
+        assert last_hop == 2
+        assert sorted(hops.keys()) == ['0', '1', '2']
+        assert hops['1']['addr'] == '10.231.1.1'
+        assert hops['2']['addr'] == '10.231.2.2'
+        assert float(hops['1']['ms']) >= 0 and float(hops['2']['ms']) >= 0
+        # Same hops as the traceroute command
+        if shutil.which('traceroute') is not None:
+            script = ('import json; from types import SimpleNamespace; from internal.traceroute import Traceroute; '
+                      'tracer = Traceroute(SimpleNamespace(), {}); '
+                      'print(json.dumps(tracer.unix_traceroute("10.231.2.2")))')
+            out = subprocess.check_output(['ip', 'netns', 'exec', client, sys.executable, '-c', script],
+                                          cwd=os.path.dirname(os.path.abspath(__file__)), timeout=120)
+            unix_last_hop, unix_hops = json.loads(out)
+            assert unix_last_hop == last_hop
+            assert [unix_hops[hop]['addr'] for hop in ['1', '2']] == [hops[hop]['addr'] for hop in ['1', '2']]
+    finally:
+        for name in created:
+            subprocess.call(['ip', 'netns', 'del', name])
@@ -0,0 +1,236 @@
+import glob
+import os
+import random
+
+import pytest
+
+from internal.support import visualmetrics
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CORPUS_FRAMES = os.path.join(ROOT, 'scripts', 'replay_corpus', '*', 'input', 'video_*', 'ms_*.jpg')
+
+
+def legacy_image_viewport(file):
+    """The pixel-walking viewport detection the vectorized version replaced"""
+    from PIL import Image
+    with Image.open(file) as im:
+        width, height = im.size
+        x = int(width / 2)
+        y = int(height / 2)
+        pixels = im.load()
+        background = pixels[x, y]
+        left = None
+        while left is None and x >= 0:
+            if not visualmetrics.colors_are_similar(background, pixels[x, y]):
+                left = x + 1
+            else:
+                x -= 1
+        left = 0 if left is None else left
+        x = int(width / 2)
+        right = None
+        while right is None and x < width:
+            if not visualmetrics.colors_are_similar(background, pixels[x, y]):
+                right = x - 1
+            else:
+                x += 1
+        right = width if right is None else right
+        x = int(width / 2)
+        top = None
+        while top is None and y >= 0:
+            if not visualmetrics.colors_are_similar(background, pixels[x, y]):
+                top = y + 1
+            else:
+                y -= 1
+        top = 0 if top is None else top
+        y = int(height / 2)
+        bottom = None
+        while bottom is None and y < height:
+            if not visualmetrics.colors_are_similar(background, pixels[x, y]):
+                bottom = y - 1
+            else:
+                y += 1
+        bottom = height if bottom is None else bottom
+    return {'x': left, 'y': top, 'width': right - left, 'height': bottom - top}
+
+
+def legacy_notification_viewport(file):
+    """The pixel-walking notification/navigation bar detection the vectorized version replaced"""
+    from PIL import Image
+    with Image.open(file) as im:
+        width, height = im.size
+        pixels = im.load()
+        middle = int(height / 2)
+        x = int(width * 0.4)
+        y = 0
+        background = pixels[x, y]
+        top = None
+        while top is None and y < middle:
+            if not visualmetrics.colors_are_similar(background, pixels[x, y]):
+                top = y
+            else:
+                y += 1
+        top = 0 if top is None else top
+        x = 0
+        y = height - 1
+        bottom = None
+        while bottom is None and y > middle:
+            if not visualmetrics.colors_are_similar(background, pixels[x, y]):
+                bottom = y
+            else:
+                y -= 1
+        bottom = height - 1 if bottom is None else bottom
+    return {'x': 0, 'y': top, 'width': width, 'height': bottom - top}
+
+
+def noisy(color, rng, amount):
+    return tuple(max(0, min(255, channel + rng.randint(-amount, amount))) for channel in color)
+
+
+def draw_frame(path, size, bars, page, seed):
+    """A first frame: browser/device bars (top, bottom, left, right) around a page, saved as a
+    jpeg so the edges carry compression noise like a real capture"""
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    width, height = size
+    im = Image.new('RGB', size, page)
+    draw = ImageDraw.Draw(im)
+    for side, extent, color in bars:
+        if side == 'top':
+            draw.rectangle([0, 0, width - 1, extent - 1], fill=color)
+        elif side == 'bottom':
+            draw.rectangle([0, height - extent, width - 1, height - 1], fill=color)
+        elif side == 'left':
+            draw.rectangle([0, 0, extent - 1, height - 1], fill=color)
+        elif side == 'right':
+            draw.rectangle([width - extent, 0, width - 1, height - 1], fill=color)
+    # A little page content and icons in the bars
+    for _ in range(12):
+        left = rng.randint(0, width - 20)
+        top = rng.randint(0, height - 20)
+        draw.rectangle([left, top, left + rng.randint(2, 20), top + rng.randint(2, 20)],
+                       fill=noisy(page, rng, 40))
+    del draw
+    im.save(path, quality=85)
+
+
+LAYOUTS = [
+    # Desktop: browser frame on all sides of a white page
+    ('desktop', (1366, 768), [('top', 85, (222, 225, 230)), ('bottom', 4, (222, 225, 230)),
+                              ('left', 4, (222, 225, 230)), ('right', 4, (222, 225, 230))], (255, 255, 255)),
+    ('desktop-dark', (1920, 1080), [('top', 79, (53, 54, 58)), ('left', 1, (53, 54, 58)),
+                                    ('right', 1, (53, 54, 58))], (250, 250, 250)),
+    # Android: colored status bar, url bar and black navigation bar
+    ('android', (1080, 1920), [('top', 63, (33, 33, 33)), ('bottom', 126, (0, 0, 0))], (255, 255, 255)),
+    ('android-light', (720, 1280), [('top', 48, (240, 240, 240)), ('bottom', 96, (20, 20, 20))],
+     (255, 255, 255)),
+    # iOS: tall status area (notch) and a home indicator strip
+    ('ios', (1170, 2532), [('top', 141, (247, 247, 247)), ('bottom', 102, (249, 249, 249))],
+     (255, 255, 255)),
+    ('ios-dark', (828, 1792), [('top', 132, (28, 28, 30)), ('bottom', 68, (28, 28, 30))], (255, 255, 255)),
+    # No frame at all
+    ('blank', (400, 300), [], (255, 255, 255)),
+]
+
+
+@pytest.fixture(scope='module')
+def first_frames(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('frames')
+    frames = []
+    for index, (name, size, bars, page) in enumerate(LAYOUTS):
+        path = str(directory.joinpath(name + '.jpg'))
+        draw_frame(path, size, bars, page, index)
+        frames.append(path)
+    frames.extend(sorted(glob.glob(CORPUS_FRAMES)))
+    return frames
+
+
+def test_image_viewport_matches_legacy(first_frames):
+    for frame in first_frames:
+        assert visualmetrics.find_image_viewport(frame) == legacy_image_viewport(frame), frame
+
+
+def test_notification_viewport_matches_legacy(first_frames):
+    for frame in first_frames:
+        assert visualmetrics.find_notification_viewport(frame) == legacy_notification_viewport(frame), frame
+
+
+def test_find_color_edge():
+    import numpy as np
+    line = np.full((10, 3), 255, dtype=np.uint8)
+    line[2] = (0, 0, 0)
+    line[7] = (250, 252, 255)
+    background = (255, 255, 255)
+    assert visualmetrics.find_color_edge(line, background, 5, -1) == 2
+    assert visualmetrics.find_color_edge(line, background, 5, 10) is None
+    assert visualmetrics.find_color_edge(line, background, 5, 10, threshold=5) == 7
+    assert visualmetrics.find_color_edge(line, background, 5, 5) is None
+
+
+def draw_progress_frames(directory, count, size, seed):
+    """A page load: blocks painted in over time, one png per 100ms"""
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    width, height = size
+    im = Image.new('RGB', size, (255, 255, 255))
+    frames = []
+    for index in range(count):
+        draw = ImageDraw.Draw(im)
+        left, right = sorted([rng.randint(0, width), rng.randint(0, width)])
+        top, bottom = sorted([rng.randint(0, height), rng.randint(0, height)])
+        draw.rectangle([left, top, right, bottom],
+                       fill=(rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+        del draw
+        path = os.path.join(str(directory), 'ms_{0:06d}.png'.format(index * 100))
+        im.save(path)
+        frames.append(path)
+    return frames
+
+
+def test_ssim_scores_match_pyssim(tmp_path):
+    ssim = pytest.importorskip('ssim')
+    frames = draw_progress_frames(tmp_path, 24, (320, 240), 1)
+    # A differently-sized frame and one with an alpha channel
+    from PIL import Image
+    with Image.open(frames[3]) as im:
+        im.resize((300, 200)).save(str(tmp_path.joinpath('resized.png')))
+        im.convert('RGBA').save(str(tmp_path.joinpath('alpha.png')))
+    frames.extend([str(tmp_path.joinpath('resized.png')), str(tmp_path.joinpath('alpha.png'))])
+    target = frames[23]
+    expected = [ssim.compute_ssim(frame, target) for frame in frames]
+    for batch_size in [1, 5, 16]:
+        scores = visualmetrics.calculate_ssim_scores(frames, target, 1.0, batch_size)
+        assert scores == pytest.approx(expected, abs=1e-4)
+    assert min(expected) < 0.9
+
+
+def test_ssim_batches_are_bounded(tmp_path, monkeypatch):
+    frames = draw_progress_frames(tmp_path, 12, (200, 100), 2)
+    unbounded = visualmetrics.calculate_ssim_scores(frames, frames[-1], 1.0, 12, 10 ** 9)
+    stacks = []
+    blur = visualmetrics.ssim_blur
+
+    def record_blur(images, kernel):
+        stacks.append(images.shape)
+        return blur(images, kernel)
+    monkeypatch.setattr(visualmetrics, 'ssim_blur', record_blur)
+    bounded = visualmetrics.calculate_ssim_scores(frames, frames[-1], 1.0, 12, 3 * 200 * 100)
+    assert bounded == pytest.approx(unbounded, abs=1e-6)
+    assert max(shape[0] for shape in stacks) == 3
+    assert all(shape[0] * shape[1] * shape[2] <= 3 * 200 * 100 for shape in stacks)
+
+
+def test_perceptual_speed_index_matches_pyssim_loop(tmp_path):
+    ssim = pytest.importorskip('ssim')
+    frames = draw_progress_frames(tmp_path, 20, (320, 240), 3)
+    progress = [{'time': index * 100, 'progress': 0} for index in range(len(frames))]
+    # The per-frame loop calculate_perceptual_speed_index used before the batching
+    target = frames[-1]
+    ssim_value = ssim.compute_ssim(frames[1], target)
+    expected = float(progress[1]['time'])
+    last_ms = progress[1]['time']
+    for p in progress[1:]:
+        expected += (p['time'] - last_ms) * (1.0 - ssim_value)
+        ssim_value = ssim.compute_ssim(os.path.join(str(tmp_path), 'ms_{0:06d}.png'.format(p['time'])), target)
+        last_ms = p['time']
+    # float32 SSIM can move the truncated result by a millisecond
+    assert abs(visualmetrics.calculate_perceptual_speed_index(progress, str(tmp_path)) - int(expected)) <= 1
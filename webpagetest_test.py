@@ -0,0 +1,178 @@
+import argparse
+import json
+import threading
+import time
+
+from internal import server_probe
+from internal.webpagetest import WebPageTest
+from server_probe_test import servers  # pylint: disable=unused-import
+
+
+def make_wpt(tmp_path, monkeypatch, server_urls, location='Test'):
+    """An agent connection to the given work servers (without the cloud metadata probing)"""
+    monkeypatch.setattr(WebPageTest, 'block_metadata', lambda self: None)
+    options = argparse.Namespace(server=','.join(server_urls), location=location, key=None, name='agent-test',
+                                 username=None, password=None, validcertificate=False, cert=None, certkey=None,
+                                 scheduler=None, schedulersalt=None, schedulernode=None, fps=10,
+                                 android=False, iOS=False, xvfb=True, ec2=False, gce=False, alive=None,
+                                 pubsub=None, collectversion=False, testrv=False, testurl=None, testspec=None,
+                                 archiveruns=False, maxcpuscale=2, cdpport=9222)
+    wpt = WebPageTest(options, str(tmp_path.joinpath('work')))
+    # Skip the CPU benchmark when preparing jobs
+    wpt.cpu_scale_multiplier = 1.0
+    return wpt
+
+
+def test_get_test_skips_failing_servers(tmp_path, monkeypatch, servers):
+    failing = servers(status=500)
+    healthy = servers(latency=0.05)
+    healthy.add_job('T1')
+    healthy.add_job('T2')
+    wpt = make_wpt(tmp_path, monkeypatch, [failing.url, healthy.url])
+    # Start with the failing server
+    monkeypatch.setattr(server_probe.random, 'shuffle', lambda items: None)
+    job = wpt.get_test({})
+    assert failing.count('getwork.php') == 1
+    assert job['Test ID'] == 'T1'
+    assert wpt.url == healthy.url
+    assert wpt.raw_job['id'] == 'T1'
+    assert wpt.raw_job['work_server'] == healthy.url
+    # The failing server is backing off so the next poll goes straight to the healthy one
+    job = wpt.get_test({})
+    assert job['Test ID'] == 'T2'
+    assert failing.count('getwork.php') == 1
+
+
+def test_diagnostics_ping_every_server(tmp_path, monkeypatch, servers):
+    slow = [servers(latency=0.5) for _ in range(3)]
+    failing = servers(status=502)
+    wpt = make_wpt(tmp_path, monkeypatch, [server.url for server in slow + [failing]], location='A,B')
+    wpt.cpu_pct = 10.0
+    wpt.report_diagnostics()
+    for server in slow + [failing]:
+        assert server.count('ping.php?location=A') == 1
+        assert server.count('ping.php?location=B') == 1
+    assert not wpt.server_prober.is_available(failing.url)
+    # Not more often than once a minute
+    wpt.report_diagnostics()
+    assert slow[0].count('ping.php') == 2
+
+
+def test_prefetch_claims_up_to_the_limit(tmp_path, monkeypatch, servers):
+    server = servers(latency=0.2)
+    for index in range(4):
+        server.add_job('T{0:d}'.format(index))
+    wpt = make_wpt(tmp_path, monkeypatch, [server.url])
+    current = wpt.get_test({})
+    assert current['Test ID'] == 'T0'
+    current_state = (wpt.url, wpt.raw_job, wpt.job)
+    # Prefetch in the background while the current job is "uploading"
+    thread = threading.Thread(target=wpt.prefetch_tests, args=({}, 2))
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert [state['raw_job']['id'] for state in wpt.prefetched] == ['T1', 'T2']
+    assert server.count('getwork.php') == 3
+    assert len(server.jobs) == 1
+    # The job that is still running is untouched
+    assert (wpt.url, wpt.raw_job, wpt.job) == current_state
+    # Prefetched jobs start in order and become the current job
+    job = wpt.get_prefetched_test()
+    assert job['Test ID'] == 'T1'
+    assert wpt.raw_job['id'] == 'T1'
+    assert wpt.get_prefetched_test()['Test ID'] == 'T2'
+    assert wpt.get_prefetched_test() is None
+
+
+def test_prefetch_leaves_the_agent_state_alone(tmp_path, monkeypatch, servers):
+    server = servers()
+    other = servers()
+    server.add_job('T0')
+    server.add_job('T1')
+    server.jobs[1].update({'work_servers': other.url, 'wpthost': 'wpt-1', 'testinfo': {}})
+    wpt = make_wpt(tmp_path, monkeypatch, [server.url])
+    wpt.get_test({})
+    # The prefetch thread doesn't share the session of the job that is uploading
+    main_threads = []
+    main_get = wpt.session.get
+    def session_get(*args, **kwargs):
+        main_threads.append(threading.current_thread())
+        return main_get(*args, **kwargs)
+    monkeypatch.setattr(wpt.session, 'get', session_get)
+    wpt.start_prefetch({}, 1)
+    wpt.wait_for_prefetch(10)
+    assert wpt.prefetch_thread is None
+    assert len(wpt.prefetched) == 1
+    assert main_threads == []
+    assert wpt.work_servers == [server.url]
+    assert wpt.wpthost is None
+    assert wpt.job['Test ID'] == 'T0'
+    # The job is stamped as started when it starts, not when it was claimed
+    time.sleep(0.2)
+    before = time.time()
+    job = wpt.get_prefetched_test()
+    assert job['Test ID'] == 'T1'
+    assert job['started'] >= before
+    assert job['testinfo']['started'] == job['started']
+    assert wpt.work_servers == [other.url]
+    assert wpt.wpthost == 'wpt-1'
+
+
+def test_shutdown_requeues_an_inflight_prefetch(tmp_path, monkeypatch, servers):
+    server = servers()
+    server.add_job('T0')
+    server.add_job('T1')
+    wpt = make_wpt(tmp_path, monkeypatch, [server.url])
+    wpt.get_test({})
+    server.latency = 0.5
+    wpt.start_prefetch({}, 1)
+    time.sleep(0.1)
+    wpt.shutdown()
+    assert wpt.prefetch_thread is None
+    requeued = sorted(path.split('id=')[1].split('&')[0] for path, _ in server.requeued)
+    assert requeued == ['T0', 'T1']
+    assert wpt.prefetched == []
+
+
+def test_prefetched_jobs_requeued_on_shutdown(tmp_path, monkeypatch, servers):
+    server = servers()
+    for index in range(3):
+        server.add_job('T{0:d}'.format(index))
+    wpt = make_wpt(tmp_path, monkeypatch, [server.url])
+    wpt.get_test({})
+    wpt.prefetch_tests({}, 5)
+    assert len(wpt.prefetched) == 2
+    wpt.shutdown()
+    requeued = sorted(path.split('id=')[1].split('&')[0] for path, _ in server.requeued)
+    assert requeued == ['T0', 'T1', 'T2']
+    for path, payload in server.requeued:
+        test_id = path.split('id=')[1].split('&')[0]
+        assert 'sig=sig-' + test_id in path
+        assert json.loads(payload)['Test ID'] == test_id
+    assert wpt.prefetched == []
+    # Nothing is claimed after shutdown
+    server.add_job('T3')
+    wpt.prefetch_tests({}, 5)
+    assert wpt.prefetched == []
+    assert len(server.jobs) == 1
+
+
+def test_prefetch_stops_on_errors_and_reboot(tmp_path, monkeypatch, servers):
+    reboots = []
+    monkeypatch.setattr(WebPageTest, 'reboot', lambda self: reboots.append(True))
+    failing = servers(status=500)
+    wpt = make_wpt(tmp_path, monkeypatch, [failing.url])
+    wpt.prefetch_tests({}, 2)
+    assert wpt.prefetched == []
+    assert failing.count('getwork.php') == 1
+    server = servers()
+    server.jobs.append('Reboot')
+    wpt = make_wpt(tmp_path, monkeypatch, [server.url])
+    wpt.prefetch_tests({}, 2)
+    assert wpt.prefetched == []
+    # The reboot is left for the next regular poll
+    assert reboots == []
+    assert not wpt.is_rebooting
+    server.jobs.append('Reboot')
+    wpt.get_test({})
+    assert reboots == [True]
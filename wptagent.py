@@ -52,6 +52,7 @@ class WPTAgent(object):
         self.browser = None
         self.shaper = TrafficShaper(options, self.root_path)
         self.pubsub_message = None
+        self.idle_start = None
         # Install the signal handlers
         signal.signal(signal.SIGTERM, self.signal_handler)
         signal.signal(signal.SIGINT, self.signal_handler)
@@ -95,14 +96,17 @@ class WPTAgent(object):
         else:
             from monotonic import monotonic
         start_time = monotonic()
+        self.idle_start = start_time
         browser = None
         done = False
         exit_file = os.path.join(self.root_path, 'exit')
         shutdown_file = os.path.join(self.root_path, 'shutdown')
+        from internal.spans import SPANS
+        SPANS.start('startup.servers')
         self.message_server = None
         if not self.options.android and not self.options.iOS:
             from internal.message_server import MessageServer
-            self.message_server = MessageServer()
+            self.message_server = MessageServer(self.options.messageport)
             self.message_server.start()
             if not self.message_server.is_ok():
                 logging.error("Unable to start the local message server")
@@ -115,7 +119,16 @@ class WPTAgent(object):
                 logging.error("Unable to start the health check server")
                 return
             self.wpt.health_check_server = self.health_check_server
-    
+        if self.options.noartifactstore:
+            from internal.artifact_store import ARTIFACTS
+            ARTIFACTS.enabled = False
+        if self.options.dnsresolver and not self.options.android and not self.options.iOS:
+            from internal.dns_resolver import RESOLVER
+            if not RESOLVER.start(self.options.dnsupstream):
+                logging.error("Unable to start the DNS resolver, falling back to the hosts file")
+        SPANS.end('startup.servers')
+        self.report_startup()
+
         # If we are using a pubsub scription, start the listening thread
         subscriber = None
         streaming_pull_future = None
@@ -133,14 +146,16 @@ class WPTAgent(object):
         while not self.must_exit and not done:
             try:
                 self.alive()
-                if os.path.isfile(exit_file):
+                # Under a supervisor (--pausefile) the supervisor handles the exit and shutdown files
+                supervised = self.options.pausefile is not None
+                if not supervised and os.path.isfile(exit_file):
                     try:
                         os.remove(exit_file)
                     except Exception:
                         pass
                     self.must_exit = True
                     break
-                elif os.path.isfile(shutdown_file):
+                elif not supervised and os.path.isfile(shutdown_file):
                     try:
                         os.remove(exit_file)
                     except Exception:
@@ -156,6 +171,9 @@ class WPTAgent(object):
                     break
                 if self.options.pubsub:
                     self.sleep(self.options.polling)
+                elif self.options.pausefile and os.path.isfile(self.options.pausefile):
+                    # The supervisor isn't admitting this worker to take new jobs right now
+                    self.sleep(self.options.polling)
                 else:
                     if self.browsers.is_ready():
                         if self.options.testurl or self.options.testspec:
@@ -177,7 +195,7 @@ class WPTAgent(object):
                             except Exception:
                                 logging.exception('Error processing test options')
                         else:
-                            self.job = self.wpt.get_test(self.browsers.browsers)
+                            self.job = self.get_next_job()
                         self.run_job()
                     elif self.options.exit > 0 and self.browsers.should_exit():
                         self.must_exit = True
@@ -217,6 +235,23 @@ class WPTAgent(object):
             if platform.system() == "Linux":
                 subprocess.call(['sudo', 'poweroff'])
 
+    def report_startup(self):
+        """Log how long the agent took to start (and where the time went) and write out the
+        startup spans next to the per-job ones"""
+        from internal.spans import SPANS
+        from internal.startup import STARTUP_CACHE, startup_breakdown
+        STARTUP_CACHE.save()
+        SPANS.end('startup')
+        total, steps = startup_breakdown(SPANS.get_trace())
+        logging.info('Ready for work %0.3fs after startup (%s)', total,
+                     ', '.join(['{0} {1:0.3f}s'.format(name, elapsed) for name, elapsed in steps]))
+        if self.options.faststartup:
+            logging.debug('Startup cache: %d hits, %d misses', STARTUP_CACHE.hits, STARTUP_CACHE.misses)
+        spans_dir = self.options.spandir
+        if spans_dir is None:
+            spans_dir = os.path.join(self.persistent_work_dir, 'spans')
+        SPANS.write_job(spans_dir)
+
     def pubsub_callback(self, message):
         """Pubsub callback for jobs"""
         logging.debug('Received pubsub job')
@@ -247,12 +282,19 @@ class WPTAgent(object):
 
     def run_job(self):
         """Run a single job from start to end"""
+        job_start = None
         try:
             if (sys.version_info >= (3, 0)):
                 from time import monotonic
             else:
                 from monotonic import monotonic
+            from internal import metrics
+            from internal.spans import SPANS
             if self.job is not None:
+                job_start = monotonic()
+                SPANS.begin_job(self.job.get('Test ID'))
+                if self.idle_start is not None:
+                    metrics.IDLE_WAIT_DURATION.observe(job_start - self.idle_start)
                 self.job['image_magick'] = self.image_magick
                 self.job['message_server'] = self.message_server
                 self.job['capture_display'] = self.capture_display
@@ -260,6 +302,7 @@ class WPTAgent(object):
                 self.task = self.wpt.get_task(self.job)
                 while self.task is not None:
                     start = monotonic()
+                    SPANS.start('agent.run', {'run': self.task['run'], 'cached': self.task['cached']})
                     try:
                         self.task['running_lighthouse'] = False
                         if self.job['type'] != 'lighthouse':
@@ -278,6 +321,7 @@ class WPTAgent(object):
                                 self.run_single_test()
                         elapsed = monotonic() - start
                         logging.debug('Test run time: %0.3f sec', elapsed)
+                        metrics.RUN_DURATION.observe(elapsed)
                     except Exception as err:
                         msg = ''
                         if err is not None and err.__str__() is not None:
@@ -286,12 +330,38 @@ class WPTAgent(object):
                             '{0}'.format(msg)
                         logging.exception("Unhandled exception running test: %s", msg)
                         traceback.print_exc(file=sys.stdout)
+                    # Claim the next job while the last run uploads
+                    if self.task['done']:
+                        self.start_prefetch()
                     self.wpt.upload_task_result(self.task)
+                    SPANS.end('agent.run')
                     # Set up for the next run
                     self.task = self.wpt.get_task(self.job)
                 self.output_test_result()
+                spans_dir = self.options.spandir
+                if spans_dir is None:
+                    spans_dir = os.path.join(self.persistent_work_dir, 'spans')
+                SPANS.write_job(spans_dir)
+                metrics.JOBS.inc()
+                metrics.JOB_DURATION.observe(monotonic() - job_start)
         except Exception:
             logging.exception('Error running job')
+        if job_start is not None:
+            self.idle_start = monotonic()
+
+    def get_next_job(self):
+        """Start the next prefetched job if there is one, otherwise poll the server for work"""
+        self.wpt.wait_for_prefetch()
+        job = self.wpt.get_prefetched_test()
+        if job is None:
+            job = self.wpt.get_test(self.browsers.browsers)
+        return job
+
+    def start_prefetch(self):
+        """Fetch the next jobs in the background (up to the --prefetch lookahead limit)"""
+        if self.options.prefetch > 0 and not self.options.testurl and not self.options.testspec and \
+                not self.options.pubsub and not self.must_exit:
+            self.wpt.start_prefetch(self.browsers.browsers, self.options.prefetch)
 
     def output_test_result(self):
         """Dump the result of a CLI test to stdout"""
@@ -314,13 +384,25 @@ class WPTAgent(object):
         self.alive()
         self.browser = self.browsers.get_browser(self.job['browser'], self.job)
         if self.browser is not None:
-            self.browser.prepare(self.job, self.task)
-            self.browser.launch(self.job, self.task)
+            from internal import metrics
+            from internal.spans import SPANS
+            if (sys.version_info >= (3, 0)):
+                from time import monotonic
+            else:
+                from monotonic import monotonic
+            launch_start = monotonic()
+            self.task['launch_start'] = launch_start
+            with SPANS.span('agent.prepare'):
+                self.browser.prepare(self.job, self.task)
+            with SPANS.span('agent.launch'):
+                self.browser.launch(self.job, self.task)
+            metrics.BROWSER_LAUNCH_DURATION.observe(monotonic() - launch_start)
             try:
                 if self.task['running_lighthouse']:
                     self.task['lighthouse_log'] = 'Lighthouse testing is not supported with this browser.'
                     try:
-                        self.browser.run_lighthouse_test(self.task)
+                        with SPANS.span('agent.lighthouse'):
+                            self.browser.run_lighthouse_test(self.task)
                     except Exception:
                         logging.exception('Error running lighthouse test')
                     if self.task['lighthouse_log']:
@@ -331,7 +413,8 @@ class WPTAgent(object):
                         except Exception:
                             logging.exception('Error compressing lighthouse log')
                 else:
-                    self.browser.run_task(self.task)
+                    with SPANS.span('agent.run_task'):
+                        self.browser.run_task(self.task)
                     # Alerts on large files in the results folder
                     if 'alertsize' in self.options and self.options.alertsize:
                         self.browser.alert_size(self.alert_config,self.task['dir'], self.task['task_prefix'])
@@ -343,10 +426,12 @@ class WPTAgent(object):
                     '{0}'.format(msg)
                 logging.exception("Unhandled exception in test run: %s", msg)
                 traceback.print_exc(file=sys.stdout)
-            self.browser.stop(self.job, self.task)
+            with SPANS.span('agent.stop'):
+                self.browser.stop(self.job, self.task)
             # Delete the browser profile if needed
             if self.task['cached'] or self.job['fvonly']:
-                self.browser.clear_profile(self.task)
+                with SPANS.span('agent.clear_profile'):
+                    self.browser.clear_profile(self.task)
         else:
             err = "Invalid browser - {0}".format(self.job['browser'])
             logging.critical(err)
@@ -376,6 +461,10 @@ class WPTAgent(object):
         if self.browser:
             self.browser.shutdown()
         self.shaper.remove()
+        from internal.dns_resolver import RESOLVER
+        RESOLVER.stop()
+        from internal.artifact_store import ARTIFACTS
+        ARTIFACTS.flush()
         if self.xvfb is not None:
             self.xvfb.stop()
         if self.adb is not None:
@@ -429,13 +518,18 @@ class WPTAgent(object):
                 os.utime(self.options.alive, None)
 
     def requires(self, module, module_name=None):
-        """Try importing a module and installing it if it isn't available"""
+        """Try importing a module and installing it if it isn't available
+        (with --faststartup the module is only located, it is imported when it is used)"""
         ret = False
         if module_name is None:
             module_name = module
         try:
-            __import__(module)
-            ret = True
+            if self.options.faststartup:
+                from internal.startup import find_module
+                ret = find_module(module)
+            else:
+                __import__(module)
+                ret = True
         except ImportError:
             pass
         if not ret and sys.version_info < (3, 0):
@@ -461,6 +555,15 @@ class WPTAgent(object):
         """Validate that all of the external dependencies are installed"""
         ret = True
 
+        # Pin the agent (and everything it launches) to the requested CPUs
+        if self.options.cpus:
+            try:
+                import psutil
+                psutil.Process().cpu_affinity([int(cpu) for cpu in self.options.cpus.split(',')])
+                logging.debug('Pinned the agent to CPUs %s', self.options.cpus)
+            except Exception:
+                logging.exception('Error pinning the agent to CPUs %s', self.options.cpus)
+
         # default /tmp/wptagent as an alive file on Linux
         if self.options.alive is None:
             if platform.system() == "Linux":
@@ -468,6 +571,8 @@ class WPTAgent(object):
             else:
                 self.options.alive = os.path.join(os.path.dirname(__file__), 'wptagent.alive')
         self.alive()
+        from internal.spans import SPANS
+        SPANS.start('startup.modules')
         ret = self.requires('dns', 'dnspython') and ret
         ret = self.requires('monotonic') and ret
         ret = self.requires('PIL', 'pillow') and ret
@@ -499,39 +604,45 @@ class WPTAgent(object):
             wsaccel.patch_ws4py()
         except Exception:
             logging.debug('wsaccel not installed, Chrome debug interface will be slower than it could be')
+        SPANS.end('startup.modules')
 
+        SPANS.start('startup.tools')
         try:
-            subprocess.check_output([sys.executable, '--version'])
+            self.check_tool('python', sys.executable, [sys.executable, '--version'])
         except Exception:
             logging.critical("Unable to start python.")
             ret = False
 
         try:
-            subprocess.check_output('{0} -version'.format(self.image_magick['convert']), shell=True)
+            self.check_tool('convert', self.image_magick['convert'],
+                            '{0} -version'.format(self.image_magick['convert']), shell=True)
         except Exception:
             logging.critical("Missing convert utility. Please install ImageMagick and make sure it is in the path.")
             ret = False
 
         try:
-            subprocess.check_output('{0} -version'.format(self.image_magick['mogrify']), shell=True)
+            self.check_tool('mogrify', self.image_magick['mogrify'],
+                            '{0} -version'.format(self.image_magick['mogrify']), shell=True)
         except Exception:
             logging.critical("Missing mogrify utility. Please install ImageMagick and make sure it is in the path.")
             ret = False
 
         if platform.system() == "Linux":
             try:
-                subprocess.check_output(['traceroute', '--version'])
+                self.check_tool('traceroute', 'traceroute', ['traceroute', '--version'])
             except Exception:
                 logging.debug("Traceroute is missing, installing...")
                 subprocess.call(['sudo', 'apt', '-yq', 'install', 'traceroute'])
 
         if not self.options.android and not self.options.iOS and 'Firefox' in detected_browsers:
             try:
-                subprocess.check_output(['geckodriver', '-V'])
+                self.check_tool('geckodriver', 'geckodriver', ['geckodriver', '-V'])
             except Exception:
                 logging.debug("geckodriver is missing, installing...")
                 subprocess.call(['sudo', 'apt', '-yq', 'install', 'firefox-geckodriver'])
+        SPANS.end('startup.tools')
 
+        SPANS.start('startup.display')
         # If we are on Linux and there is no display, enable xvfb by default
         if platform.system() == "Linux" and not self.options.android and \
                 not self.options.iOS and 'DISPLAY' not in os.environ:
@@ -541,7 +652,11 @@ class WPTAgent(object):
             ret = self.requires('xvfbwrapper') and ret
             if ret:
                 from xvfbwrapper import Xvfb
-                self.xvfb = Xvfb(width=1920, height=1200, colordepth=24)
+                if self.options.xvfbdisplay is not None:
+                    self.xvfb = Xvfb(width=1920, height=1200, colordepth=24,
+                                     display=self.options.xvfbdisplay)
+                else:
+                    self.xvfb = Xvfb(width=1920, height=1200, colordepth=24)
                 self.xvfb.start()
 
         # Figure out which display to capture from
@@ -563,7 +678,9 @@ class WPTAgent(object):
             if self.capture_display is None:
                 logging.critical('No capture display available')
                 ret = False
+        SPANS.end('startup.display')
 
+        SPANS.start('startup.lighthouse')
         # Fix Lighthouse install permissions
         if platform.system() != "Windows":
             from internal.os_util import run_elevated
@@ -588,14 +705,18 @@ class WPTAgent(object):
         # Force lighthouse 11.4.0
         if self.get_lighthouse_version() != '11.4.0':
             subprocess.call(['sudo', 'npm', 'i', '-g', 'lighthouse@11.4.0'])
+        SPANS.end('startup.lighthouse')
 
         # Check the iOS install
         if self.ios is not None:
             ret = self.requires('usbmuxwrapper') and ret
             ret = self.ios.check_install() and ret
 
-        if not self.options.android and not self.options.iOS:
-            self.wait_for_idle(300)
+        # With --faststartup the idle wait is left to the browsers (they wait before launching)
+        if not self.options.android and not self.options.iOS and not self.options.faststartup:
+            with SPANS.span('startup.idle'):
+                self.wait_for_idle(300)
+        SPANS.start('startup.shaper')
         if self.adb is not None:
             if not self.adb.start():
                 logging.critical("Error configuring adb. Make sure it is installed and in the path.")
@@ -607,6 +728,7 @@ class WPTAgent(object):
             else:
                 logging.critical("Error configuring traffic shaping, make sure it is installed.")
             ret = False
+        SPANS.end('startup.shaper')
 
         # Update the Windows root certs
         if platform.system() == "Windows":
@@ -614,14 +736,26 @@ class WPTAgent(object):
 
         return ret
 
+    def check_tool(self, key, executable, command, shell=False):
+        """Make sure a command-line tool runs (raises if it doesn't). Once it has run the
+        check is cached for as long as the executable doesn't change (with --faststartup)."""
+        from internal.startup import STARTUP_CACHE, which
+        def run_tool():
+            subprocess.check_output(command, shell=shell)
+            return True
+        return STARTUP_CACHE.cached(key, [which(executable)], run_tool)
+
     def get_node_version(self):
         """Get the installed version of Node.js"""
         version = 0
         try:
+            from internal.startup import STARTUP_CACHE, which
             if (sys.version_info >= (3, 0)):
-                stdout = subprocess.check_output(['node', '--version'], encoding='UTF-8')
+                stdout = STARTUP_CACHE.cached('node', [which('node')], lambda: subprocess.check_output(
+                    ['node', '--version'], encoding='UTF-8'))
             else:
-                stdout = subprocess.check_output(['node', '--version'])
+                stdout = STARTUP_CACHE.cached('node', [which('node')], lambda: subprocess.check_output(
+                    ['node', '--version']))
             matches = re.match(r'^v(\d+\.\d+)', stdout)
             if matches:
                 version = float(matches.group(1))
@@ -633,10 +767,13 @@ class WPTAgent(object):
         """Get the installed version of lighthouse"""
         version = None
         try:
+            from internal.startup import STARTUP_CACHE, which
             if sys.version_info >= (3, 0):
-                stdout = subprocess.check_output(['lighthouse', '--version'], encoding='UTF-8')
+                stdout = STARTUP_CACHE.cached('lighthouse', [which('lighthouse')], lambda: subprocess.check_output(
+                    ['lighthouse', '--version'], encoding='UTF-8'))
             else:
-                stdout = subprocess.check_output(['lighthouse', '--version'])
+                stdout = STARTUP_CACHE.cached('lighthouse', [which('lighthouse')], lambda: subprocess.check_output(
+                    ['lighthouse', '--version']))
             version = stdout.strip()
         except Exception:
             pass
@@ -697,7 +834,9 @@ def get_windows_build():
 
 
 def find_browsers(options):
-    """Find the various known-browsers in case they are not explicitly configured"""
+    """Find the various known-browsers in case they are not explicitly configured.
+    The probes that launch anything are cached with --faststartup."""
+    from internal.startup import STARTUP_CACHE, which
     browsers = parse_ini(os.path.join(os.path.dirname(__file__), "browsers.ini"))
     if browsers is None:
         browsers = {}
@@ -778,7 +917,9 @@ def find_browsers(options):
         # Microsoft Edge (Legacy)
         edge = None
         try:
-            build = get_windows_build()
+            build = STARTUP_CACHE.cached('windows_build',
+                                         [os.path.join(str(os.getenv('windir')), 'System32', 'ntoskrnl.exe')],
+                                         get_windows_build)
             if build >= 10240:
                 edge_exe = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'internal',
                                         'support', 'edge', 'current', 'MicrosoftWebDriver.exe')
@@ -1017,13 +1158,20 @@ def find_browsers(options):
             browsers['Safari'] = {'exe': safari_path, 'type': 'Safari'}
             # Make sure safaridriver is enabled
             try:
-                subprocess.call(['sudo', 'safaridriver', '--enable'])
+                STARTUP_CACHE.cached('safaridriver', [safari_path, which('safaridriver')],
+                                     lambda: subprocess.check_call(['sudo', 'safaridriver', '--enable']) == 0)
             except Exception:
                 logging.exception('Error starting safaridriver')
         # Get a list of all of the iOS simulator devices available
         try:
             logging.debug('Scanning for iOS simulator devices...')
-            out = subprocess.check_output(['xcrun', 'simctl', 'list', '--json', 'devices', 'available'], universal_newlines=True)
+            # The device list changes when simulator devices or runtimes are added or removed
+            out = STARTUP_CACHE.cached('simctl',
+                                       [which('xcrun'),
+                                        os.path.expanduser('~/Library/Developer/CoreSimulator/Devices/device_set.plist'),
+                                        '/Library/Developer/CoreSimulator/Profiles/Runtimes'],
+                                       lambda: subprocess.check_output(['xcrun', 'simctl', 'list', '--json', 'devices', 'available'],
+                                                                       universal_newlines=True))
             if out:
                 devices = json.loads(out)
                 if 'devices' in devices:
@@ -1069,16 +1217,18 @@ def upgrade_pip_modules():
 
 
 def get_browser_versions(browsers):
-    """Get the version of the available browsers"""
+    """Get the version of the available browsers (cached with --faststartup until the exe changes)"""
     from internal.os_util import get_file_version
+    from internal.startup import STARTUP_CACHE
     for browser in browsers:
         if 'exe' in browsers[browser] and \
                 os.path.isfile(browsers[browser]['exe']):
             exe = browsers[browser]['exe']
-            browsers[browser]['version'] = get_file_version(exe)
+            browsers[browser]['version'] = STARTUP_CACHE.cached('version:' + exe, [exe],
+                                                                lambda: get_file_version(exe))
 
 
-def fix_selenium_version():
+def fix_selenium_version(options):
     """
     On older python versions we are going to force selenium version 3.141.0, 
     newer versions are going to use 4.8.3
@@ -1088,6 +1238,12 @@ def fix_selenium_version():
     if sys.version_info[1] == 6:
         version = '3.141.0'
 
+    # Skip the pip install if the right version is already installed
+    if options.faststartup:
+        from internal.startup import installed_version
+        if installed_version('selenium') == version:
+            return
+
     run_elevated(sys.executable, f'-m pip install selenium=={version}')
 
 
@@ -1178,17 +1334,59 @@ def main():
                         choices=LOG_FORMATS)
     parser.add_argument('--noidle', action='store_true', default=False,
                         help="Do not wait for system idle at any point.")
+    parser.add_argument('--dnsresolver', action='store_true', default=False,
+                        help="Apply DNS overrides and blocked domains with a local stub DNS resolver "
+                        "(Linux only, needs to bind port 53) instead of editing the hosts file for every test.")
+    parser.add_argument('--dnsupstream',
+                        help="Comma-separated list of DNS servers (address[#port]) for the DNS resolver "
+                        "to forward to (defaults to the system DNS servers).")
+    parser.add_argument('--noprofiletemplate', action='store_true', default=False,
+                        help="Start each run with an empty browser profile instead of cloning "
+                        "a pre-built profile template.")
+    parser.add_argument('--noartifactstore', action='store_true', default=False,
+                        help="Write the results to disk and read them back for post-processing "
+                        "instead of passing them along in memory.")
+    parser.add_argument('--spandir',
+                        help="Directory for the per-job trace-event files of the agent's own timings "
+                        "(defaults to a spans directory in the persistent work directory).")
+    parser.add_argument('--archiveruns',
+                        help="Archive the inputs and results of every run to the given directory "
+                        "for replaying the post-processing offline with scripts/replay.py.")
+    parser.add_argument('--faststartup', action='store_true', default=False,
+                        help="Start accepting work sooner: cache the browser discovery and tool checks "
+                        "(until the executables change), only locate the python modules (they are imported "
+                        "when they are used) and leave the idle wait to the browser launch.")
     parser.add_argument('--collectversion', action='store_true', default=False,
                         help="Collection browser versions and submit to controller.")
     parser.add_argument('--healthcheckport', type=int, default=8889, help='Run a HTTP health check server on the given port.')
+    parser.add_argument('--messageport', type=int, default=8888,
+                        help="Port for the local message server used by the browser (defaults to 8888).")
+    parser.add_argument('--cdpport', type=int, default=9222,
+                        help="First of the 500 browser remote debugging ports (defaults to 9222).")
+    parser.add_argument('--cpus', help="Comma-separated list of CPUs to pin the agent and browsers to.")
+    parser.add_argument('--instances', type=int, default=1,
+                        help="Run a supervisor with the given number of isolated agent workers (Linux only).")
+    parser.add_argument('--pincpus', action='store_true', default=False,
+                        help="Pin each of the --instances workers to its own set of CPUs.")
+    parser.add_argument('--minheadroom', type=float, default=0.75,
+                        help="Minimum CPU benchmark speed relative to an idle machine before the supervisor "
+                        "stops admitting --instances workers (defaults to 0.75).")
+    parser.add_argument('--pausefile',
+                        help="Don't take new jobs while the given file exists (used by the supervisor).")
     parser.add_argument('--har', action='store_true', default=False,
                         help="Generate a per-run HAR file as part of the test result (defaults to False).")
+    parser.add_argument('--harcompressor', default='gzip', choices=['gzip', 'brotli', 'none'],
+                        help="Compression for the HAR files (defaults to gzip).")
+    parser.add_argument('--harlevel', type=int, default=7,
+                        help="Compression level for the HAR files (defaults to 7).")
     parser.add_argument('--maxcpuscale', type=int, default=2,
                         help='Maximum scaling to apply to CPU throttle based on host benchmark (defaults to 2).')
 
     # Video capture/display settings
     parser.add_argument('--xvfb', action='store_true', default=False,
                         help="Use an xvfb virtual display (Linux only).")
+    parser.add_argument('--xvfbdisplay', type=int,
+                        help="Display number for the xvfb virtual display (defaults to the first free one).")
     parser.add_argument('--fps', type=int, choices=range(1, 61), default=10,
                         help='Video capture frame rate (defaults to 10). '
                              'Valid range is 1-60 (Linux only).')
@@ -1205,6 +1403,9 @@ def main():
                         help='Polling interval for work (defaults to 5 seconds).')
     parser.add_argument('--pubsub',
                         help="PubSub subscription path (i.e. projects/xxx/subscriptions/queue-yyy).")
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help="Number of jobs to claim ahead of time while the last run of the current "
+                        "job uploads (defaults to 0, disabled).")
 
     # Traffic-shaping options (defaults to host-based)
     parser.add_argument('--shaper', help='Override default traffic shaper. '
@@ -1215,7 +1416,21 @@ def main():
                         '    remote,<server>,<down pipe>,<up pipe> - Connect to the remote server '
                         'over ssh and use pre-configured dummynet pipes (ssh keys for root user '
                         'should be pre-authorized).')
+    parser.add_argument('--shaperdryrun', action='store_true', default=False,
+                        help="Log the tc/ip batches for netem traffic-shaping instead of applying "
+                        "them (for testing without root).")
     parser.add_argument('--tcpdump', help='Specify an interface to use for tcpdump.')
+    parser.add_argument('--livepcap', action='store_true', default=False,
+                        help="Parse tcpdump captures while the test is running instead of after it "
+                        "completes (desktop only).")
+    parser.add_argument('--livemozlog', action='store_true', default=False,
+                        help="Parse the Firefox moz logs while the test is running instead of "
+                        "after it completes.")
+    parser.add_argument('--nativetraceroute', action='store_true', default=False,
+                        help="Use the built-in traceroute that probes all hops at the same time "
+                        "instead of the system traceroute (Linux only).")
+    parser.add_argument('--tracerouteprobes', type=int, default=3,
+                        help="Number of probes per hop for the built-in traceroute (defaults to 3).")
 
     # Android options
     parser.add_argument('--android', action='store_true', default=False,
@@ -1253,6 +1468,9 @@ def main():
                         "when using Android devices. Default is 8.8.8.8")
     parser.add_argument('--temperature', type=int, default=36,
                         help="set custom temperature treshold for device as int")
+    parser.add_argument('--noadbsession', action='store_true', default=False,
+                        help="Run every adb shell command in a new adb process instead of "
+                        "re-using a persistent shell session.")
 
     # iOS options
     parser.add_argument('--iOS', action='store_true', default=False,
@@ -1288,6 +1506,14 @@ def main():
     parser.add_argument('--alertsize', action='store_true', default=False, help="Alerts on large result file size(logging/alerts.log)")
     options, _ = parser.parse_known_args()
 
+    # Time the startup steps (reported when the agent is ready for work)
+    from internal.spans import SPANS
+    from internal.startup import CACHE_FILE, STARTUP_CACHE
+    SPANS.begin_job('startup')
+    SPANS.start('startup')
+    if options.faststartup:
+        STARTUP_CACHE.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'work', CACHE_FILE))
+
     # Make sure we are running python 2.7.11 or newer (required for Windows 8.1)
     if sys.version_info[0] < 3:
         if platform.system() == "Windows":
@@ -1301,7 +1527,8 @@ def main():
             exit(1)
 
     # Make sure we are using a compatible selenium version
-    fix_selenium_version()
+    with SPANS.span('startup.selenium'):
+        fix_selenium_version(options)
 
     if options.list:
         from internal.ios_device import iOSDevice
@@ -1326,17 +1553,37 @@ def main():
                              'pywin32', 'pypiwin32'])
             subprocess.call([sys.executable, '-m', 'pip', 'install', 'pywin32', 'pypiwin32'])
 
+    if options.instances > 1:
+        if options.android or options.iOS or platform.system() != 'Linux':
+            logging.critical("Multiple agent instances are only supported for desktop browsers on Linux")
+            exit(1)
+        from internal.supervisor import Supervisor, unshaped_browsers
+        if options.shaper is None:
+            unshaped = unshaped_browsers(find_browsers(options))
+            if unshaped:
+                logging.critical("The agent workers use browser-based traffic-shaping which can't throttle %s. "
+                                 "Pass --shaper explicitly to run them anyway (i.e. --shaper chrome).",
+                                 ', '.join(unshaped))
+                exit(1)
+        logging.critical("Running %d agent workers, hit Ctrl+C to exit", options.instances)
+        Supervisor(options, sys.argv[1:], os.path.abspath(os.path.dirname(__file__))).run()
+        logging.critical("Done")
+        return
+
     browsers = None
     if not options.android and not options.iOS:
-        browsers = find_browsers(options)
+        with SPANS.span('startup.find_browsers'):
+            browsers = find_browsers(options)
         if len(browsers) == 0:
             logging.critical("No browsers configured. Check that browsers.ini is present and correct.")
             exit(1)
 
     if options.collectversion and platform.system() == "Windows":
-        get_browser_versions(browsers)
+        with SPANS.span('startup.browser_versions'):
+            get_browser_versions(browsers)
 
-    agent = WPTAgent(options, browsers)
+    with SPANS.span('startup.init'):
+        agent = WPTAgent(options, browsers)
     if agent.startup(browsers):
         # Create a work directory relative to where we are running
         logging.critical("Running agent, hit Ctrl+C to exit")